@@ -0,0 +1,46 @@
+"""
+GravMag: Accuracy and speed of the tree code forward modeling of a large prism
+mesh
+"""
+import numpy
+from fatiando import logger, mesher, gridder, gravmag, utils
+from fatiando.vis import mpl
+
+log = logger.get()
+log.info(logger.header())
+log.info(__doc__)
+
+log.info("Making the model...")
+mesh = mesher.PrismMesh((0, 20000, 0, 20000, 0, 5000), (20, 150, 150))
+x, y, z = [0.5*(i[1:] + i[:-1])
+           for i in [mesh.get_xs(), mesh.get_ys(), mesh.get_zs()]]
+z, y, x = numpy.meshgrid(z, y, x, indexing='ij')
+density = (500*utils.gaussian2d(x, y, 3000, 2000, 8000, 6000)
+           - 300*utils.gaussian2d(x, y, 2000, 2000, 14000, 14000))
+mesh.addprop('density', density.ravel())
+shape = (40, 40)
+xp, yp, zp = gridder.regular((-5000, 25000, -5000, 25000), shape, z=-100)
+
+log.info("Running the benchmark for %d prisms..." % (mesh.size))
+thetas = [0.1, 0.2, 0.3, 0.5, 0.7, 0.9]
+exact, build, times, errors = gravmag.treecode.benchmark(xp, yp, zp, mesh,
+    'gz', thetas)
+print "Exact: %g s   Building the tree: %g s" % (exact, build)
+print "theta   time (s)   max relative error"
+for theta, t, error in zip(thetas, times, errors):
+    print "%5.2f   %8.3f   %g" % (theta, t, error)
+
+log.info("Plotting...")
+mpl.figure(figsize=(8, 4))
+mpl.subplot(1, 2, 1)
+mpl.title("Time")
+mpl.plot(thetas, times, '.-k', label='tree code')
+mpl.hlines(exact, thetas[0], thetas[-1], colors='r', label='exact')
+mpl.xlabel('Opening angle')
+mpl.ylabel('seconds')
+mpl.legend()
+mpl.subplot(1, 2, 2)
+mpl.title("Maximum relative error")
+mpl.semilogy(thetas, errors, '.-k')
+mpl.xlabel('Opening angle')
+mpl.show()
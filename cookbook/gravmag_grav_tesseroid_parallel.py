@@ -1,9 +1,9 @@
 """
 GravMag: Forward modeling of the gravity anomaly using tesseroids in parallel
-using ``multiprocessing``
+using the *njobs* argument
 """
 import time
-from multiprocessing import Pool
+import multiprocessing
 from fatiando import gravmag, gridder, logger, utils
 from fatiando.mesher import Tesseroid
 from fatiando.vis import mpl, myv
@@ -39,17 +39,12 @@ area = (-50, 50, -50, 50)
 shape = (100, 100)
 lons, lats, heights = gridder.regular(area, shape, z=250000)
 
-# Divide the model into nproc slices and calculate them in parallel
+# Use one thread per core. The threads share the work dynamically, so there is
+# no need to split the model
 log.info('Calculating...')
-def calculate(chunk):
-    return gravmag.tesseroid.gz(lons, lats, heights, chunk)
 start = time.time()
-nproc = 8 # Model size must be divisible by nproc
-chunksize = len(model)/nproc
-pool = Pool(processes=nproc)
-gz = sum(pool.map(calculate, 
-    [model[i*chunksize:(i + 1)*chunksize] for i in xrange(nproc)]))
-pool.close()
+njobs = multiprocessing.cpu_count()
+gz = gravmag.tesseroid.gz(lons, lats, heights, model, njobs=njobs)
 print "Time it took: %s" % (utils.sec2hms(time.time() - start))
 
 log.info('Plotting...')
@@ -17,6 +17,12 @@ magnetic field of various types of geometric objects:
   cross-sections
 * :mod:`~fatiando.gravmag.half_sph_shell`: Gravity fields of half a spherical
   shell. Useful for benchmarking and testing.
+* :mod:`~fatiando.gravmag.treecode`: Fast approximate forward modeling of very
+  large prism models using an octree
+* :mod:`~fatiando.gravmag.sensitivity`: Build the sensitivity matrix of any of
+  the above
+* :mod:`~fatiando.gravmag.stream`: Run any of the above on very large sets of
+  computation points, chunk by chunk
 
 **Inversion**
 
@@ -50,4 +56,4 @@ after modeling.
 
 from fatiando.gravmag import (basin2d, polyprism, prism, talwani, transform,
     harvester, sphere, tensor, fourier, imaging, euler, tesseroid,
-    half_sph_shell)
+    half_sph_shell, sensitivity, treecode, stream)
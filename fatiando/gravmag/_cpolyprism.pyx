@@ -0,0 +1,1216 @@
+"""
+Cython implementation of the potential fields of 3D prisms with polygonal
+crossection.
+
+The prisms are converted to a :class:`~fatiando.mesher.PolygonalPrismArray`
+and the loops over computation points, prisms and vertices are done in C
+without the GIL. The loop over the computation points is split among *njobs*
+OpenMP threads.
+"""
+import numpy
+
+from libc.math cimport log, atan2, sqrt, fabs
+# Import Cython definitions for numpy
+cimport numpy
+cimport cython
+from cython.parallel cimport prange
+
+DTYPE = numpy.float
+ctypedef numpy.float_t DTYPE_T
+
+from fatiando import utils
+from fatiando.constants import SI2MGAL, SI2EOTVOS, G, CM, T2NT
+from fatiando.mesher import polyprisms2array
+from fatiando.gravmag._prism import _tf_directions
+from fatiando.gravmag._polyprism import _fields_check, _fields_components, \
+    _fields_scales
+
+# The integration kernels are functions of the coordinates of the two vertices
+# of an edge (X1, Y1 and X2, Y2) and of the top and bottom of the prism (Z1 and
+# Z2) relative to the computation point
+ctypedef DTYPE_T (*kernel_func)(DTYPE_T, DTYPE_T, DTYPE_T, DTYPE_T, DTYPE_T,
+                                DTYPE_T) nogil
+
+__all__ = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+    'gzz', 'tf', 'tf_batch', 'fields']
+
+# Used to avoid singularities
+DEF DUMMY = 1e-10
+
+# Indexes of the components in _fields_components
+DEF NCOMPONENTS = 11
+DEF POTENTIAL = 0
+DEF GX = 1
+DEF GY = 2
+DEF GZ = 3
+DEF GXX = 4
+DEF TF = 10
+
+
+def tf(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, double inc,
+       double dec, int njobs=1):
+    """
+    Calculate the total-field anomaly of polygonal prisms.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: Input units are SI. Output is in nT
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the total field anomaly.
+        Prisms must have the physical property ``'magnetization'`` will be
+        ignored. If the physical properties ``'inclination'`` and
+        ``'declination'`` are not present, will use the values of *inc* and
+        *dec* instead (regional field). *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * inc : float
+        The inclination of the regional field (in degrees)
+    * dec : float
+        The declination of the regional field (in degrees)
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    verts, coefs = _get_magnetization(prisms, inc, dec)
+    res = _forward_tf(xp, yp, zp, verts[0], verts[1], verts[2], verts[3],
+                      verts[4], coefs, njobs)
+    res *= CM*T2NT
+    return numpy.asarray(res, dtype='f')
+
+def tf_batch(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+             numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+             numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, inc, dec,
+             magnetization=None, int njobs=1):
+    """
+    Calculate the total-field anomaly of polygonal prisms for many regional
+    field directions at once.
+
+    The integrals over the edges of the prisms are calculated only once and
+    projected on each direction. This is much faster than calling
+    :func:`~fatiando.gravmag.polyprism.tf` for each direction. Unlike
+    :func:`~fatiando.gravmag.polyprism.tf`, the result is in double precision.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: Input units are SI. Output is in nT
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model (or a :class:`~fatiando.mesher.PolygonalPrismArray`). If
+        *magnetization* is None, uses the physical properties
+        ``'magnetization'``, ``'inclination'`` and ``'declination'`` like
+        :func:`~fatiando.gravmag.polyprism.tf`. Prisms without
+        ``'inclination'`` and ``'declination'`` are magnetized in the
+        direction of each regional field.
+    * inc, dec : arrays
+        The inclinations and declinations of the regional fields (in degrees)
+    * magnetization : list = [mx, my, mz] or None
+        If not None, the x, y, and z components of the magnetization vector of
+        each prism (in A/m). Elements of *prisms* that are None are ignored.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The total-field anomaly with shape ``(len(inc), len(xp))``. Each row
+        is the anomaly for one regional field direction.
+
+    """
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    verts, weights = _get_batch_magnetization(prisms, magnetization)
+    terms = _forward_tf_batch(xp, yp, zp, verts[0], verts[1], verts[2],
+                              verts[3], verts[4], weights, njobs)
+    return _tf_directions(inc, dec, terms)
+
+def fields(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+           numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+           numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms,
+           components=None, inc=None, dec=None, int njobs=1):
+    """
+    Calculate several fields of polygonal prisms at once.
+
+    The integrals over each edge are calculated only once per computation
+    point and shared by all *components*. The gravity gradient tensor and the
+    total-field anomaly use the same six integrals (the V matrix of Plouff,
+    1976), and the potential, gx and gy use the same integral over the vertical
+    faces. This is much faster than calling each function separately, e.g.,
+    when calculating the full gravity gradient tensor.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units. The output units are the same as
+        the functions of each component.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the fields. The gravitational fields use
+        the physical property ``'density'`` and the total-field anomaly the
+        properties ``'magnetization'``, ``'inclination'`` and
+        ``'declination'`` (see :func:`~fatiando.gravmag.polyprism.tf`). Prisms
+        without them are ignored for those components. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * components : list of str or None
+        The fields to calculate. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``, and ``'tf'``. If None, will calculate all of
+        them (``'tf'`` only if *inc* and *dec* are given).
+    * inc, dec : float or None
+        The inclination and declination of the regional field (in degrees).
+        Needed for ``'tf'``.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : dict
+        The fields calculated on xp, yp, zp. The keys are the names of the
+        components.
+
+    """
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    components = _fields_check(components, inc, dec)
+    prisms = polyprisms2array(prisms)
+    verts = _select(prisms, numpy.ones(prisms.size, dtype=numpy.bool))
+    density = numpy.zeros(prisms.size)
+    hasdens = numpy.zeros(prisms.size, dtype=numpy.intc)
+    if 'density' in prisms.props:
+        hasdens[:] = ~numpy.isnan(prisms.props['density'])
+        density = numpy.nan_to_num(prisms.props['density'])
+    coefs = numpy.zeros((6, prisms.size))
+    magnetized = numpy.zeros(prisms.size, dtype=numpy.intc)
+    if 'tf' in components:
+        valid, tfcoefs = _tf_coefs(prisms, inc, dec)
+        coefs[:, valid] = tfcoefs
+        magnetized[:] = valid
+    effects = _forward_fields(components, xp, yp, zp, verts[0], verts[1],
+                              verts[2], verts[3], verts[4], density, hasdens,
+                              coefs, magnetized, njobs)
+    res = {}
+    for c in components:
+        effect = effects[_fields_components.index(c)]
+        effect *= _fields_scales[c]
+        res[c] = numpy.asarray(effect, dtype='f')
+    return res
+
+def potential(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+              numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+              numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms,
+              int njobs=1):
+    """
+    Calculates the gravitational potential.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in SI!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    res = _density(kernelpotential, xp, yp, zp, prisms, njobs)
+    res *= G
+    return numpy.asarray(res, dtype='f')
+
+def gx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, int njobs=1):
+    """
+    Calculates the :math:`g_x` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    res = _density(kernelgx, xp, yp, zp, prisms, njobs)
+    res *= G*SI2MGAL
+    return numpy.asarray(res, dtype='f')
+
+def gy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, int njobs=1):
+    """
+    Calculates the :math:`g_y` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    res = _density(kernelgy, xp, yp, zp, prisms, njobs)
+    res *= G*SI2MGAL
+    return numpy.asarray(res, dtype='f')
+
+def gz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, int njobs=1):
+    """
+    Calculates the :math:`g_{z}` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    res = _density(kernelgz, xp, yp, zp, prisms, njobs)
+    res *= G*SI2MGAL
+    return numpy.asarray(res, dtype='f')
+
+def gxx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, int njobs=1):
+    """
+    Calculates the :math:`g_{xx}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    res = _density(kernelgxx, xp, yp, zp, prisms, njobs)
+    res *= G*SI2EOTVOS
+    return numpy.asarray(res, dtype='f')
+
+def gxy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, int njobs=1):
+    """
+    Calculates the :math:`g_{xy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    res = _density(kernelgxy, xp, yp, zp, prisms, njobs)
+    res *= G*SI2EOTVOS
+    return numpy.asarray(res, dtype='f')
+
+def gxz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, int njobs=1):
+    """
+    Calculates the :math:`g_{xz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    res = _density(kernelgxz, xp, yp, zp, prisms, njobs)
+    res *= G*SI2EOTVOS
+    return numpy.asarray(res, dtype='f')
+
+def gyy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, int njobs=1):
+    """
+    Calculates the :math:`g_{yy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    res = _density(kernelgyy, xp, yp, zp, prisms, njobs)
+    res *= G*SI2EOTVOS
+    return numpy.asarray(res, dtype='f')
+
+def gyz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, int njobs=1):
+    """
+    Calculates the :math:`g_{yz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    res = _density(kernelgyz, xp, yp, zp, prisms, njobs)
+    res *= G*SI2EOTVOS
+    return numpy.asarray(res, dtype='f')
+
+def gzz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, int njobs=1):
+    """
+    Calculates the :math:`g_{zz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    res = _density(kernelgzz, xp, yp, zp, prisms, njobs)
+    res *= G*SI2EOTVOS
+    return numpy.asarray(res, dtype='f')
+
+def _select(prisms, valid):
+    """
+    Get the packed vertices of the prisms marked in the boolean array *valid*.
+
+    Returns:
+
+    * [x, y, offsets, z1, z2]
+        The vertices of prism ``i`` are ``x[offsets[i]:offsets[i + 1]]``
+    """
+    if valid.all():
+        offsets = prisms.offsets
+        x, y, z1, z2 = prisms.x, prisms.y, prisms.z1, prisms.z2
+    else:
+        verts = numpy.repeat(valid, prisms.nverts)
+        offsets = numpy.zeros(valid.sum() + 1, dtype=numpy.int)
+        numpy.cumsum(prisms.nverts[valid], out=offsets[1:])
+        x, y = prisms.x[verts], prisms.y[verts]
+        z1, z2 = prisms.z1[valid], prisms.z2[valid]
+    return [x, y, numpy.ascontiguousarray(offsets, dtype=numpy.intp), z1, z2]
+
+def _get_props(prisms, prop):
+    """
+    Get the packed vertices of the prisms that have physical property *prop*
+    and the values of the property.
+
+    Returns:
+
+    * [verts, values]
+        verts is the list returned by
+        :func:`~fatiando.gravmag._cpolyprism._select`
+    """
+    prisms = polyprisms2array(prisms)
+    if prop not in prisms.props:
+        valid = numpy.zeros(prisms.size, dtype=numpy.bool)
+        return _select(prisms, valid), numpy.zeros(0)
+    values = prisms.props[prop]
+    valid = ~numpy.isnan(values)
+    return _select(prisms, valid), numpy.ascontiguousarray(values[valid])
+
+def _get_magnetization(prisms, inc, dec):
+    """
+    Get the packed vertices of the magnetized prisms and the coefficients of
+    the integrals v1 to v6 in the total-field anomaly.
+
+    Returns:
+
+    * [verts, coefs]
+        coefs is a 2D array (see
+        :func:`~fatiando.gravmag._cpolyprism._tf_coefs`)
+    """
+    prisms = polyprisms2array(prisms)
+    valid, coefs = _tf_coefs(prisms, inc, dec)
+    return _select(prisms, valid), coefs
+
+def _tf_coefs(prisms, inc, dec):
+    """
+    Calculate the coefficients of the integrals v1 to v6 in the total-field
+    anomaly of a :class:`~fatiando.mesher.PolygonalPrismArray`.
+
+    Returns:
+
+    * [valid, coefs]
+        valid is a boolean array marking the prisms that have a magnetization.
+        coefs is a 2D array with the rows ``mx*fx``, ``mx*fy + my*fx``,
+        ``mx*fz + mz*fx``, ``my*fy``, ``my*fz + mz*fy``, and ``mz*fz``
+        multiplied by the magnetization intensity of these prisms.
+    """
+    props = prisms.props
+    if 'magnetization' not in props:
+        return numpy.zeros(prisms.size, dtype=numpy.bool), numpy.zeros((6, 0))
+    valid = ~numpy.isnan(props['magnetization'])
+    intensity = props['magnetization'][valid]
+    fx, fy, fz = utils.dircos(inc, dec)
+    mx, my, mz = [numpy.repeat(float(f), len(intensity)) for f in [fx, fy, fz]]
+    if 'inclination' in props and 'declination' in props:
+        incs = props['inclination'][valid]
+        decs = props['declination'][valid]
+        given = ~(numpy.isnan(incs) | numpy.isnan(decs))
+        for m, d in zip([mx, my, mz], utils.dircos(incs[given], decs[given])):
+            m[given] = d
+    coefs = intensity*numpy.array([mx*fx, mx*fy + my*fx, mx*fz + mz*fx, my*fy,
+                                   my*fz + mz*fy, mz*fz])
+    return valid, coefs
+
+def _get_batch_magnetization(prisms, magnetization):
+    """
+    Get the packed vertices of the prisms and the magnetization used by
+    tf_batch.
+
+    Returns:
+
+    * [verts, weights]
+        weights is a 2D array with rows mx, my, mz (magnetization vector of the
+        prisms with a fixed direction) and the intensity of the prisms
+        magnetized in the direction of the regional field.
+    """
+    if magnetization is not None:
+        if isinstance(prisms, list):
+            given = numpy.array([p is not None for p in prisms],
+                                dtype=numpy.bool)
+        else:
+            given = numpy.ones(len(prisms), dtype=numpy.bool)
+        mag = [numpy.asarray(m, dtype=numpy.float) for m in magnetization]
+        if len(mag) != 3 or any(m.shape != given.shape for m in mag):
+            raise ValueError(
+                "magnetization must be 3 arrays with one value per prism")
+        fixed = [m[given] for m in mag]
+        induced = numpy.zeros_like(fixed[0])
+    prisms = polyprisms2array(prisms)
+    if magnetization is None:
+        props = prisms.props
+        intensity = numpy.zeros(prisms.size)
+        if 'magnetization' in props:
+            intensity = numpy.nan_to_num(props['magnetization'])
+        given = numpy.zeros(prisms.size, dtype=numpy.bool)
+        fixed = [numpy.zeros(prisms.size) for i in xrange(3)]
+        if 'inclination' in props and 'declination' in props:
+            incs, decs = props['inclination'], props['declination']
+            given = ~(numpy.isnan(incs) | numpy.isnan(decs))
+            for m, d in zip(fixed, utils.dircos(incs[given], decs[given])):
+                m[given] = intensity[given]*d
+        induced = numpy.where(given, 0., intensity)
+    valid = numpy.ones(prisms.size, dtype=numpy.bool)
+    return _select(prisms, valid), numpy.array(fixed + [induced])
+
+cdef _density(kernel_func kernel, xp, yp, zp, prisms, int njobs):
+    """
+    Sum the effect of the prisms using their ``'density'``.
+    """
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError("Input arrays xp, yp, and zp must have same length!")
+    verts, density = _get_props(prisms, 'density')
+    return _forward(kernel, xp, yp, zp, verts[0], verts[1], verts[2], verts[3],
+                    verts[4], density, njobs)
+
+# Geometry of an edge and the logarithms and arc-tangents shared by the
+# elements of the V matrix of Plouff (1976). The terms of the second vertex end
+# in 2 and of the first in 1.
+cdef struct edge_t:
+    DTYPE_T n, g, m, c, p, d1, d2, R11, R12, R21, R22
+    DTYPE_T atan1, atan2, log1, log2, logr1, logr2
+
+cdef inline void _edge(DTYPE_T X1, DTYPE_T X2, DTYPE_T Y1, DTYPE_T Y2,
+                       DTYPE_T Z1, DTYPE_T Z2, edge_t *e) nogil:
+    cdef DTYPE_T aux0, aux1, aux2, aux6, aux7
+    aux0 = X2 - X1 + DUMMY
+    aux1 = Y2 - Y1 + DUMMY
+    e.n = aux0/aux1
+    e.g = X1 - Y1*e.n
+    e.m = aux1/aux0
+    e.c = Y1 - X1*e.m
+    aux2 = sqrt(aux0*aux0 + aux1*aux1)
+    e.p = (X1*Y2 - X2*Y1)/aux2 + DUMMY
+    e.d1 = (aux0*X1 + aux1*Y1)/aux2 + DUMMY
+    e.d2 = (aux0*X2 + aux1*Y2)/aux2 + DUMMY
+    aux6 = X1*X1 + Y1*Y1
+    aux7 = X2*X2 + Y2*Y2
+    e.R11 = sqrt(aux6 + Z1*Z1)
+    e.R12 = sqrt(aux6 + Z2*Z2)
+    e.R21 = sqrt(aux7 + Z1*Z1)
+    e.R22 = sqrt(aux7 + Z2*Z2)
+
+cdef inline void _edge_atan(DTYPE_T Z1, DTYPE_T Z2, edge_t *e) nogil:
+    e.atan2 = atan2(Z2*e.d2, e.p*e.R22) - atan2(Z1*e.d2, e.p*e.R21)
+    e.atan1 = atan2(Z2*e.d1, e.p*e.R12) - atan2(Z1*e.d1, e.p*e.R11)
+
+cdef inline void _edge_log(DTYPE_T Z1, DTYPE_T Z2, edge_t *e) nogil:
+    e.log2 = log(Z2 + e.R22 + DUMMY) - log(Z1 + e.R21 + DUMMY)
+    e.log1 = log(Z2 + e.R12 + DUMMY) - log(Z1 + e.R11 + DUMMY)
+
+cdef inline void _edge_logr(edge_t *e) nogil:
+    e.logr2 = (log((e.R22 - e.d2)/(e.R22 + e.d2) + DUMMY)
+               - log((e.R21 - e.d2)/(e.R21 + e.d2) + DUMMY))/(2*e.d2)
+    e.logr1 = (log((e.R12 - e.d1)/(e.R12 + e.d1) + DUMMY)
+               - log((e.R11 - e.d1)/(e.R11 + e.d1) + DUMMY))/(2*e.d1)
+
+# The elements of the V matrix from the terms of the edge. v1 to v4 need
+# _edge_atan and _edge_log, v3 and v5 need _edge_logr, and v6 needs _edge_atan.
+cdef inline DTYPE_T _v1(DTYPE_T Y1, DTYPE_T Y2, edge_t *e) nogil:
+    return -(e.g*Y2*e.atan2/(e.p*e.d2) + e.n*e.p*e.atan2/e.d2
+             - e.g*Y1*e.atan1/(e.p*e.d1) - e.n*e.p*e.atan1/e.d1
+             + e.n*(e.log1 - e.log2))/(1.0 + e.n*e.n)
+
+cdef inline DTYPE_T _v2(DTYPE_T Y1, DTYPE_T Y2, edge_t *e) nogil:
+    return ((e.g*e.g + e.g*e.n*Y2)*e.atan2/(e.p*e.d2) - e.p*e.atan2/e.d2
+            - (e.g*e.g + e.g*e.n*Y1)*e.atan1/(e.p*e.d1) + e.p*e.atan1/e.d1
+            + e.log2 - e.log1)/(1.0 + e.n*e.n)
+
+cdef inline DTYPE_T _v3(DTYPE_T Y1, DTYPE_T Y2, edge_t *e) nogil:
+    return -((Y2*(1.0 + e.n*e.n) + e.g*e.n)*e.logr2
+             - (Y1*(1.0 + e.n*e.n) + e.g*e.n)*e.logr1)/(1.0 + e.n*e.n)
+
+cdef inline DTYPE_T _v4(DTYPE_T X1, DTYPE_T X2, edge_t *e) nogil:
+    return (e.c*X2*e.atan2/(e.p*e.d2) + e.m*e.p*e.atan2/e.d2
+            - e.c*X1*e.atan1/(e.p*e.d1) - e.m*e.p*e.atan1/e.d1
+            + e.m*(e.log1 - e.log2))/(1.0 + e.m*e.m)
+
+cdef inline DTYPE_T _v5(DTYPE_T X1, DTYPE_T X2, edge_t *e) nogil:
+    return ((X2*(1.0 + e.m*e.m) + e.c*e.m)*e.logr2
+            - (X1*(1.0 + e.m*e.m) + e.c*e.m)*e.logr1)/(1.0 + e.m*e.m)
+
+cdef inline DTYPE_T _v6(edge_t *e) nogil:
+    return e.atan2 - e.atan1
+
+cdef inline void _integrals_v(DTYPE_T X1, DTYPE_T X2, DTYPE_T Y1, DTYPE_T Y2,
+                              DTYPE_T Z1, DTYPE_T Z2, int *want,
+                              DTYPE_T *v) nogil:
+    """
+    Calculate the elements of the V matrix marked in *want* (v1 to v6),
+    calculating the terms shared by them only once.
+    """
+    cdef edge_t e
+    _edge(X1, X2, Y1, Y2, Z1, Z2, &e)
+    if want[0] or want[1] or want[3] or want[5]:
+        _edge_atan(Z1, Z2, &e)
+    if want[0] or want[1] or want[3]:
+        _edge_log(Z1, Z2, &e)
+    if want[2] or want[4]:
+        _edge_logr(&e)
+    if want[0]:
+        v[0] = _v1(Y1, Y2, &e)
+    if want[1]:
+        v[1] = _v2(Y1, Y2, &e)
+    if want[2]:
+        v[2] = _v3(Y1, Y2, &e)
+    if want[3]:
+        v[3] = _v4(X1, X2, &e)
+    if want[4]:
+        v[4] = _v5(X1, X2, &e)
+    if want[5]:
+        v[5] = _v6(&e)
+
+cdef inline DTYPE_T kernelgxx(DTYPE_T X1, DTYPE_T X2, DTYPE_T Y1, DTYPE_T Y2,
+                              DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef edge_t e
+    _edge(X1, X2, Y1, Y2, Z1, Z2, &e)
+    _edge_atan(Z1, Z2, &e)
+    _edge_log(Z1, Z2, &e)
+    return _v1(Y1, Y2, &e)
+
+cdef inline DTYPE_T kernelgxy(DTYPE_T X1, DTYPE_T X2, DTYPE_T Y1, DTYPE_T Y2,
+                              DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef edge_t e
+    _edge(X1, X2, Y1, Y2, Z1, Z2, &e)
+    _edge_atan(Z1, Z2, &e)
+    _edge_log(Z1, Z2, &e)
+    return _v2(Y1, Y2, &e)
+
+cdef inline DTYPE_T kernelgxz(DTYPE_T X1, DTYPE_T X2, DTYPE_T Y1, DTYPE_T Y2,
+                              DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef edge_t e
+    _edge(X1, X2, Y1, Y2, Z1, Z2, &e)
+    _edge_logr(&e)
+    return _v3(Y1, Y2, &e)
+
+cdef inline DTYPE_T kernelgyy(DTYPE_T X1, DTYPE_T X2, DTYPE_T Y1, DTYPE_T Y2,
+                              DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef edge_t e
+    _edge(X1, X2, Y1, Y2, Z1, Z2, &e)
+    _edge_atan(Z1, Z2, &e)
+    _edge_log(Z1, Z2, &e)
+    return _v4(X1, X2, &e)
+
+cdef inline DTYPE_T kernelgyz(DTYPE_T X1, DTYPE_T X2, DTYPE_T Y1, DTYPE_T Y2,
+                              DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef edge_t e
+    _edge(X1, X2, Y1, Y2, Z1, Z2, &e)
+    _edge_logr(&e)
+    return _v5(X1, X2, &e)
+
+cdef inline DTYPE_T kernelgzz(DTYPE_T X1, DTYPE_T X2, DTYPE_T Y1, DTYPE_T Y2,
+                              DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef edge_t e
+    _edge(X1, X2, Y1, Y2, Z1, Z2, &e)
+    _edge_atan(Z1, Z2, &e)
+    return _v6(&e)
+
+cdef inline DTYPE_T kernelgz(DTYPE_T Xk1, DTYPE_T Xk2, DTYPE_T Yk1,
+                             DTYPE_T Yk2, DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef DTYPE_T p, p_sqr, Qk1, Qk2, Ak1, Ak2, R1k1, R1k2, R2k1, R2k2
+    cdef DTYPE_T Bk1, Bk2, E1k1, E1k2, E2k1, E2k2, Ck1, Ck2, kernel
+    p = Xk1*Yk2 - Xk2*Yk1
+    p_sqr = p**2
+    Qk1 = (Yk2 - Yk1)*Yk1 + (Xk2 - Xk1)*Xk1
+    Qk2 = (Yk2 - Yk1)*Yk2 + (Xk2 - Xk1)*Xk2
+    Ak1 = Xk1**2 + Yk1**2
+    Ak2 = Xk2**2 + Yk2**2
+    R1k1 = sqrt(Ak1 + Z1**2)
+    R1k2 = sqrt(Ak2 + Z1**2)
+    R2k1 = sqrt(Ak1 + Z2**2)
+    R2k2 = sqrt(Ak2 + Z2**2)
+    Ak1 = sqrt(Ak1)
+    Ak2 = sqrt(Ak2)
+    Bk1 = sqrt(Qk1**2 + p_sqr)
+    Bk2 = sqrt(Qk2**2 + p_sqr)
+    E1k1 = R1k1*Bk1
+    E1k2 = R1k2*Bk2
+    E2k1 = R2k1*Bk1
+    E2k2 = R2k2*Bk2
+    kernel = (Z2 - Z1)*(atan2(Qk2, p) - atan2(Qk1, p))
+    kernel += Z2*(atan2(Z2*Qk1, R2k1*p) - atan2(Z2*Qk2, R2k2*p))
+    kernel += Z1*(atan2(Z1*Qk2, R1k2*p) - atan2(Z1*Qk1, R1k1*p))
+    Ck1 = Qk1*Ak1
+    Ck2 = Qk2*Ak2
+    # DUMMY helps prevent zero division errors
+    kernel += 0.5*p*(Ak1/(Bk1 + DUMMY))*(
+        log((E1k1 - Ck1)/(E1k1 + Ck1 + DUMMY) + DUMMY) -
+        log((E2k1 - Ck1)/(E2k1 + Ck1 + DUMMY) + DUMMY))
+    kernel += 0.5*p*(Ak2/(Bk2 + DUMMY))*(
+        log((E2k2 - Ck2)/(E2k2 + Ck2 + DUMMY) + DUMMY) -
+        log((E1k2 - Ck2)/(E1k2 + Ck2 + DUMMY) + DUMMY))
+    return kernel
+
+# The potential, gx, and gy are sums of integrals of 1/r over the faces of the
+# prism (see fatiando.gravmag.polyprism)
+cdef inline DTYPE_T _integral_side(DTYPE_T p, DTYPE_T u1, DTYPE_T u2,
+                                   DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef DTYPE_T absp = fabs(p), r, res = 0
+    cdef DTYPE_T u[2]
+    cdef DTYPE_T z[2]
+    cdef int i, j
+    u[0] = u1
+    u[1] = u2
+    z[0] = Z1
+    z[1] = Z2
+    for i in range(2):
+        for j in range(2):
+            r = sqrt(u[i]**2 + z[j]**2 + p**2)
+            res += (-1.)**(i + j)*(u[i]*log(z[j] + r + DUMMY)
+                                   + z[j]*log(u[i] + r + DUMMY)
+                                   - absp*atan2(u[i]*z[j], absp*r))
+    return res
+
+cdef inline DTYPE_T _integral_face(DTYPE_T p, DTYPE_T u1, DTYPE_T u2,
+                                   DTYPE_T Z) nogil:
+    cdef DTYPE_T w = fabs(Z), R1, R2
+    R1 = sqrt(p**2 + u1**2 + w**2)
+    R2 = sqrt(p**2 + u2**2 + w**2)
+    return (p*(log(u2 + R2 + DUMMY) - log(u1 + R1 + DUMMY))
+            + w*(atan2(w*u2, p*R2) - atan2(u2, p)
+                 - atan2(w*u1, p*R1) + atan2(u1, p)))
+
+cdef inline int _face_edge(DTYPE_T X1, DTYPE_T X2, DTYPE_T Y1, DTYPE_T Y2,
+                           DTYPE_T *nx, DTYPE_T *ny, DTYPE_T *p, DTYPE_T *u1,
+                           DTYPE_T *u2) nogil:
+    """
+    Calculate the outward normal of the vertical face below an edge, the
+    distance to its plane, and the coordinates of the vertices along the edge.
+    Returns 0 if the vertices are repeated.
+    """
+    cdef DTYPE_T dx = X2 - X1, dy = Y2 - Y1, length, ex, ey
+    length = sqrt(dx**2 + dy**2)
+    if length == 0:
+        return 0
+    ex = dx/length
+    ey = dy/length
+    nx[0] = ey
+    ny[0] = -ex
+    u1[0] = X1*ex + Y1*ey
+    u2[0] = X2*ex + Y2*ey
+    p[0] = X1*ey - Y1*ex
+    return 1
+
+cdef inline DTYPE_T kernelpotential(DTYPE_T X1, DTYPE_T X2, DTYPE_T Y1,
+                                    DTYPE_T Y2, DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef DTYPE_T nx, ny, p, u1, u2
+    if not _face_edge(X1, X2, Y1, Y2, &nx, &ny, &p, &u1, &u2):
+        return 0
+    return 0.5*(p*_integral_side(p, u1, u2, Z1, Z2)
+                - Z1*_integral_face(p, u1, u2, Z1)
+                + Z2*_integral_face(p, u1, u2, Z2))
+
+cdef inline DTYPE_T kernelgx(DTYPE_T X1, DTYPE_T X2, DTYPE_T Y1, DTYPE_T Y2,
+                             DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef DTYPE_T nx, ny, p, u1, u2
+    if not _face_edge(X1, X2, Y1, Y2, &nx, &ny, &p, &u1, &u2):
+        return 0
+    return -nx*_integral_side(p, u1, u2, Z1, Z2)
+
+cdef inline DTYPE_T kernelgy(DTYPE_T X1, DTYPE_T X2, DTYPE_T Y1, DTYPE_T Y2,
+                             DTYPE_T Z1, DTYPE_T Z2) nogil:
+    cdef DTYPE_T nx, ny, p, u1, u2
+    if not _face_edge(X1, X2, Y1, Y2, &nx, &ny, &p, &u1, &u2):
+        return 0
+    return -ny*_integral_side(p, u1, u2, Z1, Z2)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _forward(kernel_func kernel, DTYPE_T[:] xp, DTYPE_T[:] yp, DTYPE_T[:] zp,
+              DTYPE_T[::1] x, DTYPE_T[::1] y, Py_ssize_t[::1] offsets,
+              DTYPE_T[::1] z1, DTYPE_T[::1] z2, DTYPE_T[::1] values,
+              int njobs):
+    """
+    Sum the effect of all prisms on the computation points.
+
+    The kernel is summed over the edges of each prism and the result is
+    multiplied by the physical property value of the prism.
+    """
+    cdef int l, size = len(xp)
+    cdef DTYPE_T[::1] res
+    result = numpy.zeros(size, dtype=DTYPE)
+    res = result
+    for l in prange(size, nogil=True, schedule='static', num_threads=njobs):
+        res[l] = _forward_point(kernel, xp[l], yp[l], zp[l], x, y, offsets,
+                                z1, z2, values)
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline DTYPE_T _forward_point(kernel_func kernel, DTYPE_T xp, DTYPE_T yp,
+                                   DTYPE_T zp, DTYPE_T[::1] x, DTYPE_T[::1] y,
+                                   Py_ssize_t[::1] offsets, DTYPE_T[::1] z1,
+                                   DTYPE_T[::1] z2,
+                                   DTYPE_T[::1] values) nogil:
+    cdef Py_ssize_t i, k, first, last, next
+    cdef DTYPE_T Z1, Z2, tmp, res = 0
+    for i in range(values.shape[0]):
+        Z1 = z1[i] - zp
+        Z2 = z2[i] - zp
+        first = offsets[i]
+        last = offsets[i + 1]
+        tmp = 0
+        for k in range(first, last):
+            next = k + 1
+            if next == last:
+                next = first
+            tmp += kernel(x[k] - xp, x[next] - xp, y[k] - yp, y[next] - yp,
+                          Z1, Z2)
+        res += tmp*values[i]
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _forward_tf(DTYPE_T[:] xp, DTYPE_T[:] yp, DTYPE_T[:] zp,
+                 DTYPE_T[::1] x, DTYPE_T[::1] y, Py_ssize_t[::1] offsets,
+                 DTYPE_T[::1] z1, DTYPE_T[::1] z2, DTYPE_T[:, ::1] coefs,
+                 int njobs):
+    """
+    Sum the total-field anomaly of all prisms on the computation points.
+
+    *coefs* are the coefficients of the integrals v1 to v6 of each prism (see
+    :func:`~fatiando.gravmag._cpolyprism._get_magnetization`).
+    """
+    cdef int l, size = len(xp)
+    cdef DTYPE_T[::1] res
+    result = numpy.zeros(size, dtype=DTYPE)
+    res = result
+    for l in prange(size, nogil=True, schedule='static', num_threads=njobs):
+        res[l] = _forward_tf_point(xp[l], yp[l], zp[l], x, y, offsets, z1, z2,
+                                   coefs)
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline DTYPE_T _forward_tf_point(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp,
+                                      DTYPE_T[::1] x, DTYPE_T[::1] y,
+                                      Py_ssize_t[::1] offsets,
+                                      DTYPE_T[::1] z1, DTYPE_T[::1] z2,
+                                      DTYPE_T[:, ::1] coefs) nogil:
+    cdef Py_ssize_t i, k, n, first, last, next
+    cdef DTYPE_T Z1, Z2, res = 0
+    cdef int want[6]
+    cdef DTYPE_T v[6]
+    for n in range(6):
+        want[n] = 1
+    for i in range(coefs.shape[1]):
+        Z1 = z1[i] - zp
+        Z2 = z2[i] - zp
+        first = offsets[i]
+        last = offsets[i + 1]
+        for k in range(first, last):
+            next = k + 1
+            if next == last:
+                next = first
+            _integrals_v(x[k] - xp, x[next] - xp, y[k] - yp, y[next] - yp,
+                         Z1, Z2, want, v)
+            for n in range(6):
+                res += coefs[n, i]*v[n]
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _forward_tf_batch(DTYPE_T[:] xp, DTYPE_T[:] yp, DTYPE_T[:] zp,
+                       DTYPE_T[::1] x, DTYPE_T[::1] y, Py_ssize_t[::1] offsets,
+                       DTYPE_T[::1] z1, DTYPE_T[::1] z2,
+                       DTYPE_T[:, ::1] weights, int njobs):
+    """
+    Calculate the 9 terms of the total-field anomaly of all prisms (see
+    :func:`~fatiando.gravmag._prism._tf_directions`) on the computation points.
+
+    *weights* has rows mx, my, mz and the intensity of the induced
+    magnetization of each prism.
+    """
+    cdef int l, size = len(xp)
+    cdef DTYPE_T[:, ::1] terms
+    result = numpy.zeros((9, size), dtype=DTYPE)
+    terms = result
+    for l in prange(size, nogil=True, schedule='static', num_threads=njobs):
+        _forward_tf_batch_point(xp[l], yp[l], zp[l], x, y, offsets, z1, z2,
+                                weights, terms, l)
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void _forward_tf_batch_point(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp,
+                                         DTYPE_T[::1] x, DTYPE_T[::1] y,
+                                         Py_ssize_t[::1] offsets,
+                                         DTYPE_T[::1] z1, DTYPE_T[::1] z2,
+                                         DTYPE_T[:, ::1] weights,
+                                         DTYPE_T[:, ::1] terms,
+                                         int l) nogil:
+    cdef Py_ssize_t i, k, n, first, last, next
+    cdef DTYPE_T Z1, Z2, mx, my, mz, induced
+    cdef int want[6]
+    cdef DTYPE_T v[6]
+    cdef DTYPE_T tmp[6]
+    for n in range(6):
+        want[n] = 1
+    for i in range(weights.shape[1]):
+        Z1 = z1[i] - zp
+        Z2 = z2[i] - zp
+        first = offsets[i]
+        last = offsets[i + 1]
+        for n in range(6):
+            tmp[n] = 0
+        for k in range(first, last):
+            next = k + 1
+            if next == last:
+                next = first
+            _integrals_v(x[k] - xp, x[next] - xp, y[k] - yp, y[next] - yp,
+                         Z1, Z2, want, v)
+            for n in range(6):
+                tmp[n] += v[n]
+        mx = weights[0, i]
+        my = weights[1, i]
+        mz = weights[2, i]
+        induced = weights[3, i]
+        terms[0, l] += mx*tmp[0] + my*tmp[1] + mz*tmp[2]
+        terms[1, l] += mx*tmp[1] + my*tmp[3] + mz*tmp[4]
+        terms[2, l] += mx*tmp[2] + my*tmp[4] + mz*tmp[5]
+        for n in range(6):
+            terms[3 + n, l] += induced*tmp[n]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _forward_fields(components, DTYPE_T[:] xp, DTYPE_T[:] yp, DTYPE_T[:] zp,
+                     DTYPE_T[::1] x, DTYPE_T[::1] y, Py_ssize_t[::1] offsets,
+                     DTYPE_T[::1] z1, DTYPE_T[::1] z2, DTYPE_T[::1] density,
+                     int[::1] hasdens, DTYPE_T[:, ::1] coefs,
+                     int[::1] magnetized, int njobs):
+    """
+    Sum the effect of all prisms on the computation points for several
+    components at once.
+
+    Returns a 2D array with the (unscaled) effect of each component, in the
+    order of _fields_components (zero for components not in *components*).
+    """
+    cdef int l, n, size = len(xp)
+    cdef int want[NCOMPONENTS]
+    cdef DTYPE_T[:, ::1] res
+    for n in range(NCOMPONENTS):
+        want[n] = _fields_components[n] in components
+    result = numpy.zeros((NCOMPONENTS, size), dtype=DTYPE)
+    res = result
+    for l in prange(size, nogil=True, schedule='static', num_threads=njobs):
+        _forward_fields_point(xp[l], yp[l], zp[l], x, y, offsets, z1, z2,
+                              density, hasdens, coefs, magnetized, want, res,
+                              l)
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void _forward_fields_point(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp,
+                                       DTYPE_T[::1] x, DTYPE_T[::1] y,
+                                       Py_ssize_t[::1] offsets,
+                                       DTYPE_T[::1] z1, DTYPE_T[::1] z2,
+                                       DTYPE_T[::1] density,
+                                       int[::1] hasdens,
+                                       DTYPE_T[:, ::1] coefs,
+                                       int[::1] magnetized, int *want,
+                                       DTYPE_T[:, ::1] res, int l) nogil:
+    cdef Py_ssize_t i, k, n, first, last, next
+    cdef int gravity, tf, faces, anyv
+    cdef int wantv[6]
+    cdef DTYPE_T v[6]
+    cdef DTYPE_T tmp[NCOMPONENTS]
+    cdef DTYPE_T Z1, Z2, X1, X2, Y1, Y2, nx, ny, p, u1, u2, side
+    cdef DTYPE_T tfres = 0
+    for i in range(density.shape[0]):
+        gravity = hasdens[i]
+        tf = want[TF] and magnetized[i]
+        if not gravity and not tf:
+            continue
+        # The total-field anomaly needs all elements of the V matrix
+        anyv = 0
+        for n in range(6):
+            wantv[n] = tf or (gravity and want[GXX + n])
+            anyv = anyv or wantv[n]
+        faces = gravity and (want[POTENTIAL] or want[GX] or want[GY])
+        Z1 = z1[i] - zp
+        Z2 = z2[i] - zp
+        first = offsets[i]
+        last = offsets[i + 1]
+        for n in range(NCOMPONENTS):
+            tmp[n] = 0
+        for k in range(first, last):
+            next = k + 1
+            if next == last:
+                next = first
+            X1 = x[k] - xp
+            X2 = x[next] - xp
+            Y1 = y[k] - yp
+            Y2 = y[next] - yp
+            if anyv:
+                _integrals_v(X1, X2, Y1, Y2, Z1, Z2, wantv, v)
+            if tf:
+                for n in range(6):
+                    tfres += coefs[n, i]*v[n]
+            if not gravity:
+                continue
+            for n in range(6):
+                if want[GXX + n]:
+                    tmp[GXX + n] += v[n]
+            if want[GZ]:
+                tmp[GZ] += kernelgz(X1, X2, Y1, Y2, Z1, Z2)
+            if faces and _face_edge(X1, X2, Y1, Y2, &nx, &ny, &p, &u1, &u2):
+                side = _integral_side(p, u1, u2, Z1, Z2)
+                if want[POTENTIAL]:
+                    tmp[POTENTIAL] += 0.5*(p*side
+                                           - Z1*_integral_face(p, u1, u2, Z1)
+                                           + Z2*_integral_face(p, u1, u2, Z2))
+                if want[GX]:
+                    tmp[GX] += -nx*side
+                if want[GY]:
+                    tmp[GY] += -ny*side
+        if gravity:
+            for n in range(TF):
+                if want[n]:
+                    res[n, l] += tmp[n]*density[i]
+    res[TF, l] = tfres
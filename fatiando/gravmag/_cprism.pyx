@@ -1,5 +1,11 @@
 """
 Cython implementation of the potential field effects of right rectangular prisms
+
+The prisms are converted to a :class:`~fatiando.mesher.PrismArray` and the loops
+over computation points and prisms are done in C without the GIL. The loop over
+the computation points is split among *njobs* OpenMP threads. A
+:class:`~fatiando.mesher.PrismMesh` is evaluated on the nodes of the mesh (see
+:func:`fatiando.gravmag._prism._get_nodes`).
 """
 import numpy
 
@@ -7,21 +13,30 @@ from libc.math cimport log, atan2, sqrt
 # Import Cython definitions for numpy
 cimport numpy
 cimport cython
+from cython.parallel cimport prange
 
 DTYPE = numpy.float
 ctypedef numpy.float_t DTYPE_T
 
 from fatiando.constants import SI2EOTVOS, SI2MGAL, G, CM, T2NT
-from fatiando import utils
+from fatiando.mesher import PrismMesh
+from fatiando.gravmag._prism import _get_props, _get_magnetization, \
+    _get_nodes, _get_nodes_tf, _fields_components, _fields_scales, \
+    _fields_terms, _get_batch_magnetization, _tf_directions, _precision_dtype
+
+# The integration kernels are functions of the coordinates of a prism corner
+# relative to the computation point
+ctypedef DTYPE_T (*kernel_func)(DTYPE_T, DTYPE_T, DTYPE_T, DTYPE_T) nogil
 
 __all__ = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
-    'gzz', 'tf']
+    'gzz', 'tf', 'tf_batch', 'fields']
 
 
 def tf(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms,
-       double inc, double dec, pmag=None, pinc=None, pdec=None):
+       double inc, double dec, pmag=None, pinc=None, pdec=None,
+       int njobs=1, precision='float64'):
     """
     Calculate the total-field anomaly of prisms.
 
@@ -40,7 +55,8 @@ def tf(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         ignored. If the physical properties ``'inclination'`` and
         ``'declination'`` are not present, will use the values of *inc* and
         *dec* instead (regional field).
-        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh`.
+        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * inc : float
         The inclination of the regional field (in degrees)
     * dec : float
@@ -55,79 +71,95 @@ def tf(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         If not None, will use this value instead of the ``'declination'``
         property of the prisms. Use this, e.g., for sensitivity matrix building.
 
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T magnetization, kernel, r, r_sqr
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    cdef DTYPE_T fx, fy, fz, mx, my, mz
+    cdef numpy.ndarray[DTYPE_T, ndim=1] res
+    dtype = _precision_dtype(precision)
     if len(xp) != len(yp) != len(zp):
-        raise ValueError("Input arrays xp, yp, and zp must have same length!")
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    # Calculate the 3 components of the unit vector in the direction of the
-    # regional field
-    fx, fy, fz = utils.dircos(inc, dec)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if (prism is None or
-            ('magnetization' not in prism.props and pmag is None)):
-            continue
-        if pmag is None:
-            magnetization = prism.props['magnetization']
-        else:
-            magnetization = pmag
-        # Get the 3 components of the unit vector in the direction of the
-        # magnetization from the inclination and declination
-        # 1) given by the function
-        if pinc is not None and pdec is not None:
-            mx, my, mz = utils.dircos(pinc, pdec)
-        # 2) given by the prism
-        elif 'inclination' in prism.props and 'declination' in prism.props:
-            mx, my, mz = utils.dircos(prism.props['inclination'],
-                                      prism.props['declination'])
-        # 3) Use in the direction of the regional field
-        else:
-            mx, my, mz = fx, fy, fz
-        # Calculate on all computation points
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            for k in range(2):
-                magnetization *= -1.
-                for j in range(2):
-                    for i in range(2):
-                        r_sqr = x[i]**2 + y[j]**2 + z[k]**2
-                        r = sqrt(r_sqr)
-                        res[l] += ((-1.)**(i + j))*magnetization*(
-                              0.5*(my*fz + mz*fy)*log((r - x[i])/(r + x[i]))
-                            + 0.5*(mx*fz + mz*fx)*log((r - y[j])/(r + y[j]))
-                            - (mx*fy + my*fx)*log(r + z[k])
-                            - mx*fx*atan2(x[i]*y[j], x[i]**2 + z[k]*r + z[k]**2)
-                            - my*fy*atan2(x[i]*y[j], r_sqr + z[k]*r - x[i]**2)
-                            + mz*fz*atan2(x[i]*y[j], z[k]*r))
+        raise ValueError(
+            "Input arrays xp, yp, and zp must have same length!")
+    if isinstance(prisms, PrismMesh):
+        nodes, weights = _get_nodes_tf(prisms, inc, dec, pmag, pinc, pdec)
+        res = _forward_nodes_tf(xp, yp, zp, numpy.array(nodes),
+                                numpy.array(weights), njobs)
+    else:
+        bounds, magnetization, coefs = _get_magnetization(
+            prisms, inc, dec, pmag, pinc, pdec)
+        res = _forward_tf(xp, yp, zp, numpy.array(bounds), magnetization,
+                          numpy.array(coefs), njobs)
     res *= CM*T2NT
-    return res
+    return numpy.asarray(res, dtype=dtype)
+
+def tf_batch(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+             numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+             numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms,
+             inc, dec, magnetization=None, int njobs=1):
+    """
+    Calculate the total-field anomaly of prisms for many regional field
+    directions at once.
+
+    The magnetic field of the prisms is calculated only once and projected on
+    each direction. This is much faster than calling
+    :func:`~fatiando.gravmag.prism.tf` for each direction.
+
+    .. note:: Input units are SI. Output is in nT
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The model. Can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`. If *magnetization* is None, uses
+        the physical properties ``'magnetization'``, ``'inclination'`` and
+        ``'declination'`` like :func:`~fatiando.gravmag.prism.tf`. Prisms
+        without ``'inclination'`` and ``'declination'`` are magnetized in the
+        direction of each regional field.
+    * inc, dec : arrays
+        The inclinations and declinations of the regional fields (in degrees)
+    * magnetization : list = [mx, my, mz] or None
+        If not None, the x, y, and z components of the magnetization vector of
+        each element of *prisms* (in A/m). Elements that are None (or masked
+        prisms of a :class:`~fatiando.mesher.PrismMesh`) are ignored.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The total-field anomaly with shape ``(len(inc), len(xp))``. Each row
+        is the anomaly for one regional field direction.
+
+    """
+    if len(xp) != len(yp) != len(zp):
+        raise ValueError(
+            "Input arrays xp, yp, and zp must have same length!")
+    bounds, weights = _get_batch_magnetization(prisms, magnetization)
+    terms = _forward_tf_batch(xp, yp, zp, bounds, weights, njobs)
+    return _tf_directions(inc, dec, terms)
 
 def potential(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
               numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-              numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+              numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+              ratio=None, int njobs=1, precision='float64'):
     """
     Calculates the gravitational potential.
 
@@ -145,7 +177,8 @@ def potential(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -153,59 +186,37 @@ def potential(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        kernel = (x[i]*y[j]*log(z[k] + r)
-                                  + y[j]*z[k]*log(x[i] + r)
-                                  + x[i]*z[k]*log(y[j] + r)
-                                  - 0.5*x[i]**2*atan2(z[k]*y[j], x[i]*r)
-                                  - 0.5*y[j]**2*atan2(z[k]*x[i], y[j]*r)
-                                  - 0.5*z[k]**2*atan2(x[i]*y[j], z[k]*r))
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
+    cdef numpy.ndarray[DTYPE_T, ndim=1] res
+    dtype = _precision_dtype(precision)
+    res = _density(kernelpotential, pointpotential, xp, yp, zp, prisms, dens,
+                   ratio, njobs)
     # Now all that is left is to multiply res by the gravitational constant
     res *= G
-    return res
+    return numpy.asarray(res, dtype=dtype)
 
 def gx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+       ratio=None, int njobs=1, precision='float64'):
     """
     Calculates the :math:`g_x` gravity acceleration component.
 
@@ -223,64 +234,44 @@ def gx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        # Minus because Nagy et al (2000) give the formula for the
-                        # gradient of the potential. Gravity is -grad(V)
-                        kernel = -(y[j]*log(z[k] + r)
-                                   + z[k]*log(y[j] + r)
-                                   - x[i]*atan2(z[k]*y[j], x[i]*r))
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
+    cdef numpy.ndarray[DTYPE_T, ndim=1] res
+    dtype = _precision_dtype(precision)
+    res = _density(kernelgx, pointgx, xp, yp, zp, prisms, dens,
+                   ratio, njobs)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to mGal units
     res *= G*SI2MGAL
-    return res
+    return numpy.asarray(res, dtype=dtype)
 
 def gy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+       ratio=None, int njobs=1, precision='float64'):
     """
     Calculates the :math:`g_y` gravity acceleration component.
 
@@ -298,64 +289,44 @@ def gy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        # Minus because Nagy et al (2000) give the formula for the
-                        # gradient of the potential. Gravity is -grad(V)
-                        kernel = -(z[k]*log(x[i] + r)
-                                   + x[i]*log(z[k] + r)
-                                   - y[j]*atan2(x[i]*z[k], y[j]*r))
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
+    cdef numpy.ndarray[DTYPE_T, ndim=1] res
+    dtype = _precision_dtype(precision)
+    res = _density(kernelgy, pointgy, xp, yp, zp, prisms, dens,
+                   ratio, njobs)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to mGal units
     res *= G*SI2MGAL
-    return res
+    return numpy.asarray(res, dtype=dtype)
 
 def gz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
        numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+       numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+       ratio=None, int njobs=1, precision='float64'):
     """
     Calculates the :math:`g_z` gravity acceleration component.
 
@@ -373,64 +344,44 @@ def gz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        # Minus because Nagy et al (2000) give the formula for the
-                        # gradient of the potential. Gravity is -grad(V)
-                        kernel = -(x[i]*log(y[j] + r)
-                                   + y[j]*log(x[i] + r)
-                                   - z[k]*atan2(x[i]*y[j], z[k]*r))
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
+    cdef numpy.ndarray[DTYPE_T, ndim=1] res
+    dtype = _precision_dtype(precision)
+    res = _density(kernelgz, pointgz, xp, yp, zp, prisms, dens,
+                   ratio, njobs)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to mGal units
     res *= G*SI2MGAL
-    return res
+    return numpy.asarray(res, dtype=dtype)
 
 def gxx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+        ratio=None, int njobs=1, precision='float64'):
     """
     Calculates the :math:`g_{xx}` gravity gradient tensor component.
 
@@ -448,60 +399,44 @@ def gxx(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        kernel = -atan2(z[k]*y[j], x[i]*r)
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
+    cdef numpy.ndarray[DTYPE_T, ndim=1] res
+    dtype = _precision_dtype(precision)
+    res = _density(kernelgxx, pointgxx, xp, yp, zp, prisms, dens,
+                   ratio, njobs)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return numpy.asarray(res, dtype=dtype)
 
 def gxy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+        ratio=None, int njobs=1, precision='float64'):
     """
     Calculates the :math:`g_{xy}` gravity gradient tensor component.
 
@@ -519,60 +454,44 @@ def gxy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        kernel = log(z[k] + r)
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
+    cdef numpy.ndarray[DTYPE_T, ndim=1] res
+    dtype = _precision_dtype(precision)
+    res = _density(kernelgxy, pointgxy, xp, yp, zp, prisms, dens,
+                   ratio, njobs)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return numpy.asarray(res, dtype=dtype)
 
 def gxz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+        ratio=None, int njobs=1, precision='float64'):
     """
     Calculates the :math:`g_{xz}` gravity gradient tensor component.
 
@@ -590,60 +509,44 @@ def gxz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        kernel = log(y[j] + r)
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
+    cdef numpy.ndarray[DTYPE_T, ndim=1] res
+    dtype = _precision_dtype(precision)
+    res = _density(kernelgxz, pointgxz, xp, yp, zp, prisms, dens,
+                   ratio, njobs)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return numpy.asarray(res, dtype=dtype)
 
 def gyy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+        ratio=None, int njobs=1, precision='float64'):
     """
     Calculates the :math:`g_{yy}` gravity gradient tensor component.
 
@@ -661,60 +564,44 @@ def gyy(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        kernel = -atan2(z[k]*x[i], y[j]*r)
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
+    cdef numpy.ndarray[DTYPE_T, ndim=1] res
+    dtype = _precision_dtype(precision)
+    res = _density(kernelgyy, pointgyy, xp, yp, zp, prisms, dens,
+                   ratio, njobs)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return numpy.asarray(res, dtype=dtype)
 
 def gyz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+        ratio=None, int njobs=1, precision='float64'):
     """
     Calculates the :math:`g_{yz}` gravity gradient tensor component.
 
@@ -732,60 +619,44 @@ def gyz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
-            for k in range(2):
-                for j in range(2):
-                    for i in range(2):
-                        r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        kernel = log(x[i] + r)
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
+    cdef numpy.ndarray[DTYPE_T, ndim=1] res
+    dtype = _precision_dtype(precision)
+    res = _density(kernelgyz, pointgyz, xp, yp, zp, prisms, dens,
+                   ratio, njobs)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
-    return res
+    return numpy.asarray(res, dtype=dtype)
 
 def gzz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         numpy.ndarray[DTYPE_T, ndim=1] yp not None,
-        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None):
+        numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, dens=None,
+        ratio=None, int njobs=1, precision='float64'):
     """
     Calculates the :math:`g_{zz}` gravity gradient tensor component.
 
@@ -803,53 +674,931 @@ def gzz(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    cdef unsigned int l, size, i, j, k
-    cdef numpy.ndarray[DTYPE_T, ndim=1] res, x, y, z
-    cdef DTYPE_T density, kernel, r
-    cdef DTYPE_T x1, x2, y1, y2, z1, z2
-    size = len(xp)
-    res = numpy.zeros(size, dtype=DTYPE)
-    x = numpy.zeros(2, dtype=DTYPE)
-    y = numpy.zeros(2, dtype=DTYPE)
-    z = numpy.zeros(2, dtype=DTYPE)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
+    cdef numpy.ndarray[DTYPE_T, ndim=1] res
+    dtype = _precision_dtype(precision)
+    res = _density(kernelgzz, pointgzz, xp, yp, zp, prisms, dens,
+                   ratio, njobs)
+    # Now all that is left is to multiply res by the gravitational constant and
+    # convert it to Eotvos units
+    res *= G*SI2EOTVOS
+    return numpy.asarray(res, dtype=dtype)
+
+def fields(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+           numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+           numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms,
+           components=None, dens=None, int njobs=1, precision='float64'):
+    """
+    Calculate several gravitational fields of the prisms at once.
+
+    The coordinate shifts, distances, logarithms, and arc-tangents of the prism
+    corners are calculated only once and shared by all *components*. This is
+    faster than calling each function separately, e.g., when calculating all
+    components of the gravity gradient tensor.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!). The output units are the
+        same as the functions of each component.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have this
+        property will be ignored in the computations. Elements of *prisms* that
+        are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * components : list of str or None
+        The fields to calculate. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, and ``'gzz'``. If None, will calculate all of them.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+
+        .. warning:: Uses this value for **all** prisms! Not only the ones that
+            have ``'density'`` as a property.
+
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
+    Returns:
+
+    * res : dict
+        The fields calculated on xp, yp, zp. The keys are the names of the
+        components.
+
+    Examples::
+
+        >>> import numpy
+        >>> from fatiando.mesher import Prism
+        >>> model = [Prism(-10, 10, -10, 10, 5, 25, {'density':1000.})]
+        >>> xp, yp, zp = numpy.array([0., 5.]), numpy.zeros(2), numpy.zeros(2)
+        >>> res = fields(xp, yp, zp, model, components=['gz', 'gzz'])
+        >>> sorted(res.keys())
+        ['gz', 'gzz']
+        >>> numpy.all(res['gzz'] == gzz(xp, yp, zp, model))
+        True
+
+    """
+    cdef numpy.ndarray[DTYPE_T, ndim=2] effects
+    dtype = _precision_dtype(precision)
+    if components is None:
+        components = _fields_components
+    components = list(components)
+    for c in components:
+        if c not in _fields_scales:
+            raise ValueError("Invalid component '%s'" % (c))
+    if isinstance(prisms, PrismMesh):
+        nodes, weights = _get_nodes(prisms, 'density', dens)
+        effects = _forward_nodes_fields(components, xp, yp, zp,
+                                        numpy.array(nodes), weights, njobs)
+    else:
+        bounds, density = _get_props(prisms, 'density', dens)
+        effects = _forward_fields(components, xp, yp, zp, numpy.array(bounds),
+                                  density, njobs)
+    res = {}
+    for c in components:
+        res[c] = numpy.asarray(
+            effects[_fields_components.index(c)]*_fields_scales[c],
+            dtype=dtype)
+    return res
+
+def _columns(component, numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+             numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+             numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms, ratio=None,
+             int njobs=1):
+    """
+    Calculate the effect of each prism with unit density on the computation
+    points. Used to build sensitivity matrices (see
+    :func:`fatiando.gravmag.sensitivity.matrix`).
+
+    The columns are the same as the function of *component* with each prism
+    alone in the model.
+
+    Returns:
+
+    * res : 2D array
+        One row per computation point and one column per prism
+    """
+    cdef kernel_func kernel, point
+    if component not in _fields_scales:
+        raise ValueError("Invalid component '%s'" % (component))
+    _component_kernels(component, &kernel, &point)
+    bounds, density = _get_props(prisms, 'density', 1.)
+    res = _forward_columns(kernel, point, ratio, xp, yp, zp,
+                           numpy.array(bounds), density, njobs)
+    res *= _fields_scales[component]
+    return res
+
+def _columns_tf(numpy.ndarray[DTYPE_T, ndim=1] xp not None,
+                numpy.ndarray[DTYPE_T, ndim=1] yp not None,
+                numpy.ndarray[DTYPE_T, ndim=1] zp not None, prisms,
+                double inc, double dec, pinc=None, pdec=None, int njobs=1):
+    """
+    Same as :func:`~fatiando.gravmag._cprism._columns` for the total-field
+    anomaly of prisms with unit magnetization. The prisms must have the
+    ``'magnetization'`` property (with value 1).
+    """
+    bounds, magnetization, coefs = _get_magnetization(prisms, inc, dec, None,
+                                                       pinc, pdec)
+    res = _forward_columns_tf(xp, yp, zp, numpy.array(bounds), magnetization,
+                              numpy.array(coefs), njobs)
+    res *= CM*T2NT
+    return res
+
+cdef _component_kernels(component, kernel_func *kernel, kernel_func *point):
+    """
+    Get the kernel and the point mass kernel of *component*.
+    """
+    if component == 'potential':
+        kernel[0], point[0] = kernelpotential, pointpotential
+    elif component == 'gx':
+        kernel[0], point[0] = kernelgx, pointgx
+    elif component == 'gy':
+        kernel[0], point[0] = kernelgy, pointgy
+    elif component == 'gz':
+        kernel[0], point[0] = kernelgz, pointgz
+    elif component == 'gxx':
+        kernel[0], point[0] = kernelgxx, pointgxx
+    elif component == 'gxy':
+        kernel[0], point[0] = kernelgxy, pointgxy
+    elif component == 'gxz':
+        kernel[0], point[0] = kernelgxz, pointgxz
+    elif component == 'gyy':
+        kernel[0], point[0] = kernelgyy, pointgyy
+    elif component == 'gyz':
+        kernel[0], point[0] = kernelgyz, pointgyz
+    else:
+        kernel[0], point[0] = kernelgzz, pointgzz
+
+cdef inline DTYPE_T kernelpotential(DTYPE_T x, DTYPE_T y, DTYPE_T z,
+                                    DTYPE_T r) nogil:
+    return (x*y*log(z + r)
+            + y*z*log(x + r)
+            + x*z*log(y + r)
+            - 0.5*x**2*atan2(z*y, x*r)
+            - 0.5*y**2*atan2(z*x, y*r)
+            - 0.5*z**2*atan2(x*y, z*r))
+
+# Minus in gx, gy, and gz because Nagy et al (2000) give the formula for the
+# gradient of the potential. Gravity is -grad(V)
+cdef inline DTYPE_T kernelgx(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return -(y*log(z + r) + z*log(y + r) - x*atan2(z*y, x*r))
+
+cdef inline DTYPE_T kernelgy(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return -(z*log(x + r) + x*log(z + r) - y*atan2(x*z, y*r))
+
+cdef inline DTYPE_T kernelgz(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return -(x*log(y + r) + y*log(x + r) - z*atan2(x*y, z*r))
+
+cdef inline DTYPE_T kernelgxx(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return -atan2(z*y, x*r)
+
+cdef inline DTYPE_T kernelgxy(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return log(z + r)
+
+cdef inline DTYPE_T kernelgxz(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return log(y + r)
+
+cdef inline DTYPE_T kernelgyy(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return -atan2(z*x, y*r)
+
+cdef inline DTYPE_T kernelgyz(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return log(x + r)
+
+cdef inline DTYPE_T kernelgzz(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return -atan2(x*y, z*r)
+
+# Effect of a point mass of unit volume on the origin. x, y, z are the
+# coordinates of the point mass and r its distance to the origin.
+cdef inline DTYPE_T pointpotential(DTYPE_T x, DTYPE_T y, DTYPE_T z,
+                                   DTYPE_T r) nogil:
+    return 1./r
+
+cdef inline DTYPE_T pointgx(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return x/r**3
+
+cdef inline DTYPE_T pointgy(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return y/r**3
+
+cdef inline DTYPE_T pointgz(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return z/r**3
+
+cdef inline DTYPE_T pointgxx(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return (3*x**2 - r**2)/r**5
+
+cdef inline DTYPE_T pointgxy(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return 3*x*y/r**5
+
+cdef inline DTYPE_T pointgxz(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return 3*x*z/r**5
+
+cdef inline DTYPE_T pointgyy(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return (3*y**2 - r**2)/r**5
+
+cdef inline DTYPE_T pointgyz(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return 3*y*z/r**5
+
+cdef inline DTYPE_T pointgzz(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r) nogil:
+    return (3*z**2 - r**2)/r**5
+
+cdef _density(kernel_func kernel, kernel_func point, xp, yp, zp, prisms, dens,
+              ratio, int njobs):
+    """
+    Sum the effect of the prisms using their ``'density'`` (or *dens*).
+
+    If *ratio* is not None, use the point mass *point* for the far prisms.
+    """
+    if isinstance(prisms, PrismMesh) and ratio is None:
+        nodes, weights = _get_nodes(prisms, 'density', dens)
+        return _forward_nodes(kernel, xp, yp, zp, numpy.array(nodes), weights,
+                              njobs)
+    bounds, density = _get_props(prisms, 'density', dens)
+    if ratio is None:
+        return _forward(kernel, xp, yp, zp, numpy.array(bounds), density,
+                        njobs)
+    return _forward_far(kernel, point, ratio, xp, yp, zp, numpy.array(bounds),
+                        density, njobs)
+
+# Indexes of the components in _fields_components and of the logarithms and
+# arc-tangents shared by them in kernelfields
+DEF NCOMPONENTS = 10
+DEF NTERMS = 6
+_fields_terms_index = ['logx', 'logy', 'logz', 'atanx', 'atany', 'atanz']
+
+cdef inline void kernelfields(DTYPE_T x, DTYPE_T y, DTYPE_T z, DTYPE_T r,
+                              int *want, int *need, DTYPE_T *out) nogil:
+    """
+    Evaluate the kernels of the wanted components on a corner, calculating each
+    logarithm and arc-tangent only once. Uses the same operations as the
+    individual kernels so that the results are exactly the same.
+    """
+    cdef DTYPE_T logx = 0, logy = 0, logz = 0, atanx = 0, atany = 0, atanz = 0
+    if need[0]:
+        logx = log(x + r)
+    if need[1]:
+        logy = log(y + r)
+    if need[2]:
+        logz = log(z + r)
+    if need[3]:
+        atanx = atan2(z*y, x*r)
+    if need[4]:
+        atany = atan2(z*x, y*r)
+    if need[5]:
+        atanz = atan2(x*y, z*r)
+    if want[0]:
+        out[0] = (x*y*logz + y*z*logx + x*z*logy - 0.5*x**2*atanx
+                  - 0.5*y**2*atany - 0.5*z**2*atanz)
+    # Minus in gx, gy, and gz because Nagy et al (2000) give the formula for
+    # the gradient of the potential. Gravity is -grad(V)
+    if want[1]:
+        out[1] = -(y*logz + z*logy - x*atanx)
+    if want[2]:
+        out[2] = -(z*logx + x*logz - y*atany)
+    if want[3]:
+        out[3] = -(x*logy + y*logx - z*atanz)
+    if want[4]:
+        out[4] = -atanx
+    if want[5]:
+        out[5] = logz
+    if want[6]:
+        out[6] = logy
+    if want[7]:
+        out[7] = -atany
+    if want[8]:
+        out[8] = logx
+    if want[9]:
+        out[9] = -atanz
+
+cdef _fields_flags(components, int *want, int *need):
+    """
+    Mark the wanted components and the terms needed to calculate them.
+    """
+    cdef unsigned int n
+    for n in range(NCOMPONENTS):
+        want[n] = _fields_components[n] in components
+    for n in range(NTERMS):
+        need[n] = 0
+    for c in components:
+        for term in _fields_terms[c]:
+            need[_fields_terms_index.index(term)] = 1
+
+# Signs of the corners in the sums over the integration limits. Corner
+# i + 2*j + 4*k has sign (-1)**(i + j + k)
+cdef DTYPE_T SIGNS[8]
+SIGNS[:] = [1, -1, -1, 1, -1, 1, 1, -1]
+
+# The loops are done in tiles of computation points and tiles of prisms (or
+# nodes). Each tile of points is calculated by one of njobs OpenMP threads,
+# which applies a tile of prisms to all points of its tile before moving on to
+# the next. This way, the prisms are read from the cache instead of from the
+# main memory for every point. Each point still adds the prisms one by one, in
+# the same order, so the results don't depend on njobs or the tile sizes.
+
+# Maximum number of computation points and of prisms (or nodes) in a tile. A
+# tile of prisms (bounds and physical property) and one of points fit in a 32KB
+# L1 cache.
+_point_tile = 64
+_prism_tile = 256
+
+def _tiles(int size, int nprisms, int njobs):
+    """
+    Get the size of the tiles of points, the number of tiles of points, the
+    size of the tiles of prisms, and the number of tiles of prisms.
+
+    The tiles of points are smaller if there are too few to give one to each
+    thread.
+    """
+    ptile = max(1, min(_point_tile, -(-size//max(1, njobs))))
+    mtile = max(1, _prism_tile)
+    return ptile, -(-size//ptile), mtile, -(-nprisms//mtile)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _forward(kernel_func kernel, DTYPE_T[:] xp, DTYPE_T[:] yp, DTYPE_T[:] zp,
+              DTYPE_T[:, ::1] bounds, DTYPE_T[::1] values, int njobs):
+    """
+    Sum the effect of all prisms on the computation points.
+
+    The corners of each prism are summed with alternating signs and the result
+    is multiplied by the physical property value of the prism.
+    """
+    cdef int t, s, l, first, last, start, stop, size = len(xp)
+    cdef int nprisms = values.shape[0], ptile, npoint_tiles, mtile, nprism_tiles
+    cdef DTYPE_T[::1] res
+    ptile, npoint_tiles, mtile, nprism_tiles = _tiles(size, nprisms, njobs)
+    result = numpy.zeros(size, dtype=DTYPE)
+    res = result
+    for t in prange(npoint_tiles, nogil=True, schedule='static',
+                    num_threads=njobs):
+        first = t*ptile
+        last = min(first + ptile, size)
+        for s in range(nprism_tiles):
+            start = s*mtile
+            stop = min(start + mtile, nprisms)
+            for l in range(first, last):
+                res[l] = _forward_point(kernel, xp[l], yp[l], zp[l], bounds,
+                                        values, start, stop, res[l])
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline DTYPE_T _forward_point(kernel_func kernel, DTYPE_T xp, DTYPE_T yp,
+                                   DTYPE_T zp, DTYPE_T[:, ::1] bounds,
+                                   DTYPE_T[::1] values, int start, int stop,
+                                   DTYPE_T res) nogil:
+    cdef int p, i, j, k
+    cdef DTYPE_T x[2]
+    cdef DTYPE_T y[2]
+    cdef DTYPE_T z[2]
+    cdef DTYPE_T tmp, r
+    for p in range(start, stop):
+        # First thing to do is make the computation point P the origin of the
+        # coordinate system
+        x[0] = bounds[1, p] - xp
+        x[1] = bounds[0, p] - xp
+        y[0] = bounds[3, p] - yp
+        y[1] = bounds[2, p] - yp
+        z[0] = bounds[5, p] - zp
+        z[1] = bounds[4, p] - zp
+        # Evaluate the integration limits
+        tmp = 0
+        for k in range(2):
+            for j in range(2):
+                for i in range(2):
+                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
+                    tmp += SIGNS[i + 2*j + 4*k]*kernel(x[i], y[j], z[k], r)
+        res += tmp*values[p]
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _forward_far(kernel_func kernel, kernel_func point, DTYPE_T ratio,
+                  DTYPE_T[:] xp, DTYPE_T[:] yp, DTYPE_T[:] zp,
+                  DTYPE_T[:, ::1] bounds, DTYPE_T[::1] values, int njobs):
+    """
+    Same as _forward but use the point mass kernel *point* for the prisms that
+    are farther than *ratio* times their diagonal from the computation point.
+    """
+    cdef int t, s, l, first, last, start, stop, size = len(xp)
+    cdef int nprisms = values.shape[0], ptile, npoint_tiles, mtile, nprism_tiles
+    cdef DTYPE_T[::1] res
+    cdef DTYPE_T ratio2 = ratio**2
+    ptile, npoint_tiles, mtile, nprism_tiles = _tiles(size, nprisms, njobs)
+    result = numpy.zeros(size, dtype=DTYPE)
+    res = result
+    for t in prange(npoint_tiles, nogil=True, schedule='static',
+                    num_threads=njobs):
+        first = t*ptile
+        last = min(first + ptile, size)
+        for s in range(nprism_tiles):
+            start = s*mtile
+            stop = min(start + mtile, nprisms)
+            for l in range(first, last):
+                res[l] = _forward_far_point(kernel, point, ratio2, xp[l],
+                                            yp[l], zp[l], bounds, values,
+                                            start, stop, res[l])
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline DTYPE_T _forward_far_point(kernel_func kernel, kernel_func point,
+                                       DTYPE_T ratio2, DTYPE_T xp, DTYPE_T yp,
+                                       DTYPE_T zp, DTYPE_T[:, ::1] bounds,
+                                       DTYPE_T[::1] values, int start,
+                                       int stop, DTYPE_T res) nogil:
+    cdef int p, i, j, k
+    cdef DTYPE_T x[2]
+    cdef DTYPE_T y[2]
+    cdef DTYPE_T z[2]
+    cdef DTYPE_T tmp, r, xc, yc, zc, dx, dy, dz, dist2
+    for p in range(start, stop):
+        x[0] = bounds[1, p] - xp
+        x[1] = bounds[0, p] - xp
+        y[0] = bounds[3, p] - yp
+        y[1] = bounds[2, p] - yp
+        z[0] = bounds[5, p] - zp
+        z[1] = bounds[4, p] - zp
+        xc = 0.5*(x[0] + x[1])
+        yc = 0.5*(y[0] + y[1])
+        zc = 0.5*(z[0] + z[1])
+        dist2 = xc**2 + yc**2 + zc**2
+        dx = x[0] - x[1]
+        dy = y[0] - y[1]
+        dz = z[0] - z[1]
+        if dist2 >= ratio2*(dx**2 + dy**2 + dz**2):
+            tmp = (dx*dy*dz)*point(xc, yc, zc, sqrt(dist2))
         else:
-            density = dens
-        x1, x2 = prism.x1, prism.x2
-        y1, y2 = prism.y1, prism.y2
-        z1, z2 = prism.z1, prism.z2
-        for l in xrange(size):
-            # First thing to do is make the computation point P the origin of
-            # the coordinate system
-            x[0] = x2 - xp[l]
-            x[1] = x1 - xp[l]
-            y[0] = y2 - yp[l]
-            y[1] = y1 - yp[l]
-            z[0] = z2 - zp[l]
-            z[1] = z1 - zp[l]
-            # Evaluate the integration limits
+            tmp = 0
             for k in range(2):
                 for j in range(2):
                     for i in range(2):
                         r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                        kernel = -atan2(x[i]*y[j], z[k]*r)
-                        res[l] += ((-1.)**(i + j + k))*kernel*density
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to Eotvos units
-    res *= G*SI2EOTVOS
+                        tmp += SIGNS[i + 2*j + 4*k]*kernel(x[i], y[j], z[k],
+                                                           r)
+        res += tmp*values[p]
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _forward_tf(DTYPE_T[:] xp, DTYPE_T[:] yp, DTYPE_T[:] zp,
+                 DTYPE_T[:, ::1] bounds, DTYPE_T[::1] magnetization,
+                 DTYPE_T[:, ::1] coefs, int njobs):
+    """
+    Sum the total-field anomaly of all prisms on the computation points.
+    """
+    cdef int t, s, l, first, last, start, stop, size = len(xp)
+    cdef int nprisms = magnetization.shape[0], ptile, npoint_tiles, mtile
+    cdef int nprism_tiles
+    cdef DTYPE_T[::1] res
+    ptile, npoint_tiles, mtile, nprism_tiles = _tiles(size, nprisms, njobs)
+    result = numpy.zeros(size, dtype=DTYPE)
+    res = result
+    for t in prange(npoint_tiles, nogil=True, schedule='static',
+                    num_threads=njobs):
+        first = t*ptile
+        last = min(first + ptile, size)
+        for s in range(nprism_tiles):
+            start = s*mtile
+            stop = min(start + mtile, nprisms)
+            for l in range(first, last):
+                res[l] = _forward_tf_point(xp[l], yp[l], zp[l], bounds,
+                                           magnetization, coefs, start, stop,
+                                           res[l])
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline DTYPE_T _forward_tf_point(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp,
+                                      DTYPE_T[:, ::1] bounds,
+                                      DTYPE_T[::1] magnetization,
+                                      DTYPE_T[:, ::1] coefs, int start,
+                                      int stop, DTYPE_T res) nogil:
+    cdef int p, i, j, k
+    cdef DTYPE_T x[2]
+    cdef DTYPE_T y[2]
+    cdef DTYPE_T z[2]
+    cdef DTYPE_T tmp, r, r_sqr, x_sqr, y_sqr, z_sqr, xy, zr
+    for p in range(start, stop):
+        # First thing to do is make the computation point P the origin of the
+        # coordinate system
+        x[0] = bounds[1, p] - xp
+        x[1] = bounds[0, p] - xp
+        y[0] = bounds[3, p] - yp
+        y[1] = bounds[2, p] - yp
+        z[0] = bounds[5, p] - zp
+        z[1] = bounds[4, p] - zp
+        tmp = 0
+        for k in range(2):
+            z_sqr = z[k]**2
+            for j in range(2):
+                y_sqr = y[j]**2
+                for i in range(2):
+                    x_sqr = x[i]**2
+                    xy = x[i]*y[j]
+                    r_sqr = x_sqr + y_sqr + z_sqr
+                    r = sqrt(r_sqr)
+                    zr = z[k]*r
+                    # The sign of the corners is (-1)**(i + j + k + 1)
+                    tmp += (-SIGNS[i + 2*j + 4*k])*(
+                          coefs[0, p]*log((r - x[i])/(r + x[i]))
+                        + coefs[1, p]*log((r - y[j])/(r + y[j]))
+                        - coefs[2, p]*log(r + z[k])
+                        - coefs[3, p]*atan2(xy, x_sqr + zr + z_sqr)
+                        - coefs[4, p]*atan2(xy, r_sqr + zr - x_sqr)
+                        + coefs[5, p]*atan2(xy, zr))
+        res += tmp*magnetization[p]
     return res
+
+# The sensitivity matrices put the effect of each prism in a separate column.
+# Each element is calculated by the same functions as the sums above, with a
+# single prism, so the columns are exactly the same as the sums of each prism
+# alone.
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _forward_columns(kernel_func kernel, kernel_func point, ratio,
+                      DTYPE_T[:] xp, DTYPE_T[:] yp, DTYPE_T[:] zp,
+                      DTYPE_T[:, ::1] bounds, DTYPE_T[::1] values, int njobs):
+    """
+    Calculate the effect of each prism on the computation points (one row per
+    point and one column per prism).
+
+    If *ratio* is not None, use the point mass *point* for the far prisms.
+    """
+    cdef int l, p, size = len(xp), nprisms = values.shape[0]
+    cdef int far = ratio is not None
+    cdef DTYPE_T ratio2 = 0
+    cdef DTYPE_T[:, ::1] res
+    if far:
+        ratio2 = ratio**2
+    result = numpy.empty((size, nprisms), dtype=DTYPE)
+    res = result
+    for l in prange(size, nogil=True, schedule='static', num_threads=njobs):
+        for p in range(nprisms):
+            if far:
+                res[l, p] = _forward_far_point(kernel, point, ratio2, xp[l],
+                                               yp[l], zp[l], bounds, values,
+                                               p, p + 1, 0)
+            else:
+                res[l, p] = _forward_point(kernel, xp[l], yp[l], zp[l],
+                                           bounds, values, p, p + 1, 0)
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _forward_columns_tf(DTYPE_T[:] xp, DTYPE_T[:] yp, DTYPE_T[:] zp,
+                         DTYPE_T[:, ::1] bounds, DTYPE_T[::1] magnetization,
+                         DTYPE_T[:, ::1] coefs, int njobs):
+    """
+    Same as _forward_columns for the total-field anomaly.
+    """
+    cdef int l, p, size = len(xp), nprisms = magnetization.shape[0]
+    cdef DTYPE_T[:, ::1] res
+    result = numpy.empty((size, nprisms), dtype=DTYPE)
+    res = result
+    for l in prange(size, nogil=True, schedule='static', num_threads=njobs):
+        for p in range(nprisms):
+            res[l, p] = _forward_tf_point(xp[l], yp[l], zp[l], bounds,
+                                          magnetization, coefs, p, p + 1, 0)
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _forward_tf_batch(DTYPE_T[:] xp, DTYPE_T[:] yp, DTYPE_T[:] zp,
+                       DTYPE_T[:, ::1] bounds, DTYPE_T[:, ::1] weights,
+                       int njobs):
+    """
+    Sum the magnetic field of the prisms with a fixed magnetization and the
+    tensor of the ones magnetized in the direction of the regional field (see
+    fatiando.gravmag._prism._tf_directions).
+    """
+    cdef int t, s, l, first, last, start, stop, size = len(xp)
+    cdef int nprisms = weights.shape[1], ptile, npoint_tiles, mtile
+    cdef int nprism_tiles
+    cdef DTYPE_T[:, ::1] res
+    ptile, npoint_tiles, mtile, nprism_tiles = _tiles(size, nprisms, njobs)
+    result = numpy.zeros((9, size), dtype=DTYPE)
+    res = result
+    for t in prange(npoint_tiles, nogil=True, schedule='static',
+                    num_threads=njobs):
+        first = t*ptile
+        last = min(first + ptile, size)
+        for s in range(nprism_tiles):
+            start = s*mtile
+            stop = min(start + mtile, nprisms)
+            for l in range(first, last):
+                _forward_tf_batch_point(xp[l], yp[l], zp[l], bounds, weights,
+                                        start, stop, res, l)
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void _forward_tf_batch_point(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp,
+                                         DTYPE_T[:, ::1] bounds,
+                                         DTYPE_T[:, ::1] weights, int start,
+                                         int stop, DTYPE_T[:, ::1] res,
+                                         int l) nogil:
+    cdef int p, i, j, k
+    cdef DTYPE_T x[2]
+    cdef DTYPE_T y[2]
+    cdef DTYPE_T z[2]
+    cdef DTYPE_T g[6]
+    cdef DTYPE_T sign, r, r_sqr, x_sqr, y_sqr, z_sqr, xy, zr
+    cdef DTYPE_T mx, my, mz, induced
+    for p in range(start, stop):
+        mx = weights[0, p]
+        my = weights[1, p]
+        mz = weights[2, p]
+        induced = weights[3, p]
+        if mx == 0 and my == 0 and mz == 0 and induced == 0:
+            continue
+        x[0] = bounds[1, p] - xp
+        x[1] = bounds[0, p] - xp
+        y[0] = bounds[3, p] - yp
+        y[1] = bounds[2, p] - yp
+        z[0] = bounds[5, p] - zp
+        z[1] = bounds[4, p] - zp
+        for i in range(6):
+            g[i] = 0
+        for k in range(2):
+            z_sqr = z[k]**2
+            for j in range(2):
+                y_sqr = y[j]**2
+                for i in range(2):
+                    x_sqr = x[i]**2
+                    xy = x[i]*y[j]
+                    r_sqr = x_sqr + y_sqr + z_sqr
+                    r = sqrt(r_sqr)
+                    zr = z[k]*r
+                    sign = -SIGNS[i + 2*j + 4*k]
+                    g[0] -= sign*atan2(xy, x_sqr + zr + z_sqr)
+                    g[1] -= sign*log(r + z[k])
+                    g[2] += sign*0.5*log((r - y[j])/(r + y[j]))
+                    g[3] -= sign*atan2(xy, r_sqr + zr - x_sqr)
+                    g[4] += sign*0.5*log((r - x[i])/(r + x[i]))
+                    g[5] += sign*atan2(xy, zr)
+        res[0, l] += mx*g[0] + my*g[1] + mz*g[2]
+        res[1, l] += mx*g[1] + my*g[3] + mz*g[4]
+        res[2, l] += mx*g[2] + my*g[4] + mz*g[5]
+        for i in range(6):
+            res[3 + i, l] += induced*g[i]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _forward_nodes(kernel_func kernel, DTYPE_T[:] xp, DTYPE_T[:] yp,
+                    DTYPE_T[:] zp, DTYPE_T[:, ::1] nodes, DTYPE_T[::1] weights,
+                    int njobs):
+    """
+    Sum the effect of a regular mesh on the computation points using its nodes.
+    """
+    cdef int t, s, l, first, last, start, stop, size = len(xp)
+    cdef int nnodes = weights.shape[0], ptile, npoint_tiles, mtile
+    cdef int nnode_tiles
+    cdef DTYPE_T[::1] res
+    ptile, npoint_tiles, mtile, nnode_tiles = _tiles(size, nnodes, njobs)
+    result = numpy.zeros(size, dtype=DTYPE)
+    res = result
+    for t in prange(npoint_tiles, nogil=True, schedule='static',
+                    num_threads=njobs):
+        first = t*ptile
+        last = min(first + ptile, size)
+        for s in range(nnode_tiles):
+            start = s*mtile
+            stop = min(start + mtile, nnodes)
+            for l in range(first, last):
+                res[l] = _forward_nodes_point(kernel, xp[l], yp[l], zp[l],
+                                              nodes, weights, start, stop,
+                                              res[l])
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline DTYPE_T _forward_nodes_point(kernel_func kernel, DTYPE_T xp,
+                                         DTYPE_T yp, DTYPE_T zp,
+                                         DTYPE_T[:, ::1] nodes,
+                                         DTYPE_T[::1] weights, int start,
+                                         int stop, DTYPE_T res) nogil:
+    cdef int n
+    cdef DTYPE_T x, y, z, r
+    for n in range(start, stop):
+        x = nodes[0, n] - xp
+        y = nodes[1, n] - yp
+        z = nodes[2, n] - zp
+        r = sqrt(x**2 + y**2 + z**2)
+        res = res + weights[n]*kernel(x, y, z, r)
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _forward_nodes_tf(DTYPE_T[:] xp, DTYPE_T[:] yp, DTYPE_T[:] zp,
+                       DTYPE_T[:, ::1] nodes, DTYPE_T[:, ::1] weights,
+                       int njobs):
+    """
+    Sum the total-field anomaly of a regular mesh on the computation points
+    using its nodes.
+    """
+    cdef int t, s, l, first, last, start, stop, size = len(xp)
+    cdef int nnodes = nodes.shape[1], ptile, npoint_tiles, mtile
+    cdef int nnode_tiles
+    cdef DTYPE_T[::1] res
+    ptile, npoint_tiles, mtile, nnode_tiles = _tiles(size, nnodes, njobs)
+    result = numpy.zeros(size, dtype=DTYPE)
+    res = result
+    for t in prange(npoint_tiles, nogil=True, schedule='static',
+                    num_threads=njobs):
+        first = t*ptile
+        last = min(first + ptile, size)
+        for s in range(nnode_tiles):
+            start = s*mtile
+            stop = min(start + mtile, nnodes)
+            for l in range(first, last):
+                res[l] = _forward_nodes_tf_point(xp[l], yp[l], zp[l], nodes,
+                                                 weights, start, stop, res[l])
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline DTYPE_T _forward_nodes_tf_point(DTYPE_T xp, DTYPE_T yp,
+                                            DTYPE_T zp, DTYPE_T[:, ::1] nodes,
+                                            DTYPE_T[:, ::1] weights,
+                                            int start, int stop,
+                                            DTYPE_T res) nogil:
+    cdef int n
+    cdef DTYPE_T x, y, z, r, r_sqr, x_sqr, z_sqr, xy, zr
+    for n in range(start, stop):
+        x = nodes[0, n] - xp
+        y = nodes[1, n] - yp
+        z = nodes[2, n] - zp
+        x_sqr = x**2
+        z_sqr = z**2
+        xy = x*y
+        r_sqr = x_sqr + y**2 + z_sqr
+        r = sqrt(r_sqr)
+        zr = z*r
+        res = res + (weights[0, n]*log((r - x)/(r + x))
+                     + weights[1, n]*log((r - y)/(r + y))
+                     - weights[2, n]*log(r + z)
+                     - weights[3, n]*atan2(xy, x_sqr + zr + z_sqr)
+                     - weights[4, n]*atan2(xy, r_sqr + zr - x_sqr)
+                     + weights[5, n]*atan2(xy, zr))
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _forward_fields(components, DTYPE_T[:] xp, DTYPE_T[:] yp, DTYPE_T[:] zp,
+                     DTYPE_T[:, ::1] bounds, DTYPE_T[::1] values, int njobs):
+    """
+    Sum the effect of all prisms on the computation points for several
+    components at once. Returns an array with one row per component in
+    _fields_components.
+    """
+    cdef int t, s, l, first, last, start, stop, size = len(xp)
+    cdef int nprisms = values.shape[0], ptile, npoint_tiles, mtile, nprism_tiles
+    cdef DTYPE_T[:, ::1] res
+    cdef int want[NCOMPONENTS]
+    cdef int need[NTERMS]
+    _fields_flags(components, want, need)
+    ptile, npoint_tiles, mtile, nprism_tiles = _tiles(size, nprisms, njobs)
+    result = numpy.zeros((NCOMPONENTS, size), dtype=DTYPE)
+    res = result
+    for t in prange(npoint_tiles, nogil=True, schedule='static',
+                    num_threads=njobs):
+        first = t*ptile
+        last = min(first + ptile, size)
+        for s in range(nprism_tiles):
+            start = s*mtile
+            stop = min(start + mtile, nprisms)
+            for l in range(first, last):
+                _forward_fields_point(xp[l], yp[l], zp[l], bounds, values,
+                                      start, stop, want, need, res, l)
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void _forward_fields_point(DTYPE_T xp, DTYPE_T yp, DTYPE_T zp,
+                                       DTYPE_T[:, ::1] bounds,
+                                       DTYPE_T[::1] values, int start,
+                                       int stop, int *want, int *need,
+                                       DTYPE_T[:, ::1] res, int l) nogil:
+    cdef int p, i, j, k, n
+    cdef DTYPE_T x[2]
+    cdef DTYPE_T y[2]
+    cdef DTYPE_T z[2]
+    cdef DTYPE_T tmp[NCOMPONENTS]
+    cdef DTYPE_T kernels[NCOMPONENTS]
+    cdef DTYPE_T r, sign
+    for p in range(start, stop):
+        # First thing to do is make the computation point P the origin of the
+        # coordinate system
+        x[0] = bounds[1, p] - xp
+        x[1] = bounds[0, p] - xp
+        y[0] = bounds[3, p] - yp
+        y[1] = bounds[2, p] - yp
+        z[0] = bounds[5, p] - zp
+        z[1] = bounds[4, p] - zp
+        # Evaluate the integration limits
+        for n in range(NCOMPONENTS):
+            tmp[n] = 0
+        for k in range(2):
+            for j in range(2):
+                for i in range(2):
+                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
+                    kernelfields(x[i], y[j], z[k], r, want, need, kernels)
+                    sign = SIGNS[i + 2*j + 4*k]
+                    for n in range(NCOMPONENTS):
+                        if want[n]:
+                            tmp[n] += sign*kernels[n]
+        for n in range(NCOMPONENTS):
+            if want[n]:
+                res[n, l] += tmp[n]*values[p]
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _forward_nodes_fields(components, DTYPE_T[:] xp, DTYPE_T[:] yp,
+                           DTYPE_T[:] zp, DTYPE_T[:, ::1] nodes,
+                           DTYPE_T[::1] weights, int njobs):
+    """
+    Sum the effect of a regular mesh on the computation points using its nodes
+    for several components at once.
+    """
+    cdef int t, s, l, first, last, start, stop, size = len(xp)
+    cdef int nnodes = weights.shape[0], ptile, npoint_tiles, mtile
+    cdef int nnode_tiles
+    cdef DTYPE_T[:, ::1] res
+    cdef int want[NCOMPONENTS]
+    cdef int need[NTERMS]
+    _fields_flags(components, want, need)
+    ptile, npoint_tiles, mtile, nnode_tiles = _tiles(size, nnodes, njobs)
+    result = numpy.zeros((NCOMPONENTS, size), dtype=DTYPE)
+    res = result
+    for t in prange(npoint_tiles, nogil=True, schedule='static',
+                    num_threads=njobs):
+        first = t*ptile
+        last = min(first + ptile, size)
+        for s in range(nnode_tiles):
+            start = s*mtile
+            stop = min(start + mtile, nnodes)
+            for l in range(first, last):
+                _forward_nodes_fields_point(xp[l], yp[l], zp[l], nodes,
+                                            weights, start, stop, want, need,
+                                            res, l)
+    return result
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline void _forward_nodes_fields_point(DTYPE_T xp, DTYPE_T yp,
+                                             DTYPE_T zp,
+                                             DTYPE_T[:, ::1] nodes,
+                                             DTYPE_T[::1] weights, int start,
+                                             int stop, int *want, int *need,
+                                             DTYPE_T[:, ::1] res,
+                                             int l) nogil:
+    cdef int m, n
+    cdef DTYPE_T kernels[NCOMPONENTS]
+    cdef DTYPE_T x, y, z, r
+    for m in range(start, stop):
+        x = nodes[0, m] - xp
+        y = nodes[1, m] - yp
+        z = nodes[2, m] - zp
+        r = sqrt(x**2 + y**2 + z**2)
+        kernelfields(x, y, z, r, want, need, kernels)
+        for n in range(NCOMPONENTS):
+            if want[n]:
+                res[n, l] += weights[m]*kernels[n]
@@ -1,424 +1,542 @@
 """
-Pure Python implementations of functions in fatiando.gravmag.tesseroid.
-Used instead of Cython versions if those are not available.
+Cython implementation of the adaptive discretization and GLQ kernels of
+fatiando.gravmag.tesseroid.
+
+The tesseroids are arrays of (w, e, s, n, top, bottom) bounds. The effect of a
+block of tesseroids on each computation point is calculated by a single thread:
+it divides each tesseroid with a stack of bounds (depth first) and integrates
+the parts that are far enough from the point. The blocks of tesseroids and
+points don't depend on *njobs*, so neither do the results.
 """
 import numpy
 # Import Cython definitions for numpy
 cimport numpy
 
-DTYPE = numpy.float
-ctypedef numpy.float_t DTYPE_T
-
 from libc.math cimport sin, cos, sqrt
+from libc.stdlib cimport malloc, free
+from cython.parallel cimport prange, parallel
+cimport cython
+
+from fatiando.constants import MEAN_EARTH_RADIUS, G
+
+cdef double R = MEAN_EARTH_RADIUS
+cdef double GRAV = G
+cdef double d2r = numpy.pi/180.
 
-from fatiando.constants import MEAN_EARTH_RADIUS
+# The kernels integrate the effect of a tesseroid on a single point from the
+# scaled GLQ nodes. They return the sum over the nodes (without the scale)
+ctypedef double (*kernel_func)(double*, double*, double*, double*, double*,
+                               double*, double*, double*, int, int, int,
+                               double, double, double, double) nogil
 
+# The nodes and weights of the GLQ in each dimension
+cdef struct glq_t:
+    int nlon, nlat, nr
+    double *lon_nodes
+    double *lon_weights
+    double *lat_nodes
+    double *lat_weights
+    double *r_nodes
+    double *r_weights
 
-def _scale_nodes(tesseroid, nodes):
-    d2r = numpy.pi/180.
-    dlon = tesseroid.e - tesseroid.w
-    dlat = tesseroid.n - tesseroid.s
-    dr = tesseroid.top - tesseroid.bottom
-    # Scale the GLQ nodes to the integration limits
-    nodes_lon = d2r*(0.5*dlon*nodes + 0.5*(tesseroid.e + tesseroid.w))
-    nodes_lat = d2r*(0.5*dlat*nodes + 0.5*(tesseroid.n + tesseroid.s))
-    nodes_r = (0.5*dr*nodes +
-        0.5*(tesseroid.top + tesseroid.bottom + 2.*MEAN_EARTH_RADIUS))
-    scale = d2r*dlon*d2r*dlat*dr*0.125
-    return nodes_lon, nodes_lat, nodes_r, scale
+# The components calculated by _fields. The position in the list is the code
+# of the component
+_components = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy',
+               'gyz', 'gzz']
 
-def potential(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+# Number of computation points in a task
+_point_block = 16
+# If there are fewer blocks of points than this, the tesseroids are split into
+# blocks as well so that there are enough tasks to balance the threads
+_min_tasks = 256
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+def calc(kernels,
+    double[:, ::1] bounds not None,
+    double[::1] densities not None,
+    double[::1] lons not None,
+    double[::1] lats not None,
+    double[::1] radii not None,
+    double ratio,
+    double[::1] lon_nodes not None,
+    double[::1] lon_weights not None,
+    double[::1] lat_nodes not None,
+    double[::1] lat_weights not None,
+    double[::1] r_nodes not None,
+    double[::1] r_weights not None,
+    int max_depth, int njobs=1):
     """
-    Integrate potential using the Gauss-Legendre Quadrature
+    Calculate the effect of the tesseroids on the points, dividing them
+    adaptively.
+
+    The work is split into tasks of a block of tesseroids and a block of
+    points. The threads take tasks from a shared queue (OpenMP dynamic
+    schedule) because the cost of the tasks varies a lot with the number of
+    divisions. Each task stores its result in a row of a shared array and the
+    rows are added in order at the end.
+
+    *kernels* is a list with the names of the components. The tesseroids are
+    divided only once for all of them. With more than one, all components are
+    calculated at each GLQ node by a single kernel.
+
+    Returns the result of each kernel (an array with one row per kernel) and
+    the number of times that a tesseroid needed to be divided but the maximum
+    depth had been reached.
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa/sqrt(l_sqr))
-        result[l] = result[l]*scale
-    return result
+    cdef int ncomp = len(kernels), c
+    cdef int[::1] comps = numpy.array([_component(k) for k in kernels] + [0],
+                                      numpy.intc)
+    cdef kernel_func func = NULL
+    cdef int ndata = lons.shape[0], ntess = bounds.shape[0]
+    cdef int stack_size = 7*max_depth + 1
+    cdef int pblock = _point_block, npblocks, tblock, ntblocks, ntasks
+    cdef int task, tb, start, stop, l
+    cdef double *stack
+    cdef int *depths
+    cdef double *buff
+    cdef double *res
+    cdef double *out
+    cdef glq_t glq
+    if ncomp == 1:
+        func = _get_kernel(kernels[0])
+    if ntess == 0 or ndata == 0 or ncomp == 0:
+        return numpy.zeros((ncomp, ndata), numpy.float), 0
+    glq.nlon = lon_nodes.shape[0]
+    glq.nlat = lat_nodes.shape[0]
+    glq.nr = r_nodes.shape[0]
+    glq.lon_nodes = &lon_nodes[0]
+    glq.lon_weights = &lon_weights[0]
+    glq.lat_nodes = &lat_nodes[0]
+    glq.lat_weights = &lat_weights[0]
+    glq.r_nodes = &r_nodes[0]
+    glq.r_weights = &r_weights[0]
+    npblocks = (ndata + pblock - 1)//pblock
+    ntblocks = 1
+    if npblocks < _min_tasks:
+        ntblocks = min(ntess, (_min_tasks + npblocks - 1)//npblocks)
+    tblock = (ntess + ntblocks - 1)//ntblocks
+    ntblocks = (ntess + tblock - 1)//tblock
+    ntasks = npblocks*ntblocks
+    cdef double[:, :, ::1] partial = numpy.zeros((ntblocks, ncomp, ndata),
+                                                 numpy.float)
+    cdef int[::1] overflow = numpy.zeros(ntasks, numpy.intc)
+    with nogil, parallel(num_threads=njobs):
+        # Each thread has its own stack and buffers for the scaled nodes and
+        # the results
+        stack = <double*>malloc(6*stack_size*sizeof(double))
+        depths = <int*>malloc(stack_size*sizeof(int))
+        buff = <double*>malloc((glq.nlon + 2*glq.nlat + 2*glq.nr)*
+                               sizeof(double))
+        res = <double*>malloc(ncomp*sizeof(double))
+        out = <double*>malloc(ncomp*sizeof(double))
+        for task in prange(ntasks, schedule='dynamic'):
+            tb = task//npblocks
+            start = tb*tblock
+            stop = min(start + tblock, ntess)
+            for l in range((task % npblocks)*pblock,
+                           min((task % npblocks + 1)*pblock, ndata)):
+                _point(func, &comps[0], ncomp, &bounds[start, 0],
+                    &densities[start], stop - start, lons[l], lats[l],
+                    radii[l], ratio, &glq, max_depth, stack, depths, buff,
+                    out, res, &overflow[task])
+                for c in range(ncomp):
+                    partial[tb, c, l] = res[c]
+        free(stack)
+        free(depths)
+        free(buff)
+        free(res)
+        free(out)
+    if ntblocks == 1:
+        result = numpy.asarray(partial)[0]
+    else:
+        result = numpy.sum(partial, axis=0)
+    return result, int(numpy.sum(overflow))
+
+def _component(kernel):
+    if kernel not in _components:
+        raise ValueError("Invalid kernel '%s'" % (kernel))
+    return _components.index(kernel)
 
-def gx(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+cdef kernel_func _get_kernel(kernel) except NULL:
+    if kernel == 'potential':
+        return _potential
+    if kernel == 'gx':
+        return _gx
+    if kernel == 'gy':
+        return _gy
+    if kernel == 'gz':
+        return _gz
+    if kernel == 'gxx':
+        return _gxx
+    if kernel == 'gxy':
+        return _gxy
+    if kernel == 'gxz':
+        return _gxz
+    if kernel == 'gyy':
+        return _gyy
+    if kernel == 'gyz':
+        return _gyz
+    if kernel == 'gzz':
+        return _gzz
+    raise ValueError("Invalid kernel '%s'" % (kernel))
+
+@cython.cdivision(True)
+cdef void _point(kernel_func func, int *comps, int ncomp, double *bounds,
+    double *densities, int ntess, double lon, double lat, double radius,
+    double ratio, glq_t *glq, int max_depth, double *stack, int *depths,
+    double *buff, double *out, double *result, int *overflow) nogil:
     """
-    Integrate gx using the Gauss-Legendre Quadrature
+    Effect of all tesseroids on a single point. Stores the result of each
+    component in *result*.
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T kphi
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
-                kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*rc[k]*kphi/(l_sqr**1.5))
-        result[l] = result[l]*scale
-    return result
+    cdef int t, i, nstack, depth
+    cdef double sinlat = sin(lat), coslat = cos(lat)
+    cdef double w, e, s, n, top, bottom, distance, size, dlon, dlat, dh
+    cdef double tes_radius, tes_lat, tes_lon
+    for i in range(ncomp):
+        result[i] = 0
+    for t in range(ntess):
+        for i in range(6):
+            stack[i] = bounds[6*t + i]
+        depths[0] = 0
+        nstack = 1
+        while nstack > 0:
+            nstack -= 1
+            w = stack[6*nstack]
+            e = stack[6*nstack + 1]
+            s = stack[6*nstack + 2]
+            n = stack[6*nstack + 3]
+            top = stack[6*nstack + 4]
+            bottom = stack[6*nstack + 5]
+            depth = depths[nstack]
+            size = R*d2r*(e - w)
+            if R*d2r*(n - s) > size:
+                size = R*d2r*(n - s)
+            if top - bottom > size:
+                size = top - bottom
+            tes_radius = top + R
+            tes_lat = d2r*0.5*(s + n)
+            tes_lon = d2r*0.5*(w + e)
+            distance = sqrt(
+                radius**2 + tes_radius**2 - 2.*radius*tes_radius*(
+                    sinlat*sin(tes_lat) + coslat*cos(tes_lat)*
+                    cos(lon - tes_lon)))
+            if distance > 0 and distance < ratio*size:
+                if depth < max_depth:
+                    # Push the 8 parts. The last one is integrated first
+                    dlon = 0.5*(e - w)
+                    dlat = 0.5*(n - s)
+                    dh = 0.5*(top - bottom)
+                    for i in range(8):
+                        stack[6*nstack] = w + dlon*(i//4)
+                        stack[6*nstack + 1] = w + dlon*(i//4) + dlon
+                        stack[6*nstack + 2] = s + dlat*((i//2) % 2)
+                        stack[6*nstack + 3] = s + dlat*((i//2) % 2) + dlat
+                        stack[6*nstack + 4] = bottom + dh*(i % 2) + dh
+                        stack[6*nstack + 5] = bottom + dh*(i % 2)
+                        depths[nstack] = depth + 1
+                        nstack += 1
+                    continue
+                # Too deep. Integrate without dividing
+                overflow[0] += 1
+            _glq(func, comps, ncomp, w, e, s, n, top, bottom, lon, sinlat,
+                 coslat, radius, glq, buff, out)
+            for i in range(ncomp):
+                result[i] += GRAV*densities[t]*out[i]
 
-def gy(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+cdef inline void _glq(kernel_func func, int *comps, int ncomp, double w,
+    double e, double s, double n, double top, double bottom, double lon,
+    double sinlat, double coslat, double radius, glq_t *glq, double *buff,
+    double *out) nogil:
     """
-    Integrate gy using the Gauss-Legendre Quadrature
+    Scale the GLQ nodes to the tesseroid and integrate the kernel (*func* or
+    all *comps* if *func* is NULL). Stores the results in *out*.
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T sinlon
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            sinlon = sin(lonc[i] - lons[l])
-            for j in xrange(order):
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*rc[k]*coslatc[j]*sinlon/(l_sqr**1.5))
-        result[l] = result[l]*scale
-    return result
+    cdef int i
+    cdef double dlon = e - w, dlat = n - s, dr = top - bottom, latc
+    cdef double scale = d2r*dlon*d2r*dlat*dr*0.125
+    cdef double *lonc = buff
+    cdef double *sinlatc = buff + glq.nlon
+    cdef double *coslatc = buff + glq.nlon + glq.nlat
+    cdef double *rc = buff + glq.nlon + 2*glq.nlat
+    cdef double *rc_sqr = buff + glq.nlon + 2*glq.nlat + glq.nr
+    for i in range(glq.nlon):
+        lonc[i] = d2r*(0.5*dlon*glq.lon_nodes[i] + 0.5*(e + w))
+    for i in range(glq.nlat):
+        latc = d2r*(0.5*dlat*glq.lat_nodes[i] + 0.5*(n + s))
+        sinlatc[i] = sin(latc)
+        coslatc[i] = cos(latc)
+    for i in range(glq.nr):
+        rc[i] = 0.5*dr*glq.r_nodes[i] + 0.5*(top + bottom + 2.*R)
+        rc_sqr[i] = rc[i]**2
+    if func != NULL:
+        out[0] = func(lonc, sinlatc, coslatc, rc, rc_sqr, glq.lon_weights,
+                      glq.lat_weights, glq.r_weights, glq.nlon, glq.nlat,
+                      glq.nr, lon, sinlat, coslat, radius)*scale
+    else:
+        _fields(lonc, sinlatc, coslatc, rc, rc_sqr, glq.lon_weights,
+                glq.lat_weights, glq.r_weights, glq.nlon, glq.nlat, glq.nr,
+                lon, sinlat, coslat, radius, comps, ncomp, out)
+        for i in range(ncomp):
+            out[i] = out[i]*scale
 
-def gz(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+@cython.cdivision(True)
+cdef void _fields(double *lonc, double *sinlatc, double *coslatc,
+    double *rc, double *rc_sqr, double *wlon, double *wlat, double *wr,
+    int nlon, int nlat, int nr, double lon, double sinlat, double coslat,
+    double radius, int *comps, int ncomp, double *out) nogil:
     """
-    Integrate gz using the Gauss-Legendre Quadrature
+    Integrate all components in *comps* (codes from _components). The
+    distances and their powers are calculated only once for each node.
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T cospsi
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
-                cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*(rc[k]*cospsi - radii[l])/(l_sqr**1.5))
-        result[l] = result[l]*scale
+    cdef int i, j, k, c
+    cdef double radii_sqr = radius**2, coslon, sinlon, cospsi, kphi, l_sqr
+    cdef double weight, inv_l, inv_l3, inv_l5, deltax, deltay, deltaz
+    cdef double res[10]
+    cdef bint want[10]
+    cdef bint tensor = 0
+    for c in range(10):
+        res[c] = 0
+        want[c] = 0
+    for c in range(ncomp):
+        want[comps[c]] = 1
+        if comps[c] >= 4:
+            tensor = 1
+    for i in range(nlon):
+        coslon = cos(lon - lonc[i])
+        sinlon = sin(lonc[i] - lon)
+        for j in range(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
+            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
+            for k in range(nr):
+                l_sqr = radii_sqr + rc_sqr[k] - 2.*radius*rc[k]*cospsi
+                inv_l = 1./sqrt(l_sqr)
+                inv_l3 = inv_l/l_sqr
+                weight = wlon[i]*wlat[j]*wr[k]*rc_sqr[k]*coslatc[j]
+                deltax = rc[k]*kphi
+                deltay = rc[k]*coslatc[j]*sinlon
+                deltaz = rc[k]*cospsi - radius
+                if want[0]:
+                    res[0] += weight*inv_l
+                if want[1]:
+                    res[1] += weight*deltax*inv_l3
+                if want[2]:
+                    res[2] += weight*deltay*inv_l3
+                if want[3]:
+                    res[3] += weight*deltaz*inv_l3
+                if tensor:
+                    inv_l5 = weight*inv_l3/l_sqr
+                    if want[4]:
+                        res[4] += (3.*deltax*deltax - l_sqr)*inv_l5
+                    if want[5]:
+                        res[5] += 3.*deltax*deltay*inv_l5
+                    if want[6]:
+                        res[6] += 3.*deltax*deltaz*inv_l5
+                    if want[7]:
+                        res[7] += (3.*deltay*deltay - l_sqr)*inv_l5
+                    if want[8]:
+                        res[8] += 3.*deltay*deltaz*inv_l5
+                    if want[9]:
+                        res[9] += (3.*deltaz*deltaz - l_sqr)*inv_l5
+    for c in range(ncomp):
+        out[c] = res[comps[c]]
+
+@cython.cdivision(True)
+cdef double _potential(double *lonc, double *sinlatc, double *coslatc,
+    double *rc, double *rc_sqr, double *wlon, double *wlat, double *wr,
+    int nlon, int nlat, int nr, double lon, double sinlat, double coslat,
+    double radius) nogil:
+    cdef int i, j, k
+    cdef double result = 0, radii_sqr = radius**2, coslon, cospsi, l_sqr
+    for i in range(nlon):
+        coslon = cos(lon - lonc[i])
+        for j in range(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
+            for k in range(nr):
+                l_sqr = radii_sqr + rc_sqr[k] - 2.*radius*rc[k]*cospsi
+                result += (wlon[i]*wlat[j]*wr[k]*
+                    rc_sqr[k]*coslatc[j]/sqrt(l_sqr))
     return result
 
-def gxx(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
-    """
-    Integrate gxx using the Gauss-Legendre Quadrature
-    """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T kphi
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
-                kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*(3.*((rc[k]*kphi)**2) - l_sqr)/(l_sqr**2.5))
-        result[l] = result[l]*scale
+@cython.cdivision(True)
+cdef double _gx(double *lonc, double *sinlatc, double *coslatc,
+    double *rc, double *rc_sqr, double *wlon, double *wlat, double *wr,
+    int nlon, int nlat, int nr, double lon, double sinlat, double coslat,
+    double radius) nogil:
+    cdef int i, j, k
+    cdef double result = 0, radii_sqr = radius**2, coslon, cospsi, l_sqr
+    cdef double kphi
+    for i in range(nlon):
+        coslon = cos(lon - lonc[i])
+        for j in range(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
+            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
+            for k in range(nr):
+                l_sqr = radii_sqr + rc_sqr[k] - 2.*radius*rc[k]*cospsi
+                result += (wlon[i]*wlat[j]*wr[k]*
+                    rc_sqr[k]*coslatc[j]*rc[k]*kphi/(l_sqr*sqrt(l_sqr)))
     return result
 
-def gxy(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
-    """
-    Integrate gxy using the Gauss-Legendre Quadrature
-    """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T kphi, sinlon
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            sinlon = sin(lonc[i] - lons[l])
-            for j in xrange(order):
-                kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*3.*(rc[k]**2)*kphi*coslatc[j]*sinlon/(l_sqr**2.5))
-        result[l] = result[l]*scale
+@cython.cdivision(True)
+cdef double _gy(double *lonc, double *sinlatc, double *coslatc,
+    double *rc, double *rc_sqr, double *wlon, double *wlat, double *wr,
+    int nlon, int nlat, int nr, double lon, double sinlat, double coslat,
+    double radius) nogil:
+    cdef int i, j, k
+    cdef double result = 0, radii_sqr = radius**2, coslon, cospsi, l_sqr
+    cdef double sinlon
+    for i in range(nlon):
+        coslon = cos(lon - lonc[i])
+        sinlon = sin(lonc[i] - lon)
+        for j in range(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
+            for k in range(nr):
+                l_sqr = radii_sqr + rc_sqr[k] - 2.*radius*rc[k]*cospsi
+                result += (wlon[i]*wlat[j]*wr[k]*
+                    rc_sqr[k]*coslatc[j]*rc[k]*coslatc[j]*sinlon/
+                    (l_sqr*sqrt(l_sqr)))
     return result
 
-def gxz(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
-    """
-    Integrate gxz using the Gauss-Legendre Quadrature
-    """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T kphi, cospsi
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
-                kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-                cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*3.*rc[k]*kphi*(rc[k]*cospsi - radii[l])/
-                        (l_sqr**2.5))
-        result[l] = result[l]*scale
+@cython.cdivision(True)
+cdef double _gz(double *lonc, double *sinlatc, double *coslatc,
+    double *rc, double *rc_sqr, double *wlon, double *wlat, double *wr,
+    int nlon, int nlat, int nr, double lon, double sinlat, double coslat,
+    double radius) nogil:
+    cdef int i, j, k
+    cdef double result = 0, radii_sqr = radius**2, coslon, cospsi, l_sqr
+    for i in range(nlon):
+        coslon = cos(lon - lonc[i])
+        for j in range(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
+            for k in range(nr):
+                l_sqr = radii_sqr + rc_sqr[k] - 2.*radius*rc[k]*cospsi
+                result += (wlon[i]*wlat[j]*wr[k]*
+                    rc_sqr[k]*coslatc[j]*(rc[k]*cospsi - radius)/
+                    (l_sqr*sqrt(l_sqr)))
     return result
 
-def gyy(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
-    """
-    Integrate gyy using the Gauss-Legendre Quadrature
-    """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T sinlon, deltay
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            sinlon = sin(lonc[i] - lons[l])
-            for j in xrange(order):
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    deltay = rc[k]*coslatc[j]*sinlon
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*(3.*(deltay**2) - l_sqr)/(l_sqr**2.5))
-        result[l] = result[l]*scale
+@cython.cdivision(True)
+cdef double _gxx(double *lonc, double *sinlatc, double *coslatc,
+    double *rc, double *rc_sqr, double *wlon, double *wlat, double *wr,
+    int nlon, int nlat, int nr, double lon, double sinlat, double coslat,
+    double radius) nogil:
+    cdef int i, j, k
+    cdef double result = 0, radii_sqr = radius**2, coslon, cospsi, l_sqr
+    cdef double kphi
+    for i in range(nlon):
+        coslon = cos(lon - lonc[i])
+        for j in range(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
+            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
+            for k in range(nr):
+                l_sqr = radii_sqr + rc_sqr[k] - 2.*radius*rc[k]*cospsi
+                result += (wlon[i]*wlat[j]*wr[k]*
+                    rc_sqr[k]*coslatc[j]*(3.*((rc[k]*kphi)**2) - l_sqr)/
+                    (l_sqr*l_sqr*sqrt(l_sqr)))
     return result
 
-def gyz(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
-    """
-    Integrate gyz using the Gauss-Legendre Quadrature
-    """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T sinlon, deltay, deltaz, cospsi
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            sinlon = sin(lonc[i] - lons[l])
-            for j in xrange(order):
-                cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    deltay = rc[k]*coslatc[j]*sinlon
-                    deltaz = rc[k]*cospsi - radii[l]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*3.*deltay*deltaz/(l_sqr**2.5))
-        result[l] = result[l]*scale
+@cython.cdivision(True)
+cdef double _gxy(double *lonc, double *sinlatc, double *coslatc,
+    double *rc, double *rc_sqr, double *wlon, double *wlat, double *wr,
+    int nlon, int nlat, int nr, double lon, double sinlat, double coslat,
+    double radius) nogil:
+    cdef int i, j, k
+    cdef double result = 0, radii_sqr = radius**2, coslon, cospsi, l_sqr
+    cdef double kphi, sinlon
+    for i in range(nlon):
+        coslon = cos(lon - lonc[i])
+        sinlon = sin(lonc[i] - lon)
+        for j in range(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
+            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
+            for k in range(nr):
+                l_sqr = radii_sqr + rc_sqr[k] - 2.*radius*rc[k]*cospsi
+                result += (wlon[i]*wlat[j]*wr[k]*
+                    rc_sqr[k]*coslatc[j]*3.*rc_sqr[k]*kphi*coslatc[j]*sinlon/
+                    (l_sqr*l_sqr*sqrt(l_sqr)))
     return result
 
-def gzz(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
-    """
-    Integrate gzz using the Gauss-Legendre Quadrature
-    """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
-    cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
-    cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
-    cdef DTYPE_T cospsi, deltaz
-    # Put the nodes in the corrent range
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    result = numpy.zeros(ndata, DTYPE)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    # Start the numerical integration
-    for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
-                cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-                for k in xrange(order):
-                    l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
-                                sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                    kappa = (rc[k]**2)*coslatc[j]
-                    deltaz = rc[k]*cospsi - radii[l]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*(3.*deltaz**2 - l_sqr)/(l_sqr**2.5))
-        result[l] = result[l]*scale
+@cython.cdivision(True)
+cdef double _gxz(double *lonc, double *sinlatc, double *coslatc,
+    double *rc, double *rc_sqr, double *wlon, double *wlat, double *wr,
+    int nlon, int nlat, int nr, double lon, double sinlat, double coslat,
+    double radius) nogil:
+    cdef int i, j, k
+    cdef double result = 0, radii_sqr = radius**2, coslon, cospsi, l_sqr
+    cdef double kphi
+    for i in range(nlon):
+        coslon = cos(lon - lonc[i])
+        for j in range(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
+            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
+            for k in range(nr):
+                l_sqr = radii_sqr + rc_sqr[k] - 2.*radius*rc[k]*cospsi
+                result += (wlon[i]*wlat[j]*wr[k]*
+                    rc_sqr[k]*coslatc[j]*3.*rc[k]*kphi*(rc[k]*cospsi - radius)/
+                    (l_sqr*l_sqr*sqrt(l_sqr)))
+    return result
+
+@cython.cdivision(True)
+cdef double _gyy(double *lonc, double *sinlatc, double *coslatc,
+    double *rc, double *rc_sqr, double *wlon, double *wlat, double *wr,
+    int nlon, int nlat, int nr, double lon, double sinlat, double coslat,
+    double radius) nogil:
+    cdef int i, j, k
+    cdef double result = 0, radii_sqr = radius**2, coslon, cospsi, l_sqr
+    cdef double sinlon, deltay
+    for i in range(nlon):
+        coslon = cos(lon - lonc[i])
+        sinlon = sin(lonc[i] - lon)
+        for j in range(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
+            for k in range(nr):
+                l_sqr = radii_sqr + rc_sqr[k] - 2.*radius*rc[k]*cospsi
+                deltay = rc[k]*coslatc[j]*sinlon
+                result += (wlon[i]*wlat[j]*wr[k]*
+                    rc_sqr[k]*coslatc[j]*(3.*(deltay**2) - l_sqr)/
+                    (l_sqr*l_sqr*sqrt(l_sqr)))
+    return result
+
+@cython.cdivision(True)
+cdef double _gyz(double *lonc, double *sinlatc, double *coslatc,
+    double *rc, double *rc_sqr, double *wlon, double *wlat, double *wr,
+    int nlon, int nlat, int nr, double lon, double sinlat, double coslat,
+    double radius) nogil:
+    cdef int i, j, k
+    cdef double result = 0, radii_sqr = radius**2, coslon, cospsi, l_sqr
+    cdef double sinlon, deltay, deltaz
+    for i in range(nlon):
+        coslon = cos(lon - lonc[i])
+        sinlon = sin(lonc[i] - lon)
+        for j in range(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
+            for k in range(nr):
+                l_sqr = radii_sqr + rc_sqr[k] - 2.*radius*rc[k]*cospsi
+                deltay = rc[k]*coslatc[j]*sinlon
+                deltaz = rc[k]*cospsi - radius
+                result += (wlon[i]*wlat[j]*wr[k]*
+                    rc_sqr[k]*coslatc[j]*3.*deltay*deltaz/
+                    (l_sqr*l_sqr*sqrt(l_sqr)))
+    return result
+
+@cython.cdivision(True)
+cdef double _gzz(double *lonc, double *sinlatc, double *coslatc,
+    double *rc, double *rc_sqr, double *wlon, double *wlat, double *wr,
+    int nlon, int nlat, int nr, double lon, double sinlat, double coslat,
+    double radius) nogil:
+    cdef int i, j, k
+    cdef double result = 0, radii_sqr = radius**2, coslon, cospsi, l_sqr
+    cdef double deltaz
+    for i in range(nlon):
+        coslon = cos(lon - lonc[i])
+        for j in range(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
+            for k in range(nr):
+                l_sqr = radii_sqr + rc_sqr[k] - 2.*radius*rc[k]*cospsi
+                deltaz = rc[k]*cospsi - radius
+                result += (wlon[i]*wlat[j]*wr[k]*
+                    rc_sqr[k]*coslatc[j]*(3.*deltaz**2 - l_sqr)/
+                    (l_sqr*l_sqr*sqrt(l_sqr)))
     return result
@@ -6,10 +6,12 @@ import numpy
 from numexpr import evaluate
 
 from fatiando.constants import SI2EOTVOS, SI2MGAL, G, CM, T2NT
-from fatiando import utils
+from fatiando.gravmag._prism import _get_props, _get_magnetization, \
+    _sum_prisms
 
 
-def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
+def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None,
+       njobs=1):
     """
     Calculate the total-field anomaly of prisms.
 
@@ -28,7 +30,8 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
         ignored. If the physical properties ``'inclination'`` and
         ``'declination'`` are not present, will use the values of *inc* and
         *dec* instead (regional field).
-        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh`.
+        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * inc : float
         The inclination of the regional field (in degrees)
     * dec : float
@@ -43,72 +46,22 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
         If not None, will use this value instead of the ``'declination'``
         property of the prisms. Use this, e.g., for sensitivity matrix building.
 
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    kernel = ''.join([
-        'res + ((-1.)**(i + j))*magnetization*(',
-        '0.5*(my*fz + mz*fy)*log((r - x)/(r + x))',
-        ' + 0.5*(mx*fz + mz*fx)*log((r - y)/(r + y))',
-        ' - (mx*fy + my*fx)*log(r + z)',
-        ' - mx*fx*arctan2(xy, x_sqr + zr + z_sqr)',
-        ' - my*fy*arctan2(xy, r_sqr + zr - x_sqr)',
-        ' + mz*fz*arctan2(xy, zr))'])
-    res = numpy.zeros_like(xp)
-    # Calculate the 3 components of the unit vector in the direction of the
-    # regional field
-    fx, fy, fz = utils.dircos(inc, dec)
-    for prism in prisms:
-        if (prism is None or
-            ('magnetization' not in prism.props and pmag is None)):
-            continue
-        if pmag is None:
-            magnetization = prism.props['magnetization']
-        else:
-            magnetization = pmag
-        # Get the 3 components of the unit vector in the direction of the
-        # magnetization from the inclination and declination
-        # 1) given by the function
-        if pinc is not None and pdec is not None:
-            mx, my, mz = utils.dircos(pinc, pdec)
-        # 2) given by the prism
-        elif 'inclination' in prism.props and 'declination' in prism.props:
-            mx, my, mz = utils.dircos(prism.props['inclination'],
-                                      prism.props['declination'])
-        # 3) Use in the direction of the regional field
-        else:
-            mx, my, mz = fx, fy, fz
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Now calculate the total field anomaly
-        for k in range(2):
-            magnetization *= -1
-            z = zs[k]
-            z_sqr = evaluate('z**2')
-            for j in range(2):
-                y = ys[j]
-                y_sqr = evaluate('y**2')
-                for i in range(2):
-                    x = xs[i]
-                    x_sqr = evaluate('x**2')
-                    xy = evaluate('x*y')
-                    r_sqr = evaluate('x_sqr + y_sqr + z_sqr')
-                    r = evaluate('sqrt(r_sqr)')
-                    zr = evaluate('z*r')
-                    res = evaluate(kernel)
+    res = _forward_tf(xp, yp, zp, prisms, inc, dec, pmag, pinc, pdec)
     res *= CM*T2NT
     return res
 
-def potential(xp, yp, zp, prisms, dens=None):
+def potential(xp, yp, zp, prisms, dens=None, njobs=1):
     """
     Calculates the gravitational potential.
 
@@ -126,7 +79,8 @@ def potential(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -134,48 +88,22 @@ def potential(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    kernel = ' '.join([
-        'x*y*log(z + r) + y*z*log(x + r) + x*z*log(y + r)',
-        '- 0.5*(x**2)*arctan2(z*y, x*r)',
-        '- 0.5*(y**2)*arctan2(z*x, y*r)',
-        '- 0.5*(z**2)*arctan2(x*y, z*r)'])
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
-    # Now all that is left is to multiply res by the gravitational constant
+    res = _forward(_kernel_potential, xp, yp, zp, prisms, 'density', dens)
     res *= G
     return res
 
-def gx(xp, yp, zp, prisms, dens=None):
+def gx(xp, yp, zp, prisms, dens=None, njobs=1):
     """
     Calculates the :math:`g_x` gravity acceleration component.
 
@@ -193,7 +121,8 @@ def gx(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -201,47 +130,22 @@ def gx(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    # Minus because Nagy et al (2000) give the formula for the
-    # gradient of the potential. Gravity is -grad(V)
-    kernel = '-(y*log(z + r) + z*log(y + r) - x*arctan2(z*y, x*r))'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to mGal units
+    res = _forward(_kernel_gx, xp, yp, zp, prisms, 'density', dens)
     res *= G*SI2MGAL
     return res
 
-def gy(xp, yp, zp, prisms, dens=None):
+def gy(xp, yp, zp, prisms, dens=None, njobs=1):
     """
     Calculates the :math:`g_y` gravity acceleration component.
 
@@ -259,7 +163,8 @@ def gy(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -267,47 +172,22 @@ def gy(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    # Minus because Nagy et al (2000) give the formula for the
-    # gradient of the potential. Gravity is -grad(V)
-    kernel = '-(z*log(x + r) + x*log(z + r) - y*arctan2(x*z, y*r))'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to mGal units
+    res = _forward(_kernel_gy, xp, yp, zp, prisms, 'density', dens)
     res *= G*SI2MGAL
     return res
 
-def gz(xp, yp, zp, prisms, dens=None):
+def gz(xp, yp, zp, prisms, dens=None, njobs=1):
     """
     Calculates the :math:`g_z` gravity acceleration component.
 
@@ -325,7 +205,8 @@ def gz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -333,47 +214,22 @@ def gz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    # Minus because Nagy et al (2000) give the formula for the
-    # gradient of the potential. Gravity is -grad(V)
-    kernel = '-(x*log(y + r) + y*log(x + r) - z*arctan2(x*y, z*r))'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to mGal units
+    res = _forward(_kernel_gz, xp, yp, zp, prisms, 'density', dens)
     res *= G*SI2MGAL
     return res
 
-def gxx(xp, yp, zp, prisms, dens=None):
+def gxx(xp, yp, zp, prisms, dens=None, njobs=1):
     """
     Calculates the :math:`g_{xx}` gravity gradient tensor component.
 
@@ -391,7 +247,8 @@ def gxx(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -399,45 +256,22 @@ def gxx(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    kernel = '-arctan2(z*y, x*r)'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to Eotvos units
+    res = _forward(_kernel_gxx, xp, yp, zp, prisms, 'density', dens)
     res *= G*SI2EOTVOS
     return res
 
-def gxy(xp, yp, zp, prisms, dens=None):
+def gxy(xp, yp, zp, prisms, dens=None, njobs=1):
     """
     Calculates the :math:`g_{xy}` gravity gradient tensor component.
 
@@ -455,7 +289,8 @@ def gxy(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -463,45 +298,22 @@ def gxy(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    kernel = 'log(z + r)'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to Eotvos units
+    res = _forward(_kernel_gxy, xp, yp, zp, prisms, 'density', dens)
     res *= G*SI2EOTVOS
     return res
 
-def gxz(xp, yp, zp, prisms, dens=None):
+def gxz(xp, yp, zp, prisms, dens=None, njobs=1):
     """
     Calculates the :math:`g_{xz}` gravity gradient tensor component.
 
@@ -519,7 +331,8 @@ def gxz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -527,45 +340,22 @@ def gxz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    kernel = 'log(y + r)'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to Eotvos units
+    res = _forward(_kernel_gxz, xp, yp, zp, prisms, 'density', dens)
     res *= G*SI2EOTVOS
     return res
 
-def gyy(xp, yp, zp, prisms, dens=None):
+def gyy(xp, yp, zp, prisms, dens=None, njobs=1):
     """
     Calculates the :math:`g_{yy}` gravity gradient tensor component.
 
@@ -583,7 +373,8 @@ def gyy(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -591,45 +382,22 @@ def gyy(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    kernel = '-arctan2(z*x, y*r)'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to Eotvos units
+    res = _forward(_kernel_gyy, xp, yp, zp, prisms, 'density', dens)
     res *= G*SI2EOTVOS
     return res
 
-def gyz(xp, yp, zp, prisms, dens=None):
+def gyz(xp, yp, zp, prisms, dens=None, njobs=1):
     """
     Calculates the :math:`g_{yz}` gravity gradient tensor component.
 
@@ -647,7 +415,8 @@ def gyz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -655,45 +424,22 @@ def gyz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    kernel = 'log(x + r)'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
-        # Evaluate the integration limits
-        for k in range(2):
-            z = zs[k]
-            for j in range(2):
-                y = ys[j]
-                for i in range(2):
-                    x = xs[i]
-                    r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to Eotvos units
+    res = _forward(_kernel_gyz, xp, yp, zp, prisms, 'density', dens)
     res *= G*SI2EOTVOS
     return res
 
-def gzz(xp, yp, zp, prisms, dens=None):
+def gzz(xp, yp, zp, prisms, dens=None, njobs=1):
     """
     Calculates the :math:`g_{zz}` gravity gradient tensor component.
 
@@ -711,7 +457,8 @@ def gzz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -719,40 +466,134 @@ def gzz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
+    """
+    res = _forward(_kernel_gzz, xp, yp, zp, prisms, 'density', dens)
+    res *= G*SI2EOTVOS
+    return res
+
+_kernel_potential = ' '.join([
+    'x*y*log(z + r) + y*z*log(x + r) + x*z*log(y + r)',
+    '- 0.5*(x**2)*arctan2(z*y, x*r)',
+    '- 0.5*(y**2)*arctan2(z*x, y*r)',
+    '- 0.5*(z**2)*arctan2(x*y, z*r)'])
+# Minus in gx, gy, and gz because Nagy et al (2000) give the formula for the
+# gradient of the potential. Gravity is -grad(V)
+_kernel_gx = '-(y*log(z + r) + z*log(y + r) - x*arctan2(z*y, x*r))'
+_kernel_gy = '-(z*log(x + r) + x*log(z + r) - y*arctan2(x*z, y*r))'
+_kernel_gz = '-(x*log(y + r) + y*log(x + r) - z*arctan2(x*y, z*r))'
+_kernel_gxx = '-arctan2(z*y, x*r)'
+_kernel_gxy = 'log(z + r)'
+_kernel_gxz = 'log(y + r)'
+_kernel_gyy = '-arctan2(z*x, y*r)'
+_kernel_gyz = 'log(x + r)'
+_kernel_gzz = '-arctan2(x*y, z*r)'
+
+_kernel_tf = ' '.join([
+    'tmp + sign*(',
+    'cyz*log((r - x)/(r + x))',
+    '+ cxz*log((r - y)/(r + y))',
+    '- cxy*log(r + z)',
+    '- cxx*arctan2(xy, x_sqr + zr + z_sqr)',
+    '- cyy*arctan2(xy, r_sqr + zr - x_sqr)',
+    '+ czz*arctan2(xy, zr))'])
+
+# Maximum number of prism-point pairs evaluated at once. Limits the size of the
+# temporary arrays
+_blocksize = 2**18
+
+def _forward(kernel, xp, yp, zp, prisms, prop, value):
+    """
+    Sum the effect of all prisms on the computation points.
+
+    Same as :func:`fatiando.gravmag._prism._forward` but *kernel* is a numexpr
+    expression of x, y, z, and r.
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    kernel = '-arctan2(x*y, z*r)'
-    expr = 'res + ((-1.)**(i + j + k))*(%s)*density' % (kernel)
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x1, x2, y1, y2, z1, z2 = prism.get_bounds()
-        xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
-        ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
-        zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
+    (x1, x2, y1, y2, z1, z2), values = _get_props(prisms, prop, value)
+    expr = 'tmp + sign*(%s)' % (kernel)
+    shape = xp.shape
+    res = numpy.zeros(xp.size, dtype=numpy.float)
+    xp, yp, zp = [numpy.ravel(i) for i in [xp, yp, zp]]
+    step = max(1, _blocksize//max(1, xp.size))
+    for start in xrange(0, len(values), step):
+        block = slice(start, start + step)
+        xs, ys, zs = _relative_corners(xp, yp, zp, x1, x2, y1, y2, z1, z2,
+                                       block)
         # Evaluate the integration limits
+        tmp = numpy.zeros_like(xs[0])
         for k in range(2):
             z = zs[k]
             for j in range(2):
                 y = ys[j]
                 for i in range(2):
                     x = xs[i]
+                    sign = (-1.)**(i + j + k)
                     r = evaluate('sqrt(x**2 + y**2 + z**2)')
-                    res = evaluate(expr)
-    # Now all that is left is to multiply res by the gravitational constant and
-    # convert it to Eotvos units
-    res *= G*SI2EOTVOS
-    return res
+                    tmp = evaluate(expr)
+        density = values[block, None]
+        tmp = evaluate('tmp*density')
+        res = _sum_prisms(res, tmp)
+    return res.reshape(shape)
+
+def _forward_tf(xp, yp, zp, prisms, inc, dec, pmag, pinc, pdec):
+    """
+    Sum the total-field anomaly of all prisms on the computation points.
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    bounds, values, coefs = _get_magnetization(prisms, inc, dec, pmag, pinc,
+                                               pdec)
+    x1, x2, y1, y2, z1, z2 = bounds
+    shape = xp.shape
+    res = numpy.zeros(xp.size, dtype=numpy.float)
+    xp, yp, zp = [numpy.ravel(i) for i in [xp, yp, zp]]
+    step = max(1, _blocksize//max(1, xp.size))
+    for start in xrange(0, len(values), step):
+        block = slice(start, start + step)
+        cyz, cxz, cxy, cxx, cyy, czz = [c[block, None] for c in coefs]
+        xs, ys, zs = _relative_corners(xp, yp, zp, x1, x2, y1, y2, z1, z2,
+                                       block)
+        tmp = numpy.zeros_like(xs[0])
+        for k in range(2):
+            z = zs[k]
+            z_sqr = evaluate('z**2')
+            for j in range(2):
+                y = ys[j]
+                y_sqr = evaluate('y**2')
+                for i in range(2):
+                    x = xs[i]
+                    sign = (-1.)**(i + j + k + 1)
+                    x_sqr = evaluate('x**2')
+                    xy = evaluate('x*y')
+                    r_sqr = evaluate('x_sqr + y_sqr + z_sqr')
+                    r = evaluate('sqrt(r_sqr)')
+                    zr = evaluate('z*r')
+                    tmp = evaluate(_kernel_tf)
+        magnetization = values[block, None]
+        tmp = evaluate('tmp*magnetization')
+        res = _sum_prisms(res, tmp)
+    return res.reshape(shape)
+
+def _relative_corners(xp, yp, zp, x1, x2, y1, y2, z1, z2, block):
+    """
+    Make the computation points the origin of the coordinate system of the
+    prisms in *block*. Rows are prisms and columns are points.
+    """
+    x1, x2 = x1[block, None], x2[block, None]
+    y1, y2 = y1[block, None], y2[block, None]
+    z1, z2 = z1[block, None], z2[block, None]
+    xs = [evaluate('x2 - xp'), evaluate('x1 - xp')]
+    ys = [evaluate('y2 - yp'), evaluate('y1 - yp')]
+    zs = [evaluate('z2 - zp'), evaluate('z1 - zp')]
+    return xs, ys, zs
@@ -0,0 +1,1002 @@
+"""
+Pure Python implementations of functions in fatiando.gravmag.polyprism.
+Used instead of Cython versions if those are not available.
+
+Accepts lists of :class:`~fatiando.mesher.PolygonalPrism` and
+:class:`~fatiando.mesher.PolygonalPrismArray` like the Cython version.
+"""
+import numpy
+from numpy import arctan2, log, sqrt, arctan
+
+from fatiando import utils
+from fatiando.constants import SI2MGAL, SI2EOTVOS, G, CM, T2NT
+from fatiando.gravmag._prism import _element_magnetization, _tf_directions
+
+__all__ = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+    'gzz', 'tf', 'tf_batch', 'fields']
+
+
+def tf(xp, yp, zp, prisms, inc, dec, njobs=1):
+    """
+    Calculate the total-field anomaly of polygonal prisms.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: Input units are SI. Output is in nT
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the total field anomaly.
+        Prisms must have the physical property ``'magnetization'`` will be
+        ignored. If the physical properties ``'inclination'`` and
+        ``'declination'`` are not present, will use the values of *inc* and
+        *dec* instead (regional field). *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * inc : float
+        The inclination of the regional field (in degrees)
+    * dec : float
+        The declination of the regional field (in degrees)
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    # Calculate the 3 components of the unit vector in the direction of the
+    # regional field
+    fx, fy, fz = utils.dircos(inc, dec)
+    res = numpy.zeros(len(xp), dtype='f')
+    for prism in prisms:
+        coefs = _tf_coefs(prism, fx, fy, fz)
+        if coefs is None:
+            continue
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Now calculate the total field anomaly
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            X1 = x[k] - xp
+            Y1 = y[k] - yp
+            X2 = x[(k + 1)%nverts] - xp
+            Y2 = y[(k + 1)%nverts] - yp
+            v = _integral_v(X1, X2, Y1, Y2, Z1, Z2)
+            res += sum(coef*vi for coef, vi in zip(coefs, v))
+    res *= CM*T2NT
+    return res
+
+def tf_batch(xp, yp, zp, prisms, inc, dec, magnetization=None, njobs=1):
+    """
+    Calculate the total-field anomaly of polygonal prisms for many regional
+    field directions at once.
+
+    The integrals over the edges of the prisms are calculated only once and
+    projected on each direction. This is much faster than calling
+    :func:`~fatiando.gravmag.polyprism.tf` for each direction. Unlike
+    :func:`~fatiando.gravmag.polyprism.tf`, the result is in double precision.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: Input units are SI. Output is in nT
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model (or a :class:`~fatiando.mesher.PolygonalPrismArray`). If
+        *magnetization* is None, uses the physical properties
+        ``'magnetization'``, ``'inclination'`` and ``'declination'`` like
+        :func:`~fatiando.gravmag.polyprism.tf`. Prisms without
+        ``'inclination'`` and ``'declination'`` are magnetized in the
+        direction of each regional field.
+    * inc, dec : arrays
+        The inclinations and declinations of the regional fields (in degrees)
+    * magnetization : list = [mx, my, mz] or None
+        If not None, the x, y, and z components of the magnetization vector of
+        each prism (in A/m). Elements of *prisms* that are None are ignored.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The total-field anomaly with shape ``(len(inc), len(xp))``. Each row
+        is the anomaly for one regional field direction.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    terms = numpy.zeros((9, len(xp)), dtype=numpy.float)
+    for index, prism in enumerate(prisms):
+        weights = _element_magnetization(prism, index, magnetization)
+        if weights is None:
+            continue
+        mx, my, mz, induced = weights
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        Z1 = prism.z1 - zp
+        Z2 = prism.z2 - zp
+        v = numpy.zeros((6, len(xp)), dtype=numpy.float)
+        for k in range(nverts):
+            X1 = x[k] - xp
+            Y1 = y[k] - yp
+            X2 = x[(k + 1)%nverts] - xp
+            Y2 = y[(k + 1)%nverts] - yp
+            v += _integral_v(X1, X2, Y1, Y2, Z1, Z2)
+        v1, v2, v3, v4, v5, v6 = v
+        terms[0] += mx*v1 + my*v2 + mz*v3
+        terms[1] += mx*v2 + my*v4 + mz*v5
+        terms[2] += mx*v3 + my*v5 + mz*v6
+        terms[3:] += induced*v
+    return _tf_directions(inc, dec, terms)
+
+def fields(xp, yp, zp, prisms, components=None, inc=None, dec=None,
+           njobs=1):
+    """
+    Calculate several fields of polygonal prisms at once.
+
+    The integrals over each edge are calculated only once per computation
+    point and shared by all *components*. The gravity gradient tensor and the
+    total-field anomaly use the same six integrals (the V matrix of Plouff,
+    1976), and the potential, gx and gy use the same integral over the vertical
+    faces. This is much faster than calling each function separately, e.g.,
+    when calculating the full gravity gradient tensor.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units. The output units are the same as
+        the functions of each component.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the fields. The gravitational fields use
+        the physical property ``'density'`` and the total-field anomaly the
+        properties ``'magnetization'``, ``'inclination'`` and
+        ``'declination'`` (see :func:`~fatiando.gravmag.polyprism.tf`). Prisms
+        without them are ignored for those components. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * components : list of str or None
+        The fields to calculate. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, ``'gzz'``, and ``'tf'``. If None, will calculate all of
+        them (``'tf'`` only if *inc* and *dec* are given).
+    * inc, dec : float or None
+        The inclination and declination of the regional field (in degrees).
+        Needed for ``'tf'``.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : dict
+        The fields calculated on xp, yp, zp. The keys are the names of the
+        components.
+
+    Examples::
+
+        >>> import numpy
+        >>> from fatiando.mesher import PolygonalPrism
+        >>> model = [PolygonalPrism([[10, -10], [10, 10], [-10, 10],
+        ...                          [-10, -10]], 5, 25, {'density':1000.})]
+        >>> xp, yp, zp = numpy.array([0., 5.]), numpy.zeros(2), numpy.zeros(2)
+        >>> res = fields(xp, yp, zp, model, components=['gz', 'gzz'])
+        >>> sorted(res.keys())
+        ['gz', 'gzz']
+        >>> numpy.allclose(res['gzz'], gzz(xp, yp, zp, model))
+        True
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    components = _fields_check(components, inc, dec)
+    gravity = [c for c in components if c != 'tf']
+    tensor = [_fields_tensor.index(c) for c in gravity if c in _fields_tensor]
+    faces = [c for c in ['potential', 'gx', 'gy'] if c in gravity]
+    if 'tf' in components:
+        fx, fy, fz = utils.dircos(inc, dec)
+    res = dict((c, numpy.zeros(len(xp), dtype=numpy.float))
+               for c in components)
+    for prism in prisms:
+        if prism is None:
+            continue
+        density = None
+        if gravity and 'density' in prism.props:
+            density = prism.props['density']
+        coefs = None
+        if 'tf' in components:
+            coefs = _tf_coefs(prism, fx, fy, fz)
+        if density is None and coefs is None:
+            continue
+        # The tensor components of the prism need only some of the elements
+        # of V but the total-field anomaly needs all of them
+        want = range(6) if coefs is not None else tensor
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        Z1 = prism.z1 - zp
+        Z2 = prism.z2 - zp
+        for k in range(nverts):
+            X1 = x[k] - xp
+            Y1 = y[k] - yp
+            X2 = x[(k + 1)%nverts] - xp
+            Y2 = y[(k + 1)%nverts] - yp
+            v = dict(zip(want, _integral_v(X1, X2, Y1, Y2, Z1, Z2, want)))
+            if coefs is not None:
+                res['tf'] += sum(coefs[i]*v[i] for i in xrange(6))
+            if density is None:
+                continue
+            for i in tensor:
+                res[_fields_tensor[i]] += density*v[i]
+            if 'gz' in gravity:
+                res['gz'] += density*_integral_gz(X1, X2, Y1, Y2, Z1, Z2)
+            if faces:
+                nx, ny, p, u1, u2 = _edge(X1, X2, Y1, Y2)
+                side = _integral_side(p, u1, u2, Z1, Z2)
+                if 'potential' in faces:
+                    res['potential'] += density*0.5*(p*side
+                        - Z1*_integral_face(p, u1, u2, Z1)
+                        + Z2*_integral_face(p, u1, u2, Z2))
+                if 'gx' in faces:
+                    res['gx'] += density*(-nx*side)
+                if 'gy' in faces:
+                    res['gy'] += density*(-ny*side)
+    for c in components:
+        res[c] = numpy.asarray(res[c]*_fields_scales[c], dtype='f')
+    return res
+
+def potential(xp, yp, zp, prisms, njobs=1):
+    """
+    Calculates the gravitational potential.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in SI!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    res = numpy.zeros(len(xp), dtype='f')
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_potential(x[k] - xp,
+                x[(k + 1)%nverts] - xp, y[k] - yp, y[(k + 1)%nverts] - yp, Z1,
+                Z2)
+    res *= G
+    return res
+
+def gx(xp, yp, zp, prisms, njobs=1):
+    """
+    Calculates the :math:`g_x` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    res = numpy.zeros(len(xp), dtype='f')
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_gx(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2MGAL
+    return res
+
+def gy(xp, yp, zp, prisms, njobs=1):
+    """
+    Calculates the :math:`g_y` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    res = numpy.zeros(len(xp), dtype='f')
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_gy(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2MGAL
+    return res
+
+def gz(xp, yp, zp, prisms, njobs=1):
+    """
+    Calculates the :math:`g_{z}` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    res = numpy.zeros(len(xp), dtype='f')
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        kernel = numpy.zeros_like(res)
+        for k in range(nverts):
+            kernel += _integral_gz(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+        res = res + kernel*density
+    res *= G*SI2MGAL
+    return res
+
+def gxx(xp, yp, zp, prisms, njobs=1):
+    """
+    Calculates the :math:`g_{xx}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    res = numpy.zeros(len(xp), dtype='f')
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_v1(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2EOTVOS
+    return res
+
+def gxy(xp, yp, zp, prisms, njobs=1):
+    """
+    Calculates the :math:`g_{xy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    res = numpy.zeros(len(xp), dtype='f')
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_v2(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2EOTVOS
+    return res
+
+def gxz(xp, yp, zp, prisms, njobs=1):
+    """
+    Calculates the :math:`g_{xz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    res = numpy.zeros(len(xp), dtype='f')
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_v3(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2EOTVOS
+    return res
+
+def gyy(xp, yp, zp, prisms, njobs=1):
+    """
+    Calculates the :math:`g_{yy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    res = numpy.zeros(len(xp), dtype='f')
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_v4(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2EOTVOS
+    return res
+
+def gyz(xp, yp, zp, prisms, njobs=1):
+    """
+    Calculates the :math:`g_{yz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    res = numpy.zeros(len(xp), dtype='f')
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_v5(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2EOTVOS
+    return res
+
+def gzz(xp, yp, zp, prisms, njobs=1):
+    """
+    Calculates the :math:`g_{zz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI units and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`fatiando.mesher.PolygonalPrism`
+        The model used to calculate the field.
+        Prisms must have the physical property ``'density'`` will be
+        ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The effect calculated on the computation points.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    res = numpy.zeros(len(xp), dtype='f')
+    for prism in prisms:
+        if prism is None or 'density' not in prism.props:
+            continue
+        density = prism.props['density']
+        nverts = prism.nverts
+        x, y = prism.x, prism.y
+        z1, z2 = prism.z1, prism.z2
+        # Calculate the effect of the prism
+        Z1 = z1 - zp
+        Z2 = z2 - zp
+        for k in range(nverts):
+            res += density*_integral_v6(x[k] - xp, x[(k + 1)%nverts] - xp,
+                y[k] - yp, y[(k + 1)%nverts] - yp, Z1, Z2)
+    res *= G*SI2EOTVOS
+    return res
+
+_fields_components = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz',
+                      'gyy', 'gyz', 'gzz', 'tf']
+_fields_scales = {'potential':G, 'gx':G*SI2MGAL, 'gy':G*SI2MGAL,
+                  'gz':G*SI2MGAL, 'gxx':G*SI2EOTVOS, 'gxy':G*SI2EOTVOS,
+                  'gxz':G*SI2EOTVOS, 'gyy':G*SI2EOTVOS, 'gyz':G*SI2EOTVOS,
+                  'gzz':G*SI2EOTVOS, 'tf':CM*T2NT}
+# The components given by each element of the V matrix
+_fields_tensor = ['gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz']
+
+def _fields_check(components, inc, dec):
+    """
+    Check the components given to fields and fill in the default ones.
+    """
+    if components is None:
+        components = [c for c in _fields_components
+                      if c != 'tf' or (inc is not None and dec is not None)]
+    components = list(components)
+    for c in components:
+        if c not in _fields_scales:
+            raise ValueError("Invalid component '%s'" % (c))
+    if 'tf' in components and (inc is None or dec is None):
+        raise ValueError("Need inc and dec to calculate 'tf'")
+    return components
+
+def _tf_coefs(prism, fx, fy, fz):
+    """
+    Calculate the coefficients of the elements v1 to v6 of the V matrix in the
+    total-field anomaly of a prism (without the CM*T2NT factor).
+
+    Returns None if the prism should be ignored.
+    """
+    if prism is None or 'magnetization' not in prism.props:
+        return None
+    magnetization = prism.props['magnetization']
+    # Get the 3 components of the unit vector in the direction of the
+    # magnetization from the inclination and declination
+    # 1) given by the prism
+    if 'inclination' in prism.props and 'declination' in prism.props:
+        mx, my, mz = utils.dircos(prism.props['inclination'],
+                                  prism.props['declination'])
+    # 2) Use in the direction of the regional field
+    else:
+        mx, my, mz = fx, fy, fz
+    return [magnetization*mx*fx, magnetization*(mx*fy + my*fx),
+            magnetization*(mx*fz + mz*fx), magnetization*my*fy,
+            magnetization*(my*fz + mz*fy), magnetization*mz*fz]
+
+def _integral_v(X1, X2, Y1, Y2, Z1, Z2, want=(0, 1, 2, 3, 4, 5)):
+    """
+    Calculates the elements of the V matrix with indexes in *want* (0 for v1,
+    the gxx component, to 5 for v6, the gzz component).
+
+    The logarithms and arc-tangents shared by the elements are calculated only
+    once. Returns a list with the elements in the order of *want*.
+    """
+    dummy = 10.**(-10) # Used to avoid singularities
+    aux0 = X2 - X1 + dummy
+    aux1 = Y2 - Y1 + dummy
+    n = aux0/aux1
+    g = X1 - Y1*n
+    m = aux1/aux0
+    c = Y1 - X1*m
+    aux2 = sqrt(aux0*aux0 + aux1*aux1)
+    p = (X1*Y2 - X2*Y1)/aux2 + dummy
+    d1 = (aux0*X1 + aux1*Y1)/aux2 + dummy
+    d2 = (aux0*X2 + aux1*Y2)/aux2 + dummy
+    aux6 = X1*X1 + Y1*Y1
+    aux7 = X2*X2 + Y2*Y2
+    R11 = sqrt(aux6 + Z1*Z1)
+    R12 = sqrt(aux6 + Z2*Z2)
+    R21 = sqrt(aux7 + Z1*Z1)
+    R22 = sqrt(aux7 + Z2*Z2)
+    # The terms of the second vertex end in 2 and of the first in 1
+    if 0 in want or 1 in want or 3 in want or 5 in want:
+        atan2_ = arctan2(Z2*d2, p*R22) - arctan2(Z1*d2, p*R21)
+        atan1 = arctan2(Z2*d1, p*R12) - arctan2(Z1*d1, p*R11)
+    if 0 in want or 1 in want or 3 in want:
+        log2 = log(Z2 + R22 + dummy) - log(Z1 + R21 + dummy)
+        log1 = log(Z2 + R12 + dummy) - log(Z1 + R11 + dummy)
+    if 2 in want or 4 in want:
+        logr2 = (log((R22 - d2)/(R22 + d2) + dummy)
+                 - log((R21 - d2)/(R21 + d2) + dummy))/(2*d2)
+        logr1 = (log((R12 - d1)/(R12 + d1) + dummy)
+                 - log((R11 - d1)/(R11 + d1) + dummy))/(2*d1)
+    res = []
+    for i in want:
+        if i == 0:
+            v = -(g*Y2*atan2_/(p*d2) + n*p*atan2_/d2
+                  - g*Y1*atan1/(p*d1) - n*p*atan1/d1
+                  + n*(log1 - log2))/(1.0 + n*n)
+        elif i == 1:
+            v = ((g*g + g*n*Y2)*atan2_/(p*d2) - p*atan2_/d2
+                 - (g*g + g*n*Y1)*atan1/(p*d1) + p*atan1/d1
+                 + log2 - log1)/(1.0 + n*n)
+        elif i == 2:
+            v = -((Y2*(1.0 + n*n) + g*n)*logr2
+                  - (Y1*(1.0 + n*n) + g*n)*logr1)/(1.0 + n*n)
+        elif i == 3:
+            v = (c*X2*atan2_/(p*d2) + m*p*atan2_/d2
+                 - c*X1*atan1/(p*d1) - m*p*atan1/d1
+                 + m*(log1 - log2))/(1.0 + m*m)
+        elif i == 4:
+            v = ((X2*(1.0 + m*m) + c*m)*logr2
+                 - (X1*(1.0 + m*m) + c*m)*logr1)/(1.0 + m*m)
+        else:
+            v = atan2_ - atan1
+        res.append(v)
+    return res
+
+def _integral_v1(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the first element of the V matrix (gxx components)
+    """
+    return _integral_v(X1, X2, Y1, Y2, Z1, Z2, [0])[0]
+
+def _integral_v2(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the second element of the V matrix (gxy components)
+    """
+    return _integral_v(X1, X2, Y1, Y2, Z1, Z2, [1])[0]
+
+def _integral_v3(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the third element of the V matrix (gxz components)
+    """
+    return _integral_v(X1, X2, Y1, Y2, Z1, Z2, [2])[0]
+
+def _integral_v4(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the forth element of the V matrix (gyy components)
+    """
+    return _integral_v(X1, X2, Y1, Y2, Z1, Z2, [3])[0]
+
+def _integral_v5(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the fith element of the V matrix (gyz components)
+    """
+    return _integral_v(X1, X2, Y1, Y2, Z1, Z2, [4])[0]
+
+def _integral_v6(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the sixth element of the V matrix (gzz components)
+    """
+    return _integral_v(X1, X2, Y1, Y2, Z1, Z2, [5])[0]
+
+def _integral_gz(Xk1, Xk2, Yk1, Yk2, Z1, Z2):
+    """
+    Calculates the part of gz (divided by G) of an edge (Plouff, 1976)
+    """
+    dummy = 10**(-10)
+    p = Xk1*Yk2 - Xk2*Yk1
+    p_sqr = p**2
+    Qk1 = (Yk2 - Yk1)*Yk1 + (Xk2 - Xk1)*Xk1
+    Qk2 = (Yk2 - Yk1)*Yk2 + (Xk2 - Xk1)*Xk2
+    Ak1 = Xk1**2 + Yk1**2
+    Ak2 = Xk2**2 + Yk2**2
+    R1k1 = sqrt(Ak1 + Z1**2)
+    R1k2 = sqrt(Ak2 + Z1**2)
+    R2k1 = sqrt(Ak1 + Z2**2)
+    R2k2 = sqrt(Ak2 + Z2**2)
+    Ak1 = sqrt(Ak1)
+    Ak2 = sqrt(Ak2)
+    Bk1 = sqrt(Qk1**2 + p_sqr)
+    Bk2 = sqrt(Qk2**2 + p_sqr)
+    E1k1 = R1k1*Bk1
+    E1k2 = R1k2*Bk2
+    E2k1 = R2k1*Bk1
+    E2k2 = R2k2*Bk2
+    kernel = (Z2 - Z1)*(arctan2(Qk2, p) - arctan2(Qk1, p))
+    kernel += Z2*(arctan2(Z2*Qk1, R2k1*p) - arctan2(Z2*Qk2, R2k2*p))
+    kernel += Z1*(arctan2(Z1*Qk2, R1k2*p) - arctan2(Z1*Qk1, R1k1*p))
+    Ck1 = Qk1*Ak1
+    Ck2 = Qk2*Ak2
+    # dummy helps prevent zero division errors
+    kernel += 0.5*p*(Ak1/(Bk1 + dummy))*(
+        log((E1k1 - Ck1)/(E1k1 + Ck1 + dummy) + dummy) -
+        log((E2k1 - Ck1)/(E2k1 + Ck1 + dummy) + dummy))
+    kernel += 0.5*p*(Ak2/(Bk2 + dummy))*(
+        log((E2k2 - Ck2)/(E2k2 + Ck2 + dummy) + dummy) -
+        log((E1k2 - Ck2)/(E1k2 + Ck2 + dummy) + dummy))
+    return kernel
+
+def _edge(X1, X2, Y1, Y2):
+    """
+    Calculates the outward normal (nx, ny) of the vertical face below an edge,
+    the distance p from the computation point to the plane of the face, and the
+    coordinates u1 and u2 of the vertices along the edge.
+    """
+    dx = X2 - X1
+    dy = Y2 - Y1
+    length = sqrt(dx**2 + dy**2)
+    # The vertices are clockwise, so the outward normal is the direction of the
+    # edge rotated 90 degrees clockwise. Repeated vertices don't contribute.
+    ex = numpy.where(length > 0, dx/numpy.where(length > 0, length, 1), 0)
+    ey = numpy.where(length > 0, dy/numpy.where(length > 0, length, 1), 0)
+    nx, ny = ey, -ex
+    u1 = X1*ex + Y1*ey
+    u2 = X2*ex + Y2*ey
+    p = X1*nx + Y1*ny
+    return nx, ny, p, u1, u2
+
+def _integral_side(p, u1, u2, Z1, Z2):
+    """
+    Calculates the integral of 1/r over the vertical face below an edge
+    """
+    dummy = 10.**(-10) # Used to avoid singularities
+    absp = numpy.abs(p)
+    res = 0
+    for u, su in [(u1, -1), (u2, 1)]:
+        for z, sz in [(Z1, -1), (Z2, 1)]:
+            r = sqrt(u**2 + z**2 + p**2)
+            res += su*sz*(u*log(z + r + dummy) + z*log(u + r + dummy)
+                          - absp*arctan2(u*z, absp*r))
+    return res
+
+def _integral_face(p, u1, u2, Z):
+    """
+    Calculates the integral of 1/r over the triangle formed by an edge and the
+    projection of the computation point on the plane of the top (or bottom) of
+    the prism, at a distance Z from the point
+    """
+    dummy = 10.**(-10) # Used to avoid singularities
+    w = numpy.abs(Z)
+    res = 0
+    for u, su in [(u1, -1), (u2, 1)]:
+        R = sqrt(p**2 + u**2 + w**2)
+        res += su*(p*log(u + R + dummy)
+                   + w*(arctan2(w*u, p*R) - arctan2(u, p)))
+    return res
+
+def _integral_potential(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the part of the potential (divided by G) of the faces of an edge
+    """
+    nx, ny, p, u1, u2 = _edge(X1, X2, Y1, Y2)
+    return 0.5*(p*_integral_side(p, u1, u2, Z1, Z2)
+                - Z1*_integral_face(p, u1, u2, Z1)
+                + Z2*_integral_face(p, u1, u2, Z2))
+
+def _integral_gx(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the part of gx (divided by G) of the vertical face of an edge
+    """
+    nx, ny, p, u1, u2 = _edge(X1, X2, Y1, Y2)
+    return -nx*_integral_side(p, u1, u2, Z1, Z2)
+
+def _integral_gy(X1, X2, Y1, Y2, Z1, Z2):
+    """
+    Calculates the part of gy (divided by G) of the vertical face of an edge
+    """
+    nx, ny, p, u1, u2 = _edge(X1, X2, Y1, Y2)
+    return -ny*_integral_side(p, u1, u2, Z1, Z2)
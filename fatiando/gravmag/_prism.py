@@ -5,19 +5,28 @@
     right rectangular prisms. There is a Cython implementation in _cprism.pyx
     It will be loaded automatically if it is compiled.
 
+    The prisms are converted to a :class:`~fatiando.mesher.PrismArray` and
+    evaluated in blocks of prisms against all computation points at once.
+    For a :class:`~fatiando.mesher.PrismMesh`, the kernels are evaluated only
+    once on each node of the mesh, instead of once per prism corner.
+
 ----
 """
+from functools import partial
+
 import numpy
 from numpy import sqrt, log, arctan2
 
 from fatiando.constants import SI2EOTVOS, SI2MGAL, G, CM, T2NT
+from fatiando.mesher import PrismMesh, PrismArray, prisms2array
 from fatiando import utils
 
 __all__ = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
-    'gzz', 'tf']
+    'gzz', 'tf', 'tf_batch', 'fields']
 
 
-def potential(xp, yp, zp, prisms, dens=None):
+def potential(xp, yp, zp, prisms, dens=None, ratio=None, njobs=1,
+              precision='float64'):
     """
     Calculates the gravitational potential.
 
@@ -35,7 +44,8 @@ def potential(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -43,44 +53,33 @@ def potential(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
-        # Evaluate the integration limits
-        for k in range(2):
-            for j in range(2):
-                for i in range(2):
-                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                    kernel = (x[i]*y[j]*log(z[k] + r)
-                              + y[j]*z[k]*log(x[i] + r)
-                              + x[i]*z[k]*log(y[j] + r)
-                              - 0.5*x[i]**2*arctan2(z[k]*y[j], x[i]*r)
-                              - 0.5*y[j]**2*arctan2(z[k]*x[i], y[j]*r)
-                              - 0.5*z[k]**2*arctan2(x[i]*y[j], z[k]*r))
-                    res += ((-1.)**(i + j + k))*kernel*density
+    res = _forward(_kernel_potential, xp, yp, zp, prisms, 'density', dens,
+                   ratio, _point_potential, precision)
     # Now all that is left is to multiply res by the gravitational constant
     res *= G
     return res
 
-def gx(xp, yp, zp, prisms, dens=None):
+def gx(xp, yp, zp, prisms, dens=None, ratio=None, njobs=1,
+       precision='float64'):
     """
     Calculates the :math:`g_x` gravity acceleration component.
 
@@ -98,7 +97,8 @@ def gx(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -106,44 +106,34 @@ def gx(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
-        # Evaluate the integration limits
-        for k in range(2):
-            for j in range(2):
-                for i in range(2):
-                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                    # Minus because Nagy et al (2000) give the formula for the
-                    # gradient of the potential. Gravity is -grad(V)
-                    kernel = -(y[j]*log(z[k] + r)
-                               + z[k]*log(y[j] + r)
-                               - x[i]*arctan2(z[k]*y[j], x[i]*r))
-                    res += ((-1.)**(i + j + k))*kernel*density
+    res = _forward(_kernel_gx, xp, yp, zp, prisms, 'density', dens,
+                   ratio, _point_gx, precision)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to mGal units
     res *= G*SI2MGAL
     return res
 
-def gy(xp, yp, zp, prisms, dens=None):
+def gy(xp, yp, zp, prisms, dens=None, ratio=None, njobs=1,
+       precision='float64'):
     """
     Calculates the :math:`g_y` gravity acceleration component.
 
@@ -161,7 +151,8 @@ def gy(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -169,44 +160,34 @@ def gy(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
-        # Evaluate the integration limits
-        for k in range(2):
-            for j in range(2):
-                for i in range(2):
-                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                    # Minus because Nagy et al (2000) give the formula for the
-                    # gradient of the potential. Gravity is -grad(V)
-                    kernel = -(z[k]*log(x[i] + r)
-                               + x[i]*log(z[k] + r)
-                               - y[j]*arctan2(x[i]*z[k], y[j]*r))
-                    res += ((-1.)**(i + j + k))*kernel*density
+    res = _forward(_kernel_gy, xp, yp, zp, prisms, 'density', dens,
+                   ratio, _point_gy, precision)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to mGal units
     res *= G*SI2MGAL
     return res
 
-def gz(xp, yp, zp, prisms, dens=None):
+def gz(xp, yp, zp, prisms, dens=None, ratio=None, njobs=1,
+       precision='float64'):
     """
     Calculates the :math:`g_z` gravity acceleration component.
 
@@ -224,7 +205,8 @@ def gz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -232,44 +214,34 @@ def gz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
-        # Evaluate the integration limits
-        for k in range(2):
-            for j in range(2):
-                for i in range(2):
-                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                    # Minus because Nagy et al (2000) give the formula for the
-                    # gradient of the potential. Gravity is -grad(V)
-                    kernel = -(x[i]*log(y[j] + r)
-                               + y[j]*log(x[i] + r)
-                               - z[k]*arctan2(x[i]*y[j], z[k]*r))
-                    res += ((-1.)**(i + j + k))*kernel*density
+    res = _forward(_kernel_gz, xp, yp, zp, prisms, 'density', dens,
+                   ratio, _point_gz, precision)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to mGal units
     res *= G*SI2MGAL
     return res
 
-def gxx(xp, yp, zp, prisms, dens=None):
+def gxx(xp, yp, zp, prisms, dens=None, ratio=None, njobs=1,
+        precision='float64'):
     """
     Calculates the :math:`g_{xx}` gravity gradient tensor component.
 
@@ -287,7 +259,8 @@ def gxx(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -295,40 +268,34 @@ def gxx(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
-        # Evaluate the integration limits
-        for k in range(2):
-            for j in range(2):
-                for i in range(2):
-                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                    kernel = -arctan2(z[k]*y[j], x[i]*r)
-                    res += ((-1.)**(i + j + k))*kernel*density
+    res = _forward(_kernel_gxx, xp, yp, zp, prisms, 'density', dens,
+                   ratio, _point_gxx, precision)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
     return res
 
-def gxy(xp, yp, zp, prisms, dens=None):
+def gxy(xp, yp, zp, prisms, dens=None, ratio=None, njobs=1,
+        precision='float64'):
     """
     Calculates the :math:`g_{xy}` gravity gradient tensor component.
 
@@ -346,7 +313,8 @@ def gxy(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -354,40 +322,34 @@ def gxy(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
-        # Evaluate the integration limits
-        for k in range(2):
-            for j in range(2):
-                for i in range(2):
-                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                    kernel = log(z[k] + r)
-                    res += ((-1.)**(i + j + k))*kernel*density
+    res = _forward(_kernel_gxy, xp, yp, zp, prisms, 'density', dens,
+                   ratio, _point_gxy, precision)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
     return res
 
-def gxz(xp, yp, zp, prisms, dens=None):
+def gxz(xp, yp, zp, prisms, dens=None, ratio=None, njobs=1,
+        precision='float64'):
     """
     Calculates the :math:`g_{xz}` gravity gradient tensor component.
 
@@ -405,7 +367,8 @@ def gxz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -413,40 +376,34 @@ def gxz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
-        # Evaluate the integration limits
-        for k in range(2):
-            for j in range(2):
-                for i in range(2):
-                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                    kernel = log(y[j] + r)
-                    res += ((-1.)**(i + j + k))*kernel*density
+    res = _forward(_kernel_gxz, xp, yp, zp, prisms, 'density', dens,
+                   ratio, _point_gxz, precision)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
     return res
 
-def gyy(xp, yp, zp, prisms, dens=None):
+def gyy(xp, yp, zp, prisms, dens=None, ratio=None, njobs=1,
+        precision='float64'):
     """
     Calculates the :math:`g_{yy}` gravity gradient tensor component.
 
@@ -464,7 +421,8 @@ def gyy(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -472,40 +430,34 @@ def gyy(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
-        # Evaluate the integration limits
-        for k in range(2):
-            for j in range(2):
-                for i in range(2):
-                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                    kernel = -arctan2(z[k]*x[i], y[j]*r)
-                    res += ((-1.)**(i + j + k))*kernel*density
+    res = _forward(_kernel_gyy, xp, yp, zp, prisms, 'density', dens,
+                   ratio, _point_gyy, precision)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
     return res
 
-def gyz(xp, yp, zp, prisms, dens=None):
+def gyz(xp, yp, zp, prisms, dens=None, ratio=None, njobs=1,
+        precision='float64'):
     """
     Calculates the :math:`g_{yz}` gravity gradient tensor component.
 
@@ -523,7 +475,8 @@ def gyz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -531,40 +484,34 @@ def gyz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
-        # Evaluate the integration limits
-        for k in range(2):
-            for j in range(2):
-                for i in range(2):
-                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                    kernel = log(x[i] + r)
-                    res += ((-1.)**(i + j + k))*kernel*density
+    res = _forward(_kernel_gyz, xp, yp, zp, prisms, 'density', dens,
+                   ratio, _point_gyz, precision)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
     return res
 
-def gzz(xp, yp, zp, prisms, dens=None):
+def gzz(xp, yp, zp, prisms, dens=None, ratio=None, njobs=1,
+        precision='float64'):
     """
     Calculates the :math:`g_{zz}` gravity gradient tensor component.
 
@@ -582,7 +529,8 @@ def gzz(xp, yp, zp, prisms, dens=None):
         Prisms must have the property ``'density'``. Prisms that don't have this
         property will be ignored in the computations. Elements of *prisms* that
         are None will also be ignored. *prisms* can also be a
-        :class:`~fatiando.mesher.PrismMesh`.
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * dens : float or None
         If not None, will use this value instead of the ``'density'`` property
         of the prisms. Use this, e.g., for sensitivity matrix building.
@@ -590,40 +538,35 @@ def gzz(xp, yp, zp, prisms, dens=None):
         .. warning:: Uses this value for **all** prisms! Not only the ones that
             have ``'density'`` as a property.
 
+    * ratio : float or None
+        If not None, prisms that are farther than *ratio* times their diagonal
+        from a computation point are approximated by a point mass at their
+        center. See the error bounds in :mod:`fatiando.gravmag.prism`.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
     """
-    if xp.shape != yp.shape != zp.shape:
-        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = numpy.zeros_like(xp)
-    for prism in prisms:
-        if prism is None or ('density' not in prism.props and dens is None):
-            continue
-        if dens is None:
-            density = prism.props['density']
-        else:
-            density = dens
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
-        # Evaluate the integration limits
-        for k in range(2):
-            for j in range(2):
-                for i in range(2):
-                    r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
-                    kernel = -arctan2(x[i]*y[j], z[k]*r)
-                    res += ((-1.)**(i + j + k))*kernel*density
+    res = _forward(_kernel_gzz, xp, yp, zp, prisms, 'density', dens,
+                   ratio, _point_gzz, precision)
     # Now all that is left is to multiply res by the gravitational constant and
     # convert it to Eotvos units
     res *= G*SI2EOTVOS
     return res
 
-def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
+def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None,
+       njobs=1,
+       precision='float64'):
     """
     Calculate the total-field anomaly of prisms.
 
@@ -642,7 +585,8 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
         ignored. If the physical properties ``'inclination'`` and
         ``'declination'`` are not present, will use the values of *inc* and
         *dec* instead (regional field).
-        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh`.
+        *prisms* can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
     * inc : float
         The inclination of the regional field (in degrees)
     * dec : float
@@ -657,62 +601,1009 @@ def tf(xp, yp, zp, prisms, inc, dec, pmag=None, pinc=None, pdec=None):
         If not None, will use this value instead of the ``'declination'``
         property of the prisms. Use this, e.g., for sensitivity matrix building.
 
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
     Returns:
 
     * res : array
         The field calculated on xp, yp, zp
 
+    """
+    res = _forward_tf(xp, yp, zp, prisms, inc, dec, pmag, pinc, pdec,
+                      precision)
+    res *= CM*T2NT
+    return res
+
+def tf_batch(xp, yp, zp, prisms, inc, dec, magnetization=None, njobs=1):
+    """
+    Calculate the total-field anomaly of prisms for many regional field
+    directions at once.
+
+    The magnetic field of the prisms is calculated only once and projected on
+    each direction. This is much faster than calling
+    :func:`~fatiando.gravmag.prism.tf` for each direction.
+
+    .. note:: Input units are SI. Output is in nT
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The model. Can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`. If *magnetization* is None, uses
+        the physical properties ``'magnetization'``, ``'inclination'`` and
+        ``'declination'`` like :func:`~fatiando.gravmag.prism.tf`. Prisms
+        without ``'inclination'`` and ``'declination'`` are magnetized in the
+        direction of each regional field.
+    * inc, dec : arrays
+        The inclinations and declinations of the regional fields (in degrees)
+    * magnetization : list = [mx, my, mz] or None
+        If not None, the x, y, and z components of the magnetization vector of
+        each element of *prisms* (in A/m). Elements that are None (or masked
+        prisms of a :class:`~fatiando.mesher.PrismMesh`) are ignored.
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+
+    Returns:
+
+    * res : array
+        The total-field anomaly with shape ``(len(inc), len(xp))``. Each row
+        is the anomaly for one regional field direction.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    bounds, weights = _get_batch_magnetization(prisms, magnetization)
+    shape = xp.shape
+    xp, yp, zp = [numpy.ravel(i) for i in [xp, yp, zp]]
+    terms = numpy.zeros((9, xp.size), dtype=numpy.float)
+    step = max(1, _blocksize//max(1, xp.size))
+    for start in xrange(0, weights.shape[1], step):
+        block = slice(start, start + step)
+        x = [bounds[1, block, None] - xp, bounds[0, block, None] - xp]
+        y = [bounds[3, block, None] - yp, bounds[2, block, None] - yp]
+        z = [bounds[5, block, None] - zp, bounds[4, block, None] - zp]
+        gxx, gxy, gxz, gyy, gyz, gzz = _magnetic_terms(x, y, z)
+        mx, my, mz, induced = weights[:, block]
+        terms[0] += (numpy.dot(mx, gxx) + numpy.dot(my, gxy)
+                     + numpy.dot(mz, gxz))
+        terms[1] += (numpy.dot(mx, gxy) + numpy.dot(my, gyy)
+                     + numpy.dot(mz, gyz))
+        terms[2] += (numpy.dot(mx, gxz) + numpy.dot(my, gyz)
+                     + numpy.dot(mz, gzz))
+        for i, g in enumerate([gxx, gxy, gxz, gyy, gyz, gzz]):
+            terms[3 + i] += numpy.dot(induced, g)
+    res = _tf_directions(inc, dec, terms)
+    return res.reshape((res.shape[0],) + shape)
+
+def fields(xp, yp, zp, prisms, components=None, dens=None, njobs=1,
+           precision='float64'):
+    """
+    Calculate several gravitational fields of the prisms at once.
+
+    The coordinate shifts, distances, logarithms, and arc-tangents of the prism
+    corners are calculated only once and shared by all *components*. This is
+    faster than calling each function separately, e.g., when calculating all
+    components of the gravity gradient tensor.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!). The output units are the
+        same as the functions of each component.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model used to calculate the gravitational effect.
+        Prisms must have the property ``'density'``. Prisms that don't have this
+        property will be ignored in the computations. Elements of *prisms* that
+        are None will also be ignored. *prisms* can also be a
+        :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * components : list of str or None
+        The fields to calculate. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, and ``'gzz'``. If None, will calculate all of them.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Use this, e.g., for sensitivity matrix building.
+
+        .. warning:: Uses this value for **all** prisms! Not only the ones that
+            have ``'density'`` as a property.
+
+    * njobs : int
+        Number of OpenMP threads used by the Cython implementation to split the
+        computation points. The result doesn't depend on it. Ignored by the
+        Python implementation.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the Python implementation evaluates the kernels in float32.
+        See the accuracy in :mod:`fatiando.gravmag.prism`.
+
+    Returns:
+
+    * res : dict
+        The fields calculated on xp, yp, zp. The keys are the names of the
+        components.
+
+    Examples::
+
+        >>> import numpy
+        >>> from fatiando.mesher import Prism
+        >>> model = [Prism(-10, 10, -10, 10, 5, 25, {'density':1000.})]
+        >>> xp, yp, zp = numpy.array([0., 5.]), numpy.zeros(2), numpy.zeros(2)
+        >>> res = fields(xp, yp, zp, model, components=['gz', 'gzz'])
+        >>> sorted(res.keys())
+        ['gz', 'gzz']
+        >>> numpy.all(res['gzz'] == gzz(xp, yp, zp, model))
+        True
+
+    """
+    if components is None:
+        components = _fields_components
+    components = list(components)
+    for c in components:
+        if c not in _fields_scales:
+            raise ValueError("Invalid component '%s'" % (c))
+    effects = _forward_fields(components, xp, yp, zp, prisms, dens,
+                              precision)
+    res = {}
+    for c, effect in zip(components, effects):
+        effect *= _fields_scales[c]
+        res[c] = effect
+    return res
+
+def _kernel_potential(x, y, z, r):
+    return (x*y*log(z + r)
+            + y*z*log(x + r)
+            + x*z*log(y + r)
+            - 0.5*x**2*arctan2(z*y, x*r)
+            - 0.5*y**2*arctan2(z*x, y*r)
+            - 0.5*z**2*arctan2(x*y, z*r))
+
+# Minus in gx, gy, and gz because Nagy et al (2000) give the formula for the
+# gradient of the potential. Gravity is -grad(V)
+def _kernel_gx(x, y, z, r):
+    return -(y*log(z + r) + z*log(y + r) - x*arctan2(z*y, x*r))
+
+def _kernel_gy(x, y, z, r):
+    return -(z*log(x + r) + x*log(z + r) - y*arctan2(x*z, y*r))
+
+def _kernel_gz(x, y, z, r):
+    return -(x*log(y + r) + y*log(x + r) - z*arctan2(x*y, z*r))
+
+def _kernel_gxx(x, y, z, r):
+    return -arctan2(z*y, x*r)
+
+def _kernel_gxy(x, y, z, r):
+    return log(z + r)
+
+def _kernel_gxz(x, y, z, r):
+    return log(y + r)
+
+def _kernel_gyy(x, y, z, r):
+    return -arctan2(z*x, y*r)
+
+def _kernel_gyz(x, y, z, r):
+    return log(x + r)
+
+def _kernel_gzz(x, y, z, r):
+    return -arctan2(x*y, z*r)
+
+# Effect of a point mass of unit volume on the origin. x, y, z are the
+# coordinates of the point mass and r its distance to the origin.
+def _point_potential(x, y, z, r):
+    return 1./r
+
+def _point_gx(x, y, z, r):
+    return x/r**3
+
+def _point_gy(x, y, z, r):
+    return y/r**3
+
+def _point_gz(x, y, z, r):
+    return z/r**3
+
+def _point_gxx(x, y, z, r):
+    return (3*x**2 - r**2)/r**5
+
+def _point_gxy(x, y, z, r):
+    return 3*x*y/r**5
+
+def _point_gxz(x, y, z, r):
+    return 3*x*z/r**5
+
+def _point_gyy(x, y, z, r):
+    return (3*y**2 - r**2)/r**5
+
+def _point_gyz(x, y, z, r):
+    return 3*y*z/r**5
+
+def _point_gzz(x, y, z, r):
+    return (3*z**2 - r**2)/r**5
+
+# Maximum number of prism-point pairs evaluated at once. Limits the size of the
+# temporary arrays
+_blocksize = 2**18
+
+# The kernels and point mass kernels of each component
+_component_kernels = {
+    'potential':(_kernel_potential, _point_potential),
+    'gx':(_kernel_gx, _point_gx), 'gy':(_kernel_gy, _point_gy),
+    'gz':(_kernel_gz, _point_gz), 'gxx':(_kernel_gxx, _point_gxx),
+    'gxy':(_kernel_gxy, _point_gxy), 'gxz':(_kernel_gxz, _point_gxz),
+    'gyy':(_kernel_gyy, _point_gyy), 'gyz':(_kernel_gyz, _point_gyz),
+    'gzz':(_kernel_gzz, _point_gzz)}
+
+def _forward(kernel, xp, yp, zp, prisms, prop, value, ratio=None, point=None,
+             precision='float64'):
+    """
+    Sum the effect of all prisms on the computation points.
+
+    *kernel* is evaluated on the corners of the prisms, with the computation
+    point as the origin of the coordinate system. The corners of each prism are
+    summed with alternating signs and the result is multiplied by its physical
+    property *prop* (or *value* if not None).
+
+    If *ratio* is not None, prisms farther than *ratio* times their diagonal
+    from a point use *point* (evaluated on the center of the prism) times their
+    volume instead of the corners.
+
+    In single *precision*, the kernels are evaluated in single precision only
+    where it is accurate (see _single_corners). The sums are always done in
+    double precision.
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _precision_dtype(precision)
+    if isinstance(prisms, PrismMesh) and ratio is None:
+        nodes, weights = _get_nodes(prisms, prop, value)
+        res = _forward_nodes(kernel, xp, yp, zp, nodes, weights)
+        return numpy.asarray(res, dtype=dtype)
+    bounds, values = _get_props(prisms, prop, value)
+    shape = xp.shape
+    res = numpy.zeros(xp.size, dtype=numpy.float)
+    for block, tmp in _effects(kernel, xp, yp, zp, bounds, values, ratio,
+                               point, dtype):
+        res = _sum_prisms(res, tmp)
+    return numpy.asarray(res.reshape(shape), dtype=dtype)
+
+def _effects(kernel, xp, yp, zp, bounds, values, ratio=None, point=None,
+             dtype=numpy.float):
+    """
+    Calculate the effect of the prisms on the points in blocks of prisms.
+
+    Yields the slice of the prisms in the block and their effects (one row per
+    prism, one column per point) multiplied by their *values*.
+    """
+    x1, x2, y1, y2, z1, z2 = bounds
+    xp, yp, zp = [numpy.ravel(i) for i in [xp, yp, zp]]
+    step = max(1, _blocksize//max(1, xp.size))
+    for start in xrange(0, len(values), step):
+        block = slice(start, start + step)
+        # First thing to do is make the computation point P the origin of the
+        # coordinate system. Rows are prisms and columns are points
+        x = [x2[block, None] - xp, x1[block, None] - xp]
+        y = [y2[block, None] - yp, y1[block, None] - yp]
+        z = [z2[block, None] - zp, z1[block, None] - zp]
+        if ratio is None:
+            tmp = _single_corners(partial(_corners, kernel), dtype, x, y, z)
+        else:
+            tmp = _far_field(kernel, point, ratio, x, y, z, dtype)
+        tmp *= values[block, None]
+        yield block, tmp
+
+def _columns(component, xp, yp, zp, prisms, ratio=None, njobs=1):
+    """
+    Calculate the effect of each prism with unit density on the computation
+    points. Used to build sensitivity matrices (see
+    :func:`fatiando.gravmag.sensitivity.matrix`).
+
+    The columns are the same as the function of *component* with each prism
+    alone in the model. *njobs* is ignored.
+
+    Returns:
+
+    * res : 2D array
+        One row per computation point and one column per prism
+    """
+    kernel, point = _component_kernels[component]
+    bounds, values = _get_props(prisms, 'density', 1.)
+    # Rows are prisms while calculating so that the blocks are contiguous
+    res = numpy.empty((len(values), numpy.size(xp)), dtype=numpy.float)
+    for block, tmp in _effects(kernel, xp, yp, zp, bounds, values, ratio,
+                               point):
+        res[block] = tmp
+    res *= _fields_scales[component]
+    return res.T
+
+def _corners(kernel, x, y, z):
+    """
+    Evaluate the integration limits: sum *kernel* on the corners of the prisms
+    with alternating signs. The sum is done in double precision.
+    """
+    tmp = numpy.zeros(x[0].shape, dtype=numpy.float)
+    for k in range(2):
+        for j in range(2):
+            for i in range(2):
+                r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
+                tmp += ((-1.)**(i + j + k))*kernel(x[i], y[j], z[k], r)
+    return tmp
+
+def _far_pairs(ratio, x, y, z):
+    """
+    Find the prism-point pairs in which the center of the prism is farther
+    than *ratio* times its diagonal from the point.
+    """
+    xc, yc, zc = [0.5*(i[0] + i[1]) for i in [x, y, z]]
+    diagonal2 = sum((i[0] - i[1])**2 for i in [x, y, z])
+    return xc**2 + yc**2 + zc**2 >= (ratio**2)*diagonal2
+
+def _far_field(kernel, point, ratio, x, y, z, dtype=numpy.float):
+    """
+    Same as _corners but use the point mass kernel *point* on the prism-point
+    pairs that are farther than *ratio* times the diagonal of the prism.
+    """
+    far = _far_pairs(ratio, x, y, z)
+    near = ~far
+    tmp = numpy.zeros(x[0].shape, dtype=numpy.float)
+    tmp[near] = _single_corners(partial(_corners, kernel), dtype,
+                                [i[near] for i in x], [i[near] for i in y],
+                                [i[near] for i in z])
+    # Center and dimensions of the prisms relative to the computation points
+    xc, yc, zc = [(0.5*(i[0][far] + i[1][far])).astype(dtype)
+                  for i in [x, y, z]]
+    dx, dy, dz = [i[0][far] - i[1][far] for i in [x, y, z]]
+    tmp[far] = (dx*dy*dz)*point(xc, yc, zc, sqrt(xc**2 + yc**2 + zc**2))
+    return tmp
+
+def _single_corners(corners, dtype, x, y, z, *args):
+    """
+    Call ``corners(x, y, z, *args)`` with the coordinates converted to *dtype*.
+
+    The alternating sum over the corners cancels most of the value of the
+    kernels when the computation point is far from the prism, which amplifies
+    their round-off. In single precision, only the prism-point pairs closer
+    than _single_ratio times the diagonal of the prism are evaluated in single
+    precision. The others are evaluated in double precision.
+
+    The coordinates must be relative to the computation points already. The
+    differences of large absolute coordinates (e.g., UTM) lose too much
+    precision in single precision.
+
+    *args* are arrays that can be broadcast to the shape of the coordinates.
+    They are passed on to *corners*. *corners* can return an array or a list
+    of arrays.
+    """
+    if dtype == numpy.float64:
+        return corners(x, y, z, *args)
+    shape = x[0].shape
+    near = ~_far_pairs(_single_ratio, x, y, z)
+    args = [numpy.broadcast_to(a, shape) for a in args]
+    parts = []
+    for mask, kind in [(near, dtype), (~near, numpy.float)]:
+        coords = [[i[mask].astype(kind) for i in c] for c in [x, y, z]]
+        parts.append((mask, corners(*(coords + [a[mask] for a in args]))))
+    single = not isinstance(parts[0][1], list)
+    tmp = [numpy.empty(shape, dtype=numpy.float)
+           for i in xrange(1 if single else len(parts[0][1]))]
+    for mask, part in parts:
+        for t, p in zip(tmp, [part] if single else part):
+            t[mask] = p
+    return tmp[0] if single else tmp
+
+# Prism-point pairs farther than this many diagonals of the prism are evaluated
+# in double precision when single precision is requested (see _single_corners)
+_single_ratio = 2
+
+def _forward_tf(xp, yp, zp, prisms, inc, dec, pmag, pinc, pdec,
+                precision='float64'):
+    """
+    Sum the total-field anomaly of all prisms on the computation points.
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    dtype = _precision_dtype(precision)
+    if isinstance(prisms, PrismMesh):
+        nodes, weights = _get_nodes_tf(prisms, inc, dec, pmag, pinc, pdec)
+        res = _forward_nodes_tf(xp, yp, zp, nodes, weights)
+        return numpy.asarray(res, dtype=dtype)
+    bounds, magnetization, coefs = _get_magnetization(prisms, inc, dec, pmag,
+                                                       pinc, pdec)
+    shape = xp.shape
+    res = numpy.zeros(xp.size, dtype=numpy.float)
+    for block, tmp in _effects_tf(xp, yp, zp, bounds, magnetization, coefs,
+                                  dtype):
+        res = _sum_prisms(res, tmp)
+    return numpy.asarray(res.reshape(shape), dtype=dtype)
+
+def _effects_tf(xp, yp, zp, bounds, magnetization, coefs, dtype=numpy.float):
+    """
+    Same as _effects for the total-field anomaly.
+    """
+    x1, x2, y1, y2, z1, z2 = bounds
+    xp, yp, zp = [numpy.ravel(i) for i in [xp, yp, zp]]
+    step = max(1, _blocksize//max(1, xp.size))
+    for start in xrange(0, len(magnetization), step):
+        block = slice(start, start + step)
+        # First thing to do is make the computation point P the origin of the
+        # coordinate system. Rows are prisms and columns are points
+        x = [x2[block, None] - xp, x1[block, None] - xp]
+        y = [y2[block, None] - yp, y1[block, None] - yp]
+        z = [z2[block, None] - zp, z1[block, None] - zp]
+        tmp = _single_corners(_corners_tf, dtype, x, y, z,
+                              *[c[block, None] for c in coefs])
+        tmp *= magnetization[block, None]
+        yield block, tmp
+
+def _columns_tf(xp, yp, zp, prisms, inc, dec, pinc=None, pdec=None, njobs=1):
+    """
+    Same as :func:`~fatiando.gravmag._prism._columns` for the total-field
+    anomaly of prisms with unit magnetization. The prisms must have the
+    ``'magnetization'`` property (with value 1).
+    """
+    bounds, magnetization, coefs = _get_magnetization(prisms, inc, dec, None,
+                                                       pinc, pdec)
+    res = numpy.empty((len(magnetization), numpy.size(xp)), dtype=numpy.float)
+    for block, tmp in _effects_tf(xp, yp, zp, bounds, magnetization, coefs):
+        res[block] = tmp
+    res *= CM*T2NT
+    return res.T
+
+def _corners_tf(x, y, z, cyz, cxz, cxy, cxx, cyy, czz):
+    """
+    Sum the total-field anomaly kernel on the corners of the prisms. The sum is
+    done in double precision.
+    """
+    tmp = numpy.zeros(x[0].shape, dtype=numpy.float)
+    for k in range(2):
+        z_sqr = z[k]**2
+        for j in range(2):
+            y_sqr = y[j]**2
+            for i in range(2):
+                x_sqr = x[i]**2
+                xy = x[i]*y[j]
+                r_sqr = x_sqr + y_sqr + z_sqr
+                r = sqrt(r_sqr)
+                zr = z[k]*r
+                tmp += ((-1.)**(i + j + k + 1))*(
+                      cyz*log((r - x[i])/(r + x[i]))
+                    + cxz*log((r - y[j])/(r + y[j]))
+                    - cxy*log(r + z[k])
+                    - cxx*arctan2(xy, x_sqr + zr + z_sqr)
+                    - cyy*arctan2(xy, r_sqr + zr - x_sqr)
+                    + czz*arctan2(xy, zr))
+    return tmp
+
+_fields_components = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz',
+                      'gyy', 'gyz', 'gzz']
+_fields_scales = {'potential':G, 'gx':G*SI2MGAL, 'gy':G*SI2MGAL,
+                  'gz':G*SI2MGAL, 'gxx':G*SI2EOTVOS, 'gxy':G*SI2EOTVOS,
+                  'gxz':G*SI2EOTVOS, 'gyy':G*SI2EOTVOS, 'gyz':G*SI2EOTVOS,
+                  'gzz':G*SI2EOTVOS}
+
+def _forward_fields(components, xp, yp, zp, prisms, value,
+                    precision='float64'):
+    """
+    Sum the effect of all prisms on the computation points for several
+    components at once.
+
+    Returns a list with the (unscaled) effect of each component.
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = numpy.zeros_like(xp)
+    dtype = _precision_dtype(precision)
+    shape = xp.shape
+    res = [numpy.zeros(xp.size, dtype=numpy.float) for c in components]
+    xp, yp, zp = [numpy.ravel(i) for i in [xp, yp, zp]]
+    step = max(1, _blocksize//max(1, xp.size))
+    if isinstance(prisms, PrismMesh):
+        (xn, yn, zn), weights = _get_nodes(prisms, 'density', value)
+        for start in xrange(0, len(weights), step):
+            block = slice(start, start + step)
+            x = xn[block, None] - xp
+            y = yn[block, None] - yp
+            z = zn[block, None] - zp
+            r = sqrt(x**2 + y**2 + z**2)
+            kernels = _kernel_fields(x, y, z, r, components)
+            for n, kernel in enumerate(kernels):
+                res[n] = _sum_prisms(res[n], weights[block, None]*kernel)
+    else:
+        (x1, x2, y1, y2, z1, z2), values = _get_props(prisms, 'density', value)
+        for start in xrange(0, len(values), step):
+            block = slice(start, start + step)
+            x = [x2[block, None] - xp, x1[block, None] - xp]
+            y = [y2[block, None] - yp, y1[block, None] - yp]
+            z = [z2[block, None] - zp, z1[block, None] - zp]
+            tmp = _single_corners(partial(_corners_fields, components), dtype,
+                                  x, y, z)
+            for n in xrange(len(components)):
+                tmp[n] *= values[block, None]
+                res[n] = _sum_prisms(res[n], tmp[n])
+    return [numpy.asarray(effect.reshape(shape), dtype=dtype)
+            for effect in res]
+
+def _corners_fields(components, x, y, z):
+    """
+    Sum the kernels of all *components* on the corners of the prisms. The sums
+    are done in double precision.
+    """
+    tmp = [numpy.zeros(x[0].shape, dtype=numpy.float) for c in components]
+    for k in range(2):
+        for j in range(2):
+            for i in range(2):
+                r = sqrt(x[i]**2 + y[j]**2 + z[k]**2)
+                kernels = _kernel_fields(x[i], y[j], z[k], r, components)
+                for n, kernel in enumerate(kernels):
+                    tmp[n] += ((-1.)**(i + j + k))*kernel
+    return tmp
+
+# The logarithms and arc-tangents used by the kernel of each component
+_fields_terms = {'potential':['logx', 'logy', 'logz', 'atanx', 'atany',
+                               'atanz'],
+                 'gx':['logy', 'logz', 'atanx'],
+                 'gy':['logx', 'logz', 'atany'],
+                 'gz':['logx', 'logy', 'atanz'],
+                 'gxx':['atanx'], 'gxy':['logz'], 'gxz':['logy'],
+                 'gyy':['atany'], 'gyz':['logx'], 'gzz':['atanz']}
+
+def _kernel_fields(x, y, z, r, components):
+    """
+    Evaluate the kernels of all *components* on a corner, calculating each
+    logarithm and arc-tangent only once.
+
+    Uses the same operations as the kernel of each component so that the
+    results are exactly the same.
+    """
+    terms = set()
+    for c in components:
+        terms.update(_fields_terms[c])
+    if 'logx' in terms:
+        logx = log(x + r)
+    if 'logy' in terms:
+        logy = log(y + r)
+    if 'logz' in terms:
+        logz = log(z + r)
+    if 'atanx' in terms:
+        atanx = arctan2(z*y, x*r)
+    if 'atany' in terms:
+        atany = arctan2(z*x, y*r)
+    if 'atanz' in terms:
+        atanz = arctan2(x*y, z*r)
+    kernels = []
+    for c in components:
+        if c == 'potential':
+            kernels.append(x*y*logz + y*z*logx + x*z*logy - 0.5*x**2*atanx
+                           - 0.5*y**2*atany - 0.5*z**2*atanz)
+        # Minus in gx, gy, and gz because Nagy et al (2000) give the formula
+        # for the gradient of the potential. Gravity is -grad(V)
+        elif c == 'gx':
+            kernels.append(-(y*logz + z*logy - x*atanx))
+        elif c == 'gy':
+            kernels.append(-(z*logx + x*logz - y*atany))
+        elif c == 'gz':
+            kernels.append(-(x*logy + y*logx - z*atanz))
+        elif c == 'gxx':
+            kernels.append(-atanx)
+        elif c == 'gxy':
+            kernels.append(logz)
+        elif c == 'gxz':
+            kernels.append(logy)
+        elif c == 'gyy':
+            kernels.append(-atany)
+        elif c == 'gyz':
+            kernels.append(logx)
+        elif c == 'gzz':
+            kernels.append(-atanz)
+    return kernels
+
+def _precision_dtype(precision):
+    """
+    Get the numpy type of a *precision* argument: ``'float64'`` or
+    ``'float32'``.
+    """
+    if precision not in _precisions:
+        raise ValueError("Invalid precision '%s'. Use %s" % (
+            precision, ' or '.join("'%s'" % p for p in sorted(_precisions))))
+    return _precisions[precision]
+
+_precisions = {'float64':numpy.float64, 'float32':numpy.float32}
+
+def _cast(coordinates, dtype):
+    """
+    Convert a list of arrays of coordinates to *dtype*.
+
+    The coordinates must be relative to the computation points already. The
+    differences of large absolute coordinates (e.g., UTM) lose too much
+    precision in single precision.
+    """
+    if dtype == numpy.float64:
+        return coordinates
+    return [c.astype(dtype) for c in coordinates]
+
+def _sum_prisms(res, effects):
+    """
+    Add the effects of a block of prisms (one per row) to res.
+
+    The prisms are added one after the other, the same way the Cython
+    implementation does it, so that both give the exact same result.
+    """
+    effects[0] += res
+    return numpy.add.reduce(effects, axis=0)
+
+def _get_props(prisms, prop, value):
+    """
+    Get the borders of the prisms and the values of physical property *prop*.
+
+    If *value* is not None, use it for all prisms instead. Otherwise, prisms
+    that don't have *prop* are left out.
+
+    Returns:
+
+    * [bounds, values]
+        bounds is a list with the arrays x1, x2, y1, y2, z1, z2
+    """
+    prisms = prisms2array(prisms)
+    bounds = prisms.get_bounds()
+    if value is not None:
+        return bounds, numpy.repeat(float(value), prisms.size)
+    if prop not in prisms.props:
+        return [b[:0] for b in bounds], numpy.zeros(0)
+    values = prisms.props[prop]
+    valid = ~numpy.isnan(values)
+    if not valid.all():
+        bounds = [b[valid] for b in bounds]
+        values = values[valid]
+    return bounds, values
+
+def _get_magnetization(prisms, inc, dec, pmag, pinc, pdec):
+    """
+    Get the borders, magnetization intensity, and the coefficients that combine
+    the magnetization and regional field directions for the total-field
+    anomaly.
+
+    Returns:
+
+    * [bounds, magnetization, coefs]
+        bounds is a list with the arrays x1, x2, y1, y2, z1, z2. coefs is a list
+        with the arrays ``0.5*(my*fz + mz*fy)``, ``0.5*(mx*fz + mz*fx)``,
+        ``mx*fy + my*fx``, ``mx*fx``, ``my*fy``, and ``mz*fz``.
+    """
+    prisms = prisms2array(prisms)
+    valid, magnetization, coefs = _magnetization_coefs(prisms.props,
+        prisms.size, inc, dec, pmag, pinc, pdec)
+    bounds = [b[valid] for b in prisms.get_bounds()]
+    return bounds, magnetization, coefs
+
+def _magnetization_coefs(props, size, inc, dec, pmag, pinc, pdec):
+    """
+    Calculate the magnetization intensity and the total-field coefficients
+    (see :func:`~fatiando.gravmag._prism._get_magnetization`) from the
+    physical property arrays *props* of *size* prisms.
+
+    Returns:
+
+    * [valid, magnetization, coefs]
+        valid is a boolean array marking the prisms that have a magnetization.
+        magnetization and coefs are only given for these prisms.
+    """
+    if pmag is not None:
+        valid = numpy.ones(size, dtype=numpy.bool)
+        magnetization = numpy.repeat(float(pmag), size)
+    elif 'magnetization' in props:
+        valid = ~numpy.isnan(props['magnetization'])
+        magnetization = props['magnetization'][valid]
+    else:
+        valid = numpy.zeros(size, dtype=numpy.bool)
+        magnetization = numpy.zeros(0)
+    size = len(magnetization)
     # Calculate the 3 components of the unit vector in the direction of the
     # regional field
     fx, fy, fz = utils.dircos(inc, dec)
-    for prism in prisms:
-        if prism is None or ('magnetization' not in prism.props
-                              and pmag is None):
-            continue
-        if pmag is None:
-            magnetization = prism.props['magnetization']
-        else:
-            magnetization = pmag
-        # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x = [prism.x2 - xp, prism.x1 - xp]
-        y = [prism.y2 - yp, prism.y1 - yp]
-        z = [prism.z2 - zp, prism.z1 - zp]
-        # Get the 3 components of the unit vector in the direction of the
-        # magnetization from the inclination and declination
-        # 1) given by the function
-        if pinc is not None and pdec is not None:
-            mx, my, mz = utils.dircos(pinc, pdec)
-        # 2) given by the prism
-        elif 'inclination' in prism.props and 'declination' in prism.props:
-            mx, my, mz = utils.dircos(prism.props['inclination'],
-                                      prism.props['declination'])
+    # Get the 3 components of the unit vector in the direction of the
+    # magnetization from the inclination and declination
+    # 1) given by the function
+    if pinc is not None and pdec is not None:
+        mx, my, mz = [numpy.repeat(m, size) for m in utils.dircos(pinc, pdec)]
+    else:
         # 3) Use in the direction of the regional field
-        else:
-            mx, my, mz = fx, fy, fz
-        # Now calculate the total field anomaly
-        for k in range(2):
-            magnetization *= -1
-            z_sqr = z[k]**2
-            for j in range(2):
-                y_sqr = y[j]**2
-                for i in range(2):
-                    x_sqr = x[i]**2
-                    xy = x[i]*y[j]
-                    r_sqr = x_sqr + y_sqr + z_sqr
-                    r = sqrt(r_sqr)
-                    zr = z[k]*r
-                    res += ((-1.)**(i + j))*magnetization*(
-                          0.5*(my*fz + mz*fy)*log((r - x[i])/(r + x[i]))
-                        + 0.5*(mx*fz + mz*fx)*log((r - y[j])/(r + y[j]))
-                        - (mx*fy + my*fx)*log(r + z[k])
-                        - mx*fx*arctan2(xy, x_sqr + zr + z_sqr)
-                        - my*fy*arctan2(xy, r_sqr + zr - x_sqr)
-                        + mz*fz*arctan2(xy, zr))
+        mx, my, mz = [numpy.repeat(f, size) for f in [fx, fy, fz]]
+        # 2) given by the prisms
+        if 'inclination' in props and 'declination' in props:
+            incs = props['inclination'][valid]
+            decs = props['declination'][valid]
+            given = ~(numpy.isnan(incs) | numpy.isnan(decs))
+            mx[given], my[given], mz[given] = utils.dircos(incs[given],
+                                                           decs[given])
+    coefs = [0.5*(my*fz + mz*fy), 0.5*(mx*fz + mz*fx), mx*fy + my*fx, mx*fx,
+             my*fy, mz*fz]
+    return valid, magnetization, coefs
+
+def _magnetic_terms(x, y, z):
+    """
+    The symmetric tensor G that gives the magnetic induction of a prism from
+    its magnetization M (B = G M, apart from the constants). x, y, z are the
+    corners of the prisms relative to the computation points (see
+    _forward_tf).
+
+    Returns:
+
+    * [gxx, gxy, gxz, gyy, gyz, gzz]
+    """
+    terms = [numpy.zeros_like(x[0]) for i in xrange(6)]
+    gxx, gxy, gxz, gyy, gyz, gzz = terms
+    for k in range(2):
+        z_sqr = z[k]**2
+        for j in range(2):
+            y_sqr = y[j]**2
+            for i in range(2):
+                x_sqr = x[i]**2
+                xy = x[i]*y[j]
+                r_sqr = x_sqr + y_sqr + z_sqr
+                r = sqrt(r_sqr)
+                zr = z[k]*r
+                sign = (-1.)**(i + j + k + 1)
+                gxx -= sign*arctan2(xy, x_sqr + zr + z_sqr)
+                gxy -= sign*log(r + z[k])
+                gxz += sign*0.5*log((r - y[j])/(r + y[j]))
+                gyy -= sign*arctan2(xy, r_sqr + zr - x_sqr)
+                gyz += sign*0.5*log((r - x[i])/(r + x[i]))
+                gzz += sign*arctan2(xy, zr)
+    return terms
+
+def _get_batch_magnetization(prisms, magnetization):
+    """
+    Get the borders of the prisms and the magnetization used by tf_batch.
+
+    Returns:
+
+    * [bounds, weights]
+        bounds is a 2D array with rows x1, x2, y1, y2, z1, z2. weights is a 2D
+        array with rows mx, my, mz (magnetization vector of the prisms with a
+        fixed direction) and the intensity of the prisms magnetized in the
+        direction of the regional field.
+    """
+    if magnetization is not None:
+        valid = _valid_elements(prisms)
+        mag = [numpy.asarray(m, dtype=numpy.float) for m in magnetization]
+        if len(mag) != 3 or any(m.shape != valid.shape for m in mag):
+            raise ValueError(
+                "magnetization must be 3 arrays with one value per prism")
+        fixed = [m[valid] for m in mag]
+        induced = numpy.zeros_like(fixed[0])
+    prisms = prisms2array(prisms)
+    bounds = numpy.array(prisms.get_bounds(), dtype=numpy.float)
+    if magnetization is None:
+        props = prisms.props
+        intensity = numpy.zeros(prisms.size)
+        if 'magnetization' in props:
+            intensity = numpy.nan_to_num(props['magnetization'])
+        given = numpy.zeros(prisms.size, dtype=numpy.bool)
+        fixed = [numpy.zeros(prisms.size) for i in xrange(3)]
+        if 'inclination' in props and 'declination' in props:
+            incs, decs = props['inclination'], props['declination']
+            given = ~(numpy.isnan(incs) | numpy.isnan(decs))
+            for m, d in zip(fixed, utils.dircos(incs[given], decs[given])):
+                m[given] = intensity[given]*d
+        induced = numpy.where(given, 0., intensity)
+    return bounds, numpy.array(fixed + [induced])
+
+def _valid_elements(prisms):
+    """
+    Mark the elements of *prisms* that are not None or masked.
+    """
+    if isinstance(prisms, PrismArray):
+        return numpy.ones(prisms.size, dtype=numpy.bool)
+    if isinstance(prisms, PrismMesh):
+        valid = numpy.ones(prisms.size, dtype=numpy.bool)
+        valid[list(prisms.mask)] = False
+        return valid
+    return numpy.array([p is not None for p in prisms], dtype=numpy.bool)
+
+def _element_magnetization(element, index, magnetization):
+    """
+    Get the magnetization of a single element (sphere, polygonal prism, etc)
+    for the tf_batch functions.
+
+    Returns [mx, my, mz, induced] (see _get_batch_magnetization) or None if
+    the element should be ignored.
+    """
+    if element is None:
+        return None
+    if magnetization is not None:
+        return [magnetization[0][index], magnetization[1][index],
+                magnetization[2][index], 0.]
+    props = element.props
+    if 'magnetization' not in props:
+        return None
+    intensity = props['magnetization']
+    if 'inclination' in props and 'declination' in props:
+        mx, my, mz = utils.dircos(props['inclination'], props['declination'])
+        return [intensity*mx, intensity*my, intensity*mz, 0.]
+    return [0., 0., 0., intensity]
+
+def _tf_directions(inc, dec, terms):
+    """
+    Project the magnetic induction on the regional field directions.
+
+    *terms* has 9 rows: the x, y, z components of the field of the sources
+    with a fixed magnetization and the xx, xy, xz, yy, yz, zz components of
+    the tensor G (see _magnetic_terms) of the sources magnetized in the
+    direction of the regional field, multiplied by their intensities.
+
+    Returns the total-field anomaly in nT, one row per direction.
+    """
+    fx, fy, fz = [numpy.atleast_1d(f) for f in utils.dircos(
+        numpy.asarray(inc, dtype=numpy.float),
+        numpy.asarray(dec, dtype=numpy.float))]
+    linear = numpy.transpose([fx, fy, fz])
+    quadratic = numpy.transpose([fx**2, 2*fx*fy, 2*fx*fz, fy**2, 2*fy*fz,
+                                 fz**2])
+    res = numpy.dot(linear, terms[:3]) + numpy.dot(quadratic, terms[3:])
     res *= CM*T2NT
     return res
 
+def _forward_nodes(kernel, xp, yp, zp, nodes, weights):
+    """
+    Sum the effect of a regular mesh on the computation points using its nodes.
+
+    *kernel* is evaluated once per node (see
+    :func:`~fatiando.gravmag._prism._get_nodes`) and multiplied by the weight
+    of the node.
+    """
+    xn, yn, zn = nodes
+    shape = xp.shape
+    res = numpy.zeros(xp.size, dtype=numpy.float)
+    xp, yp, zp = [numpy.ravel(i) for i in [xp, yp, zp]]
+    step = max(1, _blocksize//max(1, xp.size))
+    for start in xrange(0, len(weights), step):
+        block = slice(start, start + step)
+        x = xn[block, None] - xp
+        y = yn[block, None] - yp
+        z = zn[block, None] - zp
+        r = sqrt(x**2 + y**2 + z**2)
+        tmp = weights[block, None]*kernel(x, y, z, r)
+        res = _sum_prisms(res, tmp)
+    return res.reshape(shape)
+
+def _forward_nodes_tf(xp, yp, zp, nodes, weights):
+    """
+    Sum the total-field anomaly of a regular mesh on the computation points
+    using its nodes.
+
+    *weights* is a list with the node weights of each of the total-field
+    coefficients.
+    """
+    xn, yn, zn = nodes
+    shape = xp.shape
+    res = numpy.zeros(xp.size, dtype=numpy.float)
+    xp, yp, zp = [numpy.ravel(i) for i in [xp, yp, zp]]
+    step = max(1, _blocksize//max(1, xp.size))
+    for start in xrange(0, len(xn), step):
+        block = slice(start, start + step)
+        cyz, cxz, cxy, cxx, cyy, czz = [w[block, None] for w in weights]
+        x = xn[block, None] - xp
+        y = yn[block, None] - yp
+        z = zn[block, None] - zp
+        tmp = _kernel_tf(x, y, z, cyz, cxz, cxy, cxx, cyy, czz)
+        res = _sum_prisms(res, tmp)
+    return res.reshape(shape)
+
+def _kernel_tf(x, y, z, cyz, cxz, cxy, cxx, cyy, czz):
+    x_sqr = x**2
+    z_sqr = z**2
+    xy = x*y
+    r_sqr = x_sqr + y**2 + z_sqr
+    r = sqrt(r_sqr)
+    zr = z*r
+    return (cyz*log((r - x)/(r + x))
+            + cxz*log((r - y)/(r + y))
+            - cxy*log(r + z)
+            - cxx*arctan2(xy, x_sqr + zr + z_sqr)
+            - cyy*arctan2(xy, r_sqr + zr - x_sqr)
+            + czz*arctan2(xy, zr))
+
+def _get_nodes(mesh, prop, value):
+    """
+    Get the nodes of a :class:`~fatiando.mesher.PrismMesh` and their weights
+    for physical property *prop* (or *value* if not None).
+
+    Neighboring prisms of the mesh share corners. Instead of evaluating the
+    kernels on the 8 corners of every prism, they can be evaluated once on each
+    node of the mesh and multiplied by the signed sum of the physical property
+    of the (up to 8) prisms around it. Masked prisms and prisms without the
+    property count as zero.
+
+    Returns:
+
+    * [nodes, weights]
+        nodes is a list with the x, y, z arrays of the coordinates of the nodes.
+        Only nodes with non-zero weight are returned.
+    """
+    nodes, weights = _node_weights(mesh, [_mesh_values(mesh, prop, value)])
+    return nodes, weights[0]
+
+def _mesh_values(mesh, prop, value):
+    """
+    Get the values of physical property *prop* (or *value* if not None) of all
+    prisms of a :class:`~fatiando.mesher.PrismMesh`. Masked prisms and prisms
+    without the property are zero.
+    """
+    values = numpy.zeros(mesh.size, dtype=numpy.float)
+    if value is not None:
+        values[:] = value
+    elif prop in mesh.props:
+        values[:] = mesh.props[prop]
+        values[numpy.isnan(values)] = 0
+    values[mesh.mask] = 0
+    return values
+
+def _get_nodes_tf(mesh, inc, dec, pmag, pinc, pdec):
+    """
+    Get the nodes of a :class:`~fatiando.mesher.PrismMesh` and the weights of
+    each total-field coefficient (see
+    :func:`~fatiando.gravmag._prism._get_magnetization`).
+
+    Returns:
+
+    * [nodes, weights]
+        nodes is a list with the x, y, z arrays of the coordinates of the nodes.
+        weights is a list with the weights of each coefficient.
+    """
+    props = dict((p, numpy.asarray(mesh.props[p], dtype=numpy.float))
+                 for p in mesh.props)
+    valid, magnetization, coefs = _magnetization_coefs(props, mesh.size, inc,
+        dec, pmag, pinc, pdec)
+    cells = []
+    for c in coefs:
+        values = numpy.zeros(mesh.size, dtype=numpy.float)
+        # Minus because of the sign of the formula of Bhattacharyya (1964)
+        values[valid] = -magnetization*c
+        values[mesh.mask] = 0
+        cells.append(values)
+    return _node_weights(mesh, cells)
+
+def _node_weights(mesh, cells):
+    """
+    Calculate the weights of the nodes of a mesh for each array of prism values
+    in *cells*.
+
+    The weight of a node is the finite difference of the values of the prisms
+    around it along x, y, and z. Nodes with zero weight in all arrays are left
+    out.
+    """
+    nz, ny, nx = mesh.shape
+    dx, dy, dz = mesh.dims
+    weights = []
+    for values in cells:
+        # Pad with zeros so that the nodes on the borders of the mesh see empty
+        # space outside
+        w = numpy.zeros((nz + 2, ny + 2, nx + 2), dtype=numpy.float)
+        w[1:-1, 1:-1, 1:-1] = numpy.reshape(values, mesh.shape)
+        # The upper corner of a prism (x2, y2, z2) has a positive sign
+        for axis in range(3):
+            w = -numpy.diff(w, axis=axis)
+        weights.append(w.ravel())
+    keep = numpy.any([w != 0 for w in weights], axis=0)
+    i = numpy.tile(numpy.arange(nx + 1), (ny + 1)*(nz + 1))[keep]
+    j = numpy.tile(numpy.repeat(numpy.arange(ny + 1), nx + 1), nz + 1)[keep]
+    k = numpy.repeat(numpy.arange(nz + 1), (nx + 1)*(ny + 1))[keep]
+    nodes = [mesh.bounds[0] + dx*i, mesh.bounds[2] + dy*j,
+             mesh.bounds[4] + dz*k]
+    return nodes, [w[keep] for w in weights]
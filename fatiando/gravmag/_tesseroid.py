@@ -1,31 +1,124 @@
 """
 Pure Python implementations of functions in fatiando.gravmag.tesseroid.
 Used instead of Cython versions if those are not available.
+
+The adaptive discretization works on arrays of pairs of a part of a tesseroid
+(its w, e, s, n, top, bottom bounds) and a computation point. The pairs that
+need to be divided are replaced by the 8 parts of the tesseroid, one level of
+division at a time. The *njobs* argument is only used by the Cython version.
 """
 import numpy
 
-from fatiando.constants import MEAN_EARTH_RADIUS
+from fatiando.constants import MEAN_EARTH_RADIUS, G
+
+
+def calc(kernels, bounds, densities, lons, lats, radii, ratio, lon_nodes,
+         lon_weights, lat_nodes, lat_weights, r_nodes, r_weights, max_depth,
+         njobs=1):
+    """
+    Calculate the effect of the tesseroids on the points, dividing them
+    adaptively.
+
+    *kernels* is a list with the names of the components. The tesseroids are
+    divided only once for all of them.
+
+    Returns the result of each kernel (an array with one row per kernel) and
+    the number of times that a tesseroid needed to be divided but the maximum
+    depth had been reached.
+    """
+    for kernel in kernels:
+        if kernel not in _kernels:
+            raise ValueError("Invalid kernel '%s'" % (kernel))
+    funcs = [_kernels[kernel] for kernel in kernels]
+    glq = [lon_nodes, lon_weights, lat_nodes, lat_weights, r_nodes, r_weights]
+    d2r = numpy.pi/180.
+    ndata = len(lons)
+    result = numpy.zeros((len(kernels), ndata), numpy.float)
+    overflow = 0
+    for tesseroid, density in zip(bounds, densities):
+        parts = numpy.tile(tesseroid, (ndata, 1))
+        points = numpy.arange(ndata)
+        for depth in xrange(max_depth + 1):
+            w, e, s, n, top, bottom = parts.T
+            size = numpy.max([MEAN_EARTH_RADIUS*d2r*(e - w),
+                              MEAN_EARTH_RADIUS*d2r*(n - s),
+                              top - bottom], axis=0)
+            distance = _distance(parts, lons[points], lats[points],
+                                 radii[points])
+            too_close = (distance > 0) & (distance < ratio*size)
+            if depth == max_depth:
+                # Too deep. Integrate without dividing
+                overflow += numpy.count_nonzero(too_close)
+                too_close[:] = False
+            done = ~too_close
+            if numpy.any(done):
+                res = _integrate(parts[done], lons[points[done]],
+                                 lats[points[done]], radii[points[done]],
+                                 funcs, *glq)
+                for i in xrange(len(funcs)):
+                    result[i] += numpy.bincount(points[done], G*density*res[i],
+                                                minlength=ndata)
+            if not numpy.any(too_close):
+                break
+            parts = _split(parts[too_close])
+            points = numpy.repeat(points[too_close], 8)
+    return result, overflow
+
+def _split(parts):
+    """
+    Divide each part in 8, in the order used by the Cython version.
+    """
+    w, e, s, n, top, bottom = parts.T
+    dlon = 0.5*(e - w)
+    dlat = 0.5*(n - s)
+    dh = 0.5*(top - bottom)
+    split = numpy.empty((len(parts), 8, 6))
+    for i in xrange(8):
+        west = w + dlon*(i//4)
+        south = s + dlat*((i//2) % 2)
+        low = bottom + dh*(i % 2)
+        split[:, i, 0] = west
+        split[:, i, 1] = west + dlon
+        split[:, i, 2] = south
+        split[:, i, 3] = south + dlat
+        split[:, i, 4] = low + dh
+        split[:, i, 5] = low
+    return split.reshape((8*len(parts), 6))
 
+def _distance(parts, lons, lats, radii):
+    d2r = numpy.pi/180.
+    w, e, s, n, top, bottom = parts.T
+    tes_radius = top + MEAN_EARTH_RADIUS
+    tes_lat = d2r*0.5*(s + n)
+    tes_lon = d2r*0.5*(w + e)
+    distance = numpy.sqrt(
+        radii**2 + tes_radius**2 - 2.*radii*tes_radius*(
+            numpy.sin(lats)*numpy.sin(tes_lat) +
+            numpy.cos(lats)*numpy.cos(tes_lat)*
+            numpy.cos(lons - tes_lon)
+        ))
+    return distance
 
-def _scale_nodes(tesseroid, nodes):
+def _scale_nodes(parts, lon_nodes, lat_nodes, r_nodes):
     d2r = numpy.pi/180.
-    dlon = tesseroid.e - tesseroid.w
-    dlat = tesseroid.n - tesseroid.s
-    dr = tesseroid.top - tesseroid.bottom
+    w, e, s, n, top, bottom = [i.reshape((-1, 1)) for i in parts.T]
+    dlon = e - w
+    dlat = n - s
+    dr = top - bottom
     # Scale the GLQ nodes to the integration limits
-    nodes_lon = d2r*(0.5*dlon*nodes + 0.5*(tesseroid.e + tesseroid.w))
-    nodes_lat = d2r*(0.5*dlat*nodes + 0.5*(tesseroid.n + tesseroid.s))
-    nodes_r = (0.5*dr*nodes +
-        0.5*(tesseroid.top + tesseroid.bottom + 2.*MEAN_EARTH_RADIUS))
-    scale = d2r*dlon*d2r*dlat*dr*0.125
+    nodes_lon = d2r*(0.5*dlon*lon_nodes + 0.5*(e + w))
+    nodes_lat = d2r*(0.5*dlat*lat_nodes + 0.5*(n + s))
+    nodes_r = (0.5*dr*r_nodes + 0.5*(top + bottom + 2.*MEAN_EARTH_RADIUS))
+    scale = d2r*dlon[:, 0]*d2r*dlat[:, 0]*dr[:, 0]*0.125
     return nodes_lon, nodes_lat, nodes_r, scale
 
-def potential(tesseroid, lons, lats, radii, nodes, weights):
+def _integrate(parts, lons, lats, radii, kernels, lon_nodes, lon_weights,
+               lat_nodes, lat_weights, r_nodes, r_weights):
     """
-    Integrate potential using the Gauss-Legendre Quadrature
+    Integrate the kernels using the Gauss-Legendre Quadrature. The *kernels*
+    are called with the coordinates of the points and of the nodes.
     """
-    order = len(nodes)
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
+    lonc, latc, rc, scale = _scale_nodes(parts, lon_nodes, lat_nodes, r_nodes)
     # Pre-compute sines, cossines and powers
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
@@ -33,275 +126,59 @@ def potential(tesseroid, lons, lats, radii, nodes, weights):
     coslat = numpy.cos(lats)
     radii_sqr = radii**2
     # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        for j in xrange(order):
-            for k in xrange(order):
-                l_sqr = (radii_sqr + rc[k]**2 -
-                         2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                kappa = (rc[k]**2)*coslatc[j]
-                result += (weights[i]*weights[j]*weights[k]*
-                    kappa/numpy.sqrt(l_sqr))
+    result = numpy.zeros((len(kernels), len(lons)), numpy.float)
+    for i in xrange(len(lon_nodes)):
+        coslon = numpy.cos(lons - lonc[:, i])
+        sinlon = numpy.sin(lonc[:, i] - lons)
+        for j in xrange(len(lat_nodes)):
+            cospsi = sinlat*sinlatc[:, j] + coslat*coslatc[:, j]*coslon
+            kphi = coslat*sinlatc[:, j] - sinlat*coslatc[:, j]*coslon
+            for k in xrange(len(r_nodes)):
+                l_sqr = radii_sqr + rc[:, k]**2 - 2.*radii*rc[:, k]*cospsi
+                kappa = (rc[:, k]**2)*coslatc[:, j]
+                weight = lon_weights[i]*lat_weights[j]*r_weights[k]
+                for c, kernel in enumerate(kernels):
+                    result[c] += weight*kappa*kernel(radii, rc[:, k],
+                        coslatc[:, j], cospsi, kphi, sinlon, l_sqr)
     result *= scale
     return result
 
-def gx(tesseroid, lons, lats, radii, nodes, weights):
-    """
-    Integrate gx using the Gauss-Legendre Quadrature
-    """
-    order = len(nodes)
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
-    # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        for j in xrange(order):
-            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-            for k in xrange(order):
-                l_sqr = (radii_sqr + rc[k]**2 -
-                         2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                kappa = (rc[k]**2)*coslatc[j]
-                result += (weights[i]*weights[j]*weights[k]*
-                    kappa*rc[k]*kphi/(l_sqr**1.5))
-    result *= scale
-    return result
+# The kernels of each component as functions of the distances between a
+# computation point and a GLQ node
 
-def gy(tesseroid, lons, lats, radii, nodes, weights):
-    """
-    Integrate gy using the Gauss-Legendre Quadrature
-    """
-    order = len(nodes)
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
-    # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        sinlon = numpy.sin(lonc[i] - lons)
-        for j in xrange(order):
-            for k in xrange(order):
-                l_sqr = (radii_sqr + rc[k]**2 -
-                         2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                kappa = (rc[k]**2)*coslatc[j]
-                result += (weights[i]*weights[j]*weights[k]*
-                    kappa*rc[k]*coslatc[j]*sinlon/(l_sqr**1.5))
-    result *= scale
-    return result
+def potential(radii, rc, coslatc, cospsi, kphi, sinlon, l_sqr):
+    return 1./numpy.sqrt(l_sqr)
 
-def gz(tesseroid, lons, lats, radii, nodes, weights):
-    """
-    Integrate gz using the Gauss-Legendre Quadrature
-    """
-    order = len(nodes)
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
-    # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        for j in xrange(order):
-            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in xrange(order):
-                l_sqr = (radii_sqr + rc[k]**2 -
-                         2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                kappa = (rc[k]**2)*coslatc[j]
-                result += (weights[i]*weights[j]*weights[k]*
-                    kappa*(rc[k]*cospsi - radii)/(l_sqr**1.5))
-    result *= scale
-    return result
+def gx(radii, rc, coslatc, cospsi, kphi, sinlon, l_sqr):
+    return rc*kphi/(l_sqr**1.5)
 
-def gxx(tesseroid, lons, lats, radii, nodes, weights):
-    """
-    Integrate gxx using the Gauss-Legendre Quadrature
-    """
-    order = len(nodes)
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
-    # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        for j in xrange(order):
-            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-            for k in xrange(order):
-                l_sqr = (radii_sqr + rc[k]**2 -
-                         2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                kappa = (rc[k]**2)*coslatc[j]
-                result += (weights[i]*weights[j]*weights[k]*
-                    kappa*(3.*((rc[k]*kphi)**2) - l_sqr)/(l_sqr**2.5))
-    result *= scale
-    return result
+def gy(radii, rc, coslatc, cospsi, kphi, sinlon, l_sqr):
+    return rc*coslatc*sinlon/(l_sqr**1.5)
 
-def gxy(tesseroid, lons, lats, radii, nodes, weights):
-    """
-    Integrate gxy using the Gauss-Legendre Quadrature
-    """
-    order = len(nodes)
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
-    # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        sinlon = numpy.sin(lonc[i] - lons)
-        for j in xrange(order):
-            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-            for k in xrange(order):
-                l_sqr = (radii_sqr + rc[k]**2 -
-                         2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                kappa = (rc[k]**2)*coslatc[j]
-                result += (weights[i]*weights[j]*weights[k]*
-                    kappa*3.*(rc[k]**2)*kphi*coslatc[j]*sinlon/(l_sqr**2.5))
-    result *= scale
-    return result
+def gz(radii, rc, coslatc, cospsi, kphi, sinlon, l_sqr):
+    return (rc*cospsi - radii)/(l_sqr**1.5)
 
-def gxz(tesseroid, lons, lats, radii, nodes, weights):
-    """
-    Integrate gxz using the Gauss-Legendre Quadrature
-    """
-    order = len(nodes)
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
-    # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        for j in xrange(order):
-            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-            for k in xrange(order):
-                l_sqr = (radii_sqr + rc[k]**2 -
-                         2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                kappa = (rc[k]**2)*coslatc[j]
-                result += (weights[i]*weights[j]*weights[k]*
-                    kappa*3.*rc[k]*kphi*(rc[k]*cospsi - radii)/(l_sqr**2.5))
-    result *= scale
-    return result
+def gxx(radii, rc, coslatc, cospsi, kphi, sinlon, l_sqr):
+    return (3.*((rc*kphi)**2) - l_sqr)/(l_sqr**2.5)
 
-def gyy(tesseroid, lons, lats, radii, nodes, weights):
-    """
-    Integrate gyy using the Gauss-Legendre Quadrature
-    """
-    order = len(nodes)
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
-    # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        sinlon = numpy.sin(lonc[i] - lons)
-        for j in xrange(order):
-            for k in xrange(order):
-                l_sqr = (radii_sqr + rc[k]**2 -
-                         2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                kappa = (rc[k]**2)*coslatc[j]
-                deltay = rc[k]*coslatc[j]*sinlon
-                result += (weights[i]*weights[j]*weights[k]*
-                    kappa*(3.*(deltay**2) - l_sqr)/(l_sqr**2.5))
-    result *= scale
-    return result
+def gxy(radii, rc, coslatc, cospsi, kphi, sinlon, l_sqr):
+    return 3.*(rc**2)*kphi*coslatc*sinlon/(l_sqr**2.5)
 
-def gyz(tesseroid, lons, lats, radii, nodes, weights):
-    """
-    Integrate gyz using the Gauss-Legendre Quadrature
-    """
-    order = len(nodes)
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
-    # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        sinlon = numpy.sin(lonc[i]- lons)
-        for j in xrange(order):
-            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in xrange(order):
-                l_sqr = (radii_sqr + rc[k]**2 -
-                         2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                kappa = (rc[k]**2)*coslatc[j]
-                deltay = rc[k]*coslatc[j]*sinlon
-                deltaz = rc[k]*cospsi - radii
-                result += (weights[i]*weights[j]*weights[k]*
-                    kappa*3.*deltay*deltaz/(l_sqr**2.5))
-    result *= scale
-    return result
+def gxz(radii, rc, coslatc, cospsi, kphi, sinlon, l_sqr):
+    return 3.*rc*kphi*(rc*cospsi - radii)/(l_sqr**2.5)
 
-def gzz(tesseroid, lons, lats, radii, nodes, weights):
-    """
-    Integrate gzz using the Gauss-Legendre Quadrature
-    """
-    order = len(nodes)
-    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
-    # Pre-compute sines, cossines and powers
-    sinlatc = numpy.sin(latc)
-    coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
-    # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        for j in xrange(order):
-            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in xrange(order):
-                l_sqr = (radii_sqr + rc[k]**2 -
-                         2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
-                kappa = (rc[k]**2)*coslatc[j]
-                deltaz = rc[k]*cospsi - radii
-                result += weights[i]*weights[j]*weights[k]*kappa*(
-                    3.*deltaz**2 - l_sqr)/(l_sqr**2.5)
-    result *= scale
-    return result
+def gyy(radii, rc, coslatc, cospsi, kphi, sinlon, l_sqr):
+    deltay = rc*coslatc*sinlon
+    return (3.*(deltay**2) - l_sqr)/(l_sqr**2.5)
+
+def gyz(radii, rc, coslatc, cospsi, kphi, sinlon, l_sqr):
+    deltay = rc*coslatc*sinlon
+    deltaz = rc*cospsi - radii
+    return 3.*deltay*deltaz/(l_sqr**2.5)
+
+def gzz(radii, rc, coslatc, cospsi, kphi, sinlon, l_sqr):
+    deltaz = rc*cospsi - radii
+    return (3.*deltaz**2 - l_sqr)/(l_sqr**2.5)
+
+_kernels = {'potential':potential, 'gx':gx, 'gy':gy, 'gz':gz, 'gxx':gxx,
+            'gxy':gxy, 'gxz':gxz, 'gyy':gyy, 'gyz':gyz, 'gzz':gzz}
@@ -59,15 +59,15 @@ algorithm::
     >>> for p, residuals in iterator:
     ...     print '%.4f, %.4f' % (p[0], p[1])
     70000.0000, 2000.0000
-    69999.8803, 2005.4746
-    69998.6825, 2059.0979
-    69986.4671, 2502.6963
-    69843.9902, 3960.5022
-    67972.7679, 4728.4970
-    59022.3186, 4820.1359
-    50714.4178, 4952.5628
-    50001.0118, 4999.4345
-    50000.0006, 4999.9999
+    69999.8805, 2005.4746
+    69998.6827, 2059.0983
+    69986.4673, 2502.6979
+    69843.9846, 3960.4867
+    67972.7056, 4728.4794
+    59022.1665, 4820.1356
+    50714.3178, 4952.5702
+    50001.0108, 4999.4349
+    49999.9996, 4999.9998
 
 **Trapezoidal basin**
 
@@ -117,14 +117,14 @@ algorithm::
     >>> for p, residuals in iterator:
     ...     print '%.4f, %.4f' % (p[0], p[1])
     1000.0000, 500.0000
-    1010.4375, 509.4191
-    1111.6975, 600.5546
-    1888.0846, 1281.9163
-    3926.6071, 2780.5317
-    4903.8174, 3040.3444
-    4998.6977, 3001.0087
-    4999.9980, 3000.0017
-    5000.0000, 2999.9999
+    1010.4376, 509.4192
+    1111.6983, 600.5553
+    1888.0889, 1281.9188
+    3926.6033, 2780.5231
+    4903.8065, 3040.3463
+    4998.6954, 3001.0103
+    4999.9981, 3000.0018
+    5000.0001, 3000.0001
 
 ----
 
@@ -150,7 +150,8 @@ class TriangularGzDM(inversion.datamodule.DataModule):
     information.
 
     The forward modeling is done using :mod:`~fatiando.gravmag.talwani`.
-    Derivatives are calculated using a 2-point finite difference approximation.
+    Derivatives are calculated analytically using
+    :func:`~fatiando.gravmag.talwani.gz_vertex_derivatives`.
     The Hessian matrix is calculated using a Gauss-Newton approximation.
 
     Parameters:
@@ -170,8 +171,6 @@ class TriangularGzDM(inversion.datamodule.DataModule):
 
     * density : float
         Density contrast of the basin
-    * delta : float
-        Interval used to calculate the approximate derivatives
 
     .. warning:: It is very important that the vertices in the list be ordered
         clockwise! Otherwise the forward model will give results with an
@@ -179,7 +178,7 @@ class TriangularGzDM(inversion.datamodule.DataModule):
 
     """
 
-    def __init__(self, xp, zp, data, verts, density, delta=1.):
+    def __init__(self, xp, zp, data, verts, density):
         inversion.datamodule.DataModule.__init__(self, data)
         if len(xp) != len(zp) != len(data):
             raise ValueError, "xp, zp, and data must be of same length"
@@ -189,7 +188,6 @@ class TriangularGzDM(inversion.datamodule.DataModule):
         self.zp = numpy.array(zp, dtype=numpy.float64)
         self.prop = {'density':density}
         self.verts = list(verts)
-        self.delta = delta
 
     def get_predicted(self, p):
         polygon = Polygon(self.verts + [p], self.prop)
@@ -197,12 +195,8 @@ class TriangularGzDM(inversion.datamodule.DataModule):
 
     def sum_gradient(self, gradient, p, residuals):
         polygon = Polygon(self.verts + [p], self.prop)
-        at_p = talwani.gz(self.xp, self.zp, [polygon])
-        polygon = Polygon(self.verts + [[p[0] + self.delta, p[1]]], self.prop)
-        jacx = (talwani.gz(self.xp, self.zp, [polygon]) - at_p)/self.delta
-        polygon = Polygon(self.verts + [[p[0], p[1] + self.delta]], self.prop)
-        jacz = (talwani.gz(self.xp, self.zp, [polygon]) - at_p)/self.delta
-        self.jac_T = numpy.array([jacx, jacz])
+        dx, dz = talwani.gz_vertex_derivatives(self.xp, self.zp, polygon)
+        self.jac_T = numpy.array([dx[2], dz[2]])
         return gradient - 2.*numpy.dot(self.jac_T, residuals)
 
     def sum_hessian(self, hessian, p):
@@ -268,7 +262,8 @@ class TrapezoidalGzDM(inversion.datamodule.DataModule):
     Packs the necessary data and interpretative model information.
 
     The forward modeling is done using :mod:`~fatiando.gravmag.talwani`.
-    Derivatives are calculated using a 2-point finite difference approximation.
+    Derivatives are calculated analytically using
+    :func:`~fatiando.gravmag.talwani.gz_vertex_derivatives`.
     The Hessian matrix is calculated using a Gauss-Newton approximation.
 
     Parameters:
@@ -288,8 +283,6 @@ class TrapezoidalGzDM(inversion.datamodule.DataModule):
 
     * density : float
         Density contrast of the basin
-    * delta : float
-        Interval used to calculate the approximate derivatives
 
     .. warning:: It is very important that the vertices in the list be ordered
         clockwise! Otherwise the forward model will give results with an
@@ -299,7 +292,7 @@ class TrapezoidalGzDM(inversion.datamodule.DataModule):
 
     field = "gz"
 
-    def __init__(self, xp, zp, data, verts, density, delta=1.):
+    def __init__(self, xp, zp, data, verts, density):
         inversion.datamodule.DataModule.__init__(self, data)
         if len(xp) != len(zp) != len(data):
             raise ValueError, "xp, zp, and data must be of same length"
@@ -309,7 +302,6 @@ class TrapezoidalGzDM(inversion.datamodule.DataModule):
         self.zp = numpy.array(zp, dtype=numpy.float64)
         self.prop = {'density':density}
         self.verts = list(verts)
-        self.delta = delta
         self.xs = [x for x in reversed(numpy.array(verts).T[0])]
 
     def get_predicted(self, p):
@@ -321,14 +313,9 @@ class TrapezoidalGzDM(inversion.datamodule.DataModule):
     def sum_gradient(self, gradient, p, residuals):
         x1, x2 = self.verts[1][0], self.verts[0][0]
         z1, z2 = p
-        delta = self.delta
         polygon = Polygon(self.verts + [[x1, z1], [x2, z2]], self.prop)
-        at_p = talwani.gz(self.xp, self.zp, [polygon])
-        polygon = Polygon(self.verts + [[x1, z1 + delta], [x2, z2]], self.prop)
-        jacz1 = (talwani.gz(self.xp, self.zp, [polygon]) - at_p)/delta
-        polygon = Polygon(self.verts + [[x1, z1], [x2, z2 + delta]], self.prop)
-        jacz2 = (talwani.gz(self.xp, self.zp, [polygon]) - at_p)/delta
-        self.jac_T = numpy.array([jacz1, jacz2])
+        dx, dz = talwani.gz_vertex_derivatives(self.xp, self.zp, polygon)
+        self.jac_T = numpy.array([dz[2], dz[3]])
         return gradient - 2.*numpy.dot(self.jac_T, residuals)
 
     def sum_hessian(self, hessian, p):
@@ -55,6 +55,7 @@ import numpy
 from fatiando.mesher import PrismMesh
 from fatiando.gravmag import fourier
 from fatiando.gravmag import prism as pot_prism
+from fatiando.gravmag import sensitivity
 from fatiando.constants import G
 from fatiando import utils
 import fatiando.logger
@@ -121,9 +122,8 @@ def migrate(x, y, z, gz, zmin, zmax, meshshape, power=0.5, scale=1):
     weights = numpy.abs(depths)**power/(2*G*numpy.sqrt(numpy.pi))
     density = []
     for l in xrange(nlayers):
-        sensibility_T = numpy.array(
-            [pot_prism.gz(x, y, z, [p], dens=1) for p in mesh.get_layer(l)])
-        density.extend(scale*weights[l]*numpy.dot(sensibility_T, gz))
+        sens = sensitivity.matrix(x, y, z, mesh.get_layer(l), pot_prism.gz)
+        density.extend(scale*weights[l]*numpy.dot(sens.T, gz))
     tend = time.clock()
     log.info("  total time for imaging: %s" % (utils.sec2hms(tend - tstart)))
     mesh.addprop('density', numpy.array(density))
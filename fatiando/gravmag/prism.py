@@ -1,26 +1,126 @@
-"""
+r"""
 Calculate the potential fields of the 3D right rectangular prism.
 
 **Gravity**
 
 The gravitational fields are calculated using the forumla of Nagy et al. (2000)
 
-* :func:`~fatiando.gravmag._prism.potential`
-* :func:`~fatiando.gravmag._prism.gx`
-* :func:`~fatiando.gravmag._prism.gy`
-* :func:`~fatiando.gravmag._prism.gz`
-* :func:`~fatiando.gravmag._prism.gxx`
-* :func:`~fatiando.gravmag._prism.gxy`
-* :func:`~fatiando.gravmag._prism.gxz`
-* :func:`~fatiando.gravmag._prism.gyy`
-* :func:`~fatiando.gravmag._prism.gyz`
-* :func:`~fatiando.gravmag._prism.gzz`
+* :func:`~fatiando.gravmag.prism.potential`
+* :func:`~fatiando.gravmag.prism.gx`
+* :func:`~fatiando.gravmag.prism.gy`
+* :func:`~fatiando.gravmag.prism.gz`
+* :func:`~fatiando.gravmag.prism.gxx`
+* :func:`~fatiando.gravmag.prism.gxy`
+* :func:`~fatiando.gravmag.prism.gxz`
+* :func:`~fatiando.gravmag.prism.gyy`
+* :func:`~fatiando.gravmag.prism.gyz`
+* :func:`~fatiando.gravmag.prism.gzz`
+
+Use :func:`~fatiando.gravmag.prism.fields` to calculate several of these at
+once, sharing the computations done on the prism corners.
+
+**Regular grids**
+
+* :func:`~fatiando.gravmag.prism.fields_grid`: Fast forward modeling of a
+  :class:`~fatiando.mesher.PrismMesh` on a regular grid using the FFT
 
 **Magnetic**
 
 The Total Field anomaly is calculated using the formula of Bhattacharyya (1964).
 
-* :func:`~fatiando.gravmag._prism.tf`
+* :func:`~fatiando.gravmag.prism.tf`
+* :func:`~fatiando.gravmag.prism.tf_batch`: The total-field anomaly for many
+  regional field directions (or magnetization vectors) at once. The magnetic
+  field of the prisms is calculated only once and projected on each direction.
+
+**Regular meshes**
+
+Neighboring prisms of a :class:`~fatiando.mesher.PrismMesh` share their
+corners. When given a mesh, all functions evaluate the kernels only once on each
+node of the mesh, instead of 8 times per prism, and combine the physical
+properties of the prisms around each node. For meshes with many prisms this is
+several times faster. The results differ from evaluating the prisms one by one
+only by round-off.
+
+**Far-field approximation**
+
+The gravity functions take an optional *ratio* argument. If it is not None,
+prisms whose center is farther than *ratio* times their diagonal :math:`d`
+from a computation point are replaced by a point mass with the same mass
+:math:`M` at their center. Because the prism is symmetric about its center, the
+first term left out is the quadrupole and, for ``ratio >= 1``, the error of
+each prism at distance :math:`r` is bounded by
+
+.. math::
+
+    |\epsilon| \le \frac{C}{ratio^2} \frac{G |M|}{r^{n + 1}}
+
+where :math:`n` is the order of the derivative (0 for the potential, 1 for
+gravity and 2 for the gradient tensor), :math:`C = 0.1` for the potential,
+:math:`C = 0.35` for gravity and :math:`C = 1.6` for the gradient tensor.
+As *ratio* increases, *C* goes to 1/12, 1/4 and 1, respectively.
+
+The approximation is much faster for regional models in which most
+prism-point pairs are far apart. A ratio of 5 usually gives relative
+errors smaller than :math:`10^{-6}`. With *ratio*, a
+:class:`~fatiando.mesher.PrismMesh` is evaluated prism by prism instead of on
+its nodes.
+
+**Single precision**
+
+The gravity functions, :func:`~fatiando.gravmag.prism.tf`, and
+:func:`~fatiando.gravmag.prism.fields` take a *precision* argument. With
+``precision='float32'`` they return single precision arrays, which halves the
+memory of the results (e.g., when building large sensitivity matrices with
+:mod:`~fatiando.gravmag.sensitivity`).
+
+The ``'numpy'`` backend then evaluates the kernels in single precision, with
+some guards against the loss of accuracy:
+
+* The coordinates of the corners relative to the computation points are
+  calculated in double precision. Large coordinates, like UTM, can't be
+  subtracted in single precision.
+* The sums over the corners and over the prisms are done in double precision.
+* The alternating sum over the corners of a prism cancels most of the value of
+  the kernels when the computation point is far from the prism. The round-off
+  of the kernels is amplified by about the cube of the distance (in
+  diagonals of the prism). So prism-point pairs farther than 2 diagonals are
+  evaluated in double precision. Without this, the error of the potential 20
+  km away from a 5 km wide model is about 25%.
+* A :class:`~fatiando.mesher.PrismMesh` (without *ratio*) is evaluated on its
+  nodes in double precision. The sum over the nodes cancels like the sum over
+  the corners.
+
+With these, the maximum error relative to the maximum of the double precision
+result is about :math:`3 \times 10^{-5}` for the potential and gravity,
+:math:`10^{-5}` for the gravity gradient tensor, and :math:`2 \times 10^{-6}`
+for the total-field anomaly in a survey 100 m above a 5 x 5 x 2 km model. The
+errors of the far-field approximation (*ratio*) are much larger. The other
+backends do all calculations in double precision and only convert the result.
+
+**Backends**
+
+There are several implementations of the functions above: ``'numpy'`` (pure
+Python + Numpy), ``'numexpr'`` (if numexpr is installed), and ``'cython'`` (if
+the Cython extension was compiled). By default, the Cython version is used if
+available. Choose another one with:
+
+* :func:`~fatiando.gravmag.prism.set_backend`: Set the backend used by all
+  functions. Can also be set with the environment variable
+  ``FATIANDO_PRISM_BACKEND``.
+* The *backend* argument of each function: Use a backend only for that call.
+* :func:`~fatiando.gravmag.prism.autotune`: Benchmark the backends on this
+  machine and store the fastest for each function and problem size. Used when
+  the backend is ``'auto'``.
+* :func:`~fatiando.gravmag.prism.register_backend`: Add a new backend
+* :func:`~fatiando.gravmag.prism.available_backends`: List the backends that
+  can be used
+
+The numexpr backend doesn't have :func:`~fatiando.gravmag.prism.fields`,
+:func:`~fatiando.gravmag.prism.tf_batch`, or the *ratio* and *precision*
+arguments. Using a backend with a function or argument that it doesn't have
+raises a ``ValueError``. The ``'auto'`` backend only chooses among the backends
+that have the function and accept all arguments given.
 
 **References**
 
@@ -34,8 +134,534 @@ doi: 10.1007/s001900000116.
 ----
 
 """
-from fatiando.gravmag._prism import *
+import os
+import json
+import time
+import inspect
+
+import numpy
+
+from fatiando.mesher import PrismMesh, PrismArray, Prism, prisms2array
+from fatiando import gridder
+from fatiando.gravmag import _prism
+from fatiando.gravmag._prism import _mesh_values, _fields_components
+
+#: Name of the environment variable that sets the default backend
+BACKEND_ENV = 'FATIANDO_PRISM_BACKEND'
+#: File where :func:`~fatiando.gravmag.prism.autotune` stores the fastest
+#: backends
+config_file = os.path.join(os.path.expanduser('~'), '.fatiando',
+                           'prism_backends.json')
+
+_backends = {}
+# The backend set by set_backend. None means use the default.
+_backend = None
+# Winners of the auto-tuning. Loaded from config_file when first needed.
+_tuned = None
+# Largest number of prism-point pairs used in the auto-tuning benchmarks.
+# Larger problems are all benchmarked with this size and share the winner.
+_tune_maxpairs = 2**18
+
+
+def register_backend(name, module):
+    """
+    Add an implementation of the forward modeling functions.
+
+    Parameters:
+
+    * name : str
+        The name of the backend, used to select it (e.g.,
+        ``set_backend(name)``).
+    * module : module or object
+        Must have functions with the same names and arguments as the ones in
+        this module (e.g., ``module.gz(xp, yp, zp, prisms, dens=None)``). It
+        doesn't need to have all of them or all of their optional arguments.
+        Compiled functions (that can't be inspected) are assumed to take all
+        optional arguments.
+
+    """
+    _backends[name] = module
+
+def available_backends():
+    """
+    Get the names of the backends that can be used.
+
+    Returns:
+
+    * names : list of str
+
+    """
+    return sorted(_backends)
+
+def set_backend(name):
+    """
+    Set the implementation used by all functions of this module.
+
+    Parameters:
+
+    * name : str or None
+        The name of a backend (see
+        :func:`~fatiando.gravmag.prism.available_backends`), ``'auto'`` to use
+        the fastest backend for each function and problem size (see
+        :func:`~fatiando.gravmag.prism.autotune`), or None to go back to the
+        default (the value of the environment variable
+        ``FATIANDO_PRISM_BACKEND`` or the fastest compiled backend).
+
+    """
+    global _backend
+    if name is not None and name != 'auto' and name not in _backends:
+        raise ValueError("Invalid backend '%s'. Available: %s"
+                         % (name, ', '.join(available_backends())))
+    _backend = name
+
+def get_backend(name=None):
+    """
+    Get the name of the backend that will be used.
+
+    Parameters:
+
+    * name : str or None
+        If not None, will return it (after checking that it is valid).
+        Otherwise, return the backend set with
+        :func:`~fatiando.gravmag.prism.set_backend`, or the default.
+
+    Returns:
+
+    * name : str
+        The name of the backend or ``'auto'``.
+
+    """
+    if name is None:
+        name = _backend
+    if name is None:
+        name = os.environ.get(BACKEND_ENV, None)
+    if name is None:
+        name = _default_backend()
+    if name != 'auto' and name not in _backends:
+        raise ValueError("Invalid backend '%s'. Available: %s"
+                         % (name, ', '.join(available_backends())))
+    return name
+
+def _default_backend():
+    return 'cython' if 'cython' in _backends else 'numpy'
+
+def autotune(function='gz', npoints=1000, nprisms=1000, mesh=False, repeat=3,
+             save=True, options=None):
+    """
+    Find the fastest backend for a function and problem size.
+
+    Runs a small benchmark with each backend that implements *function*. The
+    winner is stored in ``config_file`` and used when the backend is
+    ``'auto'``. The problem sizes are grouped in powers of 4 of the number of
+    prism-point pairs. The benchmark has the same number of pairs as the
+    problem, up to 2**18 pairs (the number of points or prisms, whichever is
+    larger, is reduced). All larger problems share the same winner.
+
+    Parameters:
+
+    * function : str
+        The name of the function, e.g. ``'gz'`` or ``'tf'``
+    * npoints, nprisms : int
+        The size of the problem
+    * mesh : True or False
+        If True, benchmark on a :class:`~fatiando.mesher.PrismMesh` instead of
+        a list of prisms.
+    * repeat : int
+        Number of times each backend is run. The best time is used.
+    * save : True or False
+        If True, will store the winner in ``config_file``.
+    * options : dict or None
+        Optional arguments of *function* (e.g., ``{'precision':'float32'}``)
+        that the backends must accept. Backends that don't are left out. The
+        arguments that are numbers, strings, lists of strings, or None are
+        passed on to the benchmark (others, like arrays that depend on the
+        number of prisms, are not). The winner is stored separately for each
+        set of argument names and string or integer values.
+
+    Returns:
+
+    * name : str
+        The name of the fastest backend
+
+    """
+    options = dict(options or {})
+    names = sorted(options)
+    candidates = [b for b in available_backends()
+                  if _missing(b, function, names) == []]
+    if not candidates:
+        raise ValueError("No backend implements '%s' with arguments %s"
+                         % (function, ', '.join(names) or '(none)'))
+    kwargs = dict((k, v) for k, v in options.items() if _replayable(v))
+    n, m = _tune_size(npoints, nprisms)
+    xp, yp = [i.ravel() for i in numpy.meshgrid(numpy.linspace(-1, 2, n),
+                                                numpy.zeros(1))]
+    zp = -numpy.ones(n)
+    side = max(1, int(round(m**(1./3))))
+    if mesh:
+        prisms = PrismMesh((0, 1, 0, 1, 0, 1), (side, side, side))
+        prisms.addprop('density', numpy.ones(prisms.size))
+        prisms.addprop('magnetization', numpy.ones(prisms.size))
+    else:
+        corners = numpy.linspace(0, 1, m + 1)
+        prisms = [Prism(x1, x2, 0, 1, 0, 1,
+                        {'density':1., 'magnetization':1.})
+                  for x1, x2 in zip(corners[:-1], corners[1:])]
+    if function == 'tf':
+        args = (30, -15)
+    elif function == 'tf_batch':
+        args = (numpy.array([30., 60.]), numpy.array([-15., 10.]))
+    else:
+        args = ()
+    times = []
+    for name in candidates:
+        func = getattr(_backends[name], function)
+        best = None
+        for i in xrange(repeat):
+            start = time.time()
+            func(xp, yp, zp, prisms, *args, **kwargs)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        times.append(best)
+    winner = candidates[numpy.argmin(times)]
+    tuned = _load_tuned()
+    tuned[_tune_key(function, npoints, nprisms, mesh, options)] = winner
+    if save:
+        _save_tuned(tuned)
+    return winner
+
+def _tune_size(npoints, nprisms):
+    """
+    The number of points and prisms in the auto-tuning benchmark of a problem.
+    """
+    n, m = max(1, npoints), max(1, nprisms)
+    while n*m > _tune_maxpairs:
+        if n >= m:
+            n = -(-n//2)
+        else:
+            m = -(-m//2)
+    return n, m
+
+def _replayable(value):
+    """
+    Check if an optional argument can be passed on to the auto-tuning
+    benchmark (i.e., it doesn't depend on the size of the problem).
+    """
+    if isinstance(value, (list, tuple)):
+        return all(isinstance(v, basestring) for v in value)
+    return value is None or isinstance(value, (basestring, int, long, float))
+
+def _tune_key(function, npoints, nprisms, mesh, options=None):
+    """
+    The key of a function, problem size and optional arguments in the
+    auto-tuning config. Sizes larger than the benchmarks share a key.
+    """
+    pairs = min(_tune_maxpairs, max(1, npoints*nprisms))
+    kind = 'mesh' if mesh else 'prisms'
+    key = '%s:%s:%d' % (function, kind, int(numpy.log2(pairs))//2)
+    if options:
+        options = dict(options)
+        parts = []
+        for name in sorted(options):
+            value = options[name]
+            if isinstance(value, (basestring, int, long)):
+                parts.append('%s=%s' % (name, value))
+            else:
+                parts.append(name)
+        key = ':'.join([key, ','.join(parts)])
+    return key
+
+def _load_tuned():
+    global _tuned
+    if _tuned is None:
+        _tuned = {}
+        if os.path.exists(config_file):
+            try:
+                with open(config_file) as f:
+                    _tuned = json.load(f)
+            except ValueError:
+                pass
+    return _tuned
+
+def _save_tuned(tuned):
+    directory = os.path.dirname(config_file)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp = config_file + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(tuned, f, indent=2, sort_keys=True)
+    os.rename(tmp, config_file)
+
+def _arguments(module, function):
+    """
+    Get the names of the arguments of *function* in a backend.
+
+    Compiled functions that can't be inspected are assumed to take the same
+    arguments as the ones of the numpy backend.
+    """
+    try:
+        return inspect.getargspec(getattr(module, function)).args
+    except TypeError:
+        return inspect.getargspec(getattr(_prism, function)).args
+
+def _missing(name, function, options):
+    """
+    Get the *options* (names of optional arguments) of *function* that backend
+    *name* doesn't accept. Returns None if it doesn't implement *function*.
+    """
+    module = _backends[name]
+    if not hasattr(module, function):
+        return None
+    accepted = _arguments(module, function)
+    return [o for o in options if o not in accepted]
+
+def _keywords(function, args, kwargs):
+    """
+    Pass the optional arguments of *function* given by position as keyword
+    arguments (named as in the numpy backend). Backends don't need to have
+    all optional arguments, so their positions can differ.
+    """
+    spec = inspect.getargspec(getattr(_prism, function))
+    required = len(spec.args) - len(spec.defaults or ()) - 4
+    names = spec.args[4 + required:]
+    if len(args) > required + len(names):
+        raise TypeError("%s() takes at most %d arguments (%d given)"
+                        % (function, len(spec.args), len(args) + 4))
+    kwargs = dict(kwargs)
+    for name, value in zip(names, args[required:]):
+        if name in kwargs:
+            raise TypeError("%s() got multiple values for keyword argument "
+                            "'%s'" % (function, name))
+        kwargs[name] = value
+    return args[:required], kwargs
+
+def _select(function, backend, xp, prisms, options=None):
+    """
+    Get the module that will run *function* with the given *options* (dict
+    of optional arguments).
+    """
+    options = dict(options or {})
+    names = sorted(options)
+    name = get_backend(backend)
+    if name == 'auto':
+        npoints, nprisms = numpy.size(xp), len(prisms)
+        mesh = isinstance(prisms, PrismMesh)
+        name = _load_tuned().get(_tune_key(function, npoints, nprisms, mesh,
+                                           options))
+        if name not in _backends or _missing(name, function, names) != []:
+            name = autotune(function, npoints, nprisms, mesh,
+                            options=options)
+    missing = _missing(name, function, names)
+    if missing is None:
+        raise ValueError("Backend '%s' doesn't implement '%s'"
+                         % (name, function))
+    if missing:
+        raise ValueError("Backend '%s' doesn't support the argument '%s' of "
+                         "'%s'" % (name, missing[0], function))
+    return _backends[name]
+
+def _dispatcher(function):
+    """
+    Make a function that calls *function* from the selected backend.
+    """
+    def dispatch(xp, yp, zp, prisms, *args, **kwargs):
+        backend = kwargs.pop('backend', None)
+        args, kwargs = _keywords(function, args, kwargs)
+        module = _select(function, backend, xp, prisms, kwargs)
+        return getattr(module, function)(xp, yp, zp, prisms, *args, **kwargs)
+    dispatch.__name__ = function
+    dispatch.__doc__ = getattr(_prism, function).__doc__.replace(
+        "\n\n    Returns:", "\n" + _backend_doc + "\n    Returns:", 1)
+    return dispatch
+
+def _columns(field, xp, yp, zp, cells, prop, kwargs):
+    """
+    Calculate the sensitivity matrix columns of *cells* (prisms) for *field*
+    with a single call of the array kernels of the backend.
+
+    Used by :func:`fatiando.gravmag.sensitivity.matrix`. The columns are the
+    same as calling *field* with each prism alone and *prop* set to 1.
+
+    Returns None if *field* isn't a function of this module or the backend
+    can't calculate the columns with these arguments.
+    """
+    function = getattr(field, '__name__', None)
+    if globals().get(function) is not field:
+        return None
+    options = set(kwargs).difference(['backend', 'njobs'])
+    if function in _fields_components and prop == 'density':
+        if not options.issubset(['ratio']):
+            return None
+    elif function == 'tf' and prop == 'magnetization':
+        if not options.issuperset(['inc', 'dec']) or \
+           not options.issubset(['inc', 'dec', 'pinc', 'pdec']):
+            return None
+    else:
+        return None
+    name = get_backend(kwargs.get('backend'))
+    if name == 'auto':
+        name = _default_backend()
+    module = _backends[name]
+    if not hasattr(module, '_columns'):
+        return None
+    # Copy so that the physical properties of the cells aren't changed
+    array = prisms2array(cells)
+    array = PrismArray(*array.get_bounds(), props=array.props)
+    array.addprop(prop, numpy.ones(array.size))
+    args = dict((k, kwargs[k]) for k in kwargs if k != 'backend')
+    if function == 'tf':
+        return module._columns_tf(xp, yp, zp, array, **args)
+    return module._columns(function, xp, yp, zp, array, **args)
+
+_backend_doc = """\
+    * backend : str or None
+        The implementation to use, e.g. ``'numpy'``, ``'numexpr'``,
+        ``'cython'``, or ``'auto'`` (see
+        :func:`~fatiando.gravmag.prism.set_backend`). If None, will use the
+        one set by :func:`~fatiando.gravmag.prism.set_backend`. Not all
+        backends accept all arguments (e.g., *ratio*). A ``ValueError`` is
+        raised if the backend doesn't.
+"""
+
+register_backend('numpy', _prism)
 try:
-    from fatiando.gravmag._cprism import *
+    from fatiando.gravmag import _neprism
+    register_backend('numexpr', _neprism)
 except ImportError:
     pass
+try:
+    from fatiando.gravmag import _cprism
+    register_backend('cython', _cprism)
+except ImportError:
+    pass
+
+potential = _dispatcher('potential')
+gx = _dispatcher('gx')
+gy = _dispatcher('gy')
+gz = _dispatcher('gz')
+gxx = _dispatcher('gxx')
+gxy = _dispatcher('gxy')
+gxz = _dispatcher('gxz')
+gyy = _dispatcher('gyy')
+gyz = _dispatcher('gyz')
+gzz = _dispatcher('gzz')
+tf = _dispatcher('tf')
+tf_batch = _dispatcher('tf_batch')
+fields = _dispatcher('fields')
+
+
+def fields_grid(area, shape, z, mesh, components=None, dens=None, njobs=1):
+    """
+    Calculate the gravitational fields of a regular mesh on a regular grid.
+
+    If the spacing of the grid is equal to the horizontal dimensions of the
+    prisms, the effect of a layer of the mesh on the grid is a 2D discrete
+    convolution of its densities with the effect of a single prism of the
+    layer. This function calculates the effect of one prism per layer directly
+    and does the convolutions using the FFT. This is much faster than
+    :func:`~fatiando.gravmag.prism.fields` for large meshes and grids. The
+    results are the same up to round-off.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> **DOWN**.
+
+    Parameters:
+
+    * area : list = [x1, x2, y1, y2]
+        Borders of the grid (see :func:`fatiando.gridder.regular`)
+    * shape : tuple = (ny, nx)
+        Shape of the grid
+    * z : float
+        The z coordinate (height) of the grid
+    * mesh : :class:`~fatiando.mesher.PrismMesh`
+        The density model. The grid spacing must be equal to the x and y
+        dimensions of its prisms. The mesh and the grid don't need to have the
+        same shape or area.
+    * components : list of str or None
+        The fields to calculate (see :func:`~fatiando.gravmag.prism.fields`).
+        If None, will calculate all of them.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms.
+    * njobs : int
+        Number of threads used to calculate the effect of the single prisms
+        (see :func:`~fatiando.gravmag.prism.fields`). Uses the backend set by
+        :func:`~fatiando.gravmag.prism.set_backend` if it has
+        :func:`~fatiando.gravmag.prism.fields` and the default otherwise.
+
+    Returns:
+
+    * res : dict
+        The fields calculated on the grid points, in the same order as
+        :func:`fatiando.gridder.regular`. The keys are the names of the
+        components.
+
+    Examples::
+
+        >>> import numpy
+        >>> from fatiando.mesher import PrismMesh
+        >>> from fatiando import gridder
+        >>> mesh = PrismMesh((0, 100, 0, 200, 0, 50), (2, 4, 2))
+        >>> mesh.addprop('density', numpy.arange(mesh.size, dtype=float))
+        >>> area, shape = (-50, 150, -50, 250), (7, 5)
+        >>> res = fields_grid(area, shape, -10, mesh, components=['gz'])
+        >>> xp, yp, zp = gridder.regular(area, shape, z=-10)
+        >>> direct = fields(xp, yp, zp, mesh.toarray(), components=['gz'])
+        >>> numpy.allclose(res['gz'], direct['gz'], rtol=0, atol=10**(-12))
+        True
+
+    """
+    if not isinstance(mesh, PrismMesh):
+        raise ValueError("mesh must be a PrismMesh")
+    ny, nx = shape
+    mz, my, mx = mesh.shape
+    dx, dy, dz = mesh.dims
+    gdy, gdx = gridder.spacing(area, shape)
+    if (abs(gdx - dx) > _spacing_tolerance*dx or
+        abs(gdy - dy) > _spacing_tolerance*dy):
+        raise ValueError(
+            "Grid spacing (%g, %g) must be equal to the prism dimensions "
+            % (gdx, gdy) + "(%g, %g)" % (dx, dy))
+    if components is None:
+        components = _fields_components
+    components = list(components)
+    x1, x2, y1, y2, z1, z2 = mesh.bounds
+    density = numpy.reshape(_mesh_values(mesh, 'density', dens), mesh.shape)
+    # Place the computation points so that they cover all the offsets between
+    # the grid points and the prisms of a layer. Use the first prism of each
+    # layer as the reference
+    lx, ly = nx + mx - 1, ny + my - 1
+    xs = area[0] + dx*numpy.arange(-(mx - 1), nx)
+    ys = area[2] + dy*numpy.arange(-(my - 1), ny)
+    xp, yp = [i.ravel() for i in numpy.meshgrid(xs, ys)]
+    zp = z*numpy.ones_like(xp)
+    backend = get_backend()
+    if backend != 'auto' and _missing(backend, 'fields',
+                                      ['components', 'njobs']) != []:
+        backend = _default_backend()
+    spectra = dict((c, 0) for c in components)
+    for k in xrange(mz):
+        if not numpy.any(density[k]):
+            continue
+        top = z1 + dz*k
+        prism = PrismArray([x1], [x1 + dx], [y1], [y1 + dy], [top], [top + dz],
+                           props={'density':[1.]})
+        kernels = fields(xp, yp, zp, prism, components, njobs=njobs,
+                         backend=backend)
+        layer = numpy.fft.rfft2(density[k], s=(ly, lx))
+        for c in components:
+            kernel = numpy.reshape(kernels[c], (ly, lx))
+            spectra[c] = spectra[c] + layer*numpy.fft.rfft2(kernel)
+    res = {}
+    for c in components:
+        if numpy.isscalar(spectra[c]):
+            res[c] = numpy.zeros(nx*ny, dtype=numpy.float)
+            continue
+        # The circular convolution is only wrapped around on the offsets that
+        # don't correspond to grid points
+        conv = numpy.fft.irfft2(spectra[c], s=(ly, lx))
+        res[c] = conv[my - 1:, mx - 1:].ravel()
+    return res
+
+# Maximum relative difference between the grid spacing and prism dimensions
+_spacing_tolerance = 10**(-8)
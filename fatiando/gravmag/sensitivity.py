@@ -0,0 +1,386 @@
+"""
+Build the sensitivity (Jacobian) matrix of the forward modeling functions.
+
+The sensitivity matrix of a linear potential field problem has one row per
+computation point and one column per cell of the model. Element (i, j) is the
+effect that cell j would have on point i if it had a unit physical property.
+
+* :func:`~fatiando.gravmag.sensitivity.matrix`: Build the sensitivity matrix of
+  any forward modeling function, optionally directly into a
+  :class:`numpy.memmap`
+
+**Cache**
+
+Building the matrix is usually the most expensive part of an inversion. With
+``cache=True``, :func:`~fatiando.gravmag.sensitivity.matrix` stores each block
+of columns in a directory on disk and reuses it when the same block is needed
+again, even in a different Python session. Blocks are identified by a hash of
+the computation points, the forward modeling function and all of its arguments
+(including defaults), the settings of its module (e.g.,
+``tesseroid.max_depth``), the version of fatiando, and the geometry of the
+cells (everything except the physical property being inverted for). The least
+recently used blocks are deleted when the cache gets larger than
+``cache_maxsize`` bytes.
+
+* :func:`~fatiando.gravmag.sensitivity.cache_info`: The number of cache hits
+  and misses, and the size of the cache
+* :func:`~fatiando.gravmag.sensitivity.clear_cache`: Delete all blocks in the
+  cache
+
+The cache directory and maximum size can be changed through the variables
+``cache_dir`` and ``cache_maxsize`` of this module.
+
+The matrix is filled in blocks of columns so that only the final matrix (which
+can be on disk) and a single block have to fit in memory. The blocks of the
+functions of :mod:`~fatiando.gravmag.prism` (except
+:func:`~fatiando.gravmag.prism.tf_batch` and
+:func:`~fatiando.gravmag.prism.fields`) are calculated with a single call of
+the array kernels of the backend. Other functions are called once per cell.
+
+Works with all forward modeling functions that take the computation points and
+a list of cells, like the ones in :mod:`~fatiando.gravmag.prism`,
+:mod:`~fatiando.gravmag.tesseroid`, :mod:`~fatiando.gravmag.sphere`, and
+:mod:`~fatiando.gravmag.polyprism`.
+
+**Examples**
+
+Build the sensitivity matrix of the gravity anomaly of a prism mesh and use it
+to calculate the data of a density model:
+
+    >>> import numpy
+    >>> from fatiando.mesher import PrismMesh
+    >>> from fatiando.gravmag import prism
+    >>> from fatiando import gridder
+    >>> mesh = PrismMesh((0, 100, 0, 200, 0, 50), (2, 4, 2))
+    >>> xp, yp, zp = gridder.regular((-50, 150, -50, 250), (5, 5), z=-10)
+    >>> sens = matrix(xp, yp, zp, mesh, prism.gz)
+    >>> sens.shape
+    (25, 16)
+    >>> density = numpy.arange(mesh.size, dtype=float)
+    >>> mesh.addprop('density', density)
+    >>> numpy.allclose(numpy.dot(sens, density), prism.gz(xp, yp, zp, mesh))
+    True
+
+Use single precision and store the matrix in a file on disk:
+
+    >>> import tempfile
+    >>> tmp = tempfile.NamedTemporaryFile()
+    >>> out = numpy.memmap(tmp.name, dtype='float32', mode='w+',
+    ...                    shape=(len(xp), mesh.size))
+    >>> sens32 = matrix(xp, yp, zp, mesh, prism.gz, out=out)
+    >>> sens32 is out
+    True
+    >>> numpy.allclose(sens32, sens, rtol=10**(-6), atol=0)
+    True
+    >>> tmp.close()
+
+----
+
+"""
+import copy
+import os
+import sys
+import inspect
+import hashlib
+import tempfile
+
+import numpy
+
+import fatiando
+import fatiando.logger
+from fatiando.mesher import PrismMesh, PrismArray, prisms2array
+from fatiando.gravmag import prism, _prism
+
+log = fatiando.logger.dummy('fatiando.gravmag.sensitivity')
+
+#: Directory where the cached blocks of the sensitivity matrix are stored
+cache_dir = os.path.join(os.path.expanduser('~'), '.fatiando', 'sensitivity')
+#: Maximum size of the cache in bytes
+cache_maxsize = 2**30
+_cache_stats = {'hits':0, 'misses':0}
+# Part of the key of the cached blocks. Increase it when a forward modeling
+# function changes in a way that its arguments and settings don't show.
+_cache_version = 1
+
+
+def matrix(xp, yp, zp, model, field, prop='density', dtype=numpy.float,
+           out=None, blocksize=None, cache=False, **kwargs):
+    """
+    Build the sensitivity matrix of a forward modeling function.
+
+    Column j of the matrix is *field* calculated for ``model[j]`` with physical
+    property *prop* set to 1 (other properties of the cell, like inclination
+    and declination, are kept). Cells that are None (like masked prisms in a
+    :class:`~fatiando.mesher.PrismMesh`) have a column of zeros.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The coordinates of the computation points, in the format expected by
+        *field* (e.g., lons, lats, heights for tesseroids).
+    * model : list or mesh
+        The cells of the model. Can be any list of geometric elements or mesh
+        accepted by *field*.
+    * field : function
+        The forward modeling function, e.g., :func:`fatiando.gravmag.prism.gz`
+        or :func:`fatiando.gravmag.tesseroid.gzz`. Will be called as
+        ``field(xp, yp, zp, [cell], **kwargs)``, unless the columns can be
+        calculated with the array kernels of the prisms (the results are the
+        same).
+    * prop : str
+        The name of the physical property. Use, e.g., ``'magnetization'`` for
+        the total-field anomaly.
+    * dtype : numpy dtype
+        The type of the matrix. Use ``numpy.float32`` to halve the memory. The
+        columns are always calculated in double precision. Ignored if *out* is
+        given.
+    * out : 2D array or None
+        If not None, the matrix is stored in this array (e.g., a
+        :class:`numpy.memmap`). Must have shape ``(len(xp), len(model))``.
+    * blocksize : int or None
+        Number of columns calculated before copying them to the matrix. If
+        None, will choose a block of about 2**22 elements.
+    * cache : True or False
+        If True, will look for the blocks of the matrix in the cache (see
+        :func:`~fatiando.gravmag.sensitivity.cache_info`) before calculating
+        them and store the ones that were calculated.
+    * kwargs
+        Other arguments passed on to *field* (e.g., *inc* and *dec* for the
+        total-field anomaly).
+
+    Returns:
+
+    * sens : 2D array
+        The sensitivity matrix (*out* if it was given)
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    ndata, ncells = xp.size, len(model)
+    if out is None:
+        out = numpy.empty((ndata, ncells), dtype=dtype)
+    elif out.shape != (ndata, ncells):
+        raise ValueError("out must have shape %s" % (str((ndata, ncells))))
+    if blocksize is None:
+        blocksize = max(1, 2**22//max(1, ndata))
+    log.info("Building sensitivity matrix:")
+    log.info("  shape: %s" % (str(out.shape)))
+    log.info("  type: %s" % (str(out.dtype)))
+    log.info("  columns per block: %d" % (blocksize))
+    xp, yp, zp = [numpy.ravel(i) for i in [xp, yp, zp]]
+    if cache:
+        # Everything that is the same for all blocks
+        common = hashlib.sha1()
+        _fingerprint(common, [xp, yp, zp, _signature(field, prop, kwargs)])
+    array, offsets = _prism_array(model)
+    for start in xrange(0, ncells, blocksize):
+        stop = min(start + blocksize, ncells)
+        if array is None:
+            cells = [model[j] for j in xrange(start, stop)]
+            valid = [j for j, cell in enumerate(cells) if cell is not None]
+            prisms = [cells[j] for j in valid]
+        else:
+            # Slice the arrays of the prisms instead of creating one object
+            # per cell
+            cells = None
+            valid = numpy.flatnonzero(numpy.diff(offsets[start:stop + 1]))
+            prisms = array[offsets[start]:offsets[stop]]
+        if cache:
+            key = common.copy()
+            if array is None:
+                _fingerprint(key, [_geometry(cell, prop) for cell in cells])
+            else:
+                _fingerprint(key, [valid, _array_geometry(prisms, prop)])
+            fname = os.path.join(cache_dir, key.hexdigest() + '.npy')
+            block = _cache_load(fname)
+            if block is not None:
+                out[:, start:stop] = block
+                continue
+        block = numpy.zeros((ndata, stop - start), dtype=numpy.float)
+        columns = None
+        if len(valid) > 0:
+            columns = prism._columns(field, xp, yp, zp, prisms, prop, kwargs)
+        if columns is not None:
+            block[:, valid] = columns
+        else:
+            if cells is None:
+                cells = [model[j] for j in xrange(start, stop)]
+            for j in valid:
+                unit = copy.copy(cells[j])
+                unit.props = dict(cells[j].props)
+                unit.props[prop] = 1.
+                block[:, j] = field(xp, yp, zp, [unit], **kwargs)
+        if cache:
+            _cache_save(fname, block)
+        out[:, start:stop] = block
+    if hasattr(out, 'flush'):
+        out.flush()
+    return out
+
+def cache_info():
+    """
+    Get information about the cache of sensitivity matrix blocks.
+
+    Returns:
+
+    * info : dict
+        With keys ``'hits'`` and ``'misses'`` (number of blocks found and not
+        found in the cache since it was last cleared in this session),
+        ``'blocks'`` (number of blocks stored), ``'size'`` (size of the
+        cache in bytes), ``'maxsize'``, and ``'dir'``.
+
+    """
+    files = _cache_files()
+    info = dict(_cache_stats)
+    info['blocks'] = len(files)
+    info['size'] = sum(os.path.getsize(f) for f in files)
+    info['maxsize'] = cache_maxsize
+    info['dir'] = cache_dir
+    return info
+
+def clear_cache():
+    """
+    Delete all blocks from the cache and reset the hit and miss counters.
+    """
+    for f in _cache_files():
+        os.remove(f)
+    _cache_stats['hits'] = 0
+    _cache_stats['misses'] = 0
+
+def _cache_files():
+    """
+    List the files of the cached blocks.
+    """
+    if not os.path.isdir(cache_dir):
+        return []
+    return [os.path.join(cache_dir, f) for f in os.listdir(cache_dir)
+            if f.endswith('.npy')]
+
+def _cache_load(fname):
+    """
+    Load a block from the cache. Returns None if it's not there.
+    """
+    try:
+        block = numpy.load(fname)
+    except (IOError, ValueError):
+        _cache_stats['misses'] += 1
+        return None
+    # Mark the block as recently used for the LRU eviction
+    os.utime(fname, None)
+    _cache_stats['hits'] += 1
+    return block
+
+def _cache_save(fname, block):
+    """
+    Store a block in the cache and evict the least recently used blocks if the
+    cache is too big.
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # Write to a temporary file and rename it so that other processes never
+    # read a half written block
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=cache_dir)
+    with os.fdopen(fd, 'wb') as f:
+        numpy.save(f, block)
+    os.rename(tmp, fname)
+    files = sorted(_cache_files(), key=os.path.getmtime)
+    size = sum(os.path.getsize(f) for f in files)
+    while size > cache_maxsize and files:
+        oldest = files.pop(0)
+        size -= os.path.getsize(oldest)
+        os.remove(oldest)
+        log.info("  removed block %s from the cache" % (oldest))
+
+def _prism_array(model):
+    """
+    Get a :class:`~fatiando.mesher.PrismMesh` or
+    :class:`~fatiando.mesher.PrismArray` model as a
+    :class:`~fatiando.mesher.PrismArray` and the position in it of each cell
+    of the model (masked cells are left out of the array).
+
+    Returns:
+
+    * [array, offsets]
+        Cells ``start`` to ``stop`` of the model are ``array[offsets[start]:
+        offsets[stop]]``. Cell j is in the array if ``offsets[j + 1] >
+        offsets[j]``. Both are None if the model is any other list of cells.
+    """
+    if not isinstance(model, (PrismMesh, PrismArray)):
+        return None, None
+    keep = numpy.ones(len(model), dtype=numpy.int)
+    if isinstance(model, PrismMesh):
+        keep[list(model.mask)] = 0
+    offsets = numpy.zeros(len(model) + 1, dtype=numpy.int)
+    offsets[1:] = numpy.cumsum(keep)
+    return prisms2array(model), offsets
+
+def _array_geometry(prisms, prop):
+    """
+    Same as _geometry for all prisms of a
+    :class:`~fatiando.mesher.PrismArray`.
+    """
+    props = dict((p, prisms.props[p]) for p in prisms.props if p != prop)
+    return ['PrismArray', prisms.get_bounds(), props]
+
+def _signature(field, prop, kwargs):
+    """
+    Get everything about the calls to *field* that defines the columns besides
+    the cells: the function, all of its optional arguments (including the
+    defaults that aren't in *kwargs*), the settings of its module (public
+    numbers and strings, like ``tesseroid.max_depth``), and the version of
+    fatiando.
+    """
+    function = field
+    module = sys.modules.get(field.__module__)
+    settings = {}
+    if module is not None:
+        settings = dict((k, v) for k, v in vars(module).items()
+                        if not k.startswith('_') and
+                        isinstance(v, (bool, int, long, float, basestring)))
+    if getattr(prism, field.__name__, None) is field:
+        # The functions of prism only dispatch to the selected backend
+        function = getattr(_prism, field.__name__)
+        settings['backend'] = prism.get_backend(kwargs.get('backend'))
+    try:
+        spec = inspect.getargspec(function)
+        names, defaults = spec.args, spec.defaults or ()
+        args = dict(zip(names[len(names) - len(defaults):], defaults))
+    except TypeError:
+        # Compiled functions can't be inspected
+        args = {}
+    args.update(kwargs)
+    return [fatiando.version, _cache_version, field.__module__,
+            field.__name__, prop, args, settings]
+
+def _geometry(cell, prop):
+    """
+    Get everything that defines the sensitivity of a cell: its type,
+    attributes, and physical properties except *prop*.
+    """
+    if cell is None:
+        return None
+    attrs = dict(vars(cell))
+    attrs['props'] = dict((p, attrs['props'][p]) for p in attrs['props']
+                          if p != prop)
+    return [type(cell).__name__, attrs]
+
+def _fingerprint(hashobj, obj):
+    """
+    Update a hashlib object with the contents of obj (arrays, numbers, strings,
+    and lists and dicts of those).
+    """
+    if isinstance(obj, numpy.ndarray):
+        hashobj.update(str(obj.dtype))
+        hashobj.update(str(obj.shape))
+        hashobj.update(numpy.ascontiguousarray(obj).tostring())
+    elif isinstance(obj, dict):
+        hashobj.update('dict')
+        for k in sorted(obj):
+            _fingerprint(hashobj, k)
+            _fingerprint(hashobj, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        hashobj.update('list%d' % (len(obj)))
+        for item in obj:
+            _fingerprint(hashobj, item)
+    else:
+        hashobj.update(repr(obj))
@@ -1,11 +1,21 @@
 r"""
-Calculate the potential fields of a homogeneous sphere.
+Calculate the potential fields of homogeneous spheres.
+
+The spheres can be given as a list of :class:`~fatiando.mesher.Sphere` or as
+a :class:`~fatiando.mesher.SphereArray`. The effects of all spheres are
+calculated on all computation points at once using arrays. Use a
+:class:`~fatiando.mesher.SphereArray` for models with a large number of spheres
+(e.g., equivalent sources) to avoid creating a Python object per sphere. Use
+:mod:`fatiando.gravmag.stream` to split a very large number of computation
+points into chunks.
 
 **Magnetic**
 
 Calculates the total field anomaly. Uses the formula in Blakely (1995).
 
 * :func:`~fatiando.gravmag.sphere.tf`: calculates the total-field anomaly
+* :func:`~fatiando.gravmag.sphere.tf_batch`: calculates the total-field
+  anomaly for many regional field directions at once
 
 Remember that:
 
@@ -41,10 +51,27 @@ Then the total-field anomaly caused by the sphere is
 
 **Gravity**
 
-
+The gravitational fields of a homogeneous sphere are the same as the ones of a
+point mass in its center.
+
+* :func:`~fatiando.gravmag.sphere.potential`
+* :func:`~fatiando.gravmag.sphere.gx`
+* :func:`~fatiando.gravmag.sphere.gy`
+* :func:`~fatiando.gravmag.sphere.gz`
+* :func:`~fatiando.gravmag.sphere.gxx`
+* :func:`~fatiando.gravmag.sphere.gxy`
+* :func:`~fatiando.gravmag.sphere.gxz`
+* :func:`~fatiando.gravmag.sphere.gyy`
+* :func:`~fatiando.gravmag.sphere.gyz`
+* :func:`~fatiando.gravmag.sphere.gzz`
+* :func:`~fatiando.gravmag.sphere.fields`: calculates several of the above
+  at once, sharing the distances to the spheres
 
 **References**
 
+Blakely, R. J. (1995), Potential Theory in Gravity and Magnetic Applications,
+Cambridge University Press.
+
 
 ----
 """
@@ -52,9 +79,12 @@ import numpy
 
 from fatiando.constants import SI2EOTVOS, SI2MGAL, G, CM, T2NT
 from fatiando import utils
+from fatiando.mesher import SphereArray, spheres2array
+from fatiando.gravmag._prism import _magnetization_coefs, _valid_elements, \
+    _tf_directions, _precision_dtype, _cast, _sum_prisms
 
 
-def tf(xp, yp, zp, spheres, inc, dec):
+def tf(xp, yp, zp, spheres, inc, dec, precision='float64'):
     """
     Calculate the total-field anomaly of spheres.
 
@@ -69,10 +99,16 @@ def tf(xp, yp, zp, spheres, inc, dec):
         ``'inclination'`` and ``'declination'``. If ``'inclination'`` and
         ``'declination'`` are not present, will use the values of *inc* and
         *dec* instead. Those without ``'magnetization'`` will be ignored.
+        Can also be a :class:`~fatiando.mesher.SphereArray`.
     * inc : float
         The inclination of the regional field (in degrees)
     * dec : float
         The declination of the regional field (in degrees)
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the coordinates relative to the spheres are calculated and
+        the effects of the spheres are summed in double precision. The
+        relative error is of the order of :math:`10^{-7}`.
 
     Returns:
 
@@ -82,42 +118,266 @@ def tf(xp, yp, zp, spheres, inc, dec):
     """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    tf = numpy.zeros_like(xp)
-    # Calculate the 3 components of the unit vector in the direction of the
-    # regional field
-    fx, fy, fz = utils.dircos(inc, dec)
-    for sphere in spheres:
-        if sphere is None or 'magnetization' not in sphere.props:
-            continue
-        radius = sphere.radius
-        mag = sphere.props['magnetization']
-        # Get the 3 components of the unit vector in the direction of the
-        # magnetization from the inclination and declination
-        if 'inclination' in sphere.props and 'declination' in sphere.props:
-            inclination = sphere.props['inclination']
-            declination = sphere.props['declination']
-            mx, my, mz = utils.dircos(inclination, declination)
-        # If not given, use in the direction of the regional field
-        else:
-            mx, my, mz = fx, fy, fz
+    dtype = _precision_dtype(precision)
+    spheres = spheres2array(spheres)
+    valid, magnetization, coefs = _magnetization_coefs(spheres.props,
+        spheres.size, inc, dec, None, None, None)
+    xs, ys, zs = [c[valid] for c in [spheres.x, spheres.y, spheres.z]]
+    moments = magnetization*_volume(spheres.radius[valid])
+    cyz, cxz, cxy, cxx, cyy, czz = coefs
+    shape = xp.shape
+    res = numpy.zeros(xp.size, dtype=numpy.float)
+    xp, yp, zp = [numpy.ravel(i) for i in [xp, yp, zp]]
+    step = max(1, _blocksize//max(1, xp.size))
+    for start in xrange(0, len(moments), step):
+        block = slice(start, start + step)
         # First thing to do is make the computation point P the origin of the
-        # coordinate system
-        x = sphere.x - xp
-        y = sphere.y - yp
-        z = sphere.z - zp
-        # Calculate the 3 components of B
-        dotprod = mx*x + my*y + mz*z
+        # coordinate system. Rows are spheres and columns are points
+        x, y, z = _cast([xs[block, None] - xp, ys[block, None] - yp,
+                         zs[block, None] - zp], dtype)
         r_sqr = x**2 + y**2 + z**2
-        r5 = r_sqr**(2.5)
-        moment = mag*(4.*numpy.pi*(radius**3)/3.)
-        bx = moment*(3*dotprod*x - r_sqr*mx)/r5
-        by = moment*(3*dotprod*y - r_sqr*my)/r5
-        bz = moment*(3*dotprod*z - r_sqr*mz)/r5
-        tf = tf + (fx*bx + fy*by + fz*bz)
-    tf *= CM*T2NT
-    return tf
+        # The projection of B on the regional field is
+        # 3(m.r)(f.r) - (m.f)r^2, which the coefficients give directly
+        projection = (cxx[block, None]*x**2 + cyy[block, None]*y**2
+                      + czz[block, None]*z**2 + cxy[block, None]*x*y
+                      + 2*cxz[block, None]*x*z + 2*cyz[block, None]*y*z)
+        dotprod = (cxx + cyy + czz)[block, None]
+        tmp = moments[block, None]*(3*projection - dotprod*r_sqr)/r_sqr**2.5
+        res = _sum_prisms(res, tmp)
+    res *= CM*T2NT
+    return numpy.asarray(res.reshape(shape), dtype=dtype)
+
+def tf_batch(xp, yp, zp, spheres, inc, dec, magnetization=None):
+    """
+    Calculate the total-field anomaly of spheres for many regional field
+    directions at once.
+
+    The magnetic field of the spheres is calculated only once and projected on
+    each direction. This is much faster than calling
+    :func:`~fatiando.gravmag.sphere.tf` for each direction.
+
+    .. note:: Input units are SI. Output is in nT
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the anomaly will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. If *magnetization* is None, uses the properties
+        ``'magnetization'``, ``'inclination'`` and ``'declination'`` like
+        :func:`~fatiando.gravmag.sphere.tf`. Spheres without ``'inclination'``
+        and ``'declination'`` are magnetized in the direction of each regional
+        field. Can also be a :class:`~fatiando.mesher.SphereArray`.
+    * inc, dec : arrays
+        The inclinations and declinations of the regional fields (in degrees)
+    * magnetization : list = [mx, my, mz] or None
+        If not None, the x, y, and z components of the magnetization vector of
+        each sphere (in A/m). Elements of *spheres* that are None are ignored.
+
+    Returns:
+
+    * tf : array
+        The total-field anomaly with shape ``(len(inc), len(xp))``. Each row
+        is the anomaly for one regional field direction.
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    (xs, ys, zs), weights = _get_batch_magnetization(spheres, magnetization)
+    shape = xp.shape
+    xp, yp, zp = [numpy.ravel(i) for i in [xp, yp, zp]]
+    terms = numpy.zeros((9, xp.size), dtype=numpy.float)
+    step = max(1, _blocksize//max(1, xp.size))
+    for start in xrange(0, len(xs), step):
+        block = slice(start, start + step)
+        mx, my, mz, induced = [w[block, None] for w in weights]
+        x = xs[block, None] - xp
+        y = ys[block, None] - yp
+        z = zs[block, None] - zp
+        r_sqr = x**2 + y**2 + z**2
+        scale = 1./r_sqr**2.5
+        # The tensor that gives B from the magnetization vector
+        gxx = scale*(3*x*x - r_sqr)
+        gxy = scale*3*x*y
+        gxz = scale*3*x*z
+        gyy = scale*(3*y*y - r_sqr)
+        gyz = scale*3*y*z
+        gzz = scale*(3*z*z - r_sqr)
+        terms[0] = _sum_prisms(terms[0], mx*gxx + my*gxy + mz*gxz)
+        terms[1] = _sum_prisms(terms[1], mx*gxy + my*gyy + mz*gyz)
+        terms[2] = _sum_prisms(terms[2], mx*gxz + my*gyz + mz*gzz)
+        for i, g in enumerate([gxx, gxy, gxz, gyy, gyz, gzz]):
+            terms[3 + i] = _sum_prisms(terms[3 + i], induced*g)
+    tf = _tf_directions(inc, dec, terms)
+    return tf.reshape((tf.shape[0],) + shape)
+
+def fields(xp, yp, zp, spheres, components=None, dens=None,
+           precision='float64'):
+    """
+    Calculate several gravitational fields of the spheres at once.
+
+    The distances between the spheres and the computation points are
+    calculated only once and shared by all *components*. This is faster than
+    calling each function separately, e.g., when calculating the gravity
+    vector and all components of the gravity gradient tensor of an equivalent
+    layer.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI. The output units are the same as the
+        functions of each component.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the fields will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. Can also be a :class:`~fatiando.mesher.SphereArray`.
+    * components : list of str or None
+        The fields to calculate. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, and ``'gzz'``. If None, will calculate all of them.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the results.
+
+    Returns:
+
+    * res : dict
+        The fields calculated on xp, yp, zp. The keys are the names of the
+        components.
+
+    Examples::
+
+        >>> import numpy
+        >>> from fatiando.mesher import SphereArray
+        >>> model = SphereArray([0, 50], [0, 0], [100, 200], [10, 20],
+        ...                     {'density':[1000, -500]})
+        >>> xp, yp, zp = numpy.array([0., 5.]), numpy.zeros(2), numpy.zeros(2)
+        >>> res = fields(xp, yp, zp, model, components=['gz', 'gzz'])
+        >>> sorted(res.keys())
+        ['gz', 'gzz']
+        >>> numpy.all(res['gzz'] == gzz(xp, yp, zp, model))
+        True
+
+    """
+    if components is None:
+        components = _fields_components
+    components = list(components)
+    for c in components:
+        if c not in _fields_scales:
+            raise ValueError("Invalid component '%s'" % (c))
+    effects = _forward_fields(components, xp, yp, zp, spheres, dens,
+                              precision)
+    return dict(zip(components, effects))
+
+def potential(xp, yp, zp, spheres, dens=None, precision='float64'):
+    """
+    Calculates the gravitational potential.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input and output values in SI!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. Can also be a :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the coordinates relative to the spheres are calculated and
+        the effects of the spheres are summed in double precision. The
+        relative error is of the order of :math:`10^{-7}`.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _forward_fields(['potential'], xp, yp, zp, spheres, dens,
+                           precision)[0]
 
-def gz(xp, yp, zp, spheres):
+def gx(xp, yp, zp, spheres, dens=None, precision='float64'):
+    """
+    Calculates the :math:`g_x` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. Can also be a :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the coordinates relative to the spheres are calculated and
+        the effects of the spheres are summed in double precision. The
+        relative error is of the order of :math:`10^{-7}`.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _forward_fields(['gx'], xp, yp, zp, spheres, dens,
+                           precision)[0]
+
+def gy(xp, yp, zp, spheres, dens=None, precision='float64'):
+    """
+    Calculates the :math:`g_y` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in mGal!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. Can also be a :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the coordinates relative to the spheres are calculated and
+        the effects of the spheres are summed in double precision. The
+        relative error is of the order of :math:`10^{-7}`.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _forward_fields(['gy'], xp, yp, zp, spheres, dens,
+                           precision)[0]
+
+def gz(xp, yp, zp, spheres, dens=None, precision='float64'):
     """
     Calculates the :math:`g_z` gravity acceleration component.
 
@@ -132,7 +392,15 @@ def gz(xp, yp, zp, spheres):
         The x, y, and z coordinates where the field will be calculated
     * spheres : list of :class:`fatiando.mesher.Sphere`
         The spheres. Spheres must have the property ``'density'``. Those without
-        will be ignored.
+        will be ignored. Can also be a :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the coordinates relative to the spheres are calculated and
+        the effects of the spheres are summed in double precision. The
+        relative error is of the order of :math:`10^{-7}`.
 
     Returns:
 
@@ -140,19 +408,347 @@ def gz(xp, yp, zp, spheres):
         The field calculated on xp, yp, zp
 
     """
+    return _forward_fields(['gz'], xp, yp, zp, spheres, dens,
+                           precision)[0]
+
+def gxx(xp, yp, zp, spheres, dens=None, precision='float64'):
+    """
+    Calculates the :math:`g_{xx}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
 
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. Can also be a :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the coordinates relative to the spheres are calculated and
+        the effects of the spheres are summed in double precision. The
+        relative error is of the order of :math:`10^{-7}`.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _forward_fields(['gxx'], xp, yp, zp, spheres, dens,
+                           precision)[0]
+
+def gxy(xp, yp, zp, spheres, dens=None, precision='float64'):
+    """
+    Calculates the :math:`g_{xy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. Can also be a :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the coordinates relative to the spheres are calculated and
+        the effects of the spheres are summed in double precision. The
+        relative error is of the order of :math:`10^{-7}`.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _forward_fields(['gxy'], xp, yp, zp, spheres, dens,
+                           precision)[0]
+
+def gxz(xp, yp, zp, spheres, dens=None, precision='float64'):
+    """
+    Calculates the :math:`g_{xz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. Can also be a :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the coordinates relative to the spheres are calculated and
+        the effects of the spheres are summed in double precision. The
+        relative error is of the order of :math:`10^{-7}`.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _forward_fields(['gxz'], xp, yp, zp, spheres, dens,
+                           precision)[0]
+
+def gyy(xp, yp, zp, spheres, dens=None, precision='float64'):
+    """
+    Calculates the :math:`g_{yy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. Can also be a :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the coordinates relative to the spheres are calculated and
+        the effects of the spheres are summed in double precision. The
+        relative error is of the order of :math:`10^{-7}`.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _forward_fields(['gyy'], xp, yp, zp, spheres, dens,
+                           precision)[0]
+
+def gyz(xp, yp, zp, spheres, dens=None, precision='float64'):
+    """
+    Calculates the :math:`g_{yz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. Can also be a :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the coordinates relative to the spheres are calculated and
+        the effects of the spheres are summed in double precision. The
+        relative error is of the order of :math:`10^{-7}`.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _forward_fields(['gyz'], xp, yp, zp, spheres, dens,
+                           precision)[0]
+
+def gzz(xp, yp, zp, spheres, dens=None, precision='float64'):
+    """
+    Calculates the :math:`g_{zz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in SI and output in Eotvos!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The x, y, and z coordinates where the field will be calculated
+    * spheres : list of :class:`fatiando.mesher.Sphere`
+        The spheres. Spheres must have the property ``'density'``. Those without
+        will be ignored. Can also be a :class:`~fatiando.mesher.SphereArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the spheres. Use this, e.g., for sensitivity matrix building.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the result. In single
+        precision, the coordinates relative to the spheres are calculated and
+        the effects of the spheres are summed in double precision. The
+        relative error is of the order of :math:`10^{-7}`.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    return _forward_fields(['gzz'], xp, yp, zp, spheres, dens,
+                           precision)[0]
+
+# Maximum number of sphere-point pairs evaluated at once. Limits the size of
+# the temporary arrays
+_blocksize = 2**18
+
+_fields_components = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz',
+                      'gyy', 'gyz', 'gzz']
+_fields_scales = {'potential':G, 'gx':G*SI2MGAL, 'gy':G*SI2MGAL,
+                  'gz':G*SI2MGAL, 'gxx':G*SI2EOTVOS, 'gxy':G*SI2EOTVOS,
+                  'gxz':G*SI2EOTVOS, 'gyy':G*SI2EOTVOS, 'gyz':G*SI2EOTVOS,
+                  'gzz':G*SI2EOTVOS}
+
+def _volume(radius):
+    return 4.*numpy.pi*(radius**3)/3.
+
+def _get_masses(spheres, dens):
+    """
+    Get the centers and masses of the spheres that have a density (all of them
+    if *dens* is not None).
+
+    Returns:
+
+    * [centers, masses]
+        centers is a list with the arrays x, y, z
+    """
+    spheres = spheres2array(spheres)
+    if dens is not None:
+        density = numpy.repeat(float(dens), spheres.size)
+    else:
+        density = spheres.props.get('density', numpy.repeat(numpy.nan,
+                                                            spheres.size))
+    valid = ~numpy.isnan(density)
+    centers = [c[valid] for c in [spheres.x, spheres.y, spheres.z]]
+    return centers, density[valid]*_volume(spheres.radius[valid])
+
+def _get_batch_magnetization(spheres, magnetization):
+    """
+    Get the centers of the spheres and the magnetization used by tf_batch.
+
+    Returns:
+
+    * [centers, weights]
+        centers is a list with the arrays x, y, z. weights is a list with the
+        arrays mx, my, mz (magnetic moment of the spheres with a fixed
+        direction) and the moment of the spheres magnetized in the direction of
+        the regional field.
+    """
+    if magnetization is not None:
+        if isinstance(spheres, SphereArray):
+            valid = numpy.ones(spheres.size, dtype=numpy.bool)
+        else:
+            valid = _valid_elements(spheres)
+        mag = [numpy.asarray(m, dtype=numpy.float) for m in magnetization]
+        if len(mag) != 3 or any(m.shape != valid.shape for m in mag):
+            raise ValueError(
+                "magnetization must be 3 arrays with one value per sphere")
+        fixed = [m[valid] for m in mag]
+        induced = numpy.zeros_like(fixed[0])
+    spheres = spheres2array(spheres)
+    if magnetization is None:
+        props = spheres.props
+        intensity = numpy.zeros(spheres.size)
+        if 'magnetization' in props:
+            intensity = numpy.nan_to_num(props['magnetization'])
+        given = numpy.zeros(spheres.size, dtype=numpy.bool)
+        fixed = [numpy.zeros(spheres.size) for i in xrange(3)]
+        if 'inclination' in props and 'declination' in props:
+            incs, decs = props['inclination'], props['declination']
+            given = ~(numpy.isnan(incs) | numpy.isnan(decs))
+            for m, d in zip(fixed, utils.dircos(incs[given], decs[given])):
+                m[given] = intensity[given]*d
+        induced = numpy.where(given, 0., intensity)
+    volume = _volume(spheres.radius)
+    weights = [w*volume for w in fixed + [induced]]
+    return [spheres.x, spheres.y, spheres.z], weights
+
+def _forward_fields(components, xp, yp, zp, spheres, dens, precision):
+    """
+    Sum the effect of all spheres on the computation points for several
+    components at once.
+
+    Returns a list with the (scaled) effect of each component.
+    """
     if xp.shape != yp.shape != zp.shape:
         raise ValueError("Input arrays xp, yp, and zp must have same shape!")
-    res = numpy.zeros_like(xp)
-    for sphere in spheres:
-        if sphere is None or 'density' not in sphere.props:
-            continue
-        radius = sphere.radius
-        density = sphere.props['density']
-        dx = sphere.x - xp
-        dy = sphere.y - yp
-        dz = sphere.z - zp
-        r_cb = (dx**2 + dy**2 + dz**2)**(1.5)
-        mass = density*4.*numpy.pi*(radius**3)/3.
-        res = res - mass*dz/r_cb
-    return G*SI2MGAL*res
+    dtype = _precision_dtype(precision)
+    (xs, ys, zs), masses = _get_masses(spheres, dens)
+    shape = xp.shape
+    res = [numpy.zeros(xp.size, dtype=numpy.float) for c in components]
+    xp, yp, zp = [numpy.ravel(i) for i in [xp, yp, zp]]
+    step = max(1, _blocksize//max(1, xp.size))
+    for start in xrange(0, len(masses), step):
+        block = slice(start, start + step)
+        # First thing to do is make the computation point P the origin of the
+        # coordinate system. Rows are spheres and columns are points
+        x, y, z = _cast([xs[block, None] - xp, ys[block, None] - yp,
+                         zs[block, None] - zp], dtype)
+        kernels = _kernel_fields(x, y, z, masses[block, None], components)
+        for n, kernel in enumerate(kernels):
+            res[n] = _sum_prisms(res[n], kernel)
+    return [numpy.asarray(_fields_scales[c]*r.reshape(shape), dtype=dtype)
+            for c, r in zip(components, res)]
+
+def _kernel_fields(x, y, z, masses, components):
+    """
+    Evaluate the kernels of the point masses for all *components*. The masses
+    are multiplied into the inverse powers of the distance, which are only
+    calculated if a component needs them.
+    """
+    r_sqr = x*x + y*y + z*z
+    weight = masses/numpy.sqrt(r_sqr)
+    if set(components) - set(['potential']):
+        weight3 = weight/r_sqr
+    if set(components) & set(['gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz']):
+        weight5 = weight3/r_sqr
+    kernels = []
+    for c in components:
+        if c == 'potential':
+            kernels.append(weight)
+        elif c == 'gx':
+            kernels.append(x*weight3)
+        elif c == 'gy':
+            kernels.append(y*weight3)
+        elif c == 'gz':
+            kernels.append(z*weight3)
+        elif c == 'gxx':
+            kernels.append((3*x*x - r_sqr)*weight5)
+        elif c == 'gxy':
+            kernels.append(3*x*y*weight5)
+        elif c == 'gxz':
+            kernels.append(3*x*z*weight5)
+        elif c == 'gyy':
+            kernels.append((3*y*y - r_sqr)*weight5)
+        elif c == 'gyz':
+            kernels.append(3*y*z*weight5)
+        elif c == 'gzz':
+            kernels.append((3*z*z - r_sqr)*weight5)
+    return kernels
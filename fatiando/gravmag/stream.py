@@ -0,0 +1,206 @@
+"""
+Forward modeling on very large sets of computation points, chunk by chunk.
+
+The forward modeling functions calculate the effect of the model on all
+computation points at once and their temporary arrays grow with the number of
+points. The functions in this module split the points into chunks and call the
+forward modeling function on one chunk at a time. So the memory used by the
+calculations depends only on the size of the chunks.
+
+* :func:`~fatiando.gravmag.stream.chunks`: Split the computation points into
+  chunks
+* :func:`~fatiando.gravmag.stream.forward`: Calculate the field on each chunk
+  of an iterable of chunks (e.g., read from a file) and yield the results one
+  by one
+* :func:`~fatiando.gravmag.stream.compute`: Calculate the field on all points
+  chunk by chunk and store the result in an array, optionally directly into a
+  :class:`numpy.memmap`
+
+Works with all forward modeling functions that take the computation points and
+a list of elements, like the ones in :mod:`~fatiando.gravmag.prism`,
+:mod:`~fatiando.gravmag.tesseroid`, :mod:`~fatiando.gravmag.sphere`, and
+:mod:`~fatiando.gravmag.polyprism`.
+
+**Examples**
+
+Calculate the gravity anomaly of a prism model chunk by chunk:
+
+    >>> import numpy
+    >>> from fatiando.mesher import Prism
+    >>> from fatiando.gravmag import prism
+    >>> from fatiando import gridder
+    >>> model = [Prism(0, 100, 0, 200, 0, 50, {'density':500})]
+    >>> xp, yp, zp = gridder.regular((-50, 150, -50, 250), (5, 5), z=-10)
+    >>> gz = compute(xp, yp, zp, model, prism.gz, chunksize=7)
+    >>> numpy.allclose(gz, prism.gz(xp, yp, zp, model))
+    True
+
+Yield the total-field anomaly of each chunk (e.g., to write it to a file as
+soon as it is calculated):
+
+    >>> for tf in forward(chunks(xp, yp, zp, 10), model, prism.tf, inc=30,
+    ...                   dec=-15):
+    ...     print tf.shape
+    (10,)
+    (10,)
+    (5,)
+
+Store the result in a file on disk:
+
+    >>> import tempfile
+    >>> tmp = tempfile.NamedTemporaryFile()
+    >>> out = numpy.memmap(tmp.name, dtype='float32', mode='w+',
+    ...                    shape=xp.shape)
+    >>> gz32 = compute(xp, yp, zp, model, prism.gz, chunksize=7, out=out)
+    >>> gz32 is out
+    True
+    >>> numpy.allclose(gz32, gz, rtol=10**(-6), atol=0)
+    True
+    >>> tmp.close()
+
+----
+
+"""
+import numpy
+
+import fatiando.logger
+
+log = fatiando.logger.dummy('fatiando.gravmag.stream')
+
+#: Number of computation points in a chunk if *chunksize* is not given
+default_chunksize = 2**16
+
+
+def chunks(xp, yp, zp, chunksize=None):
+    """
+    Split the computation points into chunks.
+
+    The chunks are views of the (raveled) coordinate arrays, so no data is
+    copied.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The coordinates of the computation points
+    * chunksize : int or None
+        The maximum number of points in a chunk. If None, will use
+        ``default_chunksize``.
+
+    Returns:
+
+    * chunks : generator
+        Yields the ``(x, y, z)`` coordinates of each chunk (1D arrays)
+
+    Examples:
+
+        >>> import numpy
+        >>> x, y, z = numpy.arange(5.), numpy.zeros(5), numpy.ones(5)
+        >>> for chunk in chunks(x, y, z, 2):
+        ...     print chunk[0].tolist()
+        [0.0, 1.0]
+        [2.0, 3.0]
+        [4.0]
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    if chunksize is None:
+        chunksize = default_chunksize
+    if chunksize < 1:
+        raise ValueError("chunksize must be a positive integer")
+    xp, yp, zp = [numpy.ravel(i) for i in [xp, yp, zp]]
+    for start in xrange(0, xp.size, chunksize):
+        stop = min(start + chunksize, xp.size)
+        yield xp[start:stop], yp[start:stop], zp[start:stop]
+
+def forward(chunks, model, field, **kwargs):
+    """
+    Calculate a field on each chunk of computation points.
+
+    Only one chunk (and its result) needs to be in memory at a time, so
+    *chunks* can be a generator that reads the points from a file.
+
+    Parameters:
+
+    * chunks : iterable
+        The ``(x, y, z)`` coordinates of each chunk of computation points, like
+        the ones given by :func:`~fatiando.gravmag.stream.chunks`.
+    * model : list or mesh
+        The model. Can be any list of geometric elements or mesh accepted by
+        *field*.
+    * field : function
+        The forward modeling function, e.g., :func:`fatiando.gravmag.prism.gz`
+        or :func:`fatiando.gravmag.tesseroid.gzz`. Will be called as
+        ``field(x, y, z, model, **kwargs)``.
+    * kwargs
+        Other arguments passed on to *field* (e.g., *inc* and *dec* for the
+        total-field anomaly).
+
+    Returns:
+
+    * results : generator
+        Yields the result of *field* for each chunk
+
+    """
+    for x, y, z in chunks:
+        yield field(x, y, z, model, **kwargs)
+
+def compute(xp, yp, zp, model, field, chunksize=None, dtype=numpy.float,
+            out=None, **kwargs):
+    """
+    Calculate a field on all computation points, chunk by chunk.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        The coordinates of the computation points, in the format expected by
+        *field* (e.g., lons, lats, heights for tesseroids).
+    * model : list or mesh
+        The model. Can be any list of geometric elements or mesh accepted by
+        *field*.
+    * field : function
+        The forward modeling function. Will be called as
+        ``field(x, y, z, model, **kwargs)`` for each chunk. Must return an
+        array.
+    * chunksize : int or None
+        The maximum number of points in a chunk. If None, will use
+        ``default_chunksize``.
+    * dtype : numpy dtype
+        The type of the result. Ignored if *out* is given.
+    * out : array or None
+        If not None, the result is stored in this array (e.g., a
+        :class:`numpy.memmap`). Must have the same number of elements as
+        *xp*.
+    * kwargs
+        Other arguments passed on to *field* (e.g., *inc* and *dec* for the
+        total-field anomaly).
+
+    Returns:
+
+    * result : array
+        The field on the computation points, with the shape of *xp* (*out* if
+        it was given)
+
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    if out is None:
+        out = numpy.empty(xp.shape, dtype=dtype)
+    elif out.size != xp.size:
+        raise ValueError("out must have %d elements" % (xp.size))
+    # A view of out with one dimension. reshape would copy out if it is not
+    # contiguous
+    flat = out.view()
+    flat.shape = (out.size,)
+    log.info("Forward modeling in chunks:")
+    log.info("  points: %d" % (xp.size))
+    log.info("  points per chunk: %d" % (chunksize or default_chunksize))
+    start = 0
+    for res in forward(chunks(xp, yp, zp, chunksize), model, field,
+                       **kwargs):
+        stop = start + res.size
+        flat[start:stop] = res
+        start = stop
+    if hasattr(out, 'flush'):
+        out.flush()
+    return out
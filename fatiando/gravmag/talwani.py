@@ -10,6 +10,17 @@ Use the :func:`~fatiando.mesher.Polygon` object to create polygons.
 **Components**
 
 * :func:`~fatiando.gravmag.talwani.gz`
+* :func:`~fatiando.gravmag.talwani.gz_batch`: the :math:`g_z` of each polygon
+  separately (e.g., the perturbed models of a finite-difference derivative)
+
+**Derivatives**
+
+* :func:`~fatiando.gravmag.talwani.gz_vertex_derivatives`: the derivatives of
+  :math:`g_z` with respect to the coordinates of the vertices of a polygon
+
+The edges of all polygons are evaluated on all computation points at once
+using arrays. The singular cases (a computation point on the line of an edge,
+on a vertex, etc) are fixed with array masks.
 
 **References**
 
@@ -54,48 +65,253 @@ def gz(xp, zp, polygons):
     """
     if xp.shape != zp.shape:
         raise ValueError("Input arrays xp and zp must have same shape!")
-    res = numpy.zeros_like(xp)
-    # Extract the indexes of an array that have cond == True
-    subset = lambda cond: [i for i, istrue in enumerate(cond) if istrue]
-    for polygon in polygons:
+    (x1, z1, x2, z2), densities, owner = _get_edges(polygons)
+    shape = xp.shape
+    res = numpy.zeros(xp.size, dtype=numpy.float)
+    xp, zp = [numpy.ravel(i) for i in [xp, zp]]
+    step = max(1, _blocksize//max(1, xp.size))
+    for start in xrange(0, len(densities), step):
+        block = slice(start, start + step)
+        tmp = _kernel_gz(x1[block], z1[block], x2[block], z2[block], xp, zp)
+        tmp *= densities[block, None]
+        tmp[0] += res
+        res = numpy.add.reduce(tmp, axis=0)
+    res *= SI2MGAL*2.0*G
+    return res.reshape(shape)
+
+def gz_batch(xp, zp, polygons):
+    """
+    Calculates the :math:`g_z` gravity acceleration component of each polygon
+    separately.
+
+    The edges of all polygons are evaluated at once. This is much faster than
+    calling :func:`~fatiando.gravmag.talwani.gz` for each polygon, e.g., to
+    calculate the effect of every polygon of a model or of all the perturbed
+    models of a finite-difference derivative.
+
+    .. note:: The coordinate system of the input parameters is z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal**!
+
+    Parameters:
+
+    * xp, zp : arrays
+        The x and z coordinates of the computation points.
+    * polygons : list of :func:`~fatiando.mesher.Polygon`
+        The polygons. Same as in :func:`~fatiando.gravmag.talwani.gz`. Polygons
+        without the property ``'density'`` and elements that are None have an
+        effect of zero.
+
+    Returns:
+
+    * gz : array
+        The :math:`g_z` component with shape ``(len(polygons),) + xp.shape``.
+        Each row is the effect of one polygon.
+
+    Examples::
+
+        >>> import numpy
+        >>> from fatiando.mesher import Polygon
+        >>> square = Polygon([[0, 0], [100, 0], [100, 100], [0, 100]],
+        ...                  {'density':1000})
+        >>> xp, zp = numpy.linspace(-500, 500, 5), numpy.zeros(5)
+        >>> batch = gz_batch(xp, zp, [square, None])
+        >>> batch.shape
+        (2, 5)
+        >>> numpy.all(batch[0] == gz(xp, zp, [square]))
+        True
+        >>> numpy.all(batch[1] == 0)
+        True
+
+    """
+    if xp.shape != zp.shape:
+        raise ValueError("Input arrays xp and zp must have same shape!")
+    (x1, z1, x2, z2), densities, owner = _get_edges(polygons)
+    shape = xp.shape
+    res = numpy.zeros((len(polygons), xp.size), dtype=numpy.float)
+    xp, zp = [numpy.ravel(i) for i in [xp, zp]]
+    step = max(1, _blocksize//max(1, xp.size))
+    for start in xrange(0, len(densities), step):
+        block = slice(start, start + step)
+        tmp = _kernel_gz(x1[block], z1[block], x2[block], z2[block], xp, zp)
+        tmp *= densities[block, None]
+        # Sum the edges of each polygon in order, the same way gz does
+        for i in numpy.unique(owner[block]):
+            edges = tmp[owner[block] == i]
+            edges[0] += res[i]
+            res[i] = numpy.add.reduce(edges, axis=0)
+    res *= SI2MGAL*2.0*G
+    return res.reshape((len(polygons),) + shape)
+
+def gz_vertex_derivatives(xp, zp, polygon):
+    r"""
+    Calculates the derivatives of :math:`g_z` with respect to the x and z
+    coordinates of each vertex of a polygon.
+
+    Moving a vertex only moves the two edges that share it. The derivatives are
+    line integrals of the :math:`g_z` kernel along these two edges, which have
+    closed forms. So all derivatives cost about as much as one forward
+    modeling with :func:`~fatiando.gravmag.talwani.gz`. Use them as the
+    Jacobian of inversions for the vertices of a polygon (e.g.,
+    :mod:`~fatiando.gravmag.basin2d`).
+
+    .. note:: The coordinate system of the input parameters is z -> **DOWN**.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal/m**!
+
+    Parameters:
+
+    * xp, zp : arrays
+        The x and z coordinates of the computation points.
+    * polygon : :func:`~fatiando.mesher.Polygon`
+        The polygon. Must have the property ``'density'``. The vertices must be
+        given clockwise, like in :func:`~fatiando.gravmag.talwani.gz`.
+
+        .. note:: The y coordinate of the polygon is used as z!
+
+    Returns:
+
+    * [dx, dz] : arrays
+        The derivatives with respect to the x and z coordinates of the
+        vertices. Both have shape ``(polygon.nverts,) + xp.shape``. Each row is
+        the derivative with respect to one vertex.
+
+    Examples::
+
+        >>> import numpy
+        >>> from fatiando.mesher import Polygon
+        >>> props = {'density':1000}
+        >>> triangle = Polygon([[0, 10], [100, 0], [40, 90]], props)
+        >>> xp, zp = numpy.array([-50., 150.]), numpy.array([-10., -10.])
+        >>> dx, dz = gz_vertex_derivatives(xp, zp, triangle)
+        >>> dx.shape
+        (3, 2)
+        >>> # Compare with a finite-difference approximation
+        >>> moved = Polygon([[0, 10], [100, 0], [40, 90.1]], props)
+        >>> fd = (gz(xp, zp, [moved]) - gz(xp, zp, [triangle]))/0.1
+        >>> numpy.allclose(dz[2], fd, rtol=10**(-3))
+        True
+
+    """
+    if xp.shape != zp.shape:
+        raise ValueError("Input arrays xp and zp must have same shape!")
+    if 'density' not in polygon.props:
+        raise ValueError("The polygon must have the property 'density'")
+    shape = xp.shape
+    xp, zp = [numpy.ravel(i) for i in [xp, zp]]
+    # Make the computation points the origin. Rows are vertices
+    x = numpy.asarray(polygon.x, dtype=numpy.float)[:, None] - xp
+    z = numpy.asarray(polygon.y, dtype=numpy.float)[:, None] - zp
+    # Same as in gz, move points that are on a vertex by 0.01 meters
+    x[(x == 0.) & (z == 0.)] += 0.01
+    # Edge i goes from vertex i to vertex i + 1. A point on the edge moves with
+    # vertex i with weight 1 - t and with vertex i + 1 with weight t
+    dx = numpy.roll(x, -1, axis=0) - x
+    dz = numpy.roll(z, -1, axis=0) - z
+    integral, integral_t = _edge_integrals(x, z, dx, dz)
+    next_edge = integral - integral_t
+    previous_edge = numpy.roll(integral_t, 1, axis=0)
+    dx_previous = numpy.roll(dx, 1, axis=0)
+    dz_previous = numpy.roll(dz, 1, axis=0)
+    # The edge length times its normal vector is (dz, -dx)
+    scale = SI2MGAL*2.0*G*polygon.props['density']
+    derivx = scale*(dz_previous*previous_edge + dz*next_edge)
+    derivz = -scale*(dx_previous*previous_edge + dx*next_edge)
+    shape = (len(derivx),) + shape
+    return [derivx.reshape(shape), derivz.reshape(shape)]
+
+# Maximum number of edge-point pairs evaluated at once. Limits the size of the
+# temporary arrays
+_blocksize = 2**18
+
+def _get_edges(polygons):
+    """
+    Get the edges of all polygons that have a density.
+
+    Each vertex pairs with the next one and the last vertex pairs with the
+    first one.
+
+    Returns:
+
+    * [edges, densities, owner]
+        edges is a list with the arrays x1, z1, x2, z2. owner is the index of
+        the polygon of each edge in *polygons*.
+    """
+    edges = [[], [], [], []]
+    densities = []
+    owner = []
+    for i, polygon in enumerate(polygons):
         if polygon is None or 'density' not in polygon.props:
             continue
-        density = polygon.props['density']
-        x = polygon.x
-        z = polygon.y
-        nverts = polygon.nverts
-        for v in xrange(nverts):
-            # Change the coordinates of this vertice
-            xv = x[v] - xp
-            zv = z[v] - zp
-            # The last vertice pairs with the first one
-            if v == nverts - 1:
-                xvp1 = x[0] - xp
-                zvp1 = z[0] - zp
-            else:
-                xvp1 = x[v + 1]- xp
-                zvp1 = z[v + 1] - zp
-            # Temporary fix. The analytical conditions for these limits don't
-            # work. So if the conditions are breached, sum 0.01 meters to the
-            # coodinates and be happy
-            xv[subset(xv == 0.)] += 0.01
-            xv[subset(xv == xvp1)] += 0.01
-            zv[subset(zv[subset(xv == zv)] == 0.)] += 0.01
-            zv[subset(zv == zvp1)] += 0.01
-            zvp1[subset(zvp1[subset(xvp1 == zvp1)] == 0.)] += 0.01
-            xvp1[subset(xvp1 == 0.)] += 0.01
-            # End of fix
-            phi_v = arctan2(zvp1 - zv, xvp1 - xv)
-            ai = xvp1 + zvp1*(xvp1 - xv)/(zv - zvp1)
-            theta_v = arctan2(zv, xv)
-            theta_vp1 = arctan2(zvp1, xvp1)
-            theta_v[subset(theta_v < 0)] += pi
-            theta_vp1[subset(theta_vp1 < 0)] += pi
-            tmp = ai*sin(phi_v)*cos(phi_v)*(
-                    theta_v - theta_vp1 + tan(phi_v)*log(
-                        (cos(theta_v)*(tan(theta_v) - tan(phi_v)))/
-                        (cos(theta_vp1)*(tan(theta_vp1) - tan(phi_v)))))
-            tmp[subset(theta_v == theta_vp1)] = 0.
-            res = res + tmp*density
-    res = res*SI2MGAL*2.0*G
-    return res
+        x = numpy.asarray(polygon.x, dtype=numpy.float)
+        z = numpy.asarray(polygon.y, dtype=numpy.float)
+        for e, v in zip(edges, [x, z, numpy.roll(x, -1), numpy.roll(z, -1)]):
+            e.append(v)
+        densities.append(numpy.repeat(float(polygon.props['density']),
+                                      len(x)))
+        owner.append(numpy.repeat(i, len(x)))
+    if not densities:
+        return [numpy.zeros(0) for e in edges], numpy.zeros(0), \
+            numpy.zeros(0, dtype=numpy.int)
+    return ([numpy.concatenate(e) for e in edges], numpy.concatenate(densities),
+            numpy.concatenate(owner))
+
+def _kernel_gz(x1, z1, x2, z2, xp, zp):
+    """
+    The effect of the edges (x1, z1) -> (x2, z2) on the computation points
+    (without the density and constants). Rows are edges and columns are
+    points.
+    """
+    # Change the coordinates of the vertices
+    xv = x1[:, None] - xp
+    zv = z1[:, None] - zp
+    xvp1 = x2[:, None] - xp
+    zvp1 = z2[:, None] - zp
+    # Temporary fix. The analytical conditions for these limits don't
+    # work. So if the conditions are breached, sum 0.01 meters to the
+    # coodinates and be happy
+    xv[xv == 0.] += 0.01
+    xv[xv == xvp1] += 0.01
+    zv[(xv == zv) & (zv == 0.)] += 0.01
+    zvp1[(xvp1 == zvp1) & (zvp1 == 0.)] += 0.01
+    zv[zv == zvp1] += 0.01
+    xvp1[xvp1 == 0.] += 0.01
+    # End of fix
+    phi_v = arctan2(zvp1 - zv, xvp1 - xv)
+    ai = xvp1 + zvp1*(xvp1 - xv)/(zv - zvp1)
+    theta_v = arctan2(zv, xv)
+    theta_vp1 = arctan2(zvp1, xvp1)
+    theta_v[theta_v < 0] += pi
+    theta_vp1[theta_vp1 < 0] += pi
+    tmp = ai*sin(phi_v)*cos(phi_v)*(
+            theta_v - theta_vp1 + tan(phi_v)*log(
+                (cos(theta_v)*(tan(theta_v) - tan(phi_v)))/
+                (cos(theta_vp1)*(tan(theta_vp1) - tan(phi_v)))))
+    tmp[theta_v == theta_vp1] = 0.
+    return tmp
+
+def _edge_integrals(x, z, dx, dz):
+    """
+    Integrate the kernel z/(x**2 + z**2) of gz along the edges
+    (x + t*dx, z + t*dz), with t from 0 to 1.
+
+    Returns:
+
+    * [integral, integral_t]
+        The integrals of the kernel and of t times the kernel
+    """
+    # The squared distance to the points on the edge is a*t**2 + b*t + c
+    a = dx**2 + dz**2
+    b = 2.*(x*dx + z*dz)
+    c = x**2 + z**2
+    dot = c + 0.5*b
+    cross = x*dz - z*dx
+    # If the point is on the line of the edge, the arc-tangent is replaced by
+    # its limit
+    collinear = cross == 0.
+    cross[collinear] = 1.
+    int0 = arctan2(cross, dot)/cross
+    int0[collinear] = 1./dot[collinear]
+    int1 = (0.5*log((a + b + c)/c) - 0.5*b*int0)/a
+    int2 = (1. - b*int1 - c*int0)/a
+    return [z*int0 + dz*int1, z*int1 + dz*int2]
@@ -1,10 +1,77 @@
 """
 Calculates the potential fields of a tesseroid.
+
+Use :func:`~fatiando.gravmag.tesseroid.fields` to calculate several components
+at once (e.g., the gravity gradient tensor and gz). It divides the tesseroids
+only once for all components.
+
+All functions take an *njobs* argument with the number of threads used in the
+calculations. It only has an effect if the Cython extension module (compiled
+with OpenMP) is available. The work is split into tasks of a block of
+tesseroids and a block of computation points, and the threads take the next
+task from a shared queue as soon as they are done. So the threads stay busy
+even though the tesseroids close to the points (that are divided many times)
+take much longer to calculate. The results are the same for any value of
+*njobs*. There is no need to split the model among processes with
+:mod:`multiprocessing`.
+
+The tesseroids are divided adaptively: a tesseroid is split in 8 while the
+distance to a computation point is smaller than *ratio* times its size. The
+division is done on arrays of (w, e, s, n, top, bottom) bounds with a stack (in
+compiled code if the Cython extension is available). A tesseroid is divided at
+most ``max_depth`` times. Parts that would need more divisions are integrated
+as they are and a warning is logged.
+
+The parts of the tesseroids are integrated with the Gauss-Legendre Quadrature
+(GLQ). The *glq_order* argument is the number of nodes in each dimension. It
+can also be a list with the number of nodes in longitude, latitude and radius
+(e.g., ``[2, 2, 3]`` for thick tesseroids). A higher order is more accurate for
+a part of a given size, so a smaller *ratio* can be used with it (fewer
+divisions). The default *ratio* and *glq_order* of each function are the
+fastest pair with errors below 0.01% of the maximum absolute value of the field
+in all four models of the benchmark ``benchmarks/gravmag_tesseroid_glq.ipynb``
+(wide and thick tesseroids, and two near-surface models of adjacent tesseroids
+with different tops and bottoms, on grids 1 to 250 km high):
+
+=============================  =========  =============
+Function                       *ratio*    *glq_order*
+=============================  =========  =============
+``potential``                  1          3
+``gx``, ``gy``                 1.5        3
+``gz``                         1          4
+Gravity gradient tensor        1.5        4
+=============================  =========  =============
+
+The error of a pair changes by up to about 10 times with the geometry of the
+model and the positions of the points, so the defaults are 10 times more
+accurate than the target of 0.1% in these models. The 0.1% is not guaranteed
+for every model: check against a smaller *ratio* or a higher *glq_order* if
+the accuracy is critical.
+
+If the model is a :class:`~fatiando.mesher.TesseroidMesh` and the computation
+points are a grid (ordered like the ones made by
+:func:`fatiando.gridder.regular`) at a constant height and with the same
+longitude spacing as the mesh (e.g., a global crustal model and a global grid
+on satellite height), the effect of each latitude band of the mesh is
+calculated only once for a tesseroid and then shifted along longitude (a
+convolution with the densities of the band done with FFTs). This is done
+automatically and is many times faster than calculating the effect of every
+tesseroid on every point. The results are the same up to round-off.
+
+All functions also take a *precision* argument, ``'float64'`` (default) or
+``'float32'``, with the type of the result. The numerical integration is always
+done in double precision: the squared distances between the computation points
+and the integration nodes are small differences of squared radii of the Earth
+(about :math:`4 \\times 10^{13}\\ m^2`) that single precision can't resolve.
+Use ``'float32'`` to halve the memory of the results (e.g., of sensitivity
+matrices). The only error is the final rounding (relative error of about
+:math:`10^{-7}`).
 """
 import numpy
 
-from fatiando.mesher import Tesseroid
+import fatiando.logger
 from fatiando.constants import SI2MGAL, SI2EOTVOS, MEAN_EARTH_RADIUS, G
+from fatiando.gravmag._prism import _precision_dtype
 
 
 try:
@@ -13,34 +80,135 @@ except ImportError:
     from fatiando.gravmag import _tesseroid as _kernels
 
 
-_glq_nodes = numpy.array([-0.577350269, 0.577350269])
-_glq_weights = numpy.array([1., 1.])
+log = fatiando.logger.dummy('fatiando.gravmag.tesseroid')
+
+#: Maximum number of times a tesseroid is divided in half by the adaptive
+#: discretization. If a part of a tesseroid this small is still too close to a
+#: computation point, it is integrated without dividing and a warning is
+#: logged.
+max_depth = 30
+
+# The nodes and weights of the Gauss-Legendre Quadrature of each order that
+# has been used
+_glq_cache = {}
+
+_fields_components = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz',
+                      'gyy', 'gyz', 'gzz']
+# Multiply gz by -1 so that z is pointing down
+_fields_scales = {'potential':1., 'gx':SI2MGAL, 'gy':SI2MGAL, 'gz':-SI2MGAL,
+                  'gxx':SI2EOTVOS, 'gxy':SI2EOTVOS, 'gxz':SI2EOTVOS,
+                  'gyy':SI2EOTVOS, 'gyz':SI2EOTVOS, 'gzz':SI2EOTVOS}
+# The default ratio and glq_order of the function of each component
+_fields_defaults = {'potential':(1., 3), 'gx':(1.5, 3), 'gy':(1.5, 3),
+                    'gz':(1., 4), 'gxx':(1.5, 4), 'gxy':(1.5, 4),
+                    'gxz':(1.5, 4), 'gyy':(1.5, 4), 'gyz':(1.5, 4),
+                    'gzz':(1.5, 4)}
+
+
+def fields(lons, lats, heights, tesseroids, components=None, dens=None,
+           ratio=None, njobs=1, precision='float64', glq_order=None):
+    """
+    Calculate several gravitational fields of the tesseroids at once.
+
+    The tesseroids are divided only once for all *components* and all
+    components are calculated at each GLQ node. This is faster than calling
+    each function separately, e.g., when calculating the gravity gradient
+    tensor and gz on satellite orbit.
+
+    .. note:: All input values in SI, except for the longitudes and latitudes
+        (in degrees). The output units are the same as the functions of each
+        component.
+
+    Parameters:
+
+    * lons, lats, heights : arrays
+        The longitudes, latitudes and heights of the computation points
+    * tesseroids : list of :class:`fatiando.mesher.Tesseroid`
+        The tesseroids. Tesseroids must have the property ``'density'``. Those
+        without will be ignored. Can also be a
+        :class:`~fatiando.mesher.TesseroidMesh`.
+    * components : list of str or None
+        The fields to calculate. Can be any of ``'potential'``, ``'gx'``,
+        ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``, ``'gyy'``,
+        ``'gyz'``, and ``'gzz'``. If None, will calculate all of them.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the tesseroids.
+    * ratio : float or None
+        The distance/size ratio of the adaptive discretization. If None, will
+        use the largest default *ratio* of the functions of the *components*
+        (the strictest).
+    * njobs : int
+        The number of threads.
+    * precision : str
+        ``'float64'`` or ``'float32'``. The type of the results.
+    * glq_order : int, list or None
+        The order of the GLQ. If None, will use the highest default
+        *glq_order* of the functions of the *components*.
+
+    Returns:
+
+    * res : dict
+        The fields calculated on the points. The keys are the names of the
+        components.
+
+    Examples::
+
+        >>> import numpy
+        >>> from fatiando.mesher import Tesseroid
+        >>> model = [Tesseroid(-1, 1, -1, 1, 0, -10000, {'density':2670})]
+        >>> lons, lats = numpy.array([0., 0.5]), numpy.zeros(2)
+        >>> heights = 250000*numpy.ones(2)
+        >>> res = fields(lons, lats, heights, model, components=['gz', 'gzz'])
+        >>> sorted(res.keys())
+        ['gz', 'gzz']
+        >>> numpy.allclose(res['gzz'], gzz(lons, lats, heights, model))
+        True
+
+    """
+    if components is None:
+        components = _fields_components
+    components = list(components)
+    for c in components:
+        if c not in _fields_scales:
+            raise ValueError("Invalid component '%s'" % (c))
+    if ratio is None:
+        ratio = max([_fields_defaults[c][0] for c in components] + [0])
+    if glq_order is None:
+        glq_order = max([_fields_defaults[c][1] for c in components] + [1])
+    results = _optimal_discretize(tesseroids, lons, lats, heights, components,
+        ratio, dens, njobs, precision, glq_order)
+    return dict((c, _fields_scales[c]*r) for c, r in zip(components, results))
 
 
-def potential(lons, lats, heights, tesseroids, dens=None, ratio=1.):
+def potential(lons, lats, heights, tesseroids, dens=None, ratio=1., njobs=1,
+        precision='float64', glq_order=3):
     """
     Calculate the gravitational potential due to a tesseroid model.
     """
     return _optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.potential, ratio, dens)
+        ['potential'], ratio, dens, njobs, precision, glq_order)[0]
 
-def gx(lons, lats, heights, tesseroids, dens=None, ratio=1.):
+def gx(lons, lats, heights, tesseroids, dens=None, ratio=1.5, njobs=1,
+        precision='float64', glq_order=3):
     """
     Calculate the x (North) component of the gravitational attraction due to a
     tesseroid model.
     """
     return SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gx, ratio, dens)
+        ['gx'], ratio, dens, njobs, precision, glq_order)[0]
 
-def gy(lons, lats, heights, tesseroids, dens=None, ratio=1.):
+def gy(lons, lats, heights, tesseroids, dens=None, ratio=1.5, njobs=1,
+        precision='float64', glq_order=3):
     """
     Calculate the y (East) component of the gravitational attraction due to a
     tesseroid model.
     """
     return SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gy, ratio, dens)
+        ['gy'], ratio, dens, njobs, precision, glq_order)[0]
 
-def gz(lons, lats, heights, tesseroids, dens=None, ratio=1.):
+def gz(lons, lats, heights, tesseroids, dens=None, ratio=1., njobs=1,
+        precision='float64', glq_order=4):
     """
     Calculate the z (radial) component of the gravitational attraction due to a
     tesseroid model.
@@ -48,128 +216,229 @@ def gz(lons, lats, heights, tesseroids, dens=None, ratio=1.):
     # Multiply by -1 so that z is pointing down for gz and the gravity anomaly
     # doesn't look inverted (ie, negative for positive density)
     return -1*SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gz, ratio, dens)
+        ['gz'], ratio, dens, njobs, precision, glq_order)[0]
 
-def gxx(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gxx(lons, lats, heights, tesseroids, dens=None, ratio=1.5, njobs=1,
+        precision='float64', glq_order=4):
     """
     Calculate the xx (North-North) component of the gravity gradient tensor
     due to a tesseroid model.
     """
     return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gxx, ratio, dens)
+        ['gxx'], ratio, dens, njobs, precision, glq_order)[0]
 
-def gxy(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gxy(lons, lats, heights, tesseroids, dens=None, ratio=1.5, njobs=1,
+        precision='float64', glq_order=4):
     """
     Calculate the xy (North-East) component of the gravity gradient tensor
     due to a tesseroid model.
     """
     return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gxy, ratio, dens)
+        ['gxy'], ratio, dens, njobs, precision, glq_order)[0]
 
-def gxz(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gxz(lons, lats, heights, tesseroids, dens=None, ratio=1.5, njobs=1,
+        precision='float64', glq_order=4):
     """
     Calculate the xz (North-radial) component of the gravity gradient tensor
     due to a tesseroid model.
     """
     return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gxz, ratio, dens)
+        ['gxz'], ratio, dens, njobs, precision, glq_order)[0]
 
-def gyy(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gyy(lons, lats, heights, tesseroids, dens=None, ratio=1.5, njobs=1,
+        precision='float64', glq_order=4):
     """
     Calculate the yy (East-East) component of the gravity gradient tensor
     due to a tesseroid model.
     """
     return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gyy, ratio, dens)
+        ['gyy'], ratio, dens, njobs, precision, glq_order)[0]
 
-def gyz(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gyz(lons, lats, heights, tesseroids, dens=None, ratio=1.5, njobs=1,
+        precision='float64', glq_order=4):
     """
     Calculate the yz (East-radial) component of the gravity gradient tensor
     due to a tesseroid model.
     """
     return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gyz, ratio, dens)
-
+        ['gyz'], ratio, dens, njobs, precision, glq_order)[0]
 
-def gzz(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gzz(lons, lats, heights, tesseroids, dens=None, ratio=1.5, njobs=1,
+        precision='float64', glq_order=4):
     """
     Calculate the zz (radial-radial) component of the gravity gradient tensor
     due to a tesseroid model.
     """
-    result = SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gzz, ratio, dens)
-    return result
+    return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
+        ['gzz'], ratio, dens, njobs, precision, glq_order)[0]
 
-def _optimal_discretize(tesseroids, lons, lats, heights, kernel, ratio, dens):
+def _optimal_discretize(tesseroids, lons, lats, heights, kernels, ratio, dens,
+                        njobs, precision='float64', glq_order=2):
     """
-    Calculate the effect of a given kernal in the most precise way by adaptively
-    discretizing the tesseroids into smaller ones.
+    Calculate the effect of the given kernels in the most precise way by
+    adaptively discretizing the tesseroids into smaller ones. Returns a list
+    with the result of each kernel.
+
+    A tesseroid is divided in 8 while the distance to a computation point is
+    smaller than *ratio* times its size. The division is done by the kernels
+    module (on arrays of bounds) up to ``max_depth`` times.
     """
-    ndata = len(lons)
+    dtype = _precision_dtype(precision)
     # Convert things to radians
     d2r = numpy.pi/180.
-    rlons = d2r*lons
-    rlats = d2r*lats
+    rlons = numpy.ascontiguousarray(d2r*numpy.ravel(lons), dtype=numpy.float)
+    rlats = numpy.ascontiguousarray(d2r*numpy.ravel(lats), dtype=numpy.float)
     # Transform the heights into radii
-    radii = MEAN_EARTH_RADIUS + heights
-    # Start the computations
-    result = numpy.zeros(ndata, numpy.float)
-    maxsize = 10000
+    radii = numpy.ascontiguousarray(MEAN_EARTH_RADIUS + numpy.ravel(heights),
+                                    dtype=numpy.float)
+    glq = []
+    for order in _glq_orders(glq_order):
+        glq.extend(_glq(order))
+    grid = _mesh_grid(tesseroids, lons, lats, heights)
+    if grid is not None:
+        result, overflow = _lon_convolution(tesseroids, grid, kernels, ratio,
+                                            dens, glq, njobs)
+    else:
+        bounds, densities = _get_bounds(tesseroids, dens)
+        result, overflow = _kernels.calc(kernels, bounds, densities, rlons,
+            rlats, radii, ratio, *(glq + [max_depth, njobs]))
+    if overflow:
+        log.warning("Maximum depth of tesseroid divisions reached " +
+            "%d times. Integrated without dividing." % (overflow))
+    return list(numpy.asarray(result, dtype=dtype))
+
+def _glq(order):
+    """
+    Get the nodes and weights of the Gauss-Legendre Quadrature of a given
+    order. They are calculated only once for each order.
+    """
+    if order not in _glq_cache:
+        nodes, weights = numpy.polynomial.legendre.leggauss(order)
+        _glq_cache[order] = (numpy.ascontiguousarray(nodes),
+                             numpy.ascontiguousarray(weights))
+    return _glq_cache[order]
+
+def _glq_orders(glq_order):
+    """
+    Get the order of the GLQ in longitude, latitude and radius.
+    """
+    if numpy.isscalar(glq_order):
+        glq_order = [glq_order]*3
+    orders = [int(order) for order in glq_order]
+    if len(orders) != 3 or min(orders) < 1:
+        raise ValueError(
+            "glq_order must be a positive integer or a list of 3 of them")
+    return orders
+
+def _get_bounds(tesseroids, dens):
+    """
+    Get an array with the (w, e, s, n, top, bottom) bounds of the tesseroids
+    that have a density and an array with their densities.
+    """
+    bounds, densities = [], []
     for tesseroid in tesseroids:
         if (tesseroid is None or
             ('density' not in tesseroid.props and dens is None)):
             continue
         if dens is not None:
-            density = dens
+            densities.append(dens)
         else:
-            density = tesseroid.props['density']
-        lifo = [[numpy.arange(ndata), tesseroid]]
-        while lifo:
-            points_to_calc, tess = lifo.pop()
-            size = max([MEAN_EARTH_RADIUS*d2r*(tess.e - tess.w),
-                        MEAN_EARTH_RADIUS*d2r*(tess.n - tess.s),
-                        tess.top - tess.bottom])
-            distances = _distance(tess, rlons, rlats, radii, points_to_calc)
-            too_close = (distances > 0) & (distances < ratio*size)
-            need_divide = points_to_calc[too_close]
-            dont_divide = points_to_calc[~too_close]
-            if len(need_divide):
-                #if len(lifo) + 8 > maxsize:
-                #    log.warning("Maximum LIFO size reached")
-                #    dont_divide.extend(need_divide)
-                #else:
-                #    lifo.extend([need_divide, t] for t in _split(tess))
-                lifo.extend([need_divide, t] for t in _split(tess))
-            if len(dont_divide):
-                result[dont_divide] += G*density*kernel(
-                    tess, rlons[dont_divide], rlats[dont_divide],
-                    radii[dont_divide], _glq_nodes, _glq_weights)
-    return result
-
-def _split(tesseroid):
-    dlon = 0.5*(tesseroid.e - tesseroid.w)
-    dlat = 0.5*(tesseroid.n - tesseroid.s)
-    dh = 0.5*(tesseroid.top - tesseroid.bottom)
-    wests = [tesseroid.w, tesseroid.w + dlon]
-    souths = [tesseroid.s, tesseroid.s + dlat]
-    bottoms = [tesseroid.bottom, tesseroid.bottom + dh]
-    split = [
-        Tesseroid(i, i + dlon, j, j + dlat, k + dh, k, props=tesseroid.props)
-        for i in wests for j in souths for k in bottoms]
-    return split
-
-def _distance(tesseroid, lon, lat, radius, points):
-    lons = lon[points]
-    lats = lat[points]
-    radii = radius[points]
+            densities.append(tesseroid.props['density'])
+        bounds.append([tesseroid.w, tesseroid.e, tesseroid.s, tesseroid.n,
+                       tesseroid.top, tesseroid.bottom])
+    bounds = numpy.reshape(numpy.array(bounds, dtype=numpy.float),
+                           (len(densities), 6))
+    return bounds, numpy.array(densities, dtype=numpy.float)
+
+def _mesh_grid(tesseroids, lons, lats, heights):
+    """
+    Check if the computation points are a regular grid in longitude, at a
+    constant height, with the same longitude spacing as the tesseroid mesh.
+
+    The points must be ordered in rows of constant latitude (like the ones
+    made by :func:`fatiando.gridder.regular`). The latitudes of the rows can
+    be anything.
+
+    Returns the longitude of the first column, the latitudes of the rows, the
+    height and the number of columns of the grid. Returns None if
+    *tesseroids* is not a :class:`~fatiando.mesher.TesseroidMesh` or the
+    points are not such a grid.
+    """
+    # Check the attributes of the mesh instead of importing fatiando.mesher
+    # (and all of its dependencies)
+    if any(getattr(tesseroids, attr, None) is None
+           for attr in ['shape', 'dims', 'bounds', 'mask']):
+        return None
+    lons, lats, heights = [numpy.ravel(i) for i in [lons, lats, heights]]
+    if lons.size < 2 or numpy.any(heights != heights[0]):
+        return None
+    changes = numpy.flatnonzero(lats != lats[0])
+    ncols = changes[0] if changes.size else lats.size
+    if ncols < 2 or lons.size % ncols:
+        return None
+    shape = (lons.size//ncols, ncols)
+    lons, lats = lons.reshape(shape), lats.reshape(shape)
+    if numpy.any(lats != lats[:, :1]) or numpy.any(lons != lons[0]):
+        return None
+    dlon = tesseroids.dims[0]
+    if numpy.abs(numpy.diff(lons[0]) - dlon).max() > 10**(-8)*abs(dlon):
+        return None
+    return lons[0, 0], lats[:, 0], heights[0], ncols
+
+def _lon_convolution(mesh, grid, kernels, ratio, dens, glq, njobs):
+    """
+    Calculate the effect of a tesseroid mesh on a grid given by
+    :func:`~fatiando.gravmag.tesseroid._mesh_grid`.
+
+    The effect of a tesseroid on a point (in the local North, East, Up frame)
+    depends only on the difference between their longitudes. The tesseroids
+    in a latitude band of a layer of the mesh are the same tesseroid shifted
+    by whole columns of the grid. So the effect of a tesseroid of unit
+    density is calculated only once per band, on all longitude differences.
+    The effect of the band is the convolution of it with the densities along
+    longitude (done with FFTs). This takes the number of tesseroid-point pairs
+    from ``nlon*npoints`` to about ``2*npoints`` per band.
+
+    Returns the result of each kernel (an array with one row per kernel) and
+    the number of times that the maximum depth of divisions was reached.
+    """
+    lon0, lats, height, ncols = grid
+    nr, nlat, nlon = mesh.shape
+    w, s, top = mesh.bounds[0], mesh.bounds[2], mesh.bounds[4]
+    dlon, dlat, dr = mesh.dims
+    if dens is not None:
+        densities = dens*numpy.ones(mesh.size)
+    elif 'density' in mesh.props:
+        densities = numpy.array(mesh.props['density'], dtype=numpy.float)
+    else:
+        densities = numpy.zeros(mesh.size)
+    densities[numpy.array(mesh.mask, dtype=numpy.int)] = 0
+    densities = densities.reshape(mesh.shape)
+    # The points are at all longitude differences between the columns of the
+    # grid and the tesseroid in the first column of the mesh
+    size = nlon + ncols - 1
     d2r = numpy.pi/180.
-    tes_radius = tesseroid.top + MEAN_EARTH_RADIUS
-    tes_lat = d2r*0.5*(tesseroid.s + tesseroid.n)
-    tes_lon = d2r*0.5*(tesseroid.w + tesseroid.e)
-    distance = numpy.sqrt(
-        radii**2 + tes_radius**2 - 2.*radii*tes_radius*(
-            numpy.sin(lats)*numpy.sin(tes_lat) +
-            numpy.cos(lats)*numpy.cos(tes_lat)*
-            numpy.cos(lons - tes_lon)
-        ))
-    return distance
+    offsets = numpy.arange(-(nlon - 1), ncols)
+    rlons = numpy.tile(d2r*(lon0 + dlon*offsets), len(lats))
+    rlats = numpy.repeat(d2r*numpy.asarray(lats, dtype=numpy.float), size)
+    radii = (MEAN_EARTH_RADIUS + height)*numpy.ones(rlons.size)
+    spectrum = numpy.zeros((len(kernels), len(lats), size//2 + 1),
+                           dtype=numpy.complex)
+    overflow = 0
+    for k in xrange(nr):
+        for j in xrange(nlat):
+            if not numpy.any(densities[k, j]):
+                continue
+            south = s + dlat*j
+            layer = top + dr*k
+            band = numpy.array([[w, w + dlon, south, south + dlat, layer,
+                                 layer + dr]], dtype=numpy.float)
+            res, count = _kernels.calc(kernels, band, numpy.ones(1), rlons,
+                rlats, radii, ratio, *(glq + [max_depth, njobs]))
+            overflow += count
+            res = numpy.reshape(res, (len(kernels), len(lats), size))
+            spectrum += (numpy.fft.rfft(res, axis=-1)*
+                         numpy.fft.rfft(densities[k, j], size))
+    # The first nlon - 1 values of the circular convolution wrap around
+    result = numpy.fft.irfft(spectrum, size, axis=-1)[:, :, nlon - 1:]
+    return result.reshape((len(kernels), len(lats)*ncols)), overflow
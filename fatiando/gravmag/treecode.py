@@ -0,0 +1,524 @@
+r"""
+Fast forward modeling of large prism models using a Barnes-Hut tree code.
+
+The prisms are grouped in an octree. The effect of a group of prisms (a node of
+the tree) on a computation point that is far from it is approximated by the
+multipole expansion of the group (mass, dipole, and quadrupole moments about
+the center of the node). Nodes that are too close to the point are opened and
+their children are visited. The prisms of the leaves of the tree that are
+close to the point are calculated with the exact formulas of
+:mod:`fatiando.gravmag.prism`. The computation time grows like
+:math:`N_{data} \log N_{prisms}` instead of :math:`N_{data} N_{prisms}`.
+
+A node of size (diagonal) :math:`s` is approximated on a point at distance
+:math:`r` from its center if :math:`s < \theta r`. The opening angle
+:math:`\theta` controls the trade off between accuracy and speed. The error of
+each node is of the order of :math:`\theta^3` times its effect. Use
+:func:`~fatiando.gravmag.treecode.benchmark` to choose a value of
+:math:`\theta` for your model.
+
+**Gravity**
+
+* :func:`~fatiando.gravmag.treecode.gz`
+* :func:`~fatiando.gravmag.treecode.gxx`
+* :func:`~fatiando.gravmag.treecode.gxy`
+* :func:`~fatiando.gravmag.treecode.gxz`
+* :func:`~fatiando.gravmag.treecode.gyy`
+* :func:`~fatiando.gravmag.treecode.gyz`
+* :func:`~fatiando.gravmag.treecode.gzz`
+
+All functions take a list of prisms, a :class:`~fatiando.mesher.PrismMesh`, a
+:class:`~fatiando.mesher.PrismArray`, or a
+:class:`~fatiando.gravmag.treecode.PrismTree`. Build the tree once with
+:class:`~fatiando.gravmag.treecode.PrismTree` to calculate several components
+of the same model.
+
+**Benchmark**
+
+* :func:`~fatiando.gravmag.treecode.benchmark`: Time and maximum error of the
+  tree code for several opening angles compared with the exact formulas
+
+**Examples**
+
+    >>> import numpy
+    >>> from fatiando.mesher import PrismMesh
+    >>> from fatiando.gravmag import prism
+    >>> from fatiando import gridder
+    >>> mesh = PrismMesh((0, 1000, 0, 1000, 0, 500), (5, 10, 10))
+    >>> mesh.addprop('density', 1000*numpy.ones(mesh.size))
+    >>> xp, yp, zp = gridder.regular((-500, 1500, -500, 1500), (10, 10), z=-1)
+    >>> tree = PrismTree(mesh, leafsize=8)
+    >>> fast = gz(xp, yp, zp, tree, theta=0.3)
+    >>> exact = prism.gz(xp, yp, zp, mesh)
+    >>> numpy.abs(fast - exact).max()/numpy.abs(exact).max() < 0.001
+    True
+
+----
+
+"""
+import time
+
+import numpy
+from numpy import sqrt
+
+import fatiando.logger
+from fatiando.constants import SI2EOTVOS, SI2MGAL, G
+from fatiando.gravmag import _prism
+from fatiando.gravmag._prism import _get_props, _corners
+
+log = fatiando.logger.dummy('fatiando.gravmag.treecode')
+
+# Maximum number of point-node and point-prism pairs evaluated at once. Limits
+# the size of the temporary arrays
+_maxpairs = 2**16
+
+
+class PrismTree(object):
+    """
+    An octree of right rectangular prisms.
+
+    Each node stores the bounding box of its prisms, their total mass, and
+    their dipole and quadrupole moments about the center of the bounding box.
+    The quadrupole includes the second moments of each prism about its own
+    center.
+
+    Parameters:
+
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The model. Prisms that don't have the property ``'density'`` are
+        ignored. Can also be a :class:`~fatiando.mesher.PrismMesh` or a
+        :class:`~fatiando.mesher.PrismArray`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms.
+    * leafsize : int
+        Maximum number of prisms in a leaf of the tree.
+
+    """
+
+    def __init__(self, prisms, dens=None, leafsize=16):
+        if leafsize < 1:
+            raise ValueError("leafsize must be at least 1")
+        self.leafsize = leafsize
+        bounds, values = _get_props(prisms, 'density', dens)
+        self.bounds = numpy.array(bounds, dtype=numpy.float)
+        self.density = numpy.array(values, dtype=numpy.float)
+        x1, x2, y1, y2, z1, z2 = self.bounds
+        self.mass = self.density*(x2 - x1)*(y2 - y1)*(z2 - z1)
+        self.centers = numpy.array([0.5*(x1 + x2), 0.5*(y1 + y2),
+                                    0.5*(z1 + z2)])
+        self.sides = numpy.array([x2 - x1, y2 - y1, z2 - z1])
+        self._nodes = {'center':[], 'size':[], 'mass':[], 'dipole':[],
+                       'quadrupole':[], 'children':[], 'start':[], 'stop':[]}
+        self._order = []
+        if self.density.size > 0:
+            self._build(numpy.arange(self.density.size))
+        nodes = self._nodes
+        self.center = numpy.array(nodes['center'], dtype=numpy.float)
+        self.size = numpy.array(nodes['size'], dtype=numpy.float)
+        self.nodemass = numpy.array(nodes['mass'], dtype=numpy.float)
+        self.dipole = numpy.array(nodes['dipole'], dtype=numpy.float)
+        self.quadrupole = numpy.array(nodes['quadrupole'], dtype=numpy.float)
+        self.children = numpy.array(nodes['children'], dtype=numpy.int)
+        self.start = numpy.array(nodes['start'], dtype=numpy.int)
+        self.stop = numpy.array(nodes['stop'], dtype=numpy.int)
+        self.leaf = numpy.all(self.children < 0, axis=1)
+        self.order = numpy.array(self._order, dtype=numpy.int)
+        del self._nodes, self._order
+        log.info("Built prism octree:")
+        log.info("  prisms: %d" % (self.density.size))
+        log.info("  nodes: %d" % (len(self.start)))
+
+    def __len__(self):
+        return len(self.start)
+
+    def _build(self, index):
+        """
+        Add the node with the prisms in *index* and its children to the tree.
+        Returns the number of the node.
+        """
+        nodes = self._nodes
+        node = len(nodes['start'])
+        x1, x2, y1, y2, z1, z2 = self.bounds[:, index]
+        lower = numpy.array([x1.min(), y1.min(), z1.min()])
+        upper = numpy.array([x2.max(), y2.max(), z2.max()])
+        center = 0.5*(lower + upper)
+        mass = self.mass[index]
+        nodes['center'].append(center)
+        nodes['size'].append(sqrt(((upper - lower)**2).sum()))
+        nodes['mass'].append(mass.sum())
+        dist = self.centers[:, index] - center[:, None]
+        nodes['dipole'].append((mass*dist).sum(axis=1))
+        # Second moments of the prisms about the center of the node, including
+        # the moments of each prism about its own center
+        quad = numpy.dot(mass*dist, dist.T)
+        quad[range(3), range(3)] += (mass*self.sides[:, index]**2).sum(
+            axis=1)/12.
+        nodes['quadrupole'].append(quad)
+        nodes['children'].append([-1]*8)
+        nodes['start'].append(len(self._order))
+        nodes['stop'].append(None)
+        centers = self.centers[:, index]
+        middle = 0.5*(centers.min(axis=1) + centers.max(axis=1))
+        octant = ((centers[0] > middle[0]) + 2*(centers[1] > middle[1])
+                  + 4*(centers[2] > middle[2]))
+        # Prisms with the same center can't be split
+        if len(index) <= self.leafsize or numpy.all(octant == octant[0]):
+            self._order.extend(index)
+        else:
+            children = nodes['children'][node]
+            for i in xrange(8):
+                inside = index[octant == i]
+                if len(inside) > 0:
+                    children[i] = self._build(inside)
+        nodes['stop'][node] = len(self._order)
+        return node
+
+def _get_tree(prisms, dens, leafsize):
+    if isinstance(prisms, PrismTree):
+        if dens is not None:
+            raise ValueError("Can't use dens with a PrismTree")
+        return prisms
+    return PrismTree(prisms, dens, leafsize)
+
+def gz(xp, yp, zp, prisms, dens=None, theta=0.5, leafsize=16):
+    """
+    Calculates the :math:`g_z` gravity acceleration component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!) and output in **mGal**!
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism` or a PrismTree
+        The density model used to calculate the gravitational effect.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the prisms. Can't be used if *prisms* is a
+        :class:`~fatiando.gravmag.treecode.PrismTree`.
+    * theta : float
+        The opening angle. Smaller values are more accurate and slower.
+    * leafsize : int
+        Maximum number of prisms in the leaves of the tree. Ignored if
+        *prisms* is a :class:`~fatiando.gravmag.treecode.PrismTree`.
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    tree = _get_tree(prisms, dens, leafsize)
+    res = _forward(tree, 'gz', xp, yp, zp, theta)
+    res *= G*SI2MGAL
+    return res
+
+def gxx(xp, yp, zp, prisms, dens=None, theta=0.5, leafsize=16):
+    """
+    Calculates the :math:`g_{xx}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!) and output in **Eotvos**!
+
+    Parameters: see :func:`~fatiando.gravmag.treecode.gz`
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    tree = _get_tree(prisms, dens, leafsize)
+    res = _forward(tree, 'gxx', xp, yp, zp, theta)
+    res *= G*SI2EOTVOS
+    return res
+
+def gxy(xp, yp, zp, prisms, dens=None, theta=0.5, leafsize=16):
+    """
+    Calculates the :math:`g_{xy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!) and output in **Eotvos**!
+
+    Parameters: see :func:`~fatiando.gravmag.treecode.gz`
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    tree = _get_tree(prisms, dens, leafsize)
+    res = _forward(tree, 'gxy', xp, yp, zp, theta)
+    res *= G*SI2EOTVOS
+    return res
+
+def gxz(xp, yp, zp, prisms, dens=None, theta=0.5, leafsize=16):
+    """
+    Calculates the :math:`g_{xz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!) and output in **Eotvos**!
+
+    Parameters: see :func:`~fatiando.gravmag.treecode.gz`
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    tree = _get_tree(prisms, dens, leafsize)
+    res = _forward(tree, 'gxz', xp, yp, zp, theta)
+    res *= G*SI2EOTVOS
+    return res
+
+def gyy(xp, yp, zp, prisms, dens=None, theta=0.5, leafsize=16):
+    """
+    Calculates the :math:`g_{yy}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!) and output in **Eotvos**!
+
+    Parameters: see :func:`~fatiando.gravmag.treecode.gz`
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    tree = _get_tree(prisms, dens, leafsize)
+    res = _forward(tree, 'gyy', xp, yp, zp, theta)
+    res *= G*SI2EOTVOS
+    return res
+
+def gyz(xp, yp, zp, prisms, dens=None, theta=0.5, leafsize=16):
+    """
+    Calculates the :math:`g_{yz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!) and output in **Eotvos**!
+
+    Parameters: see :func:`~fatiando.gravmag.treecode.gz`
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    tree = _get_tree(prisms, dens, leafsize)
+    res = _forward(tree, 'gyz', xp, yp, zp, theta)
+    res *= G*SI2EOTVOS
+    return res
+
+def gzz(xp, yp, zp, prisms, dens=None, theta=0.5, leafsize=16):
+    """
+    Calculates the :math:`g_{zz}` gravity gradient tensor component.
+
+    .. note:: The coordinate system of the input parameters is to be x -> North,
+        y -> East and z -> Down.
+
+    .. note:: All input values in **SI** units(!) and output in **Eotvos**!
+
+    Parameters: see :func:`~fatiando.gravmag.treecode.gz`
+
+    Returns:
+
+    * res : array
+        The field calculated on xp, yp, zp
+
+    """
+    tree = _get_tree(prisms, dens, leafsize)
+    res = _forward(tree, 'gzz', xp, yp, zp, theta)
+    res *= G*SI2EOTVOS
+    return res
+
+def benchmark(xp, yp, zp, prisms, field='gz', thetas=(0.2, 0.4, 0.6, 0.8),
+              dens=None, leafsize=16):
+    """
+    Compare the tree code with the exact formulas for several opening angles.
+
+    Parameters:
+
+    * xp, yp, zp : arrays
+        Arrays with the x, y, and z coordinates of the computation points.
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The density model. Can also be a :class:`~fatiando.mesher.PrismMesh`
+        or :class:`~fatiando.mesher.PrismArray`.
+    * field : str
+        The component to calculate, e.g. ``'gz'`` or ``'gzz'``.
+    * thetas : list
+        The opening angles to test.
+    * dens, leafsize
+        See :func:`~fatiando.gravmag.treecode.gz`
+
+    Returns:
+
+    * [exact, build, times, errors]
+        *exact* is the time taken by :mod:`fatiando.gravmag.prism`, *build*
+        the time taken to build the tree, *times* the times taken by the tree
+        code for each opening angle in *thetas* (without building the tree),
+        and *errors* the maximum absolute difference to the exact result
+        divided by the maximum absolute value of the exact result.
+
+    """
+    from fatiando.gravmag import prism
+    if field not in _multipoles:
+        raise ValueError("Invalid field '%s'" % (field))
+    start = time.time()
+    true = getattr(prism, field)(xp, yp, zp, prisms, dens=dens)
+    exact = time.time() - start
+    start = time.time()
+    tree = PrismTree(prisms, dens, leafsize)
+    build = time.time() - start
+    times, errors = [], []
+    for theta in thetas:
+        start = time.time()
+        res = globals()[field](xp, yp, zp, tree, theta=theta)
+        times.append(time.time() - start)
+        errors.append(numpy.abs(res - true).max()/numpy.abs(true).max())
+    return [exact, build, numpy.array(times), numpy.array(errors)]
+
+def _forward(tree, field, xp, yp, zp, theta):
+    """
+    Traverse the tree for all computation points and sum the effect of the
+    nodes (multipole) and prisms (exact) that are used. Units of G = 1.
+    """
+    if xp.shape != yp.shape != zp.shape:
+        raise ValueError("Input arrays xp, yp, and zp must have same shape!")
+    shape = xp.shape
+    xp, yp, zp = [numpy.ravel(i) for i in [xp, yp, zp]]
+    res = numpy.zeros(xp.size, dtype=numpy.float)
+    if len(tree) == 0:
+        return res.reshape(shape)
+    # Each element of the stack is a pair of arrays with the point-node pairs
+    # that still have to be visited. Going depth first keeps only a few of
+    # them in memory.
+    stack = [(numpy.arange(xp.size), numpy.zeros(xp.size, dtype=numpy.int))]
+    while stack:
+        points, nodes = stack.pop()
+        if len(points) > _maxpairs:
+            half = len(points)//2
+            stack.append((points[half:], nodes[half:]))
+            stack.append((points[:half], nodes[:half]))
+            continue
+        # Position of the center of the node relative to the point
+        x = tree.center[nodes, 0] - xp[points]
+        y = tree.center[nodes, 1] - yp[points]
+        z = tree.center[nodes, 2] - zp[points]
+        r = sqrt(x**2 + y**2 + z**2)
+        far = tree.size[nodes] < theta*r
+        if far.any():
+            accepted = nodes[far]
+            effect = _multipoles[field](
+                x[far], y[far], z[far], r[far], tree.nodemass[accepted],
+                tree.dipole[accepted].T,
+                tree.quadrupole[accepted].transpose((1, 2, 0)))
+            res += numpy.bincount(points[far], weights=effect,
+                                  minlength=res.size)
+        near = ~far
+        leaf = near & tree.leaf[nodes]
+        if leaf.any():
+            res += _leaves(tree, field, xp, yp, zp, points[leaf], nodes[leaf])
+        inner = near & ~tree.leaf[nodes]
+        if inner.any():
+            children = tree.children[nodes[inner]].ravel()
+            points = numpy.repeat(points[inner], 8)
+            stack.append((points[children >= 0], children[children >= 0]))
+    return res.reshape(shape)
+
+def _leaves(tree, field, xp, yp, zp, points, nodes):
+    """
+    Calculate the exact effect of the prisms in the leaves *nodes* on
+    *points*.
+    """
+    res = numpy.zeros(xp.size, dtype=numpy.float)
+    kernel = getattr(_prism, '_kernel_' + field)
+    counts = tree.stop[nodes] - tree.start[nodes]
+    # Split the pairs so that there are at most _maxpairs prism-point pairs in
+    # each block
+    total = numpy.cumsum(counts)
+    splits = numpy.searchsorted(total, numpy.arange(_maxpairs, total[-1],
+                                                    _maxpairs))
+    for block in numpy.split(numpy.arange(len(nodes)), splits):
+        if len(block) == 0:
+            continue
+        bcounts = counts[block]
+        offsets = numpy.arange(bcounts.sum()) - numpy.repeat(
+            numpy.cumsum(bcounts) - bcounts, bcounts)
+        prisms = tree.order[numpy.repeat(tree.start[nodes[block]], bcounts)
+                            + offsets]
+        bpoints = numpy.repeat(points[block], bcounts)
+        x1, x2, y1, y2, z1, z2 = tree.bounds[:, prisms]
+        x = [x2 - xp[bpoints], x1 - xp[bpoints]]
+        y = [y2 - yp[bpoints], y1 - yp[bpoints]]
+        z = [z2 - zp[bpoints], z1 - zp[bpoints]]
+        effect = _corners(kernel, x, y, z)*tree.density[prisms]
+        res += numpy.bincount(bpoints, weights=effect, minlength=xp.size)
+    return res
+
+def _derivative(index, x, r):
+    """
+    Derivative of 1/r with respect to the coordinates in *index* (a list with
+    up to 4 of 0, 1, 2 for x, y, z).
+    """
+    n = len(index)
+    coords = [x[i] for i in index]
+    delta = lambda a, b: 1. if index[a] == index[b] else 0.
+    if n == 1:
+        return -coords[0]/r**3
+    if n == 2:
+        return (3*coords[0]*coords[1] - delta(0, 1)*r**2)/r**5
+    if n == 3:
+        a, b, c = coords
+        return (-15*a*b*c/r**7
+                + 3*(a*delta(1, 2) + b*delta(0, 2) + c*delta(0, 1))/r**5)
+    a, b, c, d = coords
+    return (105*a*b*c*d/r**9
+            - 15*(a*b*delta(2, 3) + a*c*delta(1, 3) + a*d*delta(1, 2)
+                  + b*c*delta(0, 3) + b*d*delta(0, 2) + c*d*delta(0, 1))/r**7
+            + 3*(delta(0, 1)*delta(2, 3) + delta(0, 2)*delta(1, 3)
+                 + delta(0, 3)*delta(1, 2))/r**5)
+
+def _multipole(index, x, y, z, r, mass, dipole, quadrupole):
+    """
+    Derivatives of the potential of a node (per unit G) with respect to the
+    coordinates in *index*. x, y, z are the coordinates of the center of the
+    node relative to the computation point. Uses the Taylor expansion of 1/r
+    around the center of the node up to second order (mass, dipole, and
+    quadrupole moments).
+    """
+    x = [x, y, z]
+    res = mass*_derivative(index, x, r)
+    for a in xrange(3):
+        res += dipole[a]*_derivative([a] + index, x, r)
+        for b in xrange(3):
+            res += 0.5*quadrupole[a, b]*_derivative([a, b] + index, x, r)
+    return res
+
+# Derivatives that give each field. gz is the derivative in the direction of
+# the mass (-z) because the origin is on the computation point.
+_multipoles = {
+    'gz':lambda *args: -_multipole([2], *args),
+    'gxx':lambda *args: _multipole([0, 0], *args),
+    'gxy':lambda *args: _multipole([0, 1], *args),
+    'gxz':lambda *args: _multipole([0, 2], *args),
+    'gyy':lambda *args: _multipole([1, 1], *args),
+    'gyz':lambda *args: _multipole([1, 2], *args),
+    'gzz':lambda *args: _multipole([2, 2], *args)}
@@ -11,6 +11,11 @@ Simple GUIs using the interactive capabilities of :mod:`matplotlib`
 
 * :class:`~fatiando.gui.simple.Lasagne`
 
+The effect of each element of the model (polygon or layer) is cached. When the
+user changes an element, only its effect is calculated again. The figures are
+redrawn at most ``fps`` times per second, no matter how many mouse events
+arrive.
+
 ----
 
 """
@@ -28,6 +33,38 @@ import fatiando.logger
 
 log = fatiando.logger.dummy('fatiando.gui.simple')
 
+class _Redraw(object):
+    """
+    Redraw the canvas of a figure at most *fps* times per second.
+
+    Calling it only marks the figure as needing a redraw. A timer of the canvas
+    does the actual drawing. Matplotlib can only draw from the GUI thread, so
+    the timer runs in the event loop instead of in a separate thread. Before
+    :meth:`~fatiando.gui.simple._Redraw.start`, draws immediately.
+    """
+
+    def __init__(self, fig, fps):
+        self.canvas = fig.canvas
+        self.interval = int(1000./fps)
+        self.timer = None
+        self.stale = False
+
+    def __call__(self):
+        if self.timer is None:
+            self.canvas.draw()
+        else:
+            self.stale = True
+
+    def start(self):
+        self.timer = self.canvas.new_timer(interval=self.interval)
+        self.timer.add_callback(self.refresh)
+        self.timer.start()
+
+    def refresh(self):
+        if self.stale:
+            self.stale = False
+            self.canvas.draw()
+
 class Moulder():
     """
     Interactive potential field direct modeling in 2D using polygons.
@@ -69,6 +106,8 @@ class Moulder():
     instructions = ("Click to start drawing - Choose density using the slider" +
                     " - Left click to close polygon - 'e' to delete")
     name = "Moulder - Direct gravimetric modeling"
+    #: Maximum number of redraws per second
+    fps = 25
 
     def __init__(self, area, xp, zp, gz=None):
         if len(zp) != len(xp):
@@ -88,7 +127,7 @@ class Moulder():
         self.fig = pyplot.figure(figsize=(12,8))
         self.fig.canvas.set_window_title(self.name)
         self.fig.suptitle(self.instructions)
-        self.draw = self.fig.canvas.draw
+        self.draw = _Redraw(self.fig, self.fps)
         # Make the data and model canvas
         self.dcanvas = self.fig.add_subplot(2, 1, 1)
         self.dcanvas.set_ylabel("mGal")
@@ -120,6 +159,9 @@ class Moulder():
         self.error = 0.
         self.densities = []
         self.polygons = []
+        # The gz of each polygon with unit density. None means that the polygon
+        # changed and its effect needs to be calculated again
+        self.effects = []
         self.nextpoly = []
         self.plotx = []
         self.ploty = []
@@ -131,6 +173,7 @@ class Moulder():
         self.picking = False
         self.connect()
         self.update()
+        self.draw.start()
         pyplot.show()
 
     def get_data(self):
@@ -148,12 +191,19 @@ class Moulder():
         self.fig.canvas.mpl_connect('motion_notify_event', self.move)
 
     def update(self):
+        # Only calculate the effect of the polygons that changed. The effects
+        # are linear on the density, so changing it needs no calculations
+        changed = [i for i, e in enumerate(self.effects) if e is None]
+        if changed:
+            polys = [Polygon(1000.*numpy.array(self.polygons[i]),
+                             {'density':1.})
+                     for i in changed]
+            for i, effect in zip(changed,
+                                 talwani.gz_batch(self.xp, self.zp, polys)):
+                self.effects[i] = effect
         if self.polygons:
-            polys = []
-            for p, d in zip(self.polygons, self.densities):
-                polys.append(Polygon(1000.*numpy.array(p), {'density':d}))
-            self.predgz = utils.contaminate(talwani.gz(self.xp, self.zp, polys),
-                self.error)
+            self.predgz = utils.contaminate(
+                numpy.dot(self.densities, self.effects), self.error)
         else:
             self.predgz = numpy.zeros_like(self.xp)
         self.predplot.set_data(self.xp*0.001, self.predgz)
@@ -192,6 +242,7 @@ class Moulder():
             if len(self.nextpoly) >= 3:
                 self.polygons.append(self.nextpoly)
                 self.densities.append(float(self.nextdens))
+                self.effects.append(None)
                 self.update()
                 self.picking = False
                 self.plotx.append(self.nextpoly[0][0])
@@ -230,6 +281,7 @@ class Moulder():
                     return 0
                 self.polygons.pop()
                 self.densities.pop()
+                self.effects.pop()
                 line, fill = self.polyplots.pop()
                 line.remove()
                 fill.remove()
@@ -286,6 +338,7 @@ class BasinTrap(Moulder):
         left, right = numpy.array(nodes)*0.001
         z1 = z2 = 0.001*0.5*(area[3] - area[2])
         self.polygons = [[left, right, [right[0], z1], [left[0], z2]]]
+        self.effects = [None]
         self.nextdens = -1000
         self.densslider.set_val(self.nextdens*0.001)
         self.densities = [self.nextdens]
@@ -330,6 +383,7 @@ class BasinTrap(Moulder):
             else:
                 self.polygons[0][2][1] = y
                 self.ploty[2] = y
+            self.effects[0] = None
             self.polyline.set_data(self.plotx, self.ploty)
             self.guide.set_data([], [])
             self.update()
@@ -391,6 +445,7 @@ class BasinTri(Moulder):
         z = 0.001*0.5*(area[3] - area[2])
         x = 0.5*(right[0] + left[0])
         self.polygons = [[left, right, [x, z]]]
+        self.effects = [None]
         self.nextdens = -1000
         self.densslider.set_val(self.nextdens*0.001)
         self.densities = [self.nextdens]
@@ -425,6 +480,7 @@ class BasinTri(Moulder):
         x, y = event.xdata, event.ydata
         if (event.button == 1):
             self.polygons[0][2] = [x, y]
+            self.effects[0] = None
             self.plotx[2] = x
             self.ploty[2] = y
             self.polyline.set_data(self.plotx, self.ploty)
@@ -477,6 +533,8 @@ class Lasagne():
 
     instructions = "Click to set the velocity of the layers"
     name = "Lasagne - Vertical seismic profiling for 1D layered media"
+    #: Maximum number of redraws per second
+    fps = 25
 
     def __init__(self, thickness, zp, vmin, vmax, tts=None):
         if tts is not None:
@@ -491,7 +549,7 @@ class Lasagne():
         self.fig = pyplot.figure(figsize=(14,8))
         self.fig.canvas.set_window_title(self.name)
         self.fig.suptitle(self.instructions)
-        self.draw = self.fig.canvas.draw
+        self.draw = _Redraw(self.fig, self.fps)
         # Make the data and model canvas
         self.dcanvas = self.fig.add_subplot(1, 2, 1)
         self.dcanvas.set_ylabel("Depth (m)")
@@ -513,9 +571,13 @@ class Lasagne():
             0, 10, valinit=0., valfmt='%2.1f (percent)')
         # Initialize the data
         self.error = 0.
-        self.velocity = vmin*numpy.ones_like(thickness)
-        self.predtts = fatiando.seismic.profile.vertical(thickness, self.velocity,
-                                                      zp)
+        self.velocity = vmin*numpy.ones(len(thickness))
+        # The distance traveled inside each layer (one row per layer). The
+        # travel-times are the slownesses times these distances, so changing a
+        # velocity doesn't need any ray tracing
+        self.distances = fatiando.seismic.profile.VerticalSlownessDM(
+            numpy.zeros(len(zp)), zp, thickness).jac_T
+        self.predtts = numpy.dot(1./self.velocity, self.distances)
         self.layers = [sum(thickness[:i]) for i in xrange(len(thickness) + 1)]
         self.predplot, = self.dcanvas.plot(self.predtts, zp, '-r', linewidth=2)
         if self.tts is not None:
@@ -533,6 +595,7 @@ class Lasagne():
 
     def run(self):
         self.connect()
+        self.draw.start()
         pyplot.show()
 
     def get_data(self):
@@ -555,9 +618,8 @@ class Lasagne():
 
     def update(self):
         self.predtts = utils.contaminate(
-            fatiando.seismic.profile.vertical(self.thickness, self.velocity,
-                self.zp),
-            self.error, percent=True)
+            numpy.dot(1./self.velocity, self.distances), self.error,
+            percent=True)
         self.predplot.set_data(self.predtts, self.zp)
         if self.tts is not None:
             xmin = min(self.predtts.min(), self.tts.min())
@@ -17,8 +17,20 @@ Generate and operate on various kinds of meshes and geometric elements
 * :class:`~fatiando.mesher.PrismRelief`
 * :class:`~fatiando.mesher.TesseroidMesh`
 
+**Array containers**
+
+* :class:`~fatiando.mesher.PrismArray`
+* :class:`~fatiando.mesher.PolygonalPrismArray`
+* :class:`~fatiando.mesher.SphereArray`
+
 **Utility functions**
 
+* :func:`~fatiando.mesher.prisms2array`: Convert a list of prisms into a
+  :class:`~fatiando.mesher.PrismArray`
+* :func:`~fatiando.mesher.polyprisms2array`: Convert a list of polygonal prisms
+  into a :class:`~fatiando.mesher.PolygonalPrismArray`
+* :func:`~fatiando.mesher.spheres2array`: Convert a list of spheres into a
+  :class:`~fatiando.mesher.SphereArray`
 * :func:`~fatiando.mesher.extract`: Extract the values of a physicalr
   property from the cells in a list
 * :func:`~fatiando.mesher.vfilter`: Remove cells whose physical property
@@ -1041,6 +1053,54 @@ class PrismMesh(object):
         layer = [self.__getitem__(p) for p in xrange(start, end)]
         return layer
 
+    def toarray(self):
+        """
+        Export the mesh to a :class:`~fatiando.mesher.PrismArray`.
+
+        The borders of the prisms are generated directly as arrays, without
+        creating any :class:`~fatiando.mesher.Prism`. The physical property
+        arrays of the mesh are used as they are (they are only copied if they
+        are not float arrays already). Masked prisms (see
+        :meth:`~fatiando.mesher.PrismMesh.carvetopo`) are left out.
+
+        Returns:
+
+        * prisms : :class:`~fatiando.mesher.PrismArray`
+            The prisms of the mesh
+
+        Examples::
+
+            >>> props = {'density':[2670.0, 1000.0]}
+            >>> mesh = PrismMesh((0, 2, 0, 4, 0, 3), (1, 1, 2), props=props)
+            >>> prisms = mesh.toarray()
+            >>> len(prisms)
+            2
+            >>> for p in prisms:
+            ...     print p
+            x1:0 | x2:1 | y1:0 | y2:4 | z1:0 | z2:3 | density:2670
+            x1:1 | x2:2 | y1:0 | y2:4 | z1:0 | z2:3 | density:1000
+
+        """
+        nz, ny, nx = self.shape
+        dx, dy, dz = self.dims
+        # Use the same operations as __getitem__ so that the borders are
+        # exactly the same as the ones of the Prism objects
+        i = numpy.tile(numpy.arange(nx), ny*nz)
+        j = numpy.tile(numpy.repeat(numpy.arange(ny), nx), nz)
+        k = numpy.repeat(numpy.arange(nz), nx*ny)
+        x1 = self.bounds[0] + dx*i
+        y1 = self.bounds[2] + dy*j
+        z1 = self.bounds[4] + dz*k
+        bounds = [x1, x1 + dx, y1, y1 + dy, z1, z1 + dz]
+        props = dict((p, numpy.asarray(self.props[p], dtype=numpy.float))
+                     for p in self.props)
+        if self.mask:
+            keep = numpy.ones(self.size, dtype=numpy.bool)
+            keep[self.mask] = False
+            bounds = [b[keep] for b in bounds]
+            props = dict((p, props[p][keep]) for p in props)
+        return PrismArray(*bounds, props=props)
+
     def dump(self, meshfile, propfile, prop):
         r"""
         Dump the mesh to a file in the format required by UBC-GIF program
@@ -1105,6 +1165,332 @@ class PrismMesh(object):
                 self.shape), order='F'),
             fmt='%.4f')
 
+class PrismArray(object):
+    """
+    A collection of 3D right rectangular prisms stored as arrays.
+
+    Instead of one :class:`~fatiando.mesher.Prism` object per prism, the
+    borders and the physical properties of all prisms are kept in contiguous
+    float arrays (a structure of arrays). The forward modeling functions in
+    :mod:`fatiando.gravmag.prism` work directly on these arrays, without any
+    Python overhead per prism. Use it for models with a large number of prisms.
+
+    :class:`~fatiando.mesher.PrismArray` can used as list of prisms. It can be
+    iterated, indexed and has a length. Indexing returns a new
+    :class:`~fatiando.mesher.Prism`. Slicing returns a new
+    :class:`~fatiando.mesher.PrismArray` with the sliced arrays (views of the
+    arrays of this one if the step is 1).
+
+    Use :func:`~fatiando.mesher.prisms2array` to convert a list of prisms and
+    :meth:`~fatiando.mesher.PrismMesh.toarray` to export a
+    :class:`~fatiando.mesher.PrismMesh`.
+
+    .. note:: The coordinate system used is x -> North, y -> East and z -> Down
+
+    Parameters:
+
+    * x1, x2 : arrays
+        South and north borders of the prisms
+    * y1, y2 : arrays
+        West and east borders of the prisms
+    * z1, z2 : arrays
+        Tops and bottoms of the prisms
+    * props : dict
+        Physical properties of the prisms. Each key should be the name of a
+        physical property. The corresponding value should be a list or array
+        with the value of that property for each prism. Use ``nan`` for prisms
+        that don't have the property.
+
+    Examples:
+
+        >>> prisms = PrismArray([0, 1], [1, 2], [0, 0], [4, 4], [0, 0], [3, 3],
+        ...                     props={'density':[2670, 1000]})
+        >>> len(prisms)
+        2
+        >>> print prisms[-1]
+        x1:1 | x2:2 | y1:0 | y2:4 | z1:0 | z2:3 | density:1000
+        >>> prisms.addprop('magnetization', [5, numpy.nan])
+        >>> for p in prisms:
+        ...     print p
+        x1:0 | x2:1 | y1:0 | y2:4 | z1:0 | z2:3 | density:2670 | magnetization:5
+        x1:1 | x2:2 | y1:0 | y2:4 | z1:0 | z2:3 | density:1000
+        >>> part = prisms[1:]
+        >>> len(part)
+        1
+        >>> print part[0]
+        x1:1 | x2:2 | y1:0 | y2:4 | z1:0 | z2:3 | density:1000
+
+    """
+
+    def __init__(self, x1, x2, y1, y2, z1, z2, props=None):
+        object.__init__(self)
+        self.x1 = numpy.ascontiguousarray(x1, dtype=numpy.float)
+        self.x2 = numpy.ascontiguousarray(x2, dtype=numpy.float)
+        self.y1 = numpy.ascontiguousarray(y1, dtype=numpy.float)
+        self.y2 = numpy.ascontiguousarray(y2, dtype=numpy.float)
+        self.z1 = numpy.ascontiguousarray(z1, dtype=numpy.float)
+        self.z2 = numpy.ascontiguousarray(z2, dtype=numpy.float)
+        self.size = len(self.x1)
+        for b in [self.x2, self.y1, self.y2, self.z1, self.z2]:
+            if len(b) != self.size:
+                raise ValueError("Prism borders must all have the same length")
+        self.props = {}
+        if props is not None:
+            for p in props:
+                self.addprop(p, props[p])
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            props = dict((p, self.props[p][index]) for p in self.props)
+            return PrismArray(*[b[index] for b in self.get_bounds()],
+                              props=props)
+        if not isinstance(index, (int, long, numpy.integer)):
+            raise TypeError('prism indices must be integers or slices, not %s'
+                            % (type(index).__name__))
+        if index >= self.size or index < -self.size:
+            raise IndexError('prism index out of range')
+        props = dict([p, self.props[p][index]] for p in self.props
+                     if not numpy.isnan(self.props[p][index]))
+        return Prism(self.x1[index], self.x2[index], self.y1[index],
+                     self.y2[index], self.z1[index], self.z2[index], props)
+
+    def __iter__(self):
+        return (self.__getitem__(i) for i in xrange(self.size))
+
+    def addprop(self, prop, values):
+        """
+        Add physical property values to the prisms.
+
+        Parameters:
+
+        * prop : str
+            Name of the physical property.
+        * values :  list or array
+            Value of this physical property in each prism. Use ``nan`` for
+            prisms that don't have this property.
+
+        """
+        values = numpy.ascontiguousarray(values, dtype=numpy.float)
+        if len(values) != self.size:
+            raise ValueError("Need one value of '%s' per prism" % (prop))
+        self.props[prop] = values
+
+    def get_bounds(self):
+        """
+        Get the borders of the prisms.
+
+        Returns:
+
+        * bounds : list
+            ``[x1, x2, y1, y2, z1, z2]``, arrays with the borders of the prisms
+
+        """
+        return [self.x1, self.x2, self.y1, self.y2, self.z1, self.z2]
+
+class PolygonalPrismArray(object):
+    """
+    A collection of 3D prisms with polygonal crossection stored as arrays.
+
+    The vertices of all prisms are packed one after the other in the arrays
+    *x* and *y*. *nverts* has the number of vertices of each prism, so the
+    vertices of prism ``i`` are ``x[offsets[i]:offsets[i + 1]]``. The forward
+    modeling functions of :mod:`fatiando.gravmag.polyprism` in the Cython
+    module work directly on these arrays, without any Python overhead per
+    prism or vertex. Use it for models with a large number of polygonal
+    prisms.
+
+    :class:`~fatiando.mesher.PolygonalPrismArray` can used as list of prisms.
+    It can be iterated, indexed and has a length. Indexing returns a new
+    :class:`~fatiando.mesher.PolygonalPrism`.
+
+    Use :func:`~fatiando.mesher.polyprisms2array` to convert a list of
+    polygonal prisms.
+
+    .. note:: The coordinate system used is x -> North, y -> East and z -> Down
+
+    .. note:: The vertices of each prism must be **CLOCKWISE** or will give
+        inverse result.
+
+    Parameters:
+
+    * x, y : arrays
+        Coordinates of the vertices of all prisms
+    * nverts : list of int
+        The number of vertices of each prism
+    * z1, z2 : arrays
+        Tops and bottoms of the prisms
+    * props : dict
+        Physical properties of the prisms. Each key should be the name of a
+        physical property. The corresponding value should be a list or array
+        with the value of that property for each prism. Use ``nan`` for prisms
+        that don't have the property.
+
+    Examples:
+
+        >>> prisms = PolygonalPrismArray([0, 0, 1, 1, 0, 1], [0, 1, 1, 0, 0, 0],
+        ...                              [4, 2], [0, 2], [1, 3],
+        ...                              props={'density':[2670, 1000]})
+        >>> len(prisms)
+        2
+        >>> prisms.offsets
+        array([0, 4, 6])
+        >>> p = prisms[1]
+        >>> print p.x, p.y, p.z1, p.z2, p.props
+        [ 0.  1.] [ 0.  0.] 2.0 3.0 {'density': 1000.0}
+
+    """
+
+    def __init__(self, x, y, nverts, z1, z2, props=None):
+        object.__init__(self)
+        self.x = numpy.ascontiguousarray(x, dtype=numpy.float)
+        self.y = numpy.ascontiguousarray(y, dtype=numpy.float)
+        self.nverts = numpy.ascontiguousarray(nverts, dtype=numpy.int)
+        self.z1 = numpy.ascontiguousarray(z1, dtype=numpy.float)
+        self.z2 = numpy.ascontiguousarray(z2, dtype=numpy.float)
+        self.size = len(self.nverts)
+        self.offsets = numpy.zeros(self.size + 1, dtype=numpy.int)
+        numpy.cumsum(self.nverts, out=self.offsets[1:])
+        if len(self.x) != len(self.y) or len(self.x) != self.offsets[-1]:
+            raise ValueError("Need sum(nverts) x and y coordinates of vertices")
+        if len(self.z1) != self.size or len(self.z2) != self.size:
+            raise ValueError("Need one top and bottom per prism")
+        self.props = {}
+        if props is not None:
+            for p in props:
+                self.addprop(p, props[p])
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index >= self.size or index < -self.size:
+            raise IndexError('prism index out of range')
+        if index < 0:
+            index += self.size
+        props = dict([p, self.props[p][index]] for p in self.props
+                     if not numpy.isnan(self.props[p][index]))
+        verts = slice(self.offsets[index], self.offsets[index + 1])
+        return PolygonalPrism(numpy.transpose([self.x[verts], self.y[verts]]),
+                              self.z1[index], self.z2[index], props)
+
+    def __iter__(self):
+        return (self.__getitem__(i) for i in xrange(self.size))
+
+    def addprop(self, prop, values):
+        """
+        Add physical property values to the prisms.
+
+        Parameters:
+
+        * prop : str
+            Name of the physical property.
+        * values :  list or array
+            Value of this physical property in each prism. Use ``nan`` for
+            prisms that don't have this property.
+
+        """
+        values = numpy.ascontiguousarray(values, dtype=numpy.float)
+        if len(values) != self.size:
+            raise ValueError("Need one value of '%s' per prism" % (prop))
+        self.props[prop] = values
+
+class SphereArray(object):
+    """
+    A collection of spheres stored as arrays.
+
+    The centers, radii and physical properties of all spheres are kept in
+    contiguous float arrays. The forward modeling functions in
+    :mod:`fatiando.gravmag.sphere` work directly on these arrays, without any
+    Python overhead per sphere. Use it for models with a large number of
+    spheres, like the point sources of an equivalent layer.
+
+    :class:`~fatiando.mesher.SphereArray` can used as list of spheres. It can
+    be iterated, indexed and has a length. Indexing returns a new
+    :class:`~fatiando.mesher.Sphere`.
+
+    Use :func:`~fatiando.mesher.spheres2array` to convert a list of spheres.
+
+    .. note:: The coordinate system used is x -> North, y -> East and z -> Down
+
+    Parameters:
+
+    * x, y, z : arrays
+        The coordinates of the centers of the spheres
+    * radius : array
+        The radii of the spheres
+    * props : dict
+        Physical properties of the spheres. Each key should be the name of a
+        physical property. The corresponding value should be a list or array
+        with the value of that property for each sphere. Use ``nan`` for
+        spheres that don't have the property.
+
+    Examples:
+
+        >>> spheres = SphereArray([0, 1], [1, 2], [10, 20], [1, 5],
+        ...                       props={'density':[2670, 1000]})
+        >>> len(spheres)
+        2
+        >>> print spheres[-1]
+        x:1 | y:2 | z:20 | radius:5 | density:1000
+        >>> spheres.addprop('magnetization', [5, numpy.nan])
+        >>> for s in spheres:
+        ...     print s
+        x:0 | y:1 | z:10 | radius:1 | density:2670 | magnetization:5
+        x:1 | y:2 | z:20 | radius:5 | density:1000
+
+    """
+
+    def __init__(self, x, y, z, radius, props=None):
+        object.__init__(self)
+        self.x = numpy.ascontiguousarray(x, dtype=numpy.float)
+        self.y = numpy.ascontiguousarray(y, dtype=numpy.float)
+        self.z = numpy.ascontiguousarray(z, dtype=numpy.float)
+        self.radius = numpy.ascontiguousarray(radius, dtype=numpy.float)
+        self.size = len(self.x)
+        for a in [self.y, self.z, self.radius]:
+            if len(a) != self.size:
+                raise ValueError(
+                    "Sphere centers and radii must all have the same length")
+        self.props = {}
+        if props is not None:
+            for p in props:
+                self.addprop(p, props[p])
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index >= self.size or index < -self.size:
+            raise IndexError('sphere index out of range')
+        props = dict([p, self.props[p][index]] for p in self.props
+                     if not numpy.isnan(self.props[p][index]))
+        return Sphere(self.x[index], self.y[index], self.z[index],
+                      self.radius[index], props)
+
+    def __iter__(self):
+        return (self.__getitem__(i) for i in xrange(self.size))
+
+    def addprop(self, prop, values):
+        """
+        Add physical property values to the spheres.
+
+        Parameters:
+
+        * prop : str
+            Name of the physical property.
+        * values :  list or array
+            Value of this physical property in each sphere. Use ``nan`` for
+            spheres that don't have this property.
+
+        """
+        values = numpy.ascontiguousarray(values, dtype=numpy.float)
+        if len(values) != self.size:
+            raise ValueError("Need one value of '%s' per sphere" % (prop))
+        self.props[prop] = values
+
 class TesseroidMesh(PrismMesh):
     """
     Generate a 3D regular mesh of tesseroids.
@@ -1148,6 +1534,144 @@ class TesseroidMesh(PrismMesh):
         PrismMesh.__init__(self, bounds, shape, props)
         self.zdown = False
         self.dump = None
+        self.toarray = None
+
+def prisms2array(prisms):
+    """
+    Convert a list of prisms into a :class:`~fatiando.mesher.PrismArray`.
+
+    Elements of *prisms* that are None are left out. Prisms that don't have a
+    physical property that others do will have a value of ``nan`` for it.
+
+    Parameters:
+
+    * prisms : list of :class:`~fatiando.mesher.Prism`
+        The prisms. Can also be a :class:`~fatiando.mesher.PrismMesh` (will use
+        :meth:`~fatiando.mesher.PrismMesh.toarray`) or a
+        :class:`~fatiando.mesher.PrismArray` (returned as is).
+
+    Returns:
+
+    * array : :class:`~fatiando.mesher.PrismArray`
+        The converted prisms
+
+    Examples:
+
+        >>> prisms = [Prism(1, 2, 3, 4, 5, 6, {'density':1}),
+        ...           None,
+        ...           Prism(2, 3, 3, 4, 5, 6, {'magnetization':2})]
+        >>> array = prisms2array(prisms)
+        >>> len(array)
+        2
+        >>> for p in array:
+        ...     print p
+        x1:1 | x2:2 | y1:3 | y2:4 | z1:5 | z2:6 | density:1
+        x1:2 | x2:3 | y1:3 | y2:4 | z1:5 | z2:6 | magnetization:2
+
+    """
+    if isinstance(prisms, PrismArray):
+        return prisms
+    if getattr(prisms, 'toarray', None) is not None:
+        return prisms.toarray()
+    prisms = [p for p in prisms if p is not None]
+    bounds = numpy.reshape([p.get_bounds() for p in prisms], (len(prisms), 6))
+    names = set(name for p in prisms for name in p.props)
+    props = dict((name, [p.props.get(name, numpy.nan) for p in prisms])
+                 for name in names)
+    return PrismArray(*bounds.T, props=props)
+
+def polyprisms2array(prisms):
+    """
+    Convert a list of polygonal prisms into a
+    :class:`~fatiando.mesher.PolygonalPrismArray`.
+
+    Elements of *prisms* that are None are left out. Prisms that don't have a
+    physical property that others do will have a value of ``nan`` for it.
+
+    Parameters:
+
+    * prisms : list of :class:`~fatiando.mesher.PolygonalPrism`
+        The prisms. Can also be a
+        :class:`~fatiando.mesher.PolygonalPrismArray` (returned as is).
+
+    Returns:
+
+    * array : :class:`~fatiando.mesher.PolygonalPrismArray`
+        The converted prisms
+
+    Examples:
+
+        >>> prisms = [PolygonalPrism([[0, 0], [0, 1], [1, 0]], 1, 2,
+        ...                          {'density':1}),
+        ...           None,
+        ...           PolygonalPrism([[0, 0], [0, 2], [2, 2], [2, 0]], 2, 3,
+        ...                          {'magnetization':2})]
+        >>> array = polyprisms2array(prisms)
+        >>> len(array)
+        2
+        >>> print array.x
+        [ 0.  0.  1.  0.  0.  2.  2.]
+        >>> print array.nverts
+        [3 4]
+        >>> print array.props['magnetization']
+        [ nan   2.]
+
+    """
+    if isinstance(prisms, PolygonalPrismArray):
+        return prisms
+    prisms = [p for p in prisms if p is not None]
+    if not prisms:
+        return PolygonalPrismArray([], [], [], [], [])
+    x = numpy.concatenate([p.x for p in prisms])
+    y = numpy.concatenate([p.y for p in prisms])
+    names = set(name for p in prisms for name in p.props)
+    props = dict((name, [p.props.get(name, numpy.nan) for p in prisms])
+                 for name in names)
+    return PolygonalPrismArray(x, y, [p.nverts for p in prisms],
+                               [p.z1 for p in prisms], [p.z2 for p in prisms],
+                               props=props)
+
+def spheres2array(spheres):
+    """
+    Convert a list of spheres into a :class:`~fatiando.mesher.SphereArray`.
+
+    Elements of *spheres* that are None are left out. Spheres that don't have
+    a physical property that others do will have a value of ``nan`` for it.
+
+    Parameters:
+
+    * spheres : list of :class:`~fatiando.mesher.Sphere`
+        The spheres. Can also be a :class:`~fatiando.mesher.SphereArray`
+        (returned as is).
+
+    Returns:
+
+    * array : :class:`~fatiando.mesher.SphereArray`
+        The converted spheres
+
+    Examples:
+
+        >>> spheres = [Sphere(1, 2, 3, 1, {'density':1}),
+        ...            None,
+        ...            Sphere(2, 3, 4, 2, {'magnetization':2})]
+        >>> array = spheres2array(spheres)
+        >>> len(array)
+        2
+        >>> for s in array:
+        ...     print s
+        x:1 | y:2 | z:3 | radius:1 | density:1
+        x:2 | y:3 | z:4 | radius:2 | magnetization:2
+
+    """
+    if isinstance(spheres, SphereArray):
+        return spheres
+    spheres = [s for s in spheres if s is not None]
+    names = set(name for s in spheres for name in s.props)
+    props = dict((name, [s.props.get(name, numpy.nan) for s in spheres])
+                 for name in names)
+    return SphereArray([s.x for s in spheres], [s.y for s in spheres],
+                       [s.z for s in spheres], [s.radius for s in spheres],
+                       props=props)
 
 def extract(prop, prisms):
     """
@@ -1,13 +1,16 @@
 import numpy as np
 
-from fatiando.mesher import PolygonalPrism, Prism
+from fatiando.mesher import PolygonalPrism, Prism, polyprisms2array
 from fatiando import gravmag
+from fatiando.gravmag import _polyprism, _cpolyprism
 
 model = None
 prismmodel = None
 xp, yp, zp = None, None, None
 inc, dec = None, None
 precision = 10**(-6)
+# The Python and Cython implementations
+modules = [_polyprism, _cpolyprism]
 
 def setup():
     global model, xp, yp, zp, inc, dec, prismmodel
@@ -24,83 +27,213 @@ def setup():
     xp, yp = [i.ravel() for i in np.meshgrid(tmp, tmp)]
     zp = -1*np.ones_like(xp)
 
-#def test_potential():
-    #"gravmag.polyprism.potential against gravmag.prism"
-    #prism = gravmag.prism.potential(xp, yp, zp, prismmodel)
-    #polyprism = gravmag.polyprism.potential(xp, yp, zp, model)
-    #diff = np.abs(prism - polyprism)
-    #assert np.all(diff <= max(prism)*precision), 'max diff: %g' % (max(diff))
-
-#def test_gx():
-    #"gravmag.polyprism.gx against gravmag.prism"
-    #prism = gravmag.prism.gx(xp, yp, zp, prismmodel)
-    #polyprism = gravmag.polyprism.gx(xp, yp, zp, model)
-    #diff = np.abs(prism - polyprism)
-    #assert np.all(diff <= max(prism)*precision), 'max diff: %g' % (max(diff))
-
-#def test_gy():
-    #"gravmag.polyprism.gy against gravmag.prism"
-    #prism = gravmag.prism.gy(xp, yp, zp, prismmodel)
-    #polyprism = gravmag.polyprism.gy(xp, yp, zp, model)
-    #diff = np.abs(prism - polyprism)
-    #assert np.all(diff <= max(prism)*precision), 'max diff: %g' % (max(diff))
+def test_potential():
+    "gravmag.polyprism.potential against gravmag.prism"
+    prism = gravmag.prism.potential(xp, yp, zp, prismmodel)
+    for module in modules:
+        polyprism = module.potential(xp, yp, zp, model)
+        diff = np.abs(prism - polyprism)
+        assert np.all(diff <= max(prism)*precision), \
+            '%s max diff: %g' % (module.__name__, max(diff))
+
+def test_gx():
+    "gravmag.polyprism.gx against gravmag.prism"
+    prism = gravmag.prism.gx(xp, yp, zp, prismmodel)
+    for module in modules:
+        polyprism = module.gx(xp, yp, zp, model)
+        diff = np.abs(prism - polyprism)
+        assert np.all(diff <= max(prism)*precision), \
+            '%s max diff: %g' % (module.__name__, max(diff))
+
+def test_gy():
+    "gravmag.polyprism.gy against gravmag.prism"
+    prism = gravmag.prism.gy(xp, yp, zp, prismmodel)
+    for module in modules:
+        polyprism = module.gy(xp, yp, zp, model)
+        diff = np.abs(prism - polyprism)
+        assert np.all(diff <= max(prism)*precision), \
+            '%s max diff: %g' % (module.__name__, max(diff))
 
 def test_gz():
     "gravmag.polyprism.gz against gravmag.prism"
     prism = gravmag.prism.gz(xp, yp, zp, prismmodel)
-    polyprism = gravmag.polyprism.gz(xp, yp, zp, model)
-    diff = np.abs(prism - polyprism)
-    errormsg = 'max diff: %g | max polyprism: %g | max prism: %g' % (
-        max(diff), max(polyprism), max(prism))
-    assert np.all(diff <= max(prism)*precision), errormsg
+    for module in modules:
+        polyprism = module.gz(xp, yp, zp, model)
+        diff = np.abs(prism - polyprism)
+        errormsg = '%s max diff: %g | max polyprism: %g | max prism: %g' % (
+            module.__name__, max(diff), max(polyprism), max(prism))
+        assert np.all(diff <= max(prism)*precision), errormsg
 
 def test_gxx():
     "gravmag.polyprism.gxx against gravmag.prism"
     prism = gravmag.prism.gxx(xp, yp, zp, prismmodel)
-    polyprism = gravmag.polyprism.gxx(xp, yp, zp, model)
-    diff = np.abs(prism - polyprism)
-    assert np.all(diff <= max(prism)*precision), 'max diff: %g' % (max(diff))
+    for module in modules:
+        polyprism = module.gxx(xp, yp, zp, model)
+        diff = np.abs(prism - polyprism)
+        assert np.all(diff <= max(prism)*precision), \
+            '%s max diff: %g' % (module.__name__, max(diff))
 
 def test_gxy():
     "gravmag.polyprism.gxy against gravmag.prism"
     prism = gravmag.prism.gxy(xp, yp, zp, prismmodel)
-    polyprism = gravmag.polyprism.gxy(xp, yp, zp, model)
-    diff = np.abs(prism - polyprism)
-    assert np.all(diff <= max(prism)*precision), 'max diff: %g' % (max(diff))
+    for module in modules:
+        polyprism = module.gxy(xp, yp, zp, model)
+        diff = np.abs(prism - polyprism)
+        assert np.all(diff <= max(prism)*precision), \
+            '%s max diff: %g' % (module.__name__, max(diff))
 
 def test_gxz():
     "gravmag.polyprism.gxx against gravmag.prism"
     prism = gravmag.prism.gxz(xp, yp, zp, prismmodel)
-    polyprism = gravmag.polyprism.gxz(xp, yp, zp, model)
-    diff = np.abs(prism - polyprism)
-    assert np.all(diff <= max(prism)*precision), 'max diff: %g' % (max(diff))
+    for module in modules:
+        polyprism = module.gxz(xp, yp, zp, model)
+        diff = np.abs(prism - polyprism)
+        assert np.all(diff <= max(prism)*precision), \
+            '%s max diff: %g' % (module.__name__, max(diff))
 
 def test_gyy():
     "gravmag.polyprism.gyy against gravmag.prism"
     prism = gravmag.prism.gyy(xp, yp, zp, prismmodel)
-    polyprism = gravmag.polyprism.gyy(xp, yp, zp, model)
-    diff = np.abs(prism - polyprism)
-    assert np.all(diff <= max(prism)*precision), 'max diff: %g' % (max(diff))
+    for module in modules:
+        polyprism = module.gyy(xp, yp, zp, model)
+        diff = np.abs(prism - polyprism)
+        assert np.all(diff <= max(prism)*precision), \
+            '%s max diff: %g' % (module.__name__, max(diff))
 
 def test_gyz():
     "gravmag.polyprism.gyz against gravmag.prism"
     prism = gravmag.prism.gyz(xp, yp, zp, prismmodel)
-    polyprism = gravmag.polyprism.gyz(xp, yp, zp, model)
-    diff = np.abs(prism - polyprism)
-    assert np.all(diff <= max(prism)*precision), 'max diff: %g' % (max(diff))
+    for module in modules:
+        polyprism = module.gyz(xp, yp, zp, model)
+        diff = np.abs(prism - polyprism)
+        assert np.all(diff <= max(prism)*precision), \
+            '%s max diff: %g' % (module.__name__, max(diff))
 
 def test_gzz():
     "gravmag.polyprism.gzz against gravmag.prism"
     prism = gravmag.prism.gzz(xp, yp, zp, prismmodel)
-    polyprism = gravmag.polyprism.gzz(xp, yp, zp, model)
-    diff = np.abs(prism - polyprism)
-    assert np.all(diff <= max(prism)*precision), 'max diff: %g' % (max(diff))
+    for module in modules:
+        polyprism = module.gzz(xp, yp, zp, model)
+        diff = np.abs(prism - polyprism)
+        assert np.all(diff <= max(prism)*precision), \
+            '%s max diff: %g' % (module.__name__, max(diff))
 
 def test_tf():
     "gravmag.polyprism.tf against gravmag.prism"
     prism = gravmag.prism.tf(xp, yp, zp, prismmodel, inc, dec)
-    polyprism = gravmag.polyprism.tf(xp, yp, zp, model, inc, dec)
-    diff = np.abs(prism - polyprism)
-    errormsg = 'max diff: %g | max polyprism: %g | max prism: %g' % (
-        max(diff), max(polyprism), max(prism))
-    assert np.all(diff <= max(prism)*precision), errormsg
+    for module in modules:
+        polyprism = module.tf(xp, yp, zp, model, inc, dec)
+        diff = np.abs(prism - polyprism)
+        errormsg = '%s max diff: %g | max polyprism: %g | max prism: %g' % (
+            module.__name__, max(diff), max(polyprism), max(prism))
+        assert np.all(diff <= max(prism)*precision), errormsg
+
+def test_tf_batch():
+    "gravmag.polyprism.tf_batch against gravmag.prism.tf_batch"
+    incs, decs = [-30, 10, 90], [50, 0, 5]
+    prism = gravmag.prism.tf_batch(xp, yp, zp, prismmodel, incs, decs)
+    for module in modules:
+        polyprism = module.tf_batch(xp, yp, zp, model, incs, decs)
+        assert polyprism.shape == prism.shape
+        diff = np.abs(prism - polyprism)
+        assert np.all(diff <= np.abs(prism).max()*precision), \
+            '%s max diff: %g' % (module.__name__, diff.max())
+
+def test_python_cython():
+    "gravmag.polyprism python vs cython implementation"
+    triangle = PolygonalPrism([[0, 0], [300, 50], [-50, 200]], 50, 150,
+                              {'density':-1., 'magnetization':3.})
+    prisms = [model[0], None, triangle]
+    for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+              'gzz']:
+        py = getattr(_polyprism, f)(xp, yp, zp, prisms)
+        cy = getattr(_cpolyprism, f)(xp, yp, zp, prisms)
+        # The results are single precision
+        diff = np.abs(py - cy)
+        assert np.all(diff <= precision*np.abs(py).max()), \
+            '%s max diff: %g' % (f, diff.max())
+    py = _polyprism.tf(xp, yp, zp, prisms, inc, dec)
+    cy = _cpolyprism.tf(xp, yp, zp, prisms, inc, dec)
+    assert np.all(np.abs(py - cy) <= precision*np.abs(py).max()), 'tf'
+    assert gravmag.polyprism.gz is _cpolyprism.gz
+
+def test_polyprisms2array():
+    "gravmag.polyprism PolygonalPrismArray vs list of polygonal prisms"
+    triangle = PolygonalPrism([[0, 0], [300, 50], [-50, 200]], 50, 150,
+                              {'density':-1.})
+    prisms = [model[0], None, triangle]
+    array = polyprisms2array(prisms)
+    for module in modules:
+        for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy',
+                  'gyz', 'gzz']:
+            field = getattr(module, f)
+            lst = field(xp, yp, zp, prisms)
+            arr = field(xp, yp, zp, array)
+            assert np.all(lst == arr), '%s %s' % (module.__name__, f)
+        lst = module.tf(xp, yp, zp, prisms, inc, dec)
+        arr = module.tf(xp, yp, zp, array, inc, dec)
+        assert np.all(lst == arr), '%s tf' % (module.__name__)
+
+def test_njobs():
+    "gravmag.polyprism results don't depend on njobs"
+    for module in modules:
+        for f in ['potential', 'gx', 'gz', 'gxy', 'gzz']:
+            field = getattr(module, f)
+            serial = field(xp, yp, zp, model)
+            for njobs in [2, 3, 8]:
+                assert np.all(serial == field(xp, yp, zp, model,
+                                              njobs=njobs)), f
+        serial = module.tf(xp, yp, zp, model, inc, dec)
+        parallel = module.tf(xp, yp, zp, model, inc, dec, njobs=3)
+        assert np.all(serial == parallel), '%s tf' % (module.__name__)
+
+def test_split():
+    "gravmag.polyprism square split into two triangles"
+    props = model[0].props
+    triangles = [
+        PolygonalPrism([[100, -100], [100, 100], [-100, 100]], 100, 300, props),
+        PolygonalPrism([[100, -100], [-100, 100], [-100, -100]], 100, 300,
+                       props)]
+    for module in modules:
+        for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy',
+                  'gyz', 'gzz']:
+            field = getattr(module, f)
+            square = field(xp, yp, zp, model)
+            split = field(xp, yp, zp, triangles)
+            diff = np.abs(square - split)
+            assert np.all(diff <= np.abs(square).max()*precision), \
+                '%s %s max diff: %g' % (module.__name__, f, diff.max())
+
+def test_fields():
+    "gravmag.polyprism.fields against the function of each component"
+    triangle = PolygonalPrism([[0, 0], [300, 50], [-50, 200]], 50, 150,
+                              {'density':-1.})
+    prisms = [model[0], None, triangle]
+    for module in modules:
+        res = module.fields(xp, yp, zp, prisms, inc=inc, dec=dec)
+        assert sorted(res.keys()) == sorted(['potential', 'gx', 'gy', 'gz',
+            'gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz', 'tf'])
+        for f in res:
+            args = [inc, dec] if f == 'tf' else []
+            single = getattr(module, f)(xp, yp, zp, prisms, *args)
+            diff = np.abs(res[f] - single)
+            assert np.all(diff <= np.abs(single).max()*precision), \
+                '%s %s max diff: %g' % (module.__name__, f, diff.max())
+        some = module.fields(xp, yp, zp, prisms, ['gzz', 'gxy'], njobs=3)
+        assert sorted(some.keys()) == ['gxy', 'gzz']
+        for f in some:
+            assert np.all(some[f] == res[f]), '%s %s' % (module.__name__, f)
+
+def test_fields_invalid():
+    "gravmag.polyprism.fields raises ValueError for invalid components"
+    for module in modules:
+        for components in [['gz', 'gxxx'], ['tf']]:
+            try:
+                module.fields(xp, yp, zp, model, components)
+            except ValueError:
+                pass
+            else:
+                assert False, '%s: no ValueError for %s' % (module.__name__,
+                                                           components)
+        res = module.fields(xp, yp, zp, model)
+        assert 'tf' not in res
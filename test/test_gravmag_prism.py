@@ -1,7 +1,12 @@
+import os
+import shutil
+import tempfile
+
 import numpy as np
 
-from fatiando.mesher import Prism
-from fatiando.gravmag import _prism, _cprism, _neprism
+from fatiando.mesher import Prism, PrismMesh, prisms2array
+from fatiando.gravmag import _prism, _cprism, _neprism, prism
+from fatiando import gridder
 
 model = None
 xp, yp, zp = None, None, None
@@ -174,3 +179,410 @@ def test_tf_ne():
     ne = _neprism.tf(xp, yp, zp, model, inc, dec)
     diff = np.abs(py - ne)
     assert np.all(diff <= precision), 'max diff: %g' % (max(diff))
+
+def test_prism_array():
+    "gravmag.prism PrismArray vs list of prisms"
+    array = prisms2array(model)
+    for mod in [_prism, _cprism, _neprism]:
+        for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy',
+                  'gyz', 'gzz']:
+            lst = getattr(mod, f)(xp, yp, zp, model)
+            arr = getattr(mod, f)(xp, yp, zp, array)
+            assert np.all(lst == arr), '%s.%s' % (mod.__name__, f)
+        lst = mod.tf(xp, yp, zp, model, inc, dec)
+        arr = mod.tf(xp, yp, zp, array, inc, dec)
+        assert np.all(lst == arr), '%s.tf' % (mod.__name__)
+        lst = mod.gz(xp, yp, zp, model[1:])
+        arr = mod.gz(xp, yp, zp, array[1:])
+        assert np.all(lst == arr), '%s.gz slice' % (mod.__name__)
+
+def test_prism_mesh():
+    "gravmag.prism PrismMesh (evaluated on the nodes) vs list of prisms"
+    mesh = PrismMesh((-300, 300, -200, 200, 0, 400), (4, 3, 5))
+    mesh.addprop('density', np.arange(mesh.size, dtype=float))
+    mesh.addprop('magnetization', np.ones(mesh.size))
+    mesh.addprop('inclination', np.linspace(-80, 80, mesh.size))
+    mesh.addprop('declination', np.linspace(-20, 40, mesh.size))
+    mesh.mask = [1, 7, 20]
+    for mod in [_prism, _cprism]:
+        for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy',
+                  'gyz', 'gzz']:
+            lst = getattr(mod, f)(xp, yp, zp, list(mesh))
+            nodes = getattr(mod, f)(xp, yp, zp, mesh)
+            diff = np.abs(lst - nodes)/np.abs(lst).max()
+            assert np.all(diff <= 10**(-10)), \
+                '%s.%s max diff: %g' % (mod.__name__, f, max(diff))
+        lst = mod.tf(xp, yp, zp, list(mesh), inc, dec)
+        nodes = mod.tf(xp, yp, zp, mesh, inc, dec)
+        diff = np.abs(lst - nodes)/np.abs(lst).max()
+        assert np.all(diff <= 10**(-10)), 'tf max diff: %g' % (max(diff))
+
+def test_prism_mesh_cython():
+    "gravmag.prism PrismMesh python vs cython implementation"
+    mesh = PrismMesh((-300, 300, -200, 200, 0, 400), (4, 3, 5))
+    mesh.addprop('density', np.arange(mesh.size, dtype=float))
+    mesh.addprop('magnetization', np.ones(mesh.size))
+    mesh.mask = [1, 7, 20]
+    for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy',
+              'gyz', 'gzz']:
+        py = getattr(_prism, f)(xp, yp, zp, mesh)
+        cy = getattr(_cprism, f)(xp, yp, zp, mesh)
+        diff = np.abs(py - cy)
+        assert np.all(diff <= precision), '%s max diff: %g' % (f, max(diff))
+    py = _prism.tf(xp, yp, zp, mesh, inc, dec)
+    cy = _cprism.tf(xp, yp, zp, mesh, inc, dec)
+    diff = np.abs(py - cy)
+    assert np.all(diff <= precision), 'tf max diff: %g' % (max(diff))
+
+def test_fields():
+    "gravmag.prism.fields vs the function of each component"
+    mesh = PrismMesh((-300, 300, -200, 200, 0, 400), (4, 3, 5))
+    mesh.addprop('density', np.arange(mesh.size, dtype=float))
+    for mod in [_prism, _cprism]:
+        for prisms in [model, mesh]:
+            res = mod.fields(xp, yp, zp, prisms)
+            for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz',
+                      'gyy', 'gyz', 'gzz']:
+                single = getattr(mod, f)(xp, yp, zp, prisms)
+                diff = np.abs(res[f] - single)
+                assert np.all(diff <= precision), \
+                    '%s.%s max diff: %g' % (mod.__name__, f, max(diff))
+        res = mod.fields(xp, yp, zp, model, components=['gzz', 'gx'], dens=3.)
+        assert sorted(res.keys()) == ['gx', 'gzz']
+        diff = np.abs(res['gx'] - mod.gx(xp, yp, zp, model, dens=3.))
+        assert np.all(diff <= precision), 'max diff: %g' % (max(diff))
+
+def test_fields_cython():
+    "gravmag.prism.fields python vs cython implementation"
+    py = _prism.fields(xp, yp, zp, model)
+    cy = _cprism.fields(xp, yp, zp, model)
+    for f in py:
+        diff = np.abs(py[f] - cy[f])
+        assert np.all(diff <= precision), '%s max diff: %g' % (f, max(diff))
+
+def test_njobs():
+    "gravmag.prism cython implementation with several threads"
+    mesh = PrismMesh((-300, 300, -200, 200, 0, 400), (4, 3, 5))
+    mesh.addprop('density', np.arange(mesh.size, dtype=float))
+    mesh.addprop('magnetization', np.ones(mesh.size))
+    for prisms in [model, mesh]:
+        for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy',
+                  'gyz', 'gzz']:
+            serial = getattr(_cprism, f)(xp, yp, zp, prisms)
+            parallel = getattr(_cprism, f)(xp, yp, zp, prisms, njobs=3)
+            assert np.all(serial == parallel), f
+        serial = _cprism.tf(xp, yp, zp, prisms, inc, dec)
+        parallel = _cprism.tf(xp, yp, zp, prisms, inc, dec, njobs=3)
+        assert np.all(serial == parallel), 'tf'
+        serial = _cprism.fields(xp, yp, zp, prisms)
+        parallel = _cprism.fields(xp, yp, zp, prisms, njobs=3)
+        for f in serial:
+            assert np.all(serial[f] == parallel[f]), 'fields %s' % (f)
+
+def test_tf_batch():
+    "gravmag.prism.tf_batch against tf for each direction"
+    incs, decs = np.array([-30, 10, 60, 90]), np.array([50, 0, -20, 5])
+    py = _prism.tf_batch(xp, yp, zp, model, incs, decs)
+    cy = _cprism.tf_batch(xp, yp, zp, model, incs, decs, njobs=2)
+    assert py.shape == cy.shape == (len(incs), len(xp)), str(py.shape)
+    for i in xrange(len(incs)):
+        true = _prism.tf(xp, yp, zp, model, incs[i], decs[i])
+        for res in [py[i], cy[i]]:
+            diff = np.abs(res - true)/np.abs(true).max()
+            assert np.all(diff <= 10**(-12)), 'max diff: %g' % (max(diff))
+
+def test_tf_batch_magnetization():
+    "gravmag.prism.tf_batch with given magnetization vectors"
+    mesh = PrismMesh((-300, 300, -200, 200, 0, 400), (2, 3, 2))
+    mesh.mask = [4]
+    mx, my, mz = [np.linspace(start, 2, mesh.size) for start in [-1, 0, 1]]
+    incs, decs = [20, -70], [-10, 30]
+    py = _prism.tf_batch(xp, yp, zp, mesh, incs, decs, [mx, my, mz])
+    cy = _cprism.tf_batch(xp, yp, zp, mesh, incs, decs, [mx, my, mz])
+    intensity = np.sqrt(mx**2 + my**2 + mz**2)
+    mesh.addprop('magnetization', intensity)
+    mesh.addprop('inclination', np.degrees(np.arcsin(mz/intensity)))
+    mesh.addprop('declination', np.degrees(np.arctan2(my, mx)))
+    for i in xrange(len(incs)):
+        true = _prism.tf(xp, yp, zp, mesh.toarray(), incs[i], decs[i])
+        for res in [py[i], cy[i]]:
+            diff = np.abs(res - true)/np.abs(true).max()
+            assert np.all(diff <= 10**(-12)), 'max diff: %g' % (max(diff))
+
+def test_fields_grid():
+    "gravmag.prism.fields_grid (FFT) vs direct calculation"
+    mesh = PrismMesh((0, 300, 0, 400, 0, 200), (4, 8, 6))
+    mesh.addprop('density', np.linspace(-200, 300, mesh.size))
+    mesh.mask = [0, 10, 100]
+    area, shape = (-150, 450, -50, 450), (11, 13)
+    res = prism.fields_grid(area, shape, -5, mesh)
+    x, y, z = gridder.regular(area, shape, z=-5)
+    direct = prism.fields(x, y, z, mesh.toarray())
+    for f in direct:
+        diff = np.abs(res[f] - direct[f])/np.abs(direct[f]).max()
+        assert np.all(diff <= 10**(-12)), '%s max diff: %g' % (f, max(diff))
+
+def test_fields_grid_spacing():
+    "gravmag.prism.fields_grid fails if the grid doesn't match the mesh"
+    mesh = PrismMesh((0, 300, 0, 400, 0, 200), (4, 8, 6))
+    mesh.addprop('density', np.ones(mesh.size))
+    try:
+        prism.fields_grid((0, 300, 0, 400), (10, 10), -5, mesh)
+    except ValueError:
+        pass
+    else:
+        assert False, "Didn't raise ValueError"
+
+def test_ratio():
+    "gravmag.prism point mass approximation within the error bound"
+    x, y, z = gridder.regular((-3000, 3000, -3000, 3000), (15, 15), z=-10)
+    bounds = [(-100, 100, -100, 100, 0, 200), (-300, 200, -20, 20, 0, 50),
+              (-200, 200, -150, 150, 10, 30)]
+    kernels = [('potential', 0, 0.1), ('gz', 1, 0.35), ('gx', 1, 0.35),
+               ('gzz', 2, 1.6), ('gxy', 2, 1.6), ('gyy', 2, 1.6)]
+    for x1, x2, y1, y2, z1, z2 in bounds:
+        p = [Prism(x1, x2, y1, y2, z1, z2, {'density':1.})]
+        volume = (x2 - x1)*(y2 - y1)*(z2 - z1)
+        dist = np.sqrt((x - 0.5*(x1 + x2))**2 + (y - 0.5*(y1 + y2))**2
+                       + (z - 0.5*(z1 + z2))**2)
+        for f, order, const in kernels:
+            kernel = getattr(_prism, '_kernel_' + f)
+            point = getattr(_prism, '_point_' + f)
+            exact = _prism._forward(kernel, x, y, z, p, 'density', None)
+            for ratio in [1, 2, 5]:
+                approx = _prism._forward(kernel, x, y, z, p, 'density', None,
+                                         ratio, point)
+                bound = const/ratio**2*volume/dist**(order + 1)
+                diff = np.abs(approx - exact)
+                assert np.all(diff <= bound + 10**(-10)*np.abs(exact)), \
+                    '%s %g: %g' % (f, ratio, (diff/bound).max())
+
+def test_ratio_cython():
+    "gravmag.prism point mass approximation python vs cython implementation"
+    mesh = PrismMesh((-300, 300, -200, 200, 0, 400), (4, 3, 5))
+    mesh.addprop('density', np.linspace(-200, 300, mesh.size))
+    for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+              'gzz']:
+        exact = getattr(_prism, f)(xp, yp, zp, mesh)
+        py = getattr(_prism, f)(xp, yp, zp, mesh, ratio=2)
+        cy = getattr(_cprism, f)(xp, yp, zp, mesh, ratio=2)
+        assert np.any(py != exact), f
+        diff = np.abs(py - cy)/np.abs(py).max()
+        assert np.all(diff <= 10**(-14)), '%s max diff: %g' % (f, max(diff))
+        threads = getattr(_cprism, f)(xp, yp, zp, mesh, ratio=2, njobs=3)
+        assert np.all(cy == threads), f
+
+def test_backends():
+    "gravmag.prism backend selection"
+    assert set(['numpy', 'numexpr', 'cython']) <= set(
+        prism.available_backends())
+    true = _prism.gz(xp, yp, zp, model)
+    for backend in ['numpy', 'numexpr', 'cython']:
+        res = prism.gz(xp, yp, zp, model, backend=backend)
+        assert np.allclose(res, true, rtol=10**(-12), atol=0), backend
+    try:
+        prism.set_backend('numpy')
+        assert prism.get_backend() == 'numpy'
+        assert prism.get_backend('cython') == 'cython'
+        assert np.all(prism.gzz(xp, yp, zp, model) ==
+                      _prism.gzz(xp, yp, zp, model))
+    finally:
+        prism.set_backend(None)
+    os.environ[prism.BACKEND_ENV] = 'numexpr'
+    try:
+        assert prism.get_backend() == 'numexpr'
+        assert np.all(prism.gzz(xp, yp, zp, model) ==
+                      _neprism.gzz(xp, yp, zp, model))
+        try:
+            prism.fields(xp, yp, zp, model)
+        except ValueError:
+            pass
+        else:
+            assert False, "Didn't raise ValueError for fields with numexpr"
+    finally:
+        del os.environ[prism.BACKEND_ENV]
+    assert prism.get_backend() == 'cython'
+    try:
+        prism.set_backend('fortran')
+    except ValueError:
+        pass
+    else:
+        assert False, "Didn't raise ValueError for invalid backend"
+
+def test_autotune():
+    "gravmag.prism auto-tuned backend stored in the config file"
+    config_file = prism.config_file
+    tmpdir = tempfile.mkdtemp()
+    prism.config_file = os.path.join(tmpdir, 'backends.json')
+    prism._tuned = None
+    try:
+        winner = prism.autotune('gz', xp.size, len(model), repeat=1)
+        assert winner in prism.available_backends()
+        # Reload from the file
+        prism._tuned = None
+        res = prism.gz(xp, yp, zp, model, backend='auto')
+        assert np.allclose(res, _prism.gz(xp, yp, zp, model), rtol=10**(-12),
+                           atol=0)
+        assert len(prism._load_tuned()) == 1
+        # A new problem size is tuned when first used
+        prism.tf(xp[:10], yp[:10], zp[:10], model, inc, dec, backend='auto')
+        assert len(prism._load_tuned()) == 2
+        # tf_batch needs the field directions in the benchmark
+        batch = prism.tf_batch(xp, yp, zp, model, [10.], [20.],
+                               backend='auto')
+        assert np.allclose(batch, _prism.tf_batch(xp, yp, zp, model, [10.],
+                                                  [20.]), rtol=10**(-12))
+        # Only backends that accept the arguments are chosen
+        single = prism.gz(xp, yp, zp, model, backend='auto',
+                          precision='float32')
+        assert single.dtype == np.float32
+        for key, name in prism._load_tuned().items():
+            if 'precision' in key:
+                assert name != 'numexpr', key
+    finally:
+        prism.config_file = config_file
+        prism._tuned = None
+        shutil.rmtree(tmpdir)
+
+def test_autotune_options():
+    "gravmag.prism.autotune benchmarks with the options and capped sizes"
+    config_file = prism.config_file
+    tmpdir = tempfile.mkdtemp()
+    prism.config_file = os.path.join(tmpdir, 'backends.json')
+    prism._tuned = None
+    calls = []
+
+    class Recorder(object):
+        "A backend that records the arguments of the benchmark"
+        @staticmethod
+        def gz(xp, yp, zp, prisms, dens=None, ratio=None, njobs=1,
+               precision='float64'):
+            calls.append((xp.size, len(prisms), precision, ratio))
+            return _prism.gz(xp, yp, zp, prisms, dens, ratio, njobs, precision)
+
+    prism.register_backend('recorder', Recorder)
+    try:
+        prism.autotune('gz', 100, 50, repeat=1, save=False,
+                       options={'precision':'float32', 'ratio':2.})
+        assert calls == [(100, 50, 'float32', 2.)], calls
+        assert 'gz:prisms:6:precision=float32,ratio' in prism._load_tuned()
+        # Larger problems are benchmarked with at most _tune_maxpairs pairs
+        # and share a key
+        calls[:] = []
+        prism.autotune('gz', 10**6, 1000, repeat=1, save=False)
+        npoints, nprisms = calls[0][:2]
+        assert npoints*nprisms <= prism._tune_maxpairs, calls
+        assert nprisms <= 1000, calls
+        big = prism._tune_key('gz', 10**6, 1000, False)
+        assert big == prism._tune_key('gz', 10**8, 10**4, False)
+        assert big != prism._tune_key('gz', 100, 50, False)
+    finally:
+        del prism._backends['recorder']
+        prism.config_file = config_file
+        prism._tuned = None
+        shutil.rmtree(tmpdir)
+
+def test_backend_arguments():
+    "gravmag.prism ValueError for arguments that the backend doesn't accept"
+    for kwargs in [{'precision':'float32'}, {'ratio':5}]:
+        try:
+            prism.gz(xp, yp, zp, model, backend='numexpr', **kwargs)
+        except ValueError as e:
+            assert kwargs.keys()[0] in str(e), str(e)
+        else:
+            assert False, "Didn't raise ValueError for %s" % (kwargs)
+    # Optional arguments given by position are checked too
+    try:
+        prism.gz(xp, yp, zp, model, None, 5, backend='numexpr')
+    except ValueError as e:
+        assert 'ratio' in str(e), str(e)
+    else:
+        assert False, "Didn't raise ValueError for ratio by position"
+    assert np.all(prism.gz(xp, yp, zp, model, 3., backend='numexpr') ==
+                  _neprism.gz(xp, yp, zp, model, dens=3.))
+    # fields_grid uses a backend that has fields
+    mesh = PrismMesh((0, 100, 0, 200, 0, 50), (2, 4, 2))
+    mesh.addprop('density', np.arange(mesh.size, dtype=float))
+    area, shape = (-50, 150, -50, 250), (7, 5)
+    default = prism.fields_grid(area, shape, -10, mesh, ['gz'])
+    try:
+        prism.set_backend('numexpr')
+        res = prism.fields_grid(area, shape, -10, mesh, ['gz'])
+    finally:
+        prism.set_backend(None)
+    assert np.all(res['gz'] == default['gz'])
+
+def test_single_precision():
+    "gravmag.prism float32 relative error against float64 in a survey"
+    # A 5 x 5 x 2 km model below a survey flown 100 m above it, in UTM
+    # coordinates
+    east, north = 500000., 7000000.
+    mesh = PrismMesh((north - 2500, north + 2500, east - 2500, east + 2500,
+                      0, 2000), (5, 5, 4))
+    mesh.addprop('density', np.linspace(-300, 500, mesh.size))
+    mesh.addprop('magnetization', np.linspace(1, 3, mesh.size))
+    model = prisms2array(mesh)
+    x, y, z = gridder.regular((north - 10000, north + 10000, east - 10000,
+                               east + 10000), (20, 20), z=-100)
+    # Maximum error relative to the maximum of the float64 result
+    errors = [('potential', 10**(-4)), ('gx', 10**(-4)), ('gz', 10**(-4)),
+              ('gxx', 10**(-4)), ('gxz', 10**(-4)), ('gzz', 10**(-4))]
+    for f, error in errors:
+        for backend, func in [(_prism, getattr(_prism, f)),
+                              (_cprism, getattr(_cprism, f))]:
+            double = func(x, y, z, model)
+            single = func(x, y, z, model, precision='float32')
+            assert single.dtype == np.float32, f
+            diff = np.abs(single - double).max()/np.abs(double).max()
+            assert diff <= error, '%s %s: %g' % (backend.__name__, f, diff)
+    double = _prism.tf(x, y, z, model, inc, dec)
+    single = _prism.tf(x, y, z, model, inc, dec, precision='float32')
+    assert single.dtype == np.float32
+    diff = np.abs(single - double).max()/np.abs(double).max()
+    assert diff <= 10**(-5), 'tf: %g' % (diff)
+    double = _prism.fields(x, y, z, model)
+    single = _prism.fields(x, y, z, model, precision='float32')
+    for c in double:
+        assert single[c].dtype == np.float32, c
+        diff = np.abs(single[c] - double[c]).max()/np.abs(double[c]).max()
+        assert diff <= 10**(-4), 'fields %s: %g' % (c, diff)
+    # Nodes of a PrismMesh are always summed in double precision
+    single = _prism.gz(x, y, z, mesh, precision='float32')
+    double = _prism.gz(x, y, z, mesh)
+    diff = np.abs(single - double).max()/np.abs(double).max()
+    assert diff <= 10**(-6), 'mesh gz: %g' % (diff)
+
+def test_single_precision_invalid():
+    "gravmag.prism raises ValueError for an invalid precision"
+    for func in [_prism.gz, _cprism.gz]:
+        try:
+            func(xp, yp, zp, model, precision='float16')
+        except ValueError:
+            pass
+        else:
+            assert False, "Didn't raise ValueError"
+
+def test_tiles_cython():
+    "gravmag.prism cython results don't depend on the tile sizes"
+    mesh = PrismMesh((-300, 300, -200, 200, 0, 400), (4, 3, 5))
+    mesh.addprop('density', np.linspace(-200, 300, mesh.size))
+    mesh.addprop('magnetization', np.linspace(1, 3, mesh.size))
+    tiles = _cprism._point_tile, _cprism._prism_tile
+    try:
+        for prisms in [mesh, prisms2array(mesh)]:
+            results = []
+            for ptile, mtile in [tiles, (1, 10**9), (7, 5)]:
+                _cprism._point_tile, _cprism._prism_tile = ptile, mtile
+                fields = _cprism.fields(xp, yp, zp, prisms)
+                results.append(
+                    [_cprism.gz(xp, yp, zp, prisms, njobs=2),
+                     _cprism.gxy(xp, yp, zp, prisms, ratio=2),
+                     _cprism.tf(xp, yp, zp, prisms, inc, dec, njobs=3),
+                     _cprism.tf_batch(xp, yp, zp, prisms, np.array([inc]),
+                                      np.array([dec]))]
+                    + [fields[c] for c in sorted(fields)])
+            for res in results[1:]:
+                for a, b in zip(results[0], res):
+                    assert np.all(a == b)
+    finally:
+        _cprism._point_tile, _cprism._prism_tile = tiles
@@ -0,0 +1,213 @@
+import os
+import tempfile
+
+import numpy as np
+
+from fatiando.mesher import (PrismMesh, Tesseroid, Sphere, PolygonalPrism,
+                             Prism, prisms2array)
+from fatiando.gravmag import sensitivity, prism, tesseroid, sphere, polyprism
+from fatiando import gridder
+
+xp, yp, zp = None, None, None
+precision = 10**(-10)
+
+def setup():
+    global xp, yp, zp
+    xp, yp, zp = gridder.regular((-500, 500, -500, 500), (7, 9), z=-10)
+
+def _check(model, field, values, prop='density', **kwargs):
+    "Check that sens*values is equal to field on the model"
+    sens = sensitivity.matrix(xp, yp, zp, model, field, prop=prop, **kwargs)
+    assert sens.shape == (xp.size, len(model)), 'shape: %s' % (str(sens.shape))
+    for cell, value in zip(model, values):
+        if cell is not None:
+            cell.addprop(prop, value)
+    if 'blocksize' in kwargs:
+        kwargs.pop('blocksize')
+    true = field(xp, yp, zp, model, **kwargs)
+    diff = np.abs(np.dot(sens, values) - true)/np.abs(true).max()
+    assert np.all(diff <= precision), 'max diff: %g' % (max(diff))
+
+def test_prism_mesh():
+    "gravmag.sensitivity.matrix with a masked PrismMesh"
+    mesh = PrismMesh((-300, 300, -200, 200, 0, 400), (3, 4, 5))
+    mesh.mask = [2, 30]
+    values = np.linspace(-100, 200, mesh.size)
+    sens = sensitivity.matrix(xp, yp, zp, mesh, prism.gzz, blocksize=7)
+    assert np.all(sens[:, 2] == 0) and np.all(sens[:, 30] == 0)
+    mesh.addprop('density', values)
+    true = prism.gzz(xp, yp, zp, mesh)
+    diff = np.abs(np.dot(sens, values) - true)/np.abs(true).max()
+    assert np.all(diff <= precision), 'max diff: %g' % (max(diff))
+
+def test_prism_tf():
+    "gravmag.sensitivity.matrix with prism.tf"
+    model = [Prism(-200, 0, -100, 100, 0, 200, {'inclination':10,
+                                                 'declination':20}),
+             Prism(0, 200, -100, 100, 100, 300)]
+    _check(model, prism.tf, [2., 3.], prop='magnetization', inc=30, dec=-10)
+
+def test_prism_columns():
+    "gravmag.sensitivity.matrix with prism array kernels equal to per cell"
+    mesh = PrismMesh((-300, 300, -200, 200, 0, 400), (3, 4, 5))
+    mesh.mask = [2, 30]
+    model = [Prism(-200, 0, -100, 100, 0, 200, {'inclination':10,
+                                                 'declination':20}),
+             None, Prism(0, 200, -100, 100, 100, 300, {'density':5.})]
+    cases = [(mesh, prism.gz, 'density', {}),
+             (mesh, prism.gxy, 'density', {'ratio':1.}),
+             (model, prism.potential, 'density', {}),
+             (prisms2array(model), prism.gyz, 'density', {}),
+             # Falls back to one call per cell
+             (mesh, prism.gz, 'density', {'precision':'float64'}),
+             (model, prism.tf, 'magnetization', {'inc':30, 'dec':-10}),
+             (model, prism.tf, 'magnetization', {'inc':30, 'dec':-10,
+                                                 'pinc':5, 'pdec':-20})]
+    # The numexpr backend has no array kernels for the columns
+    backends = [b for b in ['numpy', 'cython']
+                if b in prism.available_backends()]
+    for backend in backends:
+        for cells, field, prop, kwargs in cases:
+            kwargs = dict(kwargs, backend=backend)
+            sens = sensitivity.matrix(xp, yp, zp, cells, field, prop=prop,
+                                      blocksize=7, **kwargs)
+            for j in xrange(len(cells)):
+                if cells[j] is None:
+                    assert np.all(sens[:, j] == 0)
+                    continue
+                unit = prisms2array([cells[j]])
+                unit.addprop(prop, [1.])
+                true = field(xp, yp, zp, unit, **kwargs)
+                assert np.all(sens[:, j] == true), \
+                    '%s %s column %d' % (backend, field.__name__, j)
+    assert model[2].props == {'density':5.}
+
+def test_tesseroid():
+    "gravmag.sensitivity.matrix with tesseroids"
+    global xp, yp, zp
+    points = xp, yp, zp
+    xp, yp, zp = gridder.regular((-2, 2, -2, 2), (4, 5), z=10000)
+    try:
+        model = [Tesseroid(-1, 0, -1, 1, 0, -10000),
+                 Tesseroid(0, 1, -1, 1, -2000, -12000)]
+        _check(model, tesseroid.gz, [200., -300.])
+    finally:
+        xp, yp, zp = points
+
+def test_sphere():
+    "gravmag.sensitivity.matrix with spheres"
+    model = [Sphere(0, 0, 200, 100), Sphere(100, -100, 300, 50)]
+    _check(model, sphere.gz, [500., 1000.], blocksize=1)
+
+def test_polyprism():
+    "gravmag.sensitivity.matrix with polygonal prisms"
+    model = [PolygonalPrism([[100, -100], [100, 100], [-100, 100]], 100, 300),
+             PolygonalPrism([[0, 0], [200, 200], [300, 0]], 0, 100)]
+    sens = sensitivity.matrix(xp, yp, zp, model, polyprism.gz)
+    model[0].addprop('density', 1.)
+    model[1].addprop('density', 1.)
+    true = polyprism.gz(xp, yp, zp, model)
+    # polyprism returns single precision
+    diff = np.abs(sens.sum(axis=1) - true)/np.abs(true).max()
+    assert np.all(diff <= 10**(-6)), 'max diff: %g' % (max(diff))
+
+def test_float32_memmap():
+    "gravmag.sensitivity.matrix in single precision on a memmap"
+    mesh = PrismMesh((-300, 300, -200, 200, 0, 400), (2, 2, 3))
+    sens = sensitivity.matrix(xp, yp, zp, mesh, prism.gz)
+    tmp = tempfile.NamedTemporaryFile()
+    try:
+        out = np.memmap(tmp.name, dtype=np.float32, mode='w+',
+                        shape=(xp.size, mesh.size))
+        res = sensitivity.matrix(xp, yp, zp, mesh, prism.gz, out=out,
+                                 blocksize=5)
+        assert res is out
+        stored = np.memmap(tmp.name, dtype=np.float32, mode='r',
+                           shape=(xp.size, mesh.size))
+        diff = np.abs(stored - sens)/np.abs(sens).max()
+        assert np.all(diff <= 10**(-6)), 'max diff: %g' % (diff.max())
+    finally:
+        tmp.close()
+    res = sensitivity.matrix(xp, yp, zp, mesh, prism.gz, dtype=np.float32)
+    assert res.dtype == np.float32
+
+def test_cache():
+    "gravmag.sensitivity.matrix reuses and evicts cached blocks"
+    cache_dir, cache_maxsize = sensitivity.cache_dir, sensitivity.cache_maxsize
+    sensitivity.cache_dir = tempfile.mkdtemp()
+    try:
+        sensitivity.clear_cache()
+        mesh = PrismMesh((-300, 300, -200, 200, 0, 400), (2, 2, 3))
+        sens = sensitivity.matrix(xp, yp, zp, mesh, prism.gz, blocksize=5,
+                                  cache=True)
+        info = sensitivity.cache_info()
+        assert info['hits'] == 0 and info['misses'] == 3, str(info)
+        assert info['blocks'] == 3, str(info)
+        # Same geometry with a different density should hit the cache
+        mesh.addprop('density', np.ones(mesh.size))
+        again = sensitivity.matrix(xp, yp, zp, mesh, prism.gz, blocksize=5,
+                                   cache=True)
+        assert np.all(again == sens)
+        info = sensitivity.cache_info()
+        assert info['hits'] == 3 and info['misses'] == 3, str(info)
+        # Different geometry and different field should miss
+        other = PrismMesh((-300, 300, -200, 200, 0, 500), (2, 2, 3))
+        sensitivity.matrix(xp, yp, zp, other, prism.gz, blocksize=5,
+                           cache=True)
+        sensitivity.matrix(xp, yp, zp, mesh, prism.gzz, blocksize=5,
+                           cache=True)
+        info = sensitivity.cache_info()
+        assert info['hits'] == 3 and info['misses'] == 9, str(info)
+        # Only the most recent blocks should be kept
+        sensitivity.cache_maxsize = info['size']//2
+        sensitivity.matrix(xp, yp, zp, mesh, prism.gxx, blocksize=5,
+                           cache=True)
+        info = sensitivity.cache_info()
+        assert info['size'] <= sensitivity.cache_maxsize, str(info)
+        assert 0 < info['blocks'] < 12, str(info)
+        sensitivity.clear_cache()
+        info = sensitivity.cache_info()
+        assert info['blocks'] == info['hits'] == info['misses'] == 0, str(info)
+    finally:
+        sensitivity.clear_cache()
+        os.rmdir(sensitivity.cache_dir)
+        sensitivity.cache_dir = cache_dir
+        sensitivity.cache_maxsize = cache_maxsize
+
+def test_cache_settings():
+    "gravmag.sensitivity.matrix cache misses if defaults or settings change"
+    cache_dir, max_depth = sensitivity.cache_dir, tesseroid.max_depth
+    defaults = tesseroid.gz.func_defaults
+    sensitivity.cache_dir = tempfile.mkdtemp()
+    lons, lats, heights = gridder.regular((-2, 2, -2, 2), (4, 5), z=10000)
+    model = [Tesseroid(-1, 0, -1, 1, 0, -10000),
+             Tesseroid(0, 1, -1, 1, -2000, -12000)]
+    try:
+        sensitivity.clear_cache()
+        sens = sensitivity.matrix(lons, lats, heights, model, tesseroid.gz,
+                                  cache=True)
+        tesseroid.max_depth = 0
+        shallow = sensitivity.matrix(lons, lats, heights, model,
+                                     tesseroid.gz, cache=True)
+        info = sensitivity.cache_info()
+        assert info['hits'] == 0 and info['misses'] == 2, str(info)
+        assert np.any(shallow != sens)
+        tesseroid.max_depth = max_depth
+        # Change the default ratio
+        tesseroid.gz.func_defaults = (None, 3.) + defaults[2:]
+        sensitivity.matrix(lons, lats, heights, model, tesseroid.gz,
+                           cache=True)
+        info = sensitivity.cache_info()
+        assert info['hits'] == 0 and info['misses'] == 3, str(info)
+        tesseroid.gz.func_defaults = defaults
+        again = sensitivity.matrix(lons, lats, heights, model, tesseroid.gz,
+                                   cache=True)
+        info = sensitivity.cache_info()
+        assert info['hits'] == 1 and info['misses'] == 3, str(info)
+        assert np.all(again == sens)
+    finally:
+        tesseroid.max_depth = max_depth
+        tesseroid.gz.func_defaults = defaults
+        sensitivity.clear_cache()
+        os.rmdir(sensitivity.cache_dir)
+        sensitivity.cache_dir = cache_dir
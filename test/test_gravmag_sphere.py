@@ -0,0 +1,89 @@
+import numpy as np
+
+from fatiando.mesher import Prism, Sphere, spheres2array
+from fatiando.gravmag import sphere, prism
+from fatiando import gridder
+
+model = None
+cubemodel = None
+xp, yp, zp = None, None, None
+inc, dec = None, None
+precision = 10**(-4)
+
+def setup():
+    global model, cubemodel, xp, yp, zp, inc, dec
+    props = {'density':1000., 'magnetization':2, 'inclination':30,
+             'declination':-20}
+    # A cube far from the points has the same effect as a sphere with the
+    # same volume (its quadrupole moment is zero)
+    side = 20.
+    radius = side*(3./(4*np.pi))**(1./3.)
+    model = [Sphere(10, -20, 1000, radius, props)]
+    cubemodel = [Prism(0, 20, -30, -10, 990, 1010, props)]
+    inc, dec = -10, 45
+    xp, yp, zp = gridder.regular((-1000, 1000, -1000, 1000), (20, 20), z=-10)
+
+def _check(field, *args):
+    cube = getattr(prism, field)(xp, yp, zp, cubemodel, *args)
+    sph = getattr(sphere, field)(xp, yp, zp, model, *args)
+    diff = np.abs(cube - sph)
+    assert np.all(diff <= np.abs(cube).max()*precision), \
+        '%s max diff: %g' % (field, diff.max())
+
+def test_gravity():
+    "gravmag.sphere gravity components against a cube"
+    for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+              'gzz']:
+        _check(f)
+
+def test_tf():
+    "gravmag.sphere.tf against a cube"
+    _check('tf', inc, dec)
+
+def test_tf_batch():
+    "gravmag.sphere.tf_batch against sphere.tf"
+    incs, decs = [-10, 30, 90], [45, 0, -5]
+    induced = [Sphere(-200, 0, 300, 100, {'magnetization':3}), None]
+    spheres = model + induced
+    batch = sphere.tf_batch(xp, yp, zp, spheres, incs, decs)
+    for i in xrange(len(incs)):
+        single = sphere.tf(xp, yp, zp, spheres, incs[i], decs[i])
+        assert np.allclose(batch[i], single, rtol=10**(-10), atol=0)
+
+def test_spheres2array():
+    "gravmag.sphere SphereArray vs list of spheres"
+    spheres = [model[0], None, Sphere(100, 100, 200, 50, {'density':-200.})]
+    array = spheres2array(spheres)
+    for f in ['potential', 'gx', 'gz', 'gxy', 'gzz']:
+        field = getattr(sphere, f)
+        assert np.all(field(xp, yp, zp, spheres) == field(xp, yp, zp, array)), f
+    assert np.all(sphere.tf(xp, yp, zp, spheres, inc, dec)
+                  == sphere.tf(xp, yp, zp, array, inc, dec))
+
+def test_blocksize():
+    "gravmag.sphere results don't depend on the block size"
+    spheres = spheres2array([Sphere(x, 0, 100 + x, 10, {'density':x})
+                             for x in np.linspace(-500, 500, 11)])
+    default = sphere.fields(xp, yp, zp, spheres)
+    blocksize = sphere._blocksize
+    try:
+        sphere._blocksize = 3*xp.size
+        blocks = sphere.fields(xp, yp, zp, spheres)
+    finally:
+        sphere._blocksize = blocksize
+    for f in default:
+        assert np.all(default[f] == blocks[f]), f
+
+def test_fields():
+    "gravmag.sphere.fields against the function of each component"
+    res = sphere.fields(xp, yp, zp, model)
+    assert sorted(res.keys()) == sorted(['potential', 'gx', 'gy', 'gz', 'gxx',
+        'gxy', 'gxz', 'gyy', 'gyz', 'gzz'])
+    for f in res:
+        assert np.all(res[f] == getattr(sphere, f)(xp, yp, zp, model)), f
+    try:
+        sphere.fields(xp, yp, zp, model, ['gz', 'gxxx'])
+    except ValueError:
+        pass
+    else:
+        assert False, 'no ValueError for an invalid component'
@@ -0,0 +1,79 @@
+import os
+import tempfile
+
+import numpy as np
+
+from fatiando.mesher import PrismMesh, Tesseroid, Sphere
+from fatiando.gravmag import stream, prism, tesseroid, sphere
+from fatiando import gridder
+
+xp, yp, zp = None, None, None
+mesh = None
+
+def setup():
+    global xp, yp, zp, mesh
+    xp, yp, zp = gridder.regular((-500, 500, -500, 500), (7, 9), z=-10)
+    mesh = PrismMesh((-200, 200, -300, 300, 0, 400), (2, 3, 2))
+    mesh.addprop('density', np.linspace(-100, 300, mesh.size))
+    mesh.addprop('magnetization', np.linspace(1, 3, mesh.size))
+
+def test_chunks():
+    "gravmag.stream.chunks covers all points in order"
+    for chunksize in [1, 5, xp.size, 1000]:
+        chunks = list(stream.chunks(xp, yp, zp, chunksize))
+        assert len(chunks) == -(-xp.size//chunksize)
+        assert all(len(c[0]) <= chunksize for c in chunks)
+        for i, coord in enumerate([xp, yp, zp]):
+            assert np.all(np.concatenate([c[i] for c in chunks]) == coord)
+
+def test_compute():
+    "gravmag.stream.compute is the same as calculating on all points at once"
+    for chunksize in [1, 10, None]:
+        res = stream.compute(xp, yp, zp, mesh, prism.gz, chunksize=chunksize)
+        assert np.all(res == prism.gz(xp, yp, zp, mesh))
+        res = stream.compute(xp, yp, zp, mesh, prism.tf, chunksize=chunksize,
+                             inc=30, dec=-15)
+        assert np.all(res == prism.tf(xp, yp, zp, mesh, 30, -15))
+    spheres = [Sphere(0, 0, 200, 100, {'density':1000})]
+    assert np.all(stream.compute(xp, yp, zp, spheres, sphere.gz, chunksize=4)
+                  == sphere.gz(xp, yp, zp, spheres))
+    lons, lats, heights = gridder.regular((-10, 10, -10, 10), (4, 5),
+                                          z=250000)
+    tess = [Tesseroid(-5, 5, -5, 5, 0, -10000, {'density':1000})]
+    grid = stream.compute(lons.reshape((4, 5)), lats.reshape((4, 5)),
+                          heights.reshape((4, 5)), tess, tesseroid.gz,
+                          chunksize=3)
+    assert grid.shape == (4, 5)
+    assert np.all(grid.ravel() == tesseroid.gz(lons, lats, heights, tess))
+
+def test_compute_memmap():
+    "gravmag.stream.compute stores the result in a memmap"
+    tmpdir = tempfile.mkdtemp()
+    fname = os.path.join(tmpdir, 'gz.dat')
+    try:
+        out = np.memmap(fname, dtype='float32', mode='w+', shape=xp.shape)
+        res = stream.compute(xp, yp, zp, mesh, prism.gz, chunksize=8, out=out)
+        assert res is out
+        true = prism.gz(xp, yp, zp, mesh)
+        del out, res
+        stored = np.memmap(fname, dtype='float32', mode='r', shape=xp.shape)
+        assert np.allclose(stored, true, rtol=10**(-6), atol=0)
+        del stored
+    finally:
+        os.remove(fname)
+        os.rmdir(tmpdir)
+    try:
+        stream.compute(xp, yp, zp, mesh, prism.gz, out=np.empty(3))
+    except ValueError:
+        pass
+    else:
+        assert False, "Didn't raise ValueError"
+
+def test_forward():
+    "gravmag.stream.forward yields the result of each chunk"
+    results = list(stream.forward(stream.chunks(xp, yp, zp, 10), mesh,
+                                  prism.fields, components=['gz', 'gzz']))
+    assert len(results) == -(-xp.size//10)
+    true = prism.fields(xp, yp, zp, mesh, components=['gz', 'gzz'])
+    for c in ['gz', 'gzz']:
+        assert np.all(np.concatenate([r[c] for r in results]) == true[c])
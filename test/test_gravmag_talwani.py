@@ -0,0 +1,80 @@
+import numpy as np
+
+from fatiando.mesher import Polygon, Prism
+from fatiando.gravmag import talwani, prism
+
+xp, zp = None, None
+model = None
+precision = 10**(-6)
+
+def setup():
+    global xp, zp, model
+    xp = np.linspace(-2000, 2000, 101)
+    zp = -10*np.ones_like(xp)
+    model = [Polygon([[-300, 100], [200, 100], [200, 400], [-300, 400]],
+                     {'density':500.}),
+             None,
+             Polygon([[400, 50], [900, 50], [700, 600]], {'density':-300.}),
+             Polygon([[-900, 0], [-500, 0], [-700, 300]], {'magnetization':1})]
+
+def test_gz():
+    "gravmag.talwani.gz against a very long prism"
+    long = [Prism(-300, 200, -10.**7, 10.**7, 100, 400, {'density':500.})]
+    # The prism is along y, so use x as the profile
+    res = prism.gz(xp, np.zeros_like(xp), zp, long)
+    res2d = talwani.gz(xp, zp, model[:1])
+    diff = np.abs(res - res2d)
+    assert np.all(diff <= res.max()*10**(-4)), 'max diff: %g' % (diff.max())
+
+def test_gz_batch():
+    "gravmag.talwani.gz_batch against gz of each polygon"
+    batch = talwani.gz_batch(xp, zp, model)
+    assert batch.shape == (len(model), xp.size)
+    for i, polygon in enumerate(model):
+        assert np.all(batch[i] == talwani.gz(xp, zp, [polygon])), i
+    assert np.all(batch[1] == 0) and np.all(batch[3] == 0)
+    total = talwani.gz(xp, zp, model)
+    assert np.allclose(batch.sum(axis=0), total, rtol=precision, atol=0)
+
+def test_blocksize():
+    "gravmag.talwani results don't depend on the block size"
+    gz = talwani.gz(xp, zp, model)
+    batch = talwani.gz_batch(xp, zp, model)
+    blocksize = talwani._blocksize
+    try:
+        talwani._blocksize = 2*xp.size
+        assert np.all(talwani.gz(xp, zp, model) == gz)
+        assert np.all(talwani.gz_batch(xp, zp, model) == batch)
+    finally:
+        talwani._blocksize = blocksize
+
+def test_vertices():
+    "gravmag.talwani.gz on points over the vertices of the polygons"
+    square = [Polygon([[0, 0], [100, 0], [100, 100], [0, 100]],
+                      {'density':1.})]
+    for x in [0., 100.]:
+        near = talwani.gz(np.array([x - 0.001, x, x + 0.001]), np.zeros(3),
+                          square)
+        assert np.all(np.isfinite(near)), x
+        assert np.allclose(near, near[1], rtol=10**(-3), atol=0), x
+
+def test_gz_vertex_derivatives():
+    "gravmag.talwani.gz_vertex_derivatives against finite differences"
+    # No horizontal or vertical edges, where gz moves the vertices by 0.01 m
+    verts = [[-300, 10], [400, 0], [600, 500], [100, 900], [-200, 400]]
+    props = {'density':500.}
+    x = xp + 3.3
+    z = zp - 100
+    derivs = talwani.gz_vertex_derivatives(x, z, Polygon(verts, props))
+    delta = 0.1
+    for i in xrange(len(verts)):
+        for j, deriv in enumerate(derivs):
+            plus = [list(v) for v in verts]
+            minus = [list(v) for v in verts]
+            plus[i][j] += delta
+            minus[i][j] -= delta
+            fd = (talwani.gz(x, z, [Polygon(plus, props)])
+                  - talwani.gz(x, z, [Polygon(minus, props)]))/(2*delta)
+            diff = np.abs(fd - deriv[i])
+            assert np.all(diff <= np.abs(fd).max()*10**(-3)), \
+                'vertex %d coordinate %d max diff: %g' % (i, j, diff.max())
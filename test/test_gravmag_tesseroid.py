@@ -1,8 +1,10 @@
 import numpy as np
 
 from fatiando import gravmag
-from fatiando.mesher import Tesseroid
-#from fatiando.gravmag import _tesseroid, _ctesseroid
+from fatiando.mesher import Tesseroid, TesseroidMesh
+from fatiando import gridder
+from fatiando.constants import MEAN_EARTH_RADIUS
+from fatiando.gravmag import _tesseroid, _ctesseroid
 
 shellmodel = None
 heights = None
@@ -110,3 +112,163 @@ def test_gyz():
     tess = gravmag.tesseroid.gyz(lons, lats, heights, shellmodel)
     diff = np.abs(tess)
     assert np.all(diff <= 10**(-10)), 'diff: %s' % (str(diff))
+
+def test_njobs():
+    "gravmag.tesseroid results don't depend on the number of threads"
+    lons = np.zeros_like(heights)
+    lats = lons
+    for f in ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+              'gzz']:
+        func = getattr(gravmag.tesseroid, f)
+        serial = func(lons, lats, heights, shellmodel[:100])
+        parallel = func(lons, lats, heights, shellmodel[:100], njobs=3)
+        assert np.all(serial == parallel), f
+
+def test_tasks():
+    "gravmag.tesseroid results don't depend on how the work is split in tasks"
+    lons = np.zeros_like(heights)
+    lats = lons
+    blocks = _ctesseroid._point_block, _ctesseroid._min_tasks
+    for f in ['potential', 'gz', 'gxy', 'gzz']:
+        func = getattr(gravmag.tesseroid, f)
+        default = func(lons, lats, heights, shellmodel[:100])
+        try:
+            _ctesseroid._point_block, _ctesseroid._min_tasks = 1, 1
+            tasks = func(lons, lats, heights, shellmodel[:100], njobs=2)
+        finally:
+            _ctesseroid._point_block, _ctesseroid._min_tasks = blocks
+        diff = np.abs(default - tasks)
+        assert np.all(diff <= 10**(-10)*np.abs(default).max()), \
+            '%s max diff: %g' % (f, diff.max())
+
+def test_glq_order():
+    "gravmag.tesseroid glq_order as an integer or one per dimension"
+    lons = np.zeros_like(heights)
+    lats = lons
+    for f in ['gz', 'gzz']:
+        func = getattr(gravmag.tesseroid, f)
+        same = func(lons, lats, heights, shellmodel[:100], glq_order=[5, 5, 5])
+        assert np.all(same == func(lons, lats, heights, shellmodel[:100],
+                                   glq_order=5)), f
+        for order in [0, [2, 2], [3, 0, 2]]:
+            try:
+                func(lons, lats, heights, shellmodel[:100], glq_order=order)
+            except ValueError:
+                pass
+            else:
+                assert False, 'no ValueError for %s' % (str(order))
+
+def test_single_precision():
+    "gravmag.tesseroid float32 results are the rounded float64 results"
+    lons = np.zeros_like(heights)
+    lats = lons
+    for f in ['potential', 'gz', 'gzz']:
+        func = getattr(gravmag.tesseroid, f)
+        double = func(lons, lats, heights, shellmodel[:100])
+        single = func(lons, lats, heights, shellmodel[:100],
+                      precision='float32')
+        assert single.dtype == np.float32, f
+        diff = np.abs((single - double)/double)
+        assert np.all(diff <= 10**(-6)), '%s diff: %s' % (f, str(diff))
+
+def test_python_cython():
+    "gravmag.tesseroid adaptive discretization in Python and Cython match"
+    model = [Tesseroid(-1, 1, -1, 1, 0, -10000, props),
+             Tesseroid(1, 2, -1, 0.5, -1000, -20000, {'density':-200.})]
+    bounds, dens = gravmag.tesseroid._get_bounds(model, None)
+    lons = np.radians(np.array([0., 0.5, 1., 1.5, 3]))
+    lats = np.radians(np.array([0., -0.5, 0., 0.7, 0]))
+    radii = MEAN_EARTH_RADIUS + np.array([500., 1000., 100., 10000., 0.])
+    glq = []
+    for order in [2, 3, 2]:
+        glq.extend(gravmag.tesseroid._glq(order))
+    fields = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz',
+              'gzz']
+    for f in [[i] for i in fields] + [fields, ['gzz', 'gx']]:
+        for depth in [2, 30]:
+            py, pyover = _tesseroid.calc(f, bounds, dens, lons, lats, radii, 3,
+                                         *(glq + [depth]))
+            cy, cyover = _ctesseroid.calc(f, bounds, dens, lons, lats, radii,
+                                          3, *(glq + [depth]))
+            assert py.shape == cy.shape == (len(f), len(lons)), f
+            for i in xrange(len(f)):
+                diff = np.abs(py[i] - cy[i])
+                assert np.all(diff <= 10**(-10)*np.abs(cy[i]).max()), \
+                    '%s max diff: %g' % (f[i], diff.max())
+            assert pyover == cyover, f
+            assert (cyover > 0) == (depth == 2), f
+
+def test_max_depth():
+    "gravmag.tesseroid doesn't divide more than max_depth times"
+    model = [Tesseroid(-1, 1, -1, 1, 0, -10000, props)]
+    lons, lats, heights = np.array([0.1]), np.array([0.2]), np.array([100.])
+    nodivision = gravmag.tesseroid.gz(lons, lats, heights, model, ratio=0)
+    default = gravmag.tesseroid.max_depth
+    try:
+        gravmag.tesseroid.max_depth = 0
+        tess = gravmag.tesseroid.gz(lons, lats, heights, model)
+    finally:
+        gravmag.tesseroid.max_depth = default
+    assert np.all(tess == nodivision)
+    assert np.all(tess != gravmag.tesseroid.gz(lons, lats, heights, model))
+
+def test_fields():
+    "gravmag.tesseroid.fields against the function of each component"
+    lons = np.array([0., 1., 10., 20.])
+    lats = np.array([0., 1., -5., 30.])
+    hs = np.array([1000., 10000., 250000., 500.])
+    model = shellmodel[1200:1300] + [None]
+    res = gravmag.tesseroid.fields(lons, lats, hs, model, ratio=2, glq_order=3)
+    assert sorted(res.keys()) == sorted(['potential', 'gx', 'gy', 'gz', 'gxx',
+        'gxy', 'gxz', 'gyy', 'gyz', 'gzz'])
+    for f in res:
+        single = getattr(gravmag.tesseroid, f)(lons, lats, hs, model, ratio=2,
+                                               glq_order=3)
+        diff = np.abs(res[f] - single)
+        assert np.all(diff <= 10**(-10)*np.abs(single).max()), \
+            '%s max diff: %g' % (f, diff.max())
+    some = gravmag.tesseroid.fields(lons, lats, hs, model, ['gzz', 'gxy'],
+                                    ratio=2, glq_order=3, njobs=3)
+    assert sorted(some.keys()) == ['gxy', 'gzz']
+    for f in some:
+        assert np.all(some[f] == res[f]), f
+    # The strictest ratio and order of the components are used by default:
+    # the ratio of gx (1.5) and the order of gz (4)
+    strict = gravmag.tesseroid.fields(lons, lats, hs, model, ['gx', 'gz'])
+    gz = gravmag.tesseroid.gz(lons, lats, hs, model, ratio=1.5, glq_order=4)
+    assert np.all(np.abs(strict['gz'] - gz) <= 10**(-10)*np.abs(gz).max())
+    try:
+        gravmag.tesseroid.fields(lons, lats, hs, model, ['gz', 'gxxx'])
+    except ValueError:
+        pass
+    else:
+        assert False, 'no ValueError for invalid component'
+
+def test_mesh_grid():
+    "gravmag.tesseroid TesseroidMesh on a grid against each tesseroid"
+    mesh = TesseroidMesh((-180, 180, -90, 90, 0, -30000), (2, 9, 18))
+    mesh.addprop('density', np.linspace(-300, 300, mesh.size))
+    mesh.mask.extend([3, 50, 200])
+    # Grids with the spacing of the mesh, global and regional on the surface
+    grids = [gridder.regular((-170, 170, -80, 80), (9, 18), z=250000),
+             gridder.regular((-35, 25, -30, 10), (7, 4), z=1000)]
+    for lons, lats, hs in grids:
+        assert gravmag.tesseroid._mesh_grid(mesh, lons, lats, hs) is not None
+        for f in ['potential', 'gx', 'gy', 'gz', 'gxy', 'gzz']:
+            field = getattr(gravmag.tesseroid, f)
+            fast = field(lons, lats, hs, mesh)
+            direct = field(lons, lats, hs, list(mesh))
+            diff = np.abs(fast - direct)
+            assert np.all(diff <= 10**(-8)*np.abs(direct).max()), \
+                '%s max diff: %g' % (f, diff.max())
+        res = gravmag.tesseroid.fields(lons, lats, hs, mesh, ['gz'], dens=10)
+        direct = gravmag.tesseroid.gz(lons, lats, hs, list(mesh), dens=10)
+        diff = np.abs(res['gz'] - direct)
+        assert np.all(diff <= 10**(-8)*np.abs(direct).max())
+    # Points that are not such a grid use the direct calculation
+    lons, lats, hs = grids[0]
+    uneven = hs.copy()
+    uneven[5] += 1
+    assert gravmag.tesseroid._mesh_grid(mesh, lons, lats, uneven) is None
+    assert gravmag.tesseroid._mesh_grid(mesh, lats, lons, hs) is None
+    assert gravmag.tesseroid._mesh_grid(list(mesh), lons, lats, hs) is None
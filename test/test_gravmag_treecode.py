@@ -0,0 +1,58 @@
+import numpy as np
+
+from fatiando.mesher import Prism, PrismMesh
+from fatiando.gravmag import treecode, prism
+from fatiando import gridder
+
+mesh = None
+xp, yp, zp = None, None, None
+fields = ['gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz']
+
+def setup():
+    global mesh, xp, yp, zp
+    mesh = PrismMesh((0, 1000, 0, 2000, 0, 500), (5, 10, 8))
+    mesh.addprop('density', np.linspace(-300, 500, mesh.size))
+    xp, yp, zp = gridder.regular((-1000, 2000, -1000, 3000), (10, 12), z=-10)
+
+def test_exact():
+    "gravmag.treecode equals the exact formulas with a zero opening angle"
+    tree = treecode.PrismTree(mesh, leafsize=7)
+    for f in fields:
+        tree_res = getattr(treecode, f)(xp, yp, zp, tree, theta=0)
+        true = getattr(prism, f)(xp, yp, zp, mesh)
+        diff = np.abs(tree_res - true)/np.abs(true).max()
+        assert np.all(diff <= 10**(-10)), '%s max diff: %g' % (f, max(diff))
+
+def test_theta():
+    "gravmag.treecode error decreases with the opening angle"
+    tree = treecode.PrismTree(mesh, leafsize=4)
+    for f in fields:
+        true = getattr(prism, f)(xp, yp, zp, mesh)
+        errors = []
+        for theta in [0.8, 0.4, 0.2]:
+            res = getattr(treecode, f)(xp, yp, zp, tree, theta=theta)
+            assert np.any(res != true), f
+            errors.append(np.abs(res - true).max()/np.abs(true).max())
+        assert errors[0] > errors[1] > errors[2], '%s %s' % (f, str(errors))
+        assert errors[2] <= 10**(-3), '%s %s' % (f, str(errors))
+
+def test_prism_list():
+    "gravmag.treecode with a list of prisms and dens"
+    model = [Prism(-100, 100, -100, 100, 0, 100, {'density':1000}), None,
+             Prism(0, 300, -200, 0, 50, 150),
+             Prism(200, 300, 100, 200, 0, 200, {'density':-500})]
+    for f in fields:
+        res = getattr(treecode, f)(xp, yp, zp, model, theta=0.01, leafsize=1)
+        true = getattr(prism, f)(xp, yp, zp, model)
+        assert np.allclose(res, true, rtol=10**(-10), atol=0), f
+        res = getattr(treecode, f)(xp, yp, zp, model, dens=10, theta=0.01)
+        true = getattr(prism, f)(xp, yp, zp, [m for m in model if m], dens=10)
+        assert np.allclose(res, true, rtol=10**(-10), atol=0), f
+
+def test_benchmark():
+    "gravmag.treecode.benchmark"
+    exact, build, times, errors = treecode.benchmark(xp, yp, zp, mesh, 'gzz',
+                                                     thetas=[0, 0.5])
+    assert exact >= 0 and build >= 0
+    assert len(times) == len(errors) == 2
+    assert errors[0] <= 10**(-10) and errors[1] > errors[0]